@@ -3,15 +3,28 @@ from celery import Celery
 from django.conf import settings
 from celery.schedules import crontab
 
+from backend.metrics import install_celery_signals, install_http_instrumentation
+
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 app = Celery('backend')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
+install_celery_signals()
+install_http_instrumentation()
+
 @app.task(bind=True, ignore_result=True)
 def debug_task(self):
     print(f'Request: {self.request!r}')
+
+
+@app.task(ignore_result=False)
+def ping_queue(sent_at):
+    """Пустая задача для probe_queues.py: возвращает задержку старта в секундах."""
+    import time
+
+    return time.time() - sent_at
     
 # app.conf.beat_schedule = {
 #     'update_delivery_clusters-every-4-hour': {
@@ -0,0 +1,100 @@
+"""Очереди Celery и маршрутизация задач по ним.
+
+Имена задач в Celery — русские описания из @shared_task(name=...), поэтому очередь
+назначается по имени python-функции задачи (TASK_QUEUES). Задачи, которых нет в списке,
+уходят в очередь по умолчанию (interactive).
+
+Воркеры в docker-compose: celery (main) обслуживает interactive и supply, celery_sheets —
+ads-sheets, celery_nightly — nightly-sync. Лимиты времени задач берутся из настроек очереди.
+"""
+
+QUEUE_INTERACTIVE = "interactive"
+QUEUE_SUPPLY = "supply"
+QUEUE_ADS_SHEETS = "ads-sheets"
+QUEUE_NIGHTLY_SYNC = "nightly-sync"
+
+DEFAULT_QUEUE = QUEUE_INTERACTIVE
+
+# Настройки воркера и лимиты времени по очередям. concurrency/prefetch_multiplier
+# передаются воркеру в docker-compose, лимиты применяются к задачам очереди через аннотации.
+# interactive и supply слушает один воркер main (-Q interactive,supply): concurrency 2 — это
+# два общих слота на обе очереди, а не по два на каждую.
+QUEUES = {
+    # Действия пользователя: короткие задачи, должны стартовать сразу
+    QUEUE_INTERACTIVE: {"concurrency": 2, "prefetch_multiplier": 1, "soft_time_limit": 120, "time_limit": 180},
+    # Создание черновиков/поставок и фоновые загрузки по батчу
+    QUEUE_SUPPLY: {"concurrency": 2, "prefetch_multiplier": 1, "soft_time_limit": 600, "time_limit": 900},
+    # Google Sheets и отчёты Performance: минуты на магазин
+    QUEUE_ADS_SHEETS: {"concurrency": 2, "prefetch_multiplier": 1, "soft_time_limit": 3000, "time_limit": 3600},
+    # Ночная синхронизация каталога, остатков, продаж и аналитики
+    QUEUE_NIGHTLY_SYNC: {"concurrency": 1, "prefetch_multiplier": 1, "soft_time_limit": 6600, "time_limit": 7200},
+}
+
+TASK_QUEUES = {
+    # interactive
+    # Кнопка Старт/Стоп только переключает флаг; актуализация кампаний (create_or_update_AD) — в ads-sheets
+    "toggle_store_ads_status": QUEUE_INTERACTIVE,
+    "debug_task": QUEUE_INTERACTIVE,
+    "ping_queue": QUEUE_INTERACTIVE,
+    # supply
+    "process_supply_batch": QUEUE_SUPPLY,
+    "fetch_batch_timeslots": QUEUE_SUPPLY,
+    "refresh_batch_supply_status": QUEUE_SUPPLY,
+    # ads-sheets
+    "update_abc_sheet": QUEUE_ADS_SHEETS,
+    "update_abc_sheet_if_first_day": QUEUE_ADS_SHEETS,
+    "sync_campaign_activity_with_sheets": QUEUE_ADS_SHEETS,
+    "create_or_update_AD": QUEUE_ADS_SHEETS,
+    "reforecast_ad_budgets_for_period": QUEUE_ADS_SHEETS,
+    "update_auto_campaign_kpis_in_sheets": QUEUE_ADS_SHEETS,
+    "update_manual_campaign_kpis_in_sheets": QUEUE_ADS_SHEETS,
+    "submit_all_reports_for_today": QUEUE_ADS_SHEETS,
+    "run_store_job": QUEUE_ADS_SHEETS,
+    "summarize_store_jobs": QUEUE_ADS_SHEETS,
+    "fetch_performance_reports": QUEUE_ADS_SHEETS,
+    "monitor_auto_campaigns_weekly": QUEUE_ADS_SHEETS,
+    "rebalance_auto_weekly_budgets": QUEUE_ADS_SHEETS,
+    "scheduled_rebalance_auto_weekly_budgets_monday": QUEUE_ADS_SHEETS,
+    "sync_manual_campaigns": QUEUE_ADS_SHEETS,
+    # nightly-sync
+    "sync_all_ozon_warehouses": QUEUE_NIGHTLY_SYNC,
+    "sync_all_ozon_categories": QUEUE_NIGHTLY_SYNC,
+    "sync_all_products": QUEUE_NIGHTLY_SYNC,
+    "sync_all_warehouse_stocks": QUEUE_NIGHTLY_SYNC,
+    "sync_all_sales": QUEUE_NIGHTLY_SYNC,
+    "sync_all_fbs_stocks": QUEUE_NIGHTLY_SYNC,
+    "update_delivery_clusters": QUEUE_NIGHTLY_SYNC,
+    "update_cluster_item_analytics": QUEUE_NIGHTLY_SYNC,
+    "refresh_delivery_analytics": QUEUE_NIGHTLY_SYNC,
+    "sync_full_store_data": QUEUE_NIGHTLY_SYNC,
+    "sync_product_daily_analytics": QUEUE_NIGHTLY_SYNC,
+    "submit_all_reports_for_yesterday": QUEUE_NIGHTLY_SYNC,
+    "maintain_sales_partitions": QUEUE_NIGHTLY_SYNC,
+    "prune_payload_archive": QUEUE_NIGHTLY_SYNC,
+}
+
+
+def _task_function_name(name, task=None):
+    if task is None:
+        from celery import current_app
+
+        task = current_app.tasks.get(name)
+    run = getattr(task, "run", None)
+    return getattr(run, "__name__", None) or name.rsplit(".", 1)[-1]
+
+
+def queue_for_task(name, task=None):
+    return TASK_QUEUES.get(_task_function_name(name, task), DEFAULT_QUEUE)
+
+
+def route_task(name, args, kwargs, options, task=None, **kw):
+    """Роутер Celery (task_routes): очередь по имени функции задачи."""
+    return {"queue": queue_for_task(name, task)}
+
+
+class QueueAnnotations:
+    """Аннотации задач (task_annotations): лимиты времени из настроек очереди задачи."""
+
+    def annotate(self, task):
+        queue = QUEUES[queue_for_task(task.name, task)]
+        return {"soft_time_limit": queue["soft_time_limit"], "time_limit": queue["time_limit"]}
@@ -0,0 +1,308 @@
+"""Метрики в формате Prometheus: длительности задач Celery, API-вью и внешних вызовов.
+
+Каждый процесс (gunicorn-воркер, дочерний процесс Celery) копит гистограммы у себя в памяти
+и раз в METRICS_FLUSH_SECONDS публикует свой снимок в общий кэш (Redis). Эндпоинт /metrics
+складывает снимки всех живых процессов, поэтому в нём видны и веб, и воркеры Celery.
+
+Что пишется:
+- celery_task_duration_seconds{task,queue,state} — сигналы Celery (install_celery_signals);
+- http_request_duration_seconds{view,method,status} и http_request_db_queries{view} — MetricsMiddleware;
+- outbound_request_duration_seconds{service,endpoint,status} — все запросы через requests/gspread
+  к Ozon Seller, Performance и Google (install_http_instrumentation);
+- store_job_duration_seconds{job,store} и view_stage_duration_seconds{view,stage} — вручную (observe).
+"""
+import os
+import re
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.http import HttpResponse, HttpResponseForbidden
+
+METRICS_FLUSH_SECONDS = int(os.getenv("METRICS_FLUSH_SECONDS", "15"))
+# Снимок процесса, который давно не обновлялся (процесс умер/перезапущен), выпадает из /metrics
+METRICS_SNAPSHOT_TTL_SECONDS = 3600
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+QUERY_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+HISTOGRAMS = {
+    "celery_task_duration_seconds": ("Длительность задач Celery", SECONDS_BUCKETS),
+    "http_request_duration_seconds": ("Длительность запросов к API", SECONDS_BUCKETS),
+    "http_request_db_queries": ("Число SQL-запросов на запрос к API", QUERY_BUCKETS),
+    "outbound_request_duration_seconds": ("Длительность запросов к Ozon, Performance и Google", SECONDS_BUCKETS),
+    "store_job_duration_seconds": ("Длительность подзадачи по магазину", SECONDS_BUCKETS),
+    "view_stage_duration_seconds": ("Длительность этапов тяжёлых вью (планер, аналитика)", SECONDS_BUCKETS),
+}
+
+OUTBOUND_SERVICES = {
+    "api-seller.ozon.ru": "ozon",
+    "api-performance.ozon.ru": "performance",
+    "sheets.googleapis.com": "google",
+    "www.googleapis.com": "google",
+    "oauth2.googleapis.com": "google",
+}
+
+INDEX_KEY = "metrics:processes"
+SNAPSHOT_KEY = "metrics:process:{}"
+
+
+class _Registry:
+    """Гистограммы текущего процесса: (имя, метки) → [счётчики корзин..., count, sum]."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.series = {}
+        self.flushed_at = 0.0
+        self.process_key = None
+
+    def observe(self, name, value, labels):
+        buckets = HISTOGRAMS[name][1]
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += 1
+            series[-1] += value
+
+    def snapshot(self):
+        with self.lock:
+            return {key: list(values) for key, values in self.series.items()}
+
+    def flush(self, force=False):
+        now = time.time()
+        if not force and now - self.flushed_at < METRICS_FLUSH_SECONDS:
+            return
+        self.flushed_at = now
+        # pid меняется у дочерних процессов после fork, поэтому ключ считаем при каждой публикации
+        process_key = SNAPSHOT_KEY.format(f"{socket.gethostname()}:{os.getpid()}")
+        if process_key != self.process_key:
+            with self.lock:
+                if self.process_key is not None:
+                    # Унаследованные от родителя значения уже опубликованы родителем
+                    self.series.clear()
+                self.process_key = process_key
+        try:
+            cache.set(process_key, self.snapshot(), timeout=METRICS_SNAPSHOT_TTL_SECONDS)
+            index = cache.get(INDEX_KEY) or []
+            if process_key not in index:
+                cache.set(INDEX_KEY, index + [process_key], timeout=None)
+        except Exception:
+            # Метрики не должны ломать запросы и задачи
+            pass
+
+
+registry = _Registry()
+
+
+def observe(name, value, **labels):
+    registry.observe(name, value, labels)
+    registry.flush()
+
+
+@contextmanager
+def timed(name, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def record_stage_timings(view, timings):
+    """Переносит словарь timings из планера/аналитики в view_stage_duration_seconds."""
+    for stage, seconds in timings.items():
+        if isinstance(seconds, (int, float)):
+            registry.observe("view_stage_duration_seconds", seconds, {"view": view, "stage": stage})
+    registry.flush()
+
+
+def collect():
+    """Складывает снимки всех процессов; заодно вычищает из индекса истёкшие."""
+    registry.flush(force=True)
+    index = cache.get(INDEX_KEY) or []
+    snapshots = cache.get_many(index)
+    alive = [key for key in index if key in snapshots]
+    if len(alive) != len(index):
+        cache.set(INDEX_KEY, alive, timeout=None)
+
+    merged = {}
+    for snapshot in snapshots.values():
+        for key, values in snapshot.items():
+            if key[0] not in HISTOGRAMS:
+                continue
+            total = merged.get(key)
+            if total is None or len(total) != len(values):
+                merged[key] = list(values)
+            else:
+                merged[key] = [a + b for a, b in zip(total, values)]
+    return merged
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def render(merged=None):
+    merged = collect() if merged is None else merged
+    lines = []
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        series = sorted((labels, values) for (metric, labels), values in merged.items() if metric == name)
+        if not series:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for labels, values in series:
+            cumulative = 0
+            for bound, count in zip(buckets, values):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, ('le', f'{bound:g}'))} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {values[-2]}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {values[-1]:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {values[-2]}")
+    return "\n".join(lines) + "\n"
+
+
+def metrics_view(request):
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+class MetricsMiddleware:
+    """Длительность и число SQL-запросов на каждый запрос к API, по шаблону маршрута."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = [0]
+
+        def count_queries(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        started = time.perf_counter()
+        status = "500"
+        try:
+            with connection.execute_wrapper(count_queries):
+                response = self.get_response(request)
+            status = str(response.status_code)
+            return response
+        finally:
+            match = getattr(request, "resolver_match", None)
+            view = match.route if match and match.route else "unmatched"
+            if view != "metrics":
+                registry.observe(
+                    "http_request_duration_seconds",
+                    time.perf_counter() - started,
+                    {"view": view, "method": request.method, "status": status},
+                )
+                registry.observe("http_request_db_queries", queries[0], {"view": view})
+                registry.flush()
+
+
+_ID_SEGMENT = re.compile(r"\d")
+_VERSION_SEGMENT = re.compile(r"^v\d+(\.\d+)?$")
+
+
+def outbound_endpoint(path):
+    """Путь без идентификаторов: /api/client/campaign/123/objects → /api/client/campaign/:id/objects."""
+    segments = []
+    for segment in path.split("/"):
+        if _VERSION_SEGMENT.match(segment) or not _ID_SEGMENT.search(segment):
+            segments.append(segment)
+        elif ":" in segment:
+            # spreadsheets/<id>:batchUpdate — оставляем метод
+            segments.append(":id:" + segment.rsplit(":", 1)[1])
+        else:
+            segments.append(":id")
+    return "/".join(segments)
+
+
+def outbound_service(url):
+    """Сервис по адресу запроса; запросы к локальному стабу (ozon/stub_server.py) размечаются по пути."""
+    service = OUTBOUND_SERVICES.get(url.hostname or "")
+    if service is not None:
+        return service
+    stubs = {urlsplit(base).netloc for base in (settings.OZON_API_STUB_URL, settings.GOOGLE_SHEETS_STUB_URL) if base}
+    if url.netloc not in stubs:
+        return None
+    if url.path.startswith("/api/client"):
+        return "performance"
+    if url.path.startswith("/sheets"):
+        return "google"
+    return "ozon"
+
+
+def install_http_instrumentation():
+    """Оборачивает requests.Session.send: через него идут и requests.post/get, и gspread."""
+    import requests
+
+    if getattr(requests.Session.send, "_metrics_wrapped", False):
+        return
+    original_send = requests.Session.send
+
+    def send(self, request, **kwargs):
+        url = urlsplit(request.url)
+        service = outbound_service(url)
+        if service is None:
+            return original_send(self, request, **kwargs)
+        started = time.perf_counter()
+        status = "error"
+        try:
+            response = original_send(self, request, **kwargs)
+            status = str(response.status_code)
+            return response
+        finally:
+            observe(
+                "outbound_request_duration_seconds",
+                time.perf_counter() - started,
+                service=service,
+                endpoint=outbound_endpoint(url.path),
+                status=status,
+            )
+
+    send._metrics_wrapped = True
+    requests.Session.send = send
+
+
+def install_celery_signals():
+    from celery.signals import task_postrun, task_prerun
+
+    started = {}
+
+    @task_prerun.connect(weak=False)
+    def _task_started(task_id=None, **kwargs):
+        started[task_id] = time.perf_counter()
+
+    @task_postrun.connect(weak=False)
+    def _task_finished(task_id=None, task=None, state=None, **kwargs):
+        begin = started.pop(task_id, None)
+        if begin is None or task is None:
+            return
+        delivery_info = getattr(task.request, "delivery_info", None) or {}
+        registry.observe(
+            "celery_task_duration_seconds",
+            time.perf_counter() - begin,
+            {"task": task.name, "queue": delivery_info.get("routing_key") or "", "state": state or ""},
+        )
+        registry.flush()
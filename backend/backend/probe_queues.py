@@ -0,0 +1,48 @@
+"""Проверка очередей Celery: ставит ping_queue в каждую очередь и печатает задержку старта.
+
+Запуск локально: docker compose --profile queues run --rm queue_probe
+Задержка interactive должна быть меньше секунды и при загруженных ads-sheets/nightly-sync.
+"""
+import os
+import sys
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent  # /workspace/backend
+CURRENT_DIR = Path(__file__).resolve().parent     # /workspace/backend/backend
+
+# Как в run_scheduler.py: убираем каталог файла из sys.path, чтобы не подхватить celery.py как "celery".
+sys.path = [str(BASE_DIR)] + [p for p in sys.path if p and Path(p).resolve() != CURRENT_DIR]
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from backend.celery import ping_queue  # noqa: E402
+from backend.celery_routing import QUEUES, QUEUE_INTERACTIVE  # noqa: E402
+
+TIMEOUT = int(os.getenv("QUEUE_PROBE_TIMEOUT", "60"))
+INTERACTIVE_TARGET_SECONDS = 1.0
+
+
+def main():
+    failed = False
+    for queue in QUEUES:
+        result = ping_queue.apply_async(args=[time.time()], queue=queue)
+        try:
+            latency = result.get(timeout=TIMEOUT)
+        except Exception as e:
+            print(f"{queue:<14} нет ответа за {TIMEOUT} с: {e}")
+            failed = True
+            continue
+        mark = ""
+        if queue == QUEUE_INTERACTIVE and latency > INTERACTIVE_TARGET_SECONDS:
+            mark = f"  > {INTERACTIVE_TARGET_SECONDS} с"
+            failed = True
+        print(f"{queue:<14} старт через {latency:.3f} с{mark}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,7 +2,6 @@ import os
 import sys
 import time
 import logging
-from datetime import datetime
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent  # /workspace/backend
@@ -21,8 +20,15 @@ import django  # noqa: E402
 
 django.setup()
 
-from ozon.models import OzonSupplyBatch  # noqa: E402
-from ozon.tasks import process_supply_batch_sync, _cleanup_stale_drafts, _cleanup_old_postings  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from ozon.tasks import (  # noqa: E402
+    due_supply_store_ids,
+    next_supply_due_at,
+    process_due_supply_drafts,
+    _cleanup_stale_drafts,
+    _cleanup_old_postings,
+)
 
 
 logging.basicConfig(
@@ -35,38 +41,36 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-PROCESSING_STORES: set[int] = set()
 SLEEP_SECONDS = 5
+MIN_SLEEP_SECONDS = 1
 
 
-def pick_batches():
-    """Вернуть батчи с работой (queued/processing)."""
-    return (
-        OzonSupplyBatch.objects
-        .filter(status__in=["queued", "processing"])
-        .select_related("store")
-        .order_by("created_at")
-    )
+def sleep_seconds():
+    """Спим до ближайшего срока в очереди таймеров, но не дольше SLEEP_SECONDS."""
+    try:
+        next_due = next_supply_due_at()
+    except Exception as exc:  # noqa: BLE001
+        logger.error(f"❌ next due lookup error: {exc}")
+        return SLEEP_SECONDS
+    if next_due is None:
+        return SLEEP_SECONDS
+    until_due = (next_due - timezone.now()).total_seconds()
+    return max(MIN_SLEEP_SECONDS, min(SLEEP_SECONDS, until_due))
 
 
 def main():
     logger.info("🚀 supply scheduler started")
     while True:
         try:
-            batches = list(pick_batches())
-            for batch in batches:
-                store_id = batch.store_id
-                if store_id in PROCESSING_STORES:
-                    continue
-
-                PROCESSING_STORES.add(store_id)
+            # Берем только магазины, у которых есть черновики с наступившим сроком;
+            # сам магазин блокируется в process_due_supply_drafts (общий кеш).
+            for store_id in due_supply_store_ids():
                 try:
-                    logger.info(f"[store={store_id}] ▶️ processing batch {batch.batch_id}")
-                    process_supply_batch_sync(str(batch.batch_id))
+                    processed = process_due_supply_drafts(store_id)
+                    if processed:
+                        logger.info(f"[store={store_id}] ▶️ steps={processed}")
                 except Exception as exc:  # noqa: BLE001
-                    logger.error(f"[store={store_id}] ❌ error in batch {batch.batch_id}: {exc}")
-                finally:
-                    PROCESSING_STORES.discard(store_id)
+                    logger.error(f"[store={store_id}] ❌ error: {exc}")
 
             # Периодически чистим старые черновики/батчи
             try:
@@ -86,7 +90,7 @@ def main():
         except Exception as exc:  # noqa: BLE001
             logger.error(f"❌ scheduler loop error: {exc}")
 
-        time.sleep(SLEEP_SECONDS)
+        time.sleep(sleep_seconds())
 
 
 if __name__ == "__main__":
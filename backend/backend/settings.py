@@ -76,6 +76,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'backend.metrics.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -204,6 +205,18 @@ LOGGING = {
 }
 
 
+# Общий кеш для всех веб-воркеров и Celery: метки последних синков, блокировки, сессии бота.
+# Отдельная база Redis, чтобы не смешивать ключи кеша с очередью Celery.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('REDIS_CACHE_URL', 'redis://redis:6379/1'),
+        'KEY_PREFIX': 'markets',
+        'TIMEOUT': 300,
+    }
+}
+
+
 # Celery settings
 CELERY_BROKER_URL = 'redis://redis:6379/0'
 CELERY_RESULT_BACKEND = 'redis://redis:6379/0'
@@ -222,6 +235,27 @@ CELERY_WORKER_DISABLE_RATE_LIMITS = True
 CELERY_TASK_IGNORE_RESULT = True
 CELERY_RESULT_EXPIRES = 3600  # Результаты удаляются через час
 
+# Очереди: interactive (по умолчанию), supply, ads-sheets, nightly-sync — см. backend/celery_routing.py.
+# Лимиты времени выше — запасные, задачам с очередью они переопределяются аннотациями.
+CELERY_TASK_DEFAULT_QUEUE = 'interactive'
+CELERY_TASK_ROUTES = ('backend.celery_routing.route_task',)
+CELERY_TASK_ANNOTATIONS = ('backend.celery_routing.QueueAnnotations',)
+
+# Партиции ozon_sale и ozon_productdailyanalytics (см. ozon/partitions.py): сколько месяцев
+# держать в таблицах (0 — без ограничения) и что делать со старыми партициями: archive | drop
+PARTITION_MONTHS_AHEAD = int(os.getenv('PARTITION_MONTHS_AHEAD', '3'))
+SALE_RETENTION_MONTHS = int(os.getenv('SALE_RETENTION_MONTHS', '24'))
+DAILY_ANALYTICS_RETENTION_MONTHS = int(os.getenv('DAILY_ANALYTICS_RETENTION_MONTHS', '24'))
+PARTITION_RETENTION_ACTION = os.getenv('PARTITION_RETENTION_ACTION', 'archive')
+PARTITION_ARCHIVE_SCHEMA = os.getenv('PARTITION_ARCHIVE_SCHEMA', 'ozon_archive')
+
+# Внешние API. OZON_API_STUB_URL (например http://localhost:8765) направляет Seller и Performance API
+# на локальный стаб (python manage.py ozon_stub_server), GOOGLE_SHEETS_STUB_URL — чтение/запись листов.
+OZON_API_STUB_URL = os.getenv('OZON_API_STUB_URL', '').rstrip('/')
+OZON_SELLER_API_URL = OZON_API_STUB_URL or os.getenv('OZON_SELLER_API_URL', 'https://api-seller.ozon.ru')
+OZON_PERFORMANCE_API_URL = OZON_API_STUB_URL or os.getenv('OZON_PERFORMANCE_API_URL', 'https://api-performance.ozon.ru')
+GOOGLE_SHEETS_STUB_URL = os.getenv('GOOGLE_SHEETS_STUB_URL', '').rstrip('/')
+
 # Настройки для стабильности брокера
 CELERY_BROKER_CONNECTION_RETRY = True
 CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True
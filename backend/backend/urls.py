@@ -1,12 +1,15 @@
 from django.contrib import admin
 from django.urls import path, include
 
+from backend.metrics import metrics_view
+
 from django.conf import settings
 from django.conf.urls.static import static
 urlpatterns = [
     path('admin/', admin.site.urls),
     path("api/", include("ozon.urls")),
     path('auth/', include('users.urls')),
+    path('metrics', metrics_view, name='metrics'),
 
 
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
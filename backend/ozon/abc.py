@@ -0,0 +1,227 @@
+"""ABC-классификация товаров магазина одним SQL-запросом.
+
+Группировка ProductDailyAnalytics по товару, ранжирование по выручке, кумулятивная доля
+(SUM() OVER (ORDER BY revenue DESC)), фильтр по минимальным остаткам FBS/FBO и привязка
+ручных/авто-кампаний считаются в БД. Результат — типизированные строки AbcRow, которые
+использует update_abc_sheet и может отдавать API.
+"""
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import connection
+from django.db.models import Sum
+from django.utils.dateparse import parse_datetime
+
+from .models import ManualCampaign, ProductDailyAnalytics
+
+# Ручные кампании, которые учитываются в ABC
+ABC_MANUAL_STATES = (
+    ManualCampaign.CAMPAIGN_STATE_RUNNING,
+    ManualCampaign.CAMPAIGN_STATE_STOPPED,
+)
+
+# SKU входит в sku_list ручной кампании (JSON-массив чисел)
+_SKU_LIST_MATCH = {
+    "postgresql": "m.sku_list::jsonb @> to_jsonb(r.sku)",
+    "sqlite": "EXISTS (SELECT 1 FROM json_each(m.sku_list) j WHERE j.value = r.sku)",
+}
+
+ABC_SQL = """
+WITH sales AS (
+    SELECT offer_id, name, sku, SUM(revenue) AS revenue, SUM(ordered_units) AS units
+    FROM ozon_productdailyanalytics
+    WHERE store_id = %(store_id)s AND "date" >= %(date_from)s AND "date" <= %(date_to)s
+    GROUP BY offer_id, name, sku
+),
+total AS (
+    SELECT COALESCE(SUM(revenue), 0) AS revenue FROM sales
+),
+ranked AS (
+    SELECT
+        s.offer_id, s.name, s.sku, s.revenue, s.units,
+        ROW_NUMBER() OVER (ORDER BY s.revenue DESC, s.sku, s.offer_id, s.name) AS position,
+        SUM(s.revenue) OVER (
+            ORDER BY s.revenue DESC, s.sku, s.offer_id, s.name
+            ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+        ) AS cumulative_revenue
+    FROM sales s
+    WHERE s.revenue > 0
+),
+fbs AS (
+    SELECT sku, SUM(present) AS qty FROM ozon_fbsstock WHERE store_id = %(store_id)s GROUP BY sku
+),
+fbo AS (
+    SELECT sku, SUM(available_stock_count) AS qty FROM ozon_warehousestock WHERE store_id = %(store_id)s GROUP BY sku
+),
+auto AS (
+    SELECT sku, MIN(id) AS id FROM ozon_adplanitem WHERE store_id = %(store_id)s GROUP BY sku
+)
+SELECT
+    r.position, r.offer_id, r.name, r.sku, r.revenue, r.units, r.cumulative_revenue, t.revenue,
+    CASE
+        WHEN r.cumulative_revenue <= t.revenue * %(a_share)s THEN 'A'
+        WHEN r.cumulative_revenue <= t.revenue * %(ab_share)s THEN 'B'
+        ELSE 'C'
+    END,
+    COALESCE(fbs.qty, 0),
+    COALESCE(fbo.qty, 0),
+    (%(min_fbs)s <= 0 OR COALESCE(fbs.qty, 0) >= %(min_fbs)s)
+        AND (%(min_fbo)s <= 0 OR COALESCE(fbo.qty, 0) >= %(min_fbo)s),
+    a.ozon_campaign_id, COALESCE(NULLIF(a.campaign_name, ''), NULLIF(a.name, ''), a.offer_id), a.state,
+    a.is_active_in_sheets,
+    m.ozon_campaign_id, m.name, m.state, m.ozon_updated_at
+FROM ranked r
+CROSS JOIN total t
+LEFT JOIN fbs ON fbs.sku = r.sku
+LEFT JOIN fbo ON fbo.sku = r.sku
+LEFT JOIN auto ON auto.sku = r.sku AND r.sku <> 0
+LEFT JOIN ozon_adplanitem a ON a.id = auto.id
+LEFT JOIN ozon_manualcampaign m
+    ON m.store_id = %(store_id)s
+    AND r.sku <> 0
+    AND m.state IN ({manual_states})
+    AND (m.sku = r.sku OR {sku_list_match})
+ORDER BY r.position, CASE WHEN m.sku = r.sku THEN 0 ELSE 1 END, m.id
+"""
+
+
+@dataclass
+class AbcCampaign:
+    ozon_campaign_id: str
+    name: str
+    state: str
+    manual: bool
+    ozon_updated_at: datetime | None = None
+    is_active_in_sheets: bool = False
+
+
+@dataclass
+class AbcRow:
+    position: int
+    offer_id: str
+    name: str
+    sku: int
+    revenue: Decimal
+    units: int
+    cumulative_revenue: Decimal
+    abc: str
+    fbs_stock: int
+    fbo_stock: int
+    stock_ok: bool
+    manual_campaigns: list[AbcCampaign] = field(default_factory=list)
+    auto_campaign: AbcCampaign | None = None
+
+    @property
+    def avg_price(self) -> Decimal:
+        if not self.units:
+            return Decimal('0')
+        return (self.revenue / self.units).quantize(Decimal('0.1'), rounding=ROUND_HALF_UP)
+
+    @property
+    def campaign(self) -> AbcCampaign | None:
+        """Кампания для листа: ручная в приоритете, иначе авто."""
+        return self.manual_campaigns[0] if self.manual_campaigns else self.auto_campaign
+
+
+@dataclass
+class AbcResult:
+    total_revenue: Decimal
+    rows: list[AbcRow]
+
+
+def _decimal(value) -> Decimal:
+    return Decimal(str(value or 0))
+
+
+def _datetime(value):
+    if isinstance(value, str):
+        return parse_datetime(value)
+    return value
+
+
+def abc_classify(
+    store,
+    date_from: date,
+    date_to: date,
+    shares: tuple[Decimal, Decimal, Decimal],
+    min_fbs_stock: int = 0,
+    min_fbo_stock: int = 0,
+) -> AbcResult:
+    """ABC по выручке за [date_from, date_to]: доли shares = (A, B, C) от общей выручки.
+
+    total_revenue — выручка по всем товарам периода; в rows только товары с выручкой > 0,
+    по убыванию выручки. stock_ok — товар проходит пороги min_fbs_stock/min_fbo_stock.
+    """
+    a_share, b_share = Decimal(str(shares[0])), Decimal(str(shares[1]))
+    state_params = {f"manual_state_{i}": state for i, state in enumerate(ABC_MANUAL_STATES)}
+    sql = ABC_SQL.format(
+        sku_list_match=_SKU_LIST_MATCH[connection.vendor],
+        manual_states=", ".join(f"%({name})s" for name in state_params),
+    )
+    params = {
+        "store_id": store.id,
+        "date_from": date_from,
+        "date_to": date_to,
+        "a_share": a_share,
+        "ab_share": a_share + b_share,
+        "min_fbs": int(min_fbs_stock or 0),
+        "min_fbo": int(min_fbo_stock or 0),
+        **state_params,
+    }
+    if connection.vendor == "sqlite":
+        # sqlite получает Decimal строкой — для умножения нужны числа
+        params.update(a_share=float(a_share), ab_share=float(a_share + b_share))
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        records = cursor.fetchall()
+
+    total_revenue = Decimal('0')
+    rows: list[AbcRow] = []
+    for (
+        position, offer_id, name, sku, revenue, units, cumulative, total, abc, fbs, fbo, stock_ok,
+        auto_id, auto_name, auto_state, auto_active,
+        manual_id, manual_name, manual_state, manual_updated_at,
+    ) in records:
+        total_revenue = _decimal(total)
+        if not rows or rows[-1].position != position:
+            auto = None
+            if auto_id is not None:
+                auto = AbcCampaign(
+                    ozon_campaign_id=auto_id or '',
+                    name=auto_name or '',
+                    state=auto_state or 'CAMPAIGN_STATE_UNKNOWN',
+                    manual=False,
+                    is_active_in_sheets=bool(auto_active),
+                )
+            rows.append(AbcRow(
+                position=position,
+                offer_id=offer_id or '',
+                name=name or '',
+                sku=sku,
+                revenue=_decimal(revenue),
+                units=int(units or 0),
+                cumulative_revenue=_decimal(cumulative),
+                abc=abc,
+                fbs_stock=int(fbs or 0),
+                fbo_stock=int(fbo or 0),
+                stock_ok=bool(stock_ok),
+                auto_campaign=auto,
+            ))
+        if manual_name is not None:
+            rows[-1].manual_campaigns.append(AbcCampaign(
+                ozon_campaign_id=manual_id or '',
+                name=manual_name,
+                state=manual_state,
+                manual=True,
+                ozon_updated_at=_datetime(manual_updated_at),
+            ))
+
+    if not rows:
+        # Товаров с выручкой > 0 нет, но общая выручка периода всё равно нужна листу (B4)
+        total_revenue = _decimal(
+            ProductDailyAnalytics.objects.filter(store=store, date__gte=date_from, date__lte=date_to)
+            .aggregate(total=Sum('revenue'))['total']
+        )
+    return AbcResult(total_revenue=total_revenue, rows=rows)
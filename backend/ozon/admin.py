@@ -20,6 +20,7 @@ from .models import (
     ManualCampaign,
     CampaignPerformanceReport,
     CampaignPerformanceReportEntry,
+    CampaignDailySpend,
     StoreAdControl,
     OzonFbsPosting,
     OzonFbsPostingStatusHistory,
@@ -571,6 +572,14 @@ class CampaignPerformanceReportEntryAdmin(admin.ModelAdmin):
     report_date_to.admin_order_field = 'report__date_to'
 
 
+@admin.register(CampaignDailySpend)
+class CampaignDailySpendAdmin(admin.ModelAdmin):
+    list_display = ('id', 'store', 'ozon_campaign_id', 'date', 'spend', 'orders', 'revenue', 'updated_at')
+    list_filter = (('date', DateFieldListFilter),)
+    search_fields = ('ozon_campaign_id',)
+    ordering = ('-date', 'ozon_campaign_id')
+
+
 @admin.register(StoreAdControl)
 class StoreAdControlAdmin(admin.ModelAdmin):
     list_display = ('store', 'is_system_enabled', 'updated_at')
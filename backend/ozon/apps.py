@@ -10,3 +10,22 @@ class OzonConfig(AppConfig):
     def ready(self):
         import ozon.tasks  # <- обязательно, чтобы celery подхватил
 
+        from django.db.models.signals import post_save
+
+        from users.models import OzonStore
+        from . import models
+        from .planner_snapshot import invalidate_for_instance, invalidate_for_store
+
+        # Снимок данных планнера: post_delete не подключаем, чтобы delete() по queryset оставался
+        # одним запросом — такие места сами вызывают planner_snapshot.invalidate()
+        for model in (
+            models.Product,
+            models.Sale,
+            models.WarehouseStock,
+            models.FbsStock,
+            models.DeliveryCluster,
+            models.DeliveryClusterItemAnalytics,
+            models.DeliveryAnalyticsSummary,
+        ):
+            post_save.connect(invalidate_for_instance, sender=model, dispatch_uid=f"planner_snapshot_{model.__name__}")
+        post_save.connect(invalidate_for_store, sender=OzonStore, dispatch_uid="planner_snapshot_store")
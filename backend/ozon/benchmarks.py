@@ -0,0 +1,441 @@
+"""Офлайн-бенчмарки планнера, аналитики, ABC и KPI на синтетическом магазине.
+
+generate_store() наполняет БД магазином на N SKU, M кластеров и D дней истории (продажи, остатки,
+ежедневная аналитика, статистика Performance, отправления FBS, кампании). run_benchmarks() гоняет
+сценарии SCENARIOS без сети: запросы к Ozon (requests) запрещены, лист Google подменён снимком в
+памяти. По каждому сценарию пишется время (min/медиана) и число SQL-запросов, compare() сверяет
+результат с сохранённой базой.
+
+Запуск: python manage.py benchmark (см. ozon/management/commands/benchmark.py) — на отдельной
+тестовой БД, как у manage.py test; для реальных цифр — локальный PostgreSQL.
+"""
+import random
+import statistics
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock
+
+import requests
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from users.models import OzonStore, User
+
+from .abc import abc_classify
+from .models import (
+    AdPlanItem,
+    CampaignDailySpend,
+    CampaignPerformanceReport,
+    CampaignPerformanceReportEntry,
+    DeliveryAnalyticsSummary,
+    DeliveryCluster,
+    DeliveryClusterItemAnalytics,
+    FbsStock,
+    ManualCampaign,
+    OzonFbsPosting,
+    Product,
+    ProductDailyAnalytics,
+    Sale,
+    WarehouseStock,
+)
+from .payloads import PayloadRef, store_payloads
+from .sheets import SheetSnapshot
+
+BATCH_SIZE = 2000
+SHEET_START_ROW = 13
+ABC_SHARES = (Decimal("0.8"), Decimal("0.15"), Decimal("0.05"))
+
+
+@dataclass
+class SyntheticStoreSpec:
+    skus: int = 500
+    clusters: int = 20
+    days: int = 60
+    warehouses_per_cluster: int = 2
+    campaign_share: float = 0.3
+    manual_campaigns: int = 20
+    postings_per_day: int = 50
+    seed: int = 1
+
+
+@dataclass
+class SyntheticStore:
+    store: OzonStore
+    user: User
+    spec: SyntheticStoreSpec
+    campaign_ids: list
+    manual_campaign_ids: list
+
+
+def _bulk(model, objs):
+    model.objects.bulk_create(objs, batch_size=BATCH_SIZE)
+
+
+def generate_store(spec: SyntheticStoreSpec, name: str = "Benchmark") -> SyntheticStore:
+    """Магазин с историей по spec; данные детерминированы seed."""
+    rnd = random.Random(spec.seed)
+    today = timezone.localdate()
+    now = timezone.now()
+    tz = timezone.get_current_timezone()
+
+    user = User.objects.create_user(telegram_id=900000000 + spec.seed, password="benchmark")
+    store = OzonStore.objects.create(
+        user=user,
+        name=name,
+        client_id=f"bench-{spec.seed}",
+        api_key=f"bench-key-{spec.seed}",
+        google_sheet_url=f"https://sheets.invalid/benchmark/{spec.seed}",
+    )
+
+    clusters = [(100 + i, f"Кластер {i + 1}") for i in range(spec.clusters)]
+    warehouses = [
+        (cluster_id * 100 + j, f"Склад {cluster_name} #{j + 1}", cluster_id, cluster_name)
+        for cluster_id, cluster_name in clusters
+        for j in range(spec.warehouses_per_cluster)
+    ]
+
+    products = [
+        Product(
+            store=store,
+            product_id=spec.seed * 10_000_000 + i,
+            sku=spec.seed * 10_000_000 + i,
+            offer_id=f"BENCH-{i:05d}",
+            name=f"Товар {i}",
+            barcodes=[f"46{spec.seed:03d}{i:08d}"],
+            price=Decimal(rnd.randint(300, 5000)),
+        )
+        for i in range(spec.skus)
+    ]
+    _bulk(Product, products)
+    products = list(Product.objects.filter(store=store).order_by("sku"))
+    # Спрос по SKU неравномерный, как в жизни: немного лидеров и длинный хвост
+    demand = {p.sku: rnd.paretovariate(1.2) for p in products}
+
+    sales, analytics = [], []
+    for day in range(spec.days):
+        day_date = today - timedelta(days=day)
+        day_start = timezone.make_aware(datetime.combine(day_date, datetime.min.time()), tz)
+        for product in products:
+            qty_total = int(demand[product.sku] * rnd.random())
+            if not qty_total:
+                continue
+            revenue = Decimal("0")
+            for _ in range(min(qty_total, 3)):
+                _, cluster_name = rnd.choice(clusters)
+                qty = max(1, qty_total // 3)
+                revenue += product.price * qty
+                sales.append(Sale(
+                    store=store,
+                    sale_type=Sale.FBO if rnd.random() < 0.7 else Sale.FBS,
+                    sku=product.sku,
+                    date=day_start + timedelta(minutes=rnd.randint(0, 1439)),
+                    quantity=qty,
+                    price=product.price,
+                    payout=product.price * Decimal("0.8"),
+                    commission_amount=product.price * Decimal("0.2"),
+                    cluster_to=cluster_name,
+                    status="delivered",
+                ))
+            analytics.append(ProductDailyAnalytics(
+                store=store, sku=product.sku, offer_id=product.offer_id, name=product.name,
+                date=day_date, revenue=revenue, ordered_units=qty_total,
+            ))
+        if len(sales) >= BATCH_SIZE * 5:
+            _bulk(Sale, sales)
+            sales = []
+    _bulk(Sale, sales)
+    _bulk(ProductDailyAnalytics, analytics)
+
+    stocks, fbs_stocks, cluster_items = [], [], []
+    for product in products:
+        for warehouse_id, warehouse_name, cluster_id, cluster_name in rnd.sample(warehouses, min(len(warehouses), 4)):
+            stocks.append(WarehouseStock(
+                store=store, product=product, sku=product.sku, warehouse_id=warehouse_id,
+                warehouse_name=warehouse_name, cluster_id=cluster_id, cluster_name=cluster_name,
+                available_stock_count=rnd.randint(0, 200), transit_stock_count=rnd.randint(0, 20),
+            ))
+        fbs_stocks.append(FbsStock(
+            store=store, product_id=product.product_id, sku=product.sku, fbs_sku=product.sku,
+            present=rnd.randint(0, 50), warehouse_id=1, warehouse_name="FBS",
+        ))
+        for cluster_id, cluster_name in rnd.sample(clusters, min(len(clusters), 3)):
+            cluster_items.append(DeliveryClusterItemAnalytics(
+                store=store, cluster_id=cluster_id, cluster_name=cluster_name, sku=product.sku,
+                offer_id=product.offer_id, delivery_schema="FBO", average_delivery_time=rnd.uniform(20, 60),
+                average_delivery_time_status="MEDIUM", impact_share=rnd.random(), attention_level="LOW",
+                recommended_supply=rnd.randint(0, 30),
+            ))
+    _bulk(WarehouseStock, stocks)
+    _bulk(FbsStock, fbs_stocks)
+    _bulk(DeliveryClusterItemAnalytics, cluster_items)
+    _bulk(DeliveryCluster, [
+        DeliveryCluster(
+            store=store, delivery_cluster_id=cluster_id, name=cluster_name, type="CLUSTER_TYPE_OZON",
+            average_delivery_time=rnd.uniform(20, 60), impact_share=rnd.random(),
+            lost_profit=Decimal(rnd.randint(0, 100000)), recommended_supply=rnd.randint(0, 500),
+        )
+        for cluster_id, cluster_name in clusters
+    ])
+    DeliveryAnalyticsSummary.objects.create(
+        store=store, average_delivery_time=40, average_delivery_time_status="MEDIUM", total_orders=len(analytics),
+        lost_profit=Decimal("0"), impact_share=0.5, attention_level="LOW", recommended_supply=0,
+    )
+
+    # Авто-кампании на долю SKU и ручные — на лидеров спроса
+    campaign_products = products[: int(len(products) * spec.campaign_share)]
+    _bulk(AdPlanItem, [
+        AdPlanItem(
+            store=store, sku=p.sku, offer_id=p.offer_id, name=p.name, week_budget=Decimal("7000"),
+            day_budget=Decimal("1000"), ozon_campaign_id=f"{spec.seed}{i:07d}",
+            state=AdPlanItem.CAMPAIGN_STATE_RUNNING, ozon_created_at=now - timedelta(days=spec.days),
+        )
+        for i, p in enumerate(campaign_products)
+    ])
+    campaign_ids = [f"{spec.seed}{i:07d}" for i in range(len(campaign_products))]
+    leaders = sorted(products, key=lambda p: demand[p.sku], reverse=True)[: spec.manual_campaigns]
+    _bulk(ManualCampaign, [
+        ManualCampaign(
+            store=store, name=f"Ручная {p.offer_id}", offer_id=p.offer_id, sku=p.sku,
+            ozon_campaign_id=f"{spec.seed}9{i:06d}", sku_list=[p.sku], offer_id_list=[p.offer_id],
+            state=ManualCampaign.CAMPAIGN_STATE_RUNNING,
+        )
+        for i, p in enumerate(leaders)
+    ])
+    manual_campaign_ids = [f"{spec.seed}9{i:06d}" for i in range(len(leaders))]
+
+    reports, entries = [], []
+    for day in range(spec.days):
+        day_date = today - timedelta(days=day)
+        day_start = timezone.make_aware(datetime.combine(day_date, datetime.min.time()), tz)
+        reports.append(CampaignPerformanceReport(
+            store=store, report_uuid=f"bench-{spec.seed}-{day_date:%Y%m%d}",
+            date_from=day_start, date_to=day_start + timedelta(days=1) - timedelta(microseconds=1),
+            status=CampaignPerformanceReport.STATUS_READY,
+        ))
+    _bulk(CampaignPerformanceReport, reports)
+    reports = {r.date_from.astimezone(tz).date(): r for r in CampaignPerformanceReport.objects.filter(store=store)}
+    for day_date, report in reports.items():
+        for campaign_id in campaign_ids + manual_campaign_ids:
+            orders = rnd.randint(0, 10)
+            totals = {
+                "orders": str(orders),
+                "ordersMoney": str(orders * rnd.randint(300, 5000)),
+                "moneySpent": f"{rnd.uniform(0, 1500):.2f}",
+                "clicks": str(rnd.randint(0, 500)),
+            }
+            entries.append(CampaignPerformanceReportEntry(
+                store=store, report=report, ozon_campaign_id=campaign_id, report_date=day_date,
+                totals=totals, rows=[totals],
+            ))
+    _bulk(CampaignPerformanceReportEntry, entries)
+    # bulk_create минует save(), журнал расхода заполняем сами
+    CampaignDailySpend.record_entries(entries)
+
+    postings = []
+    for day in range(spec.days):
+        moment = now - timedelta(days=day)
+        for i in range(spec.postings_per_day):
+            product = rnd.choice(products)
+            postings.append((
+                OzonFbsPosting(
+                    store=store, posting_number=f"{spec.seed}-{day:03d}-{i:05d}-1",
+                    status=rnd.choice([OzonFbsPosting.STATUS_AWAITING_PACKAGING, OzonFbsPosting.STATUS_DELIVERED]),
+                    in_process_at=moment, shipment_date=moment + timedelta(days=1), last_seen_at=moment,
+                ),
+                [{"sku": product.sku, "offer_id": product.offer_id, "quantity": 1, "price": str(product.price)}],
+            ))
+    digests = store_payloads(products_payload for _, products_payload in postings)
+    for (posting, _), digest in zip(postings, digests):
+        posting.products = PayloadRef(digest)
+    _bulk(OzonFbsPosting, [posting for posting, _ in postings])
+
+    return SyntheticStore(store, user, spec, campaign_ids, manual_campaign_ids)
+
+
+# --- без сети ---------------------------------------------------------------
+
+
+class OfflineError(RuntimeError):
+    """Сценарий бенчмарка попытался сходить во внешний сервис."""
+
+
+class _OfflineSpreadsheet:
+    def batch_update(self, body):
+        return {}
+
+
+class _OfflineWorksheet:
+    title = "Main_ADV"
+    id = 0
+    spreadsheet = _OfflineSpreadsheet()
+
+    def batch_update(self, data, **kwargs):
+        return {}
+
+
+def sheet_values(synthetic: SyntheticStore):
+    """Лист Main_ADV: магазин в V23, период KPI в V28, авто-кампании, затем блок ручных (E = «Ручная»)."""
+    grid = [[""] * 22 for _ in range(SHEET_START_ROW - 1)]
+    rows = [[campaign_id, "TRUE", "", "", "Авто"] for campaign_id in synthetic.campaign_ids]
+    rows += [[campaign_id, "TRUE", "", "", "Ручная"] for campaign_id in synthetic.manual_campaign_ids]
+    grid += rows
+    # V23/V28 лежат в строках кампаний или ниже — дописываем колонку V в нужные строки
+    for row, value in ((23, synthetic.store.name), (28, "30")):
+        while len(grid) < row:
+            grid.append([])
+        line = grid[row - 1]
+        line.extend([""] * (22 - len(line)))
+        line[21] = value
+    return grid
+
+
+@contextmanager
+def offline(synthetic: SyntheticStore):
+    """Запрещает HTTP к Ozon и Google; лист открывается из памяти, запись в него никуда не уходит."""
+
+    def _blocked(self, method, url, *args, **kwargs):
+        raise OfflineError(f"Внешний запрос в бенчмарке: {method} {url}")
+
+    def _snapshot(*args, **kwargs):
+        return SheetSnapshot(_OfflineWorksheet(), sheet_values(synthetic))
+
+    with mock.patch.object(requests.Session, "request", _blocked), \
+            mock.patch("ozon.tasks.open_sheet_snapshot", _snapshot), \
+            mock.patch("ozon.sheets.open_sheet_snapshot", _snapshot):
+        yield
+
+
+# --- сценарии ---------------------------------------------------------------
+
+
+class ScenarioFailed(RuntimeError):
+    """Сценарий отработал с ошибкой: замер такого прогона ничего не говорит о скорости."""
+
+
+def check_result(name, result):
+    """Ответ view не 200 или dict задачи с "error" — исключение ScenarioFailed."""
+    status_code = getattr(result, "status_code", None)
+    if status_code is not None and status_code != 200:
+        raise ScenarioFailed(f"{name}: HTTP {status_code} {getattr(result, 'data', '')}")
+    if isinstance(result, dict) and result.get("error"):
+        raise ScenarioFailed(f"{name}: {result['error']}")
+    return result
+
+
+def _post_view(view_cls, data, user=None):
+    request = APIRequestFactory().post("/benchmark/", data, format="json")
+    if user is not None:
+        force_authenticate(request, user=user)
+    return view_cls.as_view()(request)
+
+
+def bench_planner(synthetic):
+    from .views import Planer_View
+    return _post_view(Planer_View, {"store_id": synthetic.store.id}, synthetic.user)
+
+
+def bench_planner_pivot(synthetic):
+    from .views import PlanerPivotView
+    return _post_view(PlanerPivotView, {"store_id": synthetic.store.id}, synthetic.user)
+
+
+def bench_analytics_by_item(synthetic):
+    from .views import ProductAnalyticsByItemView
+    store = synthetic.store
+    return _post_view(ProductAnalyticsByItemView, {"Api-Key": store.api_key, "client_id": store.client_id, "days": 30})
+
+
+def bench_abc(synthetic):
+    today = timezone.localdate()
+    return abc_classify(synthetic.store, today - timedelta(days=synthetic.spec.days - 1), today, ABC_SHARES)
+
+
+def bench_kpi_auto(synthetic):
+    from .tasks import update_auto_campaign_kpis_in_sheets
+    return update_auto_campaign_kpis_in_sheets(spreadsheet_url=synthetic.store.google_sheet_url)
+
+
+def bench_kpi_manual(synthetic):
+    from .tasks import update_manual_campaign_kpis_in_sheets
+    return update_manual_campaign_kpis_in_sheets(spreadsheet_url=synthetic.store.google_sheet_url)
+
+
+SCENARIOS = {
+    "planner": bench_planner,
+    "planner_pivot": bench_planner_pivot,
+    "analytics_by_item": bench_analytics_by_item,
+    "abc": bench_abc,
+    "kpi_auto": bench_kpi_auto,
+    "kpi_manual": bench_kpi_manual,
+}
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    runs: int
+    min_sec: float
+    median_sec: float
+    queries: int
+
+
+def run_benchmarks(synthetic: SyntheticStore, names=None, repeat: int = 3) -> list[BenchmarkResult]:
+    """Каждый сценарий repeat раз: время по всем прогонам, число запросов — по последнему.
+
+    Прогон, завершившийся ошибкой (check_result), прерывает бенчмарк исключением ScenarioFailed.
+    """
+    results = []
+    with offline(synthetic):
+        for name in names or SCENARIOS:
+            scenario = SCENARIOS[name]
+            durations = []
+            queries = 0
+            for _ in range(max(1, repeat)):
+                with CaptureQueriesContext(connection) as ctx:
+                    started = time.perf_counter()
+                    result = scenario(synthetic)
+                    durations.append(time.perf_counter() - started)
+                check_result(name, result)
+                queries = len(ctx.captured_queries)
+            results.append(BenchmarkResult(
+                name=name,
+                runs=len(durations),
+                min_sec=round(min(durations), 4),
+                median_sec=round(statistics.median(durations), 4),
+                queries=queries,
+            ))
+    return results
+
+
+def report(synthetic: SyntheticStore, results) -> dict:
+    return {
+        "created_at": timezone.now().isoformat(),
+        "vendor": connection.vendor,
+        "spec": asdict(synthetic.spec),
+        "results": {r.name: asdict(r) for r in results},
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float = 0.25, min_delta_sec: float = 0.05) -> list[str]:
+    """Регрессии относительно базы: больше SQL-запросов или медиана дольше на tolerance (и на min_delta_sec).
+
+    Сравнивается только при одинаковых spec и СУБД — иначе цифры несопоставимы.
+    """
+    if current.get("spec") != baseline.get("spec") or current.get("vendor") != baseline.get("vendor"):
+        return []
+    regressions = []
+    for name, result in current.get("results", {}).items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        if result["queries"] > base["queries"]:
+            regressions.append(f"{name}: SQL-запросов {base['queries']} → {result['queries']}")
+        limit = base["median_sec"] * (1 + tolerance)
+        if result["median_sec"] > limit and result["median_sec"] - base["median_sec"] > min_delta_sec:
+            regressions.append(f"{name}: медиана {base['median_sec']}s → {result['median_sec']}s")
+    return regressions
@@ -0,0 +1,265 @@
+"""Синхронизация аналитики доставки по кластерам (average-delivery-time) пачками.
+
+Кластеры магазина: один запрос общей аналитики, названия — из справочника складов
+(get_cluster_names), в /v1/cluster/list уходят только кластеры, которых там нет; запись — одним
+INSERT … ON CONFLICT по (store, delivery_cluster_id).
+
+Товары по кластерам: страницы details по всем парам (кластер, схема FBS/FBO) забираются
+параллельно в пределах общего бюджета запросов магазина и сводятся в памяти по (кластер, sku).
+В базу уходят только строки с изменившимся row_hash — одним upsert по (store, cluster_id, sku),
+пропавшие из выдачи строки удаляются одним запросом. Повторный прогон без изменений у Ozon
+сводится к чтению хешей, поэтому аналитику для планнера можно обновлять несколько раз в день.
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import requests
+
+from .models import DeliveryAnalyticsSummary, DeliveryCluster, DeliveryClusterItemAnalytics
+from .payloads import payload_digest
+from .planner_snapshot import invalidate as invalidate_planner_snapshot
+from .utils import SELLER_API_URL, acquire_rate_slot, get_cluster_names
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_URL = f"{SELLER_API_URL}/v1/analytics/average-delivery-time"
+DETAILS_URL = f"{SELLER_API_URL}/v1/analytics/average-delivery-time/details"
+CLUSTER_LIST_URL = f"{SELLER_API_URL}/v1/cluster/list"
+
+SCHEMAS = ("FBS", "FBO")
+SUPPLY_PERIOD = "FOUR_WEEKS"
+PAGE_LIMIT = 1000
+CLUSTER_LIST_CHUNK = 10
+
+# Бюджет запросов аналитики доставки на магазин (общий для потоков и воркеров) и число потоков.
+DELIVERY_ANALYTICS_RPS = 2
+DELIVERY_ANALYTICS_CONCURRENCY = 4
+DELIVERY_ANALYTICS_MAX_RETRIES = 3
+DELIVERY_ANALYTICS_RETRY_SECONDS = 2.0
+
+# Поля строки, из которых считается row_hash
+HASHED_FIELDS = (
+    "cluster_name",
+    "offer_id",
+    "delivery_schema",
+    "average_delivery_time",
+    "average_delivery_time_status",
+    "impact_share",
+    "attention_level",
+    "recommended_supply",
+    "recommended_supply_FBO",
+    "recommended_supply_FBS",
+)
+
+
+def rate_key(store) -> str:
+    return f"ozon_delivery_rate:{store.id}"
+
+
+def _headers(store) -> dict:
+    return {"Client-Id": store.client_id, "Api-Key": store.api_key, "Content-Type": "application/json"}
+
+
+def post(store, url, payload) -> dict:
+    """POST в пределах бюджета магазина с повтором на 429 (Retry-After); ошибка HTTP — исключение."""
+    attempt = 0
+    while True:
+        attempt += 1
+        acquire_rate_slot(rate_key(store), DELIVERY_ANALYTICS_RPS)
+        resp = requests.post(url, headers=_headers(store), json=payload, timeout=30)
+        if resp.status_code == 429 and attempt < DELIVERY_ANALYTICS_MAX_RETRIES:
+            try:
+                delay = float(resp.headers.get("Retry-After"))
+            except (TypeError, ValueError):
+                delay = DELIVERY_ANALYTICS_RETRY_SECONDS
+            time.sleep(delay)
+            continue
+        resp.raise_for_status()
+        return resp.json()
+
+
+# ---------- кластеры ----------
+
+def sync_delivery_clusters(store) -> int:
+    """Общая аналитика доставки магазина: сводка и кластеры. Возвращает число записанных кластеров."""
+    data = post(store, ANALYTICS_URL, {"delivery_schema": "ALL"})
+
+    total = data.get("total") or {}
+    if total:
+        DeliveryAnalyticsSummary.objects.update_or_create(
+            store=store,
+            defaults={
+                "average_delivery_time": total.get("average_delivery_time", 0),
+                "average_delivery_time_status": total.get("average_delivery_time_status", ""),
+                "total_orders": (total.get("orders_count") or {}).get("total", 0),
+                "lost_profit": total.get("lost_profit", 0),
+                "impact_share": total.get("exact_impact_share", 0),
+                "attention_level": total.get("attention_level", ""),
+                "recommended_supply": total.get("recommended_supply", 0),
+            },
+        )
+
+    metrics_map = {}
+    for item in data.get("data") or []:
+        cluster_id = item.get("delivery_cluster_id")
+        if cluster_id and int(cluster_id) > 0:
+            metrics_map[int(cluster_id)] = item.get("metrics") or {}
+    if not metrics_map:
+        return 0
+
+    names = {cid: value for cid, value in get_cluster_names(store).items() if cid in metrics_map}
+    missing = [cid for cid in metrics_map if cid not in names]
+    for chunk in (missing[i:i + CLUSTER_LIST_CHUNK] for i in range(0, len(missing), CLUSTER_LIST_CHUNK)):
+        clusters = post(store, CLUSTER_LIST_URL, {
+            "cluster_ids": [str(cid) for cid in chunk],
+            "cluster_type": "CLUSTER_TYPE_OZON",
+        }).get("clusters") or []
+        for cluster in clusters:
+            names[int(cluster["id"])] = (cluster["name"], cluster["type"])
+
+    clusters = [
+        DeliveryCluster(
+            store=store,
+            delivery_cluster_id=cid,
+            name=names[cid][0],
+            type=names[cid][1],
+            average_delivery_time=metrics.get("average_delivery_time") or 0,
+            impact_share=metrics.get("exact_impact_share") or 0,
+            lost_profit=metrics.get("lost_profit") or 0,
+            recommended_supply=metrics.get("recommended_supply") or 0,
+        )
+        for cid, metrics in metrics_map.items()
+        if cid in names
+    ]
+    if clusters:
+        DeliveryCluster.objects.bulk_create(
+            clusters,
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=["store", "delivery_cluster_id"],
+            update_fields=["name", "type", "average_delivery_time", "impact_share", "lost_profit", "recommended_supply"],
+        )
+        invalidate_planner_snapshot(store.id)
+    return len(clusters)
+
+
+# ---------- товары по кластерам ----------
+
+@dataclass
+class ClusterSyncResult:
+    written: int = 0
+    unchanged: int = 0
+    deleted: int = 0
+    failed_clusters: list = field(default_factory=list)
+
+
+def fetch_details(store, cluster_id, schema) -> list:
+    """Все страницы details по кластеру и схеме."""
+    entries, offset = [], 0
+    while True:
+        data = post(store, DETAILS_URL, {
+            "cluster_id": cluster_id,
+            "limit": PAGE_LIMIT,
+            "offset": offset,
+            "filters": {"delivery_schema": schema, "supply_period": SUPPLY_PERIOD},
+        }).get("data") or []
+        entries.extend(data)
+        if len(data) < PAGE_LIMIT:
+            return entries
+        offset += PAGE_LIMIT
+
+
+def merge_details(cluster_id, cluster_name, pages) -> dict:
+    """{схема: entries} кластера → {sku: поля строки}.
+
+    Общие метрики берутся из последней схемы (FBO поверх FBS, как раньше), рекомендованная поставка —
+    по каждой схеме отдельно; recommended_supply — максимум из двух.
+    """
+    rows = {}
+    for schema in SCHEMAS:
+        for entry in pages.get(schema) or []:
+            item, metrics = entry["item"], entry["metrics"]
+            row = rows.setdefault(item["sku"], {"recommended_supply_FBO": None, "recommended_supply_FBS": None})
+            row.update({
+                "cluster_name": cluster_name,
+                "offer_id": item["offer_id"],
+                "delivery_schema": item["delivery_schema"],
+                "average_delivery_time": metrics["average_delivery_time"],
+                "average_delivery_time_status": metrics["average_delivery_time_status"],
+                "impact_share": metrics["exact_impact_share"],
+                "attention_level": metrics["attention_level"],
+                f"recommended_supply_{schema}": metrics["recommended_supply"],
+            })
+    for row in rows.values():
+        row["recommended_supply"] = max(row["recommended_supply_FBO"] or 0, row["recommended_supply_FBS"] or 0)
+        row["row_hash"] = payload_digest([row[name] for name in HASHED_FIELDS])
+    return rows
+
+
+def sync_cluster_item_analytics(store, concurrency=DELIVERY_ANALYTICS_CONCURRENCY) -> ClusterSyncResult:
+    """Детализация по товарам во всех кластерах магазина (кластеры — из DeliveryCluster)."""
+    result = ClusterSyncResult()
+    cluster_names = dict(
+        DeliveryCluster.objects.filter(store=store).values_list("delivery_cluster_id", "name")
+    )
+    if not cluster_names:
+        return result
+
+    jobs = [(cluster_id, schema) for cluster_id in cluster_names for schema in SCHEMAS]
+
+    def run(job):
+        cluster_id, schema = job
+        try:
+            return job, fetch_details(store, cluster_id, schema)
+        except Exception as e:
+            logger.warning(f"[{store}] Аналитика доставки: кластер {cluster_id} ({schema}) не загружен: {e}")
+            return job, None
+
+    pages = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(jobs)))) as pool:
+        for (cluster_id, schema), entries in pool.map(run, jobs):
+            pages.setdefault(cluster_id, {})[schema] = entries
+
+    # Кластер, у которого не загрузилась хотя бы одна схема, не трогаем: ни обновления, ни удаления
+    failed = {cluster_id for cluster_id, by_schema in pages.items() if None in by_schema.values()}
+    result.failed_clusters = sorted(failed)
+
+    fresh = {}
+    for cluster_id, by_schema in pages.items():
+        if cluster_id in failed:
+            continue
+        for sku, row in merge_details(cluster_id, cluster_names[cluster_id], by_schema).items():
+            fresh[(cluster_id, sku)] = row
+
+    stale_ids, existing = [], {}
+    for pk, cluster_id, sku, row_hash in DeliveryClusterItemAnalytics.objects.filter(store=store).values_list(
+        "id", "cluster_id", "sku", "row_hash",
+    ):
+        if (cluster_id, sku) in fresh:
+            existing[(cluster_id, sku)] = row_hash
+        elif cluster_id not in failed:
+            stale_ids.append(pk)
+
+    changed = [
+        DeliveryClusterItemAnalytics(store=store, cluster_id=cluster_id, sku=sku, **row)
+        for (cluster_id, sku), row in fresh.items()
+        if existing.get((cluster_id, sku)) != row["row_hash"]
+    ]
+    if changed:
+        DeliveryClusterItemAnalytics.objects.bulk_create(
+            changed,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=["store", "cluster_id", "sku"],
+            update_fields=[*HASHED_FIELDS, "row_hash", "updated_at"],
+        )
+    if stale_ids:
+        result.deleted, _ = DeliveryClusterItemAnalytics.objects.filter(pk__in=stale_ids).delete()
+    if changed or stale_ids:
+        invalidate_planner_snapshot(store.id)
+
+    result.written = len(changed)
+    result.unchanged = len(fresh) - len(changed)
+    return result
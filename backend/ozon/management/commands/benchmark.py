@@ -0,0 +1,82 @@
+"""python manage.py benchmark — офлайн-бенчмарки планнера, аналитики, ABC и KPI (ozon/benchmarks.py).
+
+Синтетический магазин создаётся в отдельной тестовой БД (как у manage.py test), рабочие данные не
+трогаются. Результат пишется в JSON (--output); с --baseline сравнивается с сохранённым прогоном,
+и при регрессии команда завершается с ошибкой. --save-baseline перезаписывает базу текущим прогоном.
+
+Пример: python manage.py benchmark --skus 2000 --clusters 30 --days 60 --baseline benchmarks/baseline.json
+"""
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+
+from ozon.benchmarks import SCENARIOS, SyntheticStoreSpec, compare, generate_store, report, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = "Офлайн-бенчмарки на синтетическом магазине (отдельная тестовая БД, без Ozon и Google)"
+
+    def add_arguments(self, parser):
+        defaults = SyntheticStoreSpec()
+        parser.add_argument("--skus", type=int, default=defaults.skus)
+        parser.add_argument("--clusters", type=int, default=defaults.clusters)
+        parser.add_argument("--days", type=int, default=defaults.days)
+        parser.add_argument("--postings-per-day", type=int, default=defaults.postings_per_day)
+        parser.add_argument("--seed", type=int, default=defaults.seed)
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="по умолчанию — все")
+        parser.add_argument("--output", default="benchmarks/latest.json")
+        parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+        parser.add_argument("--save-baseline", action="store_true", help="записать текущий прогон в --baseline")
+        parser.add_argument("--tolerance", type=float, default=0.25, help="допустимый рост медианы (0.25 = 25%%)")
+        parser.add_argument("--keepdb", action="store_true", help="не пересоздавать тестовую БД")
+
+    def handle(self, *args, **options):
+        spec = SyntheticStoreSpec(
+            skus=options["skus"],
+            clusters=options["clusters"],
+            days=options["days"],
+            postings_per_day=options["postings_per_day"],
+            seed=options["seed"],
+        )
+        verbosity = options["verbosity"]
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity=verbosity, interactive=False, keepdb=options["keepdb"])
+        try:
+            self.stdout.write(f"Генерация магазина: {spec}")
+            synthetic = generate_store(spec)
+            results = run_benchmarks(synthetic, options["scenario"], options["repeat"])
+            data = report(synthetic, results)
+        finally:
+            teardown_databases(old_config, verbosity=verbosity, keepdb=options["keepdb"])
+            teardown_test_environment()
+
+        for result in results:
+            self.stdout.write(
+                f"{result.name:<20} медиана {result.median_sec:>8.4f}s  min {result.min_sec:>8.4f}s  "
+                f"SQL {result.queries:>6}"
+            )
+
+        output = Path(options["output"])
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(data, ensure_ascii=False, indent=2))
+        self.stdout.write(f"Результат: {output}")
+
+        baseline_path = Path(options["baseline"]) if options["baseline"] else None
+        if baseline_path and options["save_baseline"]:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baseline_path.write_text(json.dumps(data, ensure_ascii=False, indent=2))
+            self.stdout.write(f"База обновлена: {baseline_path}")
+            return
+        if baseline_path and baseline_path.exists():
+            baseline = json.loads(baseline_path.read_text())
+            if baseline.get("spec") != data["spec"] or baseline.get("vendor") != data["vendor"]:
+                self.stdout.write(self.style.WARNING("База снята с другими параметрами или на другой СУБД — не сравниваем"))
+                return
+            regressions = compare(data, baseline, tolerance=options["tolerance"])
+            if regressions:
+                raise CommandError("Регрессии:\n" + "\n".join(regressions))
+            self.stdout.write(self.style.SUCCESS("Регрессий нет"))
@@ -0,0 +1,51 @@
+"""python manage.py ozon_stub_server — локальный стаб Ozon/Performance/Sheets (ozon/stub_server.py)."""
+from django.core.management.base import BaseCommand
+
+from ozon.stub_server import StubConfig, make_server
+
+
+class Command(BaseCommand):
+    help = "Стаб Ozon Seller, Performance API и Google Sheets с задержкой, лимитом частоты и пагинацией"
+
+    def add_arguments(self, parser):
+        defaults = StubConfig()
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--latency-ms", type=int, default=defaults.latency_ms)
+        parser.add_argument("--jitter-ms", type=int, default=defaults.jitter_ms)
+        parser.add_argument("--rps", type=int, default=defaults.rps, help="запросов в секунду на клиента, 0 — без лимита")
+        parser.add_argument("--products", type=int, default=defaults.products)
+        parser.add_argument("--postings-per-day", type=int, default=defaults.postings_per_day)
+        parser.add_argument("--campaigns", type=int, default=defaults.campaigns)
+        parser.add_argument("--report-pending-polls", type=int, default=defaults.report_pending_polls)
+        parser.add_argument("--report-missing-polls", type=int, default=defaults.report_missing_polls)
+        parser.add_argument("--max-page-size", type=int, default=defaults.max_page_size)
+        parser.add_argument("--recordings-dir", default=defaults.recordings_dir)
+        parser.add_argument("--seed", type=int, default=defaults.seed)
+
+    def handle(self, *args, **options):
+        config = StubConfig(
+            latency_ms=options["latency_ms"],
+            jitter_ms=options["jitter_ms"],
+            rps=options["rps"],
+            products=options["products"],
+            postings_per_day=options["postings_per_day"],
+            campaigns=options["campaigns"],
+            report_pending_polls=options["report_pending_polls"],
+            report_missing_polls=options["report_missing_polls"],
+            max_page_size=options["max_page_size"],
+            recordings_dir=options["recordings_dir"],
+            seed=options["seed"],
+        )
+        server = make_server(config, options["host"], options["port"])
+        base_url = f"http://{options['host']}:{server.server_address[1]}"
+        self.stdout.write(
+            f"Стаб слушает {base_url}\n"
+            f"Для backend и воркеров: OZON_API_STUB_URL={base_url} GOOGLE_SHEETS_STUB_URL={base_url}"
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,39 @@
+from django.db import migrations, models
+from django.db.models import Max
+import django.db.models.deletion
+
+
+def init_sequences(apps, schema_editor):
+    OzonSupplyBatch = apps.get_model("ozon", "OzonSupplyBatch")
+    OzonSupplyBatchSequence = apps.get_model("ozon", "OzonSupplyBatchSequence")
+    rows = OzonSupplyBatch.objects.values("store_id").annotate(last_seq=Max("batch_seq"))
+    OzonSupplyBatchSequence.objects.bulk_create(
+        [OzonSupplyBatchSequence(store_id=row["store_id"], last_seq=row["last_seq"] or 0) for row in rows]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0010_ozonstore_api_key_invalid_at"),
+        ("ozon", "0045_fbs_posting_extra_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OzonSupplyBatchSequence",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("last_seq", models.PositiveIntegerField(default=0)),
+                (
+                    "store",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="supply_batch_sequence",
+                        to="users.ozonstore",
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(init_sequences, migrations.RunPython.noop),
+    ]
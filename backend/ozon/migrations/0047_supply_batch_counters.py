@@ -0,0 +1,51 @@
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+ACTIVE_STATUSES = ("queued", "in_progress", "draft_created", "supply_queued", "supply_in_progress")
+FAILED_STATUSES = ("failed", "supply_failed")
+
+
+def init_counters(apps, schema_editor):
+    OzonSupplyBatch = apps.get_model("ozon", "OzonSupplyBatch")
+    batches = OzonSupplyBatch.objects.annotate(
+        active=Count("drafts", filter=Q(drafts__status__in=ACTIVE_STATUSES)),
+        failed=Count("drafts", filter=Q(drafts__status__in=FAILED_STATUSES)),
+        total=Count("drafts"),
+    )
+    updated = []
+    for batch in batches:
+        batch.active_drafts = batch.active
+        batch.failed_drafts = batch.failed
+        batch.done_drafts = batch.total - batch.active - batch.failed
+        updated.append(batch)
+    OzonSupplyBatch.objects.bulk_update(updated, ["active_drafts", "failed_drafts", "done_drafts"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ozon", "0046_supply_batch_sequence"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ozonsupplybatch",
+            name="active_drafts",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="ozonsupplybatch",
+            name="failed_drafts",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="ozonsupplybatch",
+            name="done_drafts",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="ozonsupplydraft",
+            index=models.Index(fields=["status", "next_attempt_at"], name="ozon_ozonsu_status_04a75a_idx"),
+        ),
+        migrations.RunPython(init_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,79 @@
+from decimal import Decimal
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def _to_decimal(value):
+    if value is None:
+        return Decimal("0")
+    text = str(value).replace("\u00A0", "").replace("\u202F", "").replace(" ", "").replace(",", ".")
+    try:
+        return Decimal(text)
+    except Exception:
+        return Decimal("0")
+
+
+def fill_daily_spend(apps, schema_editor):
+    Entry = apps.get_model("ozon", "CampaignPerformanceReportEntry")
+    CampaignDailySpend = apps.get_model("ozon", "CampaignDailySpend")
+    batch = []
+    entries = Entry.objects.only("store_id", "ozon_campaign_id", "report_date", "totals")
+    for entry in entries.iterator(chunk_size=2000):
+        totals = entry.totals or {}
+        batch.append(CampaignDailySpend(
+            store_id=entry.store_id,
+            ozon_campaign_id=str(entry.ozon_campaign_id),
+            date=entry.report_date,
+            spend=_to_decimal(totals.get("moneySpent")).quantize(Decimal("0.01")),
+            orders=int(_to_decimal(totals.get("orders"))),
+            revenue=_to_decimal(totals.get("ordersMoney")).quantize(Decimal("0.01")),
+        ))
+        if len(batch) >= 2000:
+            CampaignDailySpend.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        CampaignDailySpend.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0010_ozonstore_api_key_invalid_at"),
+        ("ozon", "0047_supply_batch_counters"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CampaignDailySpend",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("ozon_campaign_id", models.CharField(max_length=100)),
+                ("date", models.DateField()),
+                ("spend", models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ("orders", models.IntegerField(default=0)),
+                ("revenue", models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "store",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="campaign_daily_spend",
+                        to="users.ozonstore",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Расход кампании за день",
+                "verbose_name_plural": "Расход кампаний по дням",
+                "indexes": [models.Index(fields=["date", "store"], name="ozon_campai_date_866459_idx")],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("store", "ozon_campaign_id", "date"),
+                        name="ozon_daily_spend_unique_store_campaign_date",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(fill_daily_spend, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,105 @@
+from django.db import migrations
+from django.utils import timezone
+
+from ozon.partitions import (
+    PARTITIONED_TABLES,
+    add_months,
+    create_partition,
+    default_partition_name,
+    month_start,
+)
+
+MAINTENANCE_TASK = "Обслуживание партиций продаж и аналитики"
+
+
+def _rebuild(schema_editor, table, partitioned):
+    """Пересоздаёт таблицу (секционированной или обычной) с теми же колонками, индексами и ограничениями."""
+    qn = schema_editor.quote_name
+    column = PARTITIONED_TABLES[table][0]
+    legacy = f"{table}_legacy"
+    with schema_editor.connection.cursor() as cursor:
+        # Индексы и ограничения переносим под прежними именами — их знает состояние миграций Django
+        cursor.execute(
+            "SELECT indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s "
+            "AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s))",
+            [table, table],
+        )
+        index_defs = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = to_regclass(%s) AND contype IN ('u', 'f')",
+            [table],
+        )
+        constraints = cursor.fetchall()
+        cursor.execute(f"SELECT MIN({qn(column)})::date FROM {qn(table)}")
+        first_day = cursor.fetchone()[0]
+
+        cursor.execute(f"ALTER TABLE {qn(table)} RENAME TO {qn(legacy)}")
+        if partitioned:
+            cursor.execute(
+                f"CREATE TABLE {qn(table)} (LIKE {qn(legacy)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+                f"PARTITION BY RANGE ({qn(column)})"
+            )
+            cursor.execute(f"CREATE TABLE {qn(default_partition_name(table))} PARTITION OF {qn(table)} DEFAULT")
+            current = month_start(timezone.localdate())
+            month = month_start(first_day) if first_day else current
+            while month <= add_months(current, 3):
+                create_partition(cursor, table, month)
+                month = add_months(month, 1)
+        else:
+            cursor.execute(f"CREATE TABLE {qn(table)} (LIKE {qn(legacy)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+
+        cursor.execute(f"INSERT INTO {qn(table)} SELECT * FROM {qn(legacy)}")
+        # Вместе со старой таблицей уходят её sequence для id, индексы и имена ограничений
+        cursor.execute(f"DROP TABLE {qn(legacy)} CASCADE")
+
+        # На секционированной таблице первичный ключ обязан включать ключ секционирования
+        pk_columns = f"{qn('id')}, {qn(column)}" if partitioned else qn("id")
+        cursor.execute(f"ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(table + '_pkey')} PRIMARY KEY ({pk_columns})")
+        sequence = f"{table}_id_seq"
+        cursor.execute(f"CREATE SEQUENCE {qn(sequence)} OWNED BY {qn(table)}.{qn('id')}")
+        cursor.execute(f"SELECT setval(%s, COALESCE((SELECT MAX(id) FROM {qn(table)}), 0) + 1, false)", [sequence])
+        cursor.execute(f"ALTER TABLE {qn(table)} ALTER COLUMN {qn('id')} SET DEFAULT nextval('{sequence}')")
+
+        for index_def in index_defs:
+            cursor.execute(index_def)
+        for name, definition in constraints:
+            cursor.execute(f"ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(name)} {definition}")
+
+
+def partition_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for table in PARTITIONED_TABLES:
+        _rebuild(schema_editor, table, partitioned=True)
+
+    CrontabSchedule = apps.get_model("django_celery_beat", "CrontabSchedule")
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+    schedule, _ = CrontabSchedule.objects.get_or_create(
+        minute="30", hour="4", day_of_week="*", day_of_month="*", month_of_year="*",
+    )
+    PeriodicTask.objects.get_or_create(
+        name=MAINTENANCE_TASK, defaults={"task": MAINTENANCE_TASK, "crontab": schedule},
+    )
+
+
+def unpartition_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for table in PARTITIONED_TABLES:
+        _rebuild(schema_editor, table, partitioned=False)
+
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+    PeriodicTask.objects.filter(name=MAINTENANCE_TASK).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_celery_beat", "0001_initial"),
+        ("ozon", "0048_campaign_daily_spend"),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_tables, unpartition_tables),
+    ]
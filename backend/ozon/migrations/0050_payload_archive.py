@@ -0,0 +1,115 @@
+from django.db import migrations, models
+
+import ozon.payloads
+from ozon.payloads import PayloadRef, load_payloads, store_payloads
+
+# Модель → поля, тела которых переезжают в PayloadBlob
+ARCHIVED_FIELDS = {
+    "ozonsupplydraft": ["response_payload", "timeslot_response"],
+    "ozonfbsposting": ["cancellation", "available_actions", "products", "raw_payload"],
+    "campaignperformancereport": ["raw_response", "rows"],
+}
+HELP_TEXTS = {
+    ("campaignperformancereport", "raw_response"): "Полный ответ отчёта как есть",
+    ("campaignperformancereport", "rows"): "Строки отчёта (report.rows)",
+}
+BATCH_SIZE = 500
+PRUNE_TASK = "Очистка архива ответов Ozon"
+
+
+def _batches(queryset):
+    batch = []
+    for obj in queryset.iterator(chunk_size=BATCH_SIZE):
+        batch.append(obj)
+        if len(batch) >= BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def archive_inline(apps, schema_editor):
+    PayloadBlob = apps.get_model("ozon", "PayloadBlob")
+    for model_name, fields in ARCHIVED_FIELDS.items():
+        Model = apps.get_model("ozon", model_name)
+        qs = Model.objects.only("pk", *[f"{name}_inline" for name in fields]).order_by("pk")
+        for batch in _batches(qs):
+            for name in fields:
+                digests = store_payloads([getattr(obj, f"{name}_inline") for obj in batch], blob_model=PayloadBlob)
+                for obj, digest in zip(batch, digests):
+                    setattr(obj, name, PayloadRef(digest) if digest else None)
+            Model.objects.bulk_update(batch, fields)
+
+
+def restore_inline(apps, schema_editor):
+    PayloadBlob = apps.get_model("ozon", "PayloadBlob")
+    for model_name, fields in ARCHIVED_FIELDS.items():
+        Model = apps.get_model("ozon", model_name)
+        for batch in _batches(Model.objects.only("pk", *fields).order_by("pk")):
+            refs = [obj.__dict__.get(name) for obj in batch for name in fields]
+            values = load_payloads([ref.digest for ref in refs if ref], blob_model=PayloadBlob)
+            for obj in batch:
+                for name in fields:
+                    ref = obj.__dict__.get(name)
+                    setattr(obj, f"{name}_inline", values.get(ref.digest) if ref else None)
+            Model.objects.bulk_update(batch, [f"{name}_inline" for name in fields])
+
+
+def schedule_prune(apps, schema_editor):
+    CrontabSchedule = apps.get_model("django_celery_beat", "CrontabSchedule")
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+    schedule, _ = CrontabSchedule.objects.get_or_create(
+        minute="45", hour="4", day_of_week="*", day_of_month="*", month_of_year="*",
+    )
+    PeriodicTask.objects.get_or_create(name=PRUNE_TASK, defaults={"task": PRUNE_TASK, "crontab": schedule})
+
+
+def unschedule_prune(apps, schema_editor):
+    apps.get_model("django_celery_beat", "PeriodicTask").objects.filter(name=PRUNE_TASK).delete()
+
+
+def _field_operations():
+    operations = []
+    for model_name, fields in ARCHIVED_FIELDS.items():
+        for name in fields:
+            operations += [
+                migrations.RenameField(model_name=model_name, old_name=name, new_name=f"{name}_inline"),
+                migrations.AddField(
+                    model_name=model_name,
+                    name=name,
+                    field=ozon.payloads.ArchivedJSONField(
+                        db_column=f"{name}_digest", help_text=HELP_TEXTS.get((model_name, name), ""),
+                    ),
+                ),
+            ]
+    return operations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_celery_beat", "0001_initial"),
+        ("ozon", "0049_partition_sales_and_daily_analytics"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PayloadBlob",
+            fields=[
+                ("digest", models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ("codec", models.CharField(max_length=8)),
+                ("data", models.BinaryField()),
+                ("size", models.PositiveIntegerField(default=0, help_text="Размер JSON до сжатия, байт")),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("seen_at", models.DateTimeField()),
+            ],
+            options={
+                "verbose_name": "Архив ответа Ozon",
+                "verbose_name_plural": "Архив ответов Ozon",
+                "indexes": [models.Index(fields=["seen_at"], name="ozon_payload_seen_at_idx")],
+            },
+        ),
+        *_field_operations(),
+        migrations.RunPython(archive_inline, restore_inline),
+        migrations.RunPython(schedule_prune, unschedule_prune),
+    ]
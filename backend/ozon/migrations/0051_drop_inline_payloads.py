@@ -0,0 +1,21 @@
+from django.db import migrations
+
+ARCHIVED_FIELDS = {
+    "ozonsupplydraft": ["response_payload", "timeslot_response"],
+    "ozonfbsposting": ["cancellation", "available_actions", "products", "raw_payload"],
+    "campaignperformancereport": ["raw_response", "rows"],
+}
+
+
+class Migration(migrations.Migration):
+    # Отдельная миграция: колонки удаляются в новой транзакции, после переноса тел в 0050
+
+    dependencies = [
+        ("ozon", "0050_payload_archive"),
+    ]
+
+    operations = [
+        migrations.RemoveField(model_name=model_name, name=f"{name}_inline")
+        for model_name, fields in ARCHIVED_FIELDS.items()
+        for name in fields
+    ]
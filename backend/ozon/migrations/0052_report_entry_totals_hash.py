@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ozon", "0051_drop_inline_payloads"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="campaignperformancereportentry",
+            name="totals_hash",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+    ]
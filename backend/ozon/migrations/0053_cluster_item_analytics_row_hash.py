@@ -0,0 +1,33 @@
+from django.db import migrations, models
+
+REFRESH_TASK = "Обновление аналитики доставки по кластерам"
+
+
+def schedule_refresh(apps, schema_editor):
+    CrontabSchedule = apps.get_model("django_celery_beat", "CrontabSchedule")
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+    schedule, _ = CrontabSchedule.objects.get_or_create(
+        minute="20", hour="6-22/2", day_of_week="*", day_of_month="*", month_of_year="*",
+    )
+    PeriodicTask.objects.get_or_create(name=REFRESH_TASK, defaults={"task": REFRESH_TASK, "crontab": schedule})
+
+
+def unschedule_refresh(apps, schema_editor):
+    apps.get_model("django_celery_beat", "PeriodicTask").objects.filter(name=REFRESH_TASK).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_celery_beat", "0001_initial"),
+        ("ozon", "0052_report_entry_totals_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="deliveryclusteritemanalytics",
+            name="row_hash",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+        migrations.RunPython(schedule_refresh, unschedule_refresh),
+    ]
@@ -4,6 +4,8 @@ from decimal import Decimal
 from django.db import models
 from users.models import User, OzonStore
 
+from .payloads import ArchivedJSONField, PayloadQuerySet
+
 class Product(models.Model):
     store = models.ForeignKey(OzonStore, on_delete=models.CASCADE, related_name='products')
 
@@ -133,6 +135,11 @@ class OzonSupplyBatch(models.Model):
     drop_off_point_warehouse_id = models.BigIntegerField()
     drop_off_point_name = models.CharField(max_length=255, blank=True)
     status = models.CharField(max_length=32, default="queued")
+    # Счетчики черновиков по группам статусов: сдвигаются при каждом переходе черновика,
+    # итоговый статус батча считается по ним без чтения всех черновиков.
+    active_drafts = models.PositiveIntegerField(default=0)
+    failed_drafts = models.PositiveIntegerField(default=0)
+    done_drafts = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -143,6 +150,16 @@ class OzonSupplyBatch(models.Model):
         return f"Batch {self.batch_seq or self.batch_id}"
 
 
+class OzonSupplyBatchSequence(models.Model):
+    # Счетчик номеров батчей магазина: строка блокируется (select_for_update) на время выдачи номера,
+    # поэтому параллельные запросы не получают одинаковый batch_seq.
+    store = models.OneToOneField(OzonStore, on_delete=models.CASCADE, related_name="supply_batch_sequence")
+    last_seq = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.store_id}: {self.last_seq}"
+
+
 class OzonSupplyDraft(models.Model):
     STATUS_CHOICES = [
         ("queued", "Queued"),
@@ -165,7 +182,7 @@ class OzonSupplyDraft(models.Model):
     drop_off_point_name = models.CharField(max_length=255, blank=True)
 
     request_payload = models.JSONField()
-    response_payload = models.JSONField(null=True, blank=True)
+    response_payload = ArchivedJSONField(db_column="response_payload_digest")
     operation_id = models.CharField(max_length=64, blank=True)
     operation_id_supply = models.CharField(max_length=64, blank=True)
     draft_id = models.BigIntegerField(null=True, blank=True)
@@ -175,7 +192,7 @@ class OzonSupplyDraft(models.Model):
     supply_status_updated_at = models.DateTimeField(null=True, blank=True)
     supply_warehouse = models.JSONField(null=True, blank=True)
     selected_supply_warehouse = models.JSONField(null=True, blank=True)
-    timeslot_response = models.JSONField(null=True, blank=True)
+    timeslot_response = ArchivedJSONField(db_column="timeslot_response_digest")
     selected_timeslot = models.JSONField(null=True, blank=True)
     timeslot_updated_at = models.DateTimeField(null=True, blank=True)
 
@@ -187,11 +204,14 @@ class OzonSupplyDraft(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = PayloadQuerySet.as_manager()
+
     class Meta:
         indexes = [
             models.Index(fields=["store", "logistic_cluster_id"]),
             models.Index(fields=["operation_id"]),
             models.Index(fields=["batch"]),
+            models.Index(fields=["status", "next_attempt_at"]),
         ]
         verbose_name = "Черновик поставки OZON"
         verbose_name_plural = "Черновики поставок OZON"
@@ -239,10 +259,11 @@ class OzonFbsPosting(models.Model):
     shipment_date = models.DateTimeField(null=True, blank=True)
     delivering_date = models.DateTimeField(null=True, blank=True)
 
-    cancellation = models.JSONField(null=True, blank=True)
-    available_actions = models.JSONField(null=True, blank=True)
-    products = models.JSONField(null=True, blank=True)
-    raw_payload = models.JSONField(null=True, blank=True)
+    # Полные ответы Ozon — в архиве PayloadBlob, в строке только ссылки (ozon/payloads.py)
+    cancellation = ArchivedJSONField(db_column="cancellation_digest")
+    available_actions = ArchivedJSONField(db_column="available_actions_digest")
+    products = ArchivedJSONField(db_column="products_digest")
+    raw_payload = ArchivedJSONField(db_column="raw_payload_digest")
 
     status_changed_at = models.DateTimeField(null=True, blank=True)
     awaiting_packaging_at = models.DateTimeField(null=True, blank=True)
@@ -262,6 +283,8 @@ class OzonFbsPosting(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = PayloadQuerySet.as_manager()
+
     class Meta:
         unique_together = ("store", "posting_number")
         indexes = [
@@ -424,6 +447,7 @@ class Sale(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
+        # В PostgreSQL таблица секционирована помесячно по date (ozon/partitions.py, миграция 0049)
         indexes = [
             models.Index(fields=["store", "date"]),
             models.Index(fields=["store", "date", "sale_type"]),
@@ -491,7 +515,8 @@ class DeliveryClusterItemAnalytics(models.Model):
     recommended_supply = models.PositiveIntegerField()
     recommended_supply_FBO = models.PositiveIntegerField(null=True, blank=True)
     recommended_supply_FBS = models.PositiveIntegerField(null=True, blank=True)
-
+    # sha256 полей строки: неизменившиеся строки при синхронизации не перезаписываются
+    row_hash = models.CharField(max_length=64, blank=True, default='')
 
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -548,6 +573,7 @@ class ProductDailyAnalytics(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
+        # В PostgreSQL таблица секционирована помесячно по date (ozon/partitions.py, миграция 0049)
         unique_together = ("store", "date", "sku")
         verbose_name = "Ежедневная аналитика товара"
         verbose_name_plural = "Ежедневная аналитика товаров"
@@ -886,9 +912,11 @@ class CampaignPerformanceReport(models.Model):
 
     # Полезные данные
     request_payload = models.JSONField(null=True, blank=True, help_text='Тело запроса на построение отчёта')
-    raw_response = models.JSONField(null=True, blank=True, help_text='Полный ответ отчёта как есть')
+    raw_response = ArchivedJSONField(db_column='raw_response_digest', help_text='Полный ответ отчёта как есть')
     totals = models.JSONField(null=True, blank=True, help_text='Сводные метрики отчёта (report.totals)')
-    rows = models.JSONField(null=True, blank=True, help_text='Строки отчёта (report.rows)')
+    rows = ArchivedJSONField(db_column='rows_digest', help_text='Строки отчёта (report.rows)')
+
+    objects = PayloadQuerySet.as_manager()
 
     class Meta:
         indexes = [
@@ -919,6 +947,8 @@ class CampaignPerformanceReportEntry(models.Model):
 
     totals = models.JSONField(null=True, blank=True)
     rows = models.JSONField(null=True, blank=True)
+    # sha256 от totals+rows: неизменившиеся записи при пакетной загрузке не перезаписываются
+    totals_hash = models.CharField(max_length=64, blank=True, default='')
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -939,6 +969,11 @@ class CampaignPerformanceReportEntry(models.Model):
 
     def __str__(self):
         return f"Entry {self.ozon_campaign_id} of {self.report_id} ({self.report_date:%Y-%m-%d})"
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Суточный расход кампании держим в CampaignDailySpend, чтобы не разбирать totals при чтении
+        CampaignDailySpend.record_entries([self])
     @property
     def is_active(self):
         """Проверяет, активна ли кампания"""
@@ -986,3 +1021,90 @@ class CampaignPerformanceReportEntry(models.Model):
             self.CAMPAIGN_STATE_STOPPED,
             self.CAMPAIGN_STATE_INACTIVE
         ]
+
+
+def parse_report_decimal(value) -> Decimal:
+    """Число из totals отчёта Performance: строки с пробелами-разделителями и запятой."""
+    if value is None:
+        return Decimal('0')
+    text = str(value).replace('\u00A0', '').replace('\u202F', '').replace(' ', '').replace(',', '.')
+    try:
+        return Decimal(text)
+    except Exception:
+        return Decimal('0')
+
+
+class CampaignDailySpend(models.Model):
+    """
+    Суточный расход, заказы и выручка кампании, разобранные из CampaignPerformanceReportEntry.totals.
+    Обновляется при сохранении записи отчёта (record_entries).
+    """
+
+    store = models.ForeignKey(OzonStore, on_delete=models.CASCADE, related_name='campaign_daily_spend')
+    ozon_campaign_id = models.CharField(max_length=100)
+    date = models.DateField()
+
+    spend = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    orders = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['date', 'store']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['store', 'ozon_campaign_id', 'date'], name='ozon_daily_spend_unique_store_campaign_date'),
+        ]
+        verbose_name = 'Расход кампании за день'
+        verbose_name_plural = 'Расход кампаний по дням'
+
+    def __str__(self):
+        return f"{self.ozon_campaign_id} {self.date:%Y-%m-%d}: {self.spend}"
+
+    @classmethod
+    def from_entry(cls, entry: CampaignPerformanceReportEntry) -> 'CampaignDailySpend':
+        totals = entry.totals or {}
+        return cls(
+            store_id=entry.store_id,
+            ozon_campaign_id=str(entry.ozon_campaign_id),
+            date=entry.report_date,
+            spend=parse_report_decimal(totals.get('moneySpent')).quantize(Decimal('0.01')),
+            orders=int(parse_report_decimal(totals.get('orders'))),
+            revenue=parse_report_decimal(totals.get('ordersMoney')).quantize(Decimal('0.01')),
+        )
+
+    @classmethod
+    def record_entries(cls, entries):
+        """Upsert строк журнала по записям отчёта одним запросом."""
+        rows = [cls.from_entry(entry) for entry in entries]
+        if rows:
+            cls.objects.bulk_create(
+                rows,
+                batch_size=1000,
+                update_conflicts=True,
+                unique_fields=['store', 'ozon_campaign_id', 'date'],
+                update_fields=['spend', 'orders', 'revenue', 'updated_at'],
+            )
+
+
+class PayloadBlob(models.Model):
+    """Сжатое тело JSON-ответа Ozon; ключ — sha256 канонического JSON (ozon/payloads.py)."""
+    digest = models.CharField(max_length=64, primary_key=True)
+    codec = models.CharField(max_length=8)
+    data = models.BinaryField()
+    size = models.PositiveIntegerField(default=0, help_text='Размер JSON до сжатия, байт')
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Последняя запись ссылки на тело: очистка не трогает недавно использованные
+    seen_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Архив ответа Ozon'
+        verbose_name_plural = 'Архив ответов Ozon'
+        indexes = [
+            models.Index(fields=['seen_at'], name='ozon_payload_seen_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.digest[:12]} ({self.codec}, {self.size} б)"
@@ -0,0 +1,167 @@
+"""Помесячные партиции продаж и ежедневной аналитики (PostgreSQL).
+
+ozon_sale и ozon_productdailyanalytics секционированы по RANGE(date) помесячно (миграция 0049):
+запросы за последние дни/недели по (store, date) читают одну-две партиции, а индексы и vacuum
+работают с партициями размером в месяц, сколько бы истории ни накопилось.
+
+Партиции называются <таблица>_pYYYYMM. Строки вне созданных партиций попадают в <таблица>_default
+и при следующем обслуживании переносятся в партицию своего месяца.
+
+maintain_partitions() (задача maintain_sales_partitions, ночная очередь):
+- создаёт партиции на PARTITION_MONTHS_AHEAD месяцев вперёд и разбирает default;
+- партиции старше срока хранения (SALE_RETENTION_MONTHS, DAILY_ANALYTICS_RETENTION_MONTHS, 0 — хранить
+  всё) отключает от таблицы и переносит в схему PARTITION_ARCHIVE_SCHEMA, либо удаляет, если
+  PARTITION_RETENTION_ACTION = "drop".
+
+На других СУБД (sqlite в тестах) таблицы обычные, функции ничего не делают.
+"""
+import logging
+import re
+from datetime import date
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Таблица → (колонка ключа, колонка timestamptz или date)
+PARTITIONED_TABLES = {
+    "ozon_sale": ("date", True),
+    "ozon_productdailyanalytics": ("date", False),
+}
+
+_PARTITION_MONTH = re.compile(r"_p(\d{4})(\d{2})$")
+
+
+def month_start(value) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f"{table}_p{month:%Y%m}"
+
+
+def default_partition_name(table):
+    return f"{table}_default"
+
+
+def retention_months(table):
+    return {
+        "ozon_sale": getattr(settings, "SALE_RETENTION_MONTHS", 0),
+        "ozon_productdailyanalytics": getattr(settings, "DAILY_ANALYTICS_RETENTION_MONTHS", 0),
+    }.get(table, 0)
+
+
+def _bound(table, month):
+    # Границы для timestamptz — полночь UTC первого числа месяца
+    return f"{month.isoformat()} 00:00:00+00" if PARTITIONED_TABLES[table][1] else month.isoformat()
+
+
+def is_partitioned(cursor, table):
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [table])
+    row = cursor.fetchone()
+    return bool(row) and row[0] == "p"
+
+
+def partition_months(cursor, table):
+    """{месяц: имя партиции} для подключённых помесячных партиций таблицы."""
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(%s)",
+        [table],
+    )
+    months = {}
+    for (name,) in cursor.fetchall():
+        match = _PARTITION_MONTH.search(name)
+        if match:
+            months[date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return months
+
+
+def create_partition(cursor, table, month):
+    """Партиция месяца; строки этого месяца, уже лежащие в default, переносятся в неё."""
+    qn = connection.ops.quote_name
+    column = qn(PARTITIONED_TABLES[table][0])
+    name = partition_name(table, month)
+    lower, upper = _bound(table, month), _bound(table, add_months(month, 1))
+    with transaction.atomic():
+        cursor.execute(f"CREATE TABLE {qn(name)} (LIKE {qn(table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        cursor.execute(
+            f"WITH moved AS (DELETE FROM {qn(default_partition_name(table))} "
+            f"WHERE {column} >= %s AND {column} < %s RETURNING *) "
+            f"INSERT INTO {qn(name)} SELECT * FROM moved",
+            [lower, upper],
+        )
+        moved = cursor.rowcount
+        cursor.execute(f"ALTER TABLE {qn(table)} ATTACH PARTITION {qn(name)} FOR VALUES FROM ('{lower}') TO ('{upper}')")
+    logger.info(f"[🧱] {table}: создана партиция {name} (перенесено из default: {max(moved, 0)})")
+    return name
+
+
+def ensure_partitions(cursor, table, first_month=None, months_ahead=None):
+    """Создаёт недостающие партиции от first_month (по умолчанию текущий месяц) до months_ahead вперёд
+    и партиции для месяцев, строки которых попали в default."""
+    if months_ahead is None:
+        months_ahead = getattr(settings, "PARTITION_MONTHS_AHEAD", 3)
+    current = month_start(timezone.localdate())
+    month = first_month or current
+    needed = set()
+    while month <= add_months(current, months_ahead):
+        needed.add(month)
+        month = add_months(month, 1)
+
+    qn = connection.ops.quote_name
+    column = qn(PARTITIONED_TABLES[table][0])
+    cursor.execute(f"SELECT DISTINCT date_trunc('month', {column})::date FROM {qn(default_partition_name(table))}")
+    needed.update(row[0] for row in cursor.fetchall())
+
+    existing = partition_months(cursor, table)
+    return [create_partition(cursor, table, month) for month in sorted(needed - existing.keys())]
+
+
+def apply_retention(cursor, table, months=None, action=None):
+    """Отключает партиции старше months месяцев: переносит в архивную схему или удаляет."""
+    months = retention_months(table) if months is None else months
+    if not months:
+        return []
+    action = action or getattr(settings, "PARTITION_RETENTION_ACTION", "archive")
+    schema = getattr(settings, "PARTITION_ARCHIVE_SCHEMA", "ozon_archive")
+    cutoff = add_months(month_start(timezone.localdate()), -months)
+
+    qn = connection.ops.quote_name
+    removed = []
+    for month, name in sorted(partition_months(cursor, table).items()):
+        if month >= cutoff:
+            continue
+        with transaction.atomic():
+            cursor.execute(f"ALTER TABLE {qn(table)} DETACH PARTITION {qn(name)}")
+            if action == "drop":
+                cursor.execute(f"DROP TABLE {qn(name)}")
+            else:
+                cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {qn(schema)}")
+                cursor.execute(f"ALTER TABLE {qn(name)} SET SCHEMA {qn(schema)}")
+        logger.info(f"[🗄] {table}: партиция {name} старше {months} мес. — {'удалена' if action == 'drop' else f'перенесена в {schema}'}")
+        removed.append(name)
+    return removed
+
+
+def maintain_partitions():
+    """Будущие партиции + срок хранения для всех секционированных таблиц."""
+    result = {}
+    if connection.vendor != "postgresql":
+        return result
+    with connection.cursor() as cursor:
+        for table in PARTITIONED_TABLES:
+            if not is_partitioned(cursor, table):
+                continue
+            result[table] = {
+                "created": ensure_partitions(cursor, table),
+                "removed": apply_retention(cursor, table),
+            }
+    return result
@@ -0,0 +1,255 @@
+"""Архив больших JSON-ответов Ozon вне горячих таблиц.
+
+Полные ответы (raw_payload/products/available_actions/cancellation постинга FBS, raw_response/rows
+отчёта Performance, ответы по черновику поставки) лежат в PayloadBlob: ключ — sha256 канонического
+JSON, тело сжато zstd (zlib, если пакет zstandard не установлен). В строке модели остаётся только
+ссылка на тело (колонка <поле>_digest, 64 символа): списки и фильтры читают узкие строки, а
+одинаковые ответы разных синхронизаций хранятся один раз.
+
+Для кода ArchivedJSONField выглядит как JSONField:
+- значение читается из архива при первом обращении к атрибуту;
+- save/update_or_create/bulk_create/update кладут тело в архив и пишут ссылку, а неизменённое
+  значение (тот же sha256, что был прочитан из БД) повторно не пишется;
+- QuerySet.with_payloads(...) для списков читает тела всей выборки одним запросом.
+values()/values_list() по такому полю возвращают PayloadRef (ссылку), а не JSON.
+"""
+import hashlib
+import json
+import logging
+import zlib
+from datetime import timedelta
+
+from django import forms
+from django.apps import apps
+from django.db import models
+from django.db.models.query import ModelIterable
+from django.db.models.query_utils import DeferredAttribute
+from django.utils import timezone
+
+try:
+    import zstandard
+except ImportError:  # без пакета пишем zlib; строки с codec=zstd тогда не прочитать
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+CODEC_ZSTD = "zstd"
+CODEC_ZLIB = "zlib"
+ZSTD_LEVEL = 3
+
+# Тело без ссылок удаляется не раньше, чем через столько дней после последней записи
+PRUNE_GRACE_DAYS = 2
+
+
+class PayloadRef:
+    """Ссылка на тело в архиве: значение поля, пока его не прочитали."""
+
+    __slots__ = ("digest",)
+
+    def __init__(self, digest):
+        self.digest = digest
+
+    def __eq__(self, other):
+        return isinstance(other, PayloadRef) and other.digest == self.digest
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def __repr__(self):
+        return f"PayloadRef({self.digest[:12]}…)"
+
+
+def canonical_json(value) -> bytes:
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def payload_digest(value) -> str:
+    return hashlib.sha256(canonical_json(value)).hexdigest()
+
+
+def compress(raw: bytes):
+    if zstandard is not None:
+        return CODEC_ZSTD, zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    return CODEC_ZLIB, zlib.compress(raw, 6)
+
+
+def decompress(codec, data) -> bytes:
+    data = bytes(data)
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("Тело сжато zstd, а пакет zstandard не установлен")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def _blob_model(model=None):
+    return model or apps.get_model("ozon", "PayloadBlob")
+
+
+def store_payloads(values, blob_model=None):
+    """Кладёт значения в архив (один INSERT … ON CONFLICT на пачку), возвращает их digest (None → None)."""
+    digests = []
+    blobs = {}
+    now = timezone.now()
+    PayloadBlob = _blob_model(blob_model)
+    for value in values:
+        if value is None:
+            digests.append(None)
+            continue
+        raw = canonical_json(value)
+        digest = hashlib.sha256(raw).hexdigest()
+        digests.append(digest)
+        if digest not in blobs:
+            codec, data = compress(raw)
+            blobs[digest] = PayloadBlob(digest=digest, codec=codec, data=data, size=len(raw), seen_at=now)
+    if blobs:
+        # Для уже существующего тела только обновляем seen_at, чтобы очистка его не удалила
+        PayloadBlob.objects.bulk_create(
+            list(blobs.values()), update_conflicts=True, unique_fields=["digest"], update_fields=["seen_at"],
+        )
+    return digests
+
+
+def load_payloads(digests, blob_model=None):
+    """{digest: значение} для набора ссылок — один запрос."""
+    digests = {digest for digest in digests if digest}
+    if not digests:
+        return {}
+    PayloadBlob = _blob_model(blob_model)
+    values = {}
+    for digest, codec, data in PayloadBlob.objects.filter(digest__in=digests).values_list("digest", "codec", "data"):
+        values[digest] = json.loads(decompress(codec, data))
+    missing = digests - values.keys()
+    if missing:
+        logger.warning(f"[⚠️] В архиве ответов нет тел: {sorted(missing)[:5]} (всего {len(missing)})")
+    return values
+
+
+def stored_digest(instance, name):
+    """sha256 тела поля, прочитанного из БД и ещё не загруженного (иначе None)."""
+    value = instance.__dict__.get(name)
+    return value.digest if isinstance(value, PayloadRef) else None
+
+
+def resolve_payloads(instances, fields):
+    """Подставляет тела полей fields во все instances одним запросом к архиву."""
+    pending = []
+    for obj in instances:
+        for name in fields:
+            value = obj.__dict__.get(name)
+            if isinstance(value, PayloadRef):
+                pending.append((obj, name, value.digest))
+    if not pending:
+        return
+    values = load_payloads(digest for _, _, digest in pending)
+    for obj, name, digest in pending:
+        obj.__dict__[name] = values.get(digest)
+
+
+class ArchivedPayloadDescriptor(DeferredAttribute):
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super().__get__(instance, cls)
+        if isinstance(value, PayloadRef):
+            value = instance.__dict__[self.field.attname] = load_payloads([value.digest]).get(value.digest)
+        return value
+
+    def __set__(self, instance, value):
+        if isinstance(value, PayloadRef):
+            # Ссылка из БД: запоминаем, чтобы не писать то же тело повторно при save()
+            instance.__dict__.setdefault("_payload_digests", {})[self.field.attname] = value.digest
+        instance.__dict__[self.field.attname] = value
+
+
+class ArchivedJSONField(models.Field):
+    """JSON-значение в архиве PayloadBlob; в строке модели — только sha256 тела."""
+
+    description = "JSON в архиве ответов (ссылка sha256)"
+    descriptor_class = ArchivedPayloadDescriptor
+
+    def __init__(self, *args, **kwargs):
+        kwargs["max_length"] = 64
+        kwargs.setdefault("null", True)
+        kwargs.setdefault("blank", True)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs.pop("max_length", None)
+        return name, path, args, kwargs
+
+    def get_internal_type(self):
+        return "CharField"
+
+    def from_db_value(self, value, expression, connection):
+        return PayloadRef(value) if value else None
+
+    def pre_save(self, model_instance, add):
+        value = model_instance.__dict__.get(self.attname)
+        if value is None or isinstance(value, PayloadRef):
+            return value
+        digest = payload_digest(value)
+        if model_instance.__dict__.get("_payload_digests", {}).get(self.attname) == digest:
+            return PayloadRef(digest)
+        store_payloads([value])
+        model_instance.__dict__.setdefault("_payload_digests", {})[self.attname] = digest
+        return PayloadRef(digest)
+
+    def get_prep_value(self, value):
+        if value is None or isinstance(value, PayloadRef):
+            return value.digest if value is not None else None
+        # update()/bulk_update() передают значение без pre_save
+        return store_payloads([value])[0]
+
+    def value_to_string(self, obj):
+        return json.dumps(self.value_from_object(obj), ensure_ascii=False)
+
+    def formfield(self, **kwargs):
+        return super().formfield(**{"form_class": forms.JSONField, **kwargs})
+
+
+class PayloadQuerySet(models.QuerySet):
+    """QuerySet моделей с ArchivedJSONField: with_payloads() читает тела выборки пачкой."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._payload_fields = ()
+
+    def with_payloads(self, *fields):
+        clone = self._chain()
+        clone._payload_fields = fields or tuple(
+            field.attname for field in self.model._meta.concrete_fields if isinstance(field, ArchivedJSONField)
+        )
+        return clone
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._payload_fields = self._payload_fields
+        return clone
+
+    def _fetch_all(self):
+        fetched = self._result_cache is None
+        super()._fetch_all()
+        if fetched and self._payload_fields and self._iterable_class is ModelIterable:
+            resolve_payloads(self._result_cache, self._payload_fields)
+
+
+def archived_fields():
+    """[(модель, имя поля)] всех ArchivedJSONField проекта."""
+    return [
+        (model, field.attname)
+        for model in apps.get_models()
+        for field in model._meta.concrete_fields
+        if isinstance(field, ArchivedJSONField)
+    ]
+
+
+def prune_payload_blobs(grace_days=PRUNE_GRACE_DAYS):
+    """Удаляет тела, на которые больше не ссылается ни одна строка и которые давно не писались."""
+    PayloadBlob = _blob_model()
+    qs = PayloadBlob.objects.filter(seen_at__lt=timezone.now() - timedelta(days=grace_days))
+    for model, name in archived_fields():
+        qs = qs.exclude(digest__in=model._base_manager.filter(**{f"{name}__isnull": False}).values(name))
+    deleted, _ = qs.delete()
+    return deleted
@@ -0,0 +1,157 @@
+"""Приём статистики Performance API пачкой.
+
+Ответ (daily/json или отчёт по UUID) разбирается один раз в записи CampaignStatRecord, после чего
+записи по кампаниям магазина за день пишутся одним INSERT … ON CONFLICT по ограничению
+ozon_report_entry_unique_store_campaign_date. Неизменившиеся записи (тот же totals_hash) не пишутся
+вовсе, поэтому ежечасное обновление не зависит по числу запросов от числа кампаний.
+"""
+from dataclasses import dataclass, field
+from datetime import date, datetime
+
+from django.utils import timezone
+
+from .models import CampaignDailySpend, CampaignPerformanceReport, CampaignPerformanceReportEntry
+from .payloads import PayloadRef, payload_digest, store_payloads, stored_digest
+
+DAILY_SOURCE = "daily_json"
+
+
+@dataclass
+class CampaignStatRecord:
+    campaign_id: str
+    totals: dict | None
+    rows: list | None
+    totals_hash: str = field(init=False)
+
+    def __post_init__(self):
+        self.totals_hash = payload_digest({"totals": self.totals, "rows": self.rows})
+
+
+def parse_daily_statistics(payload) -> list[CampaignStatRecord]:
+    """daily/json: {"rows": [{"id": <кампания>, ...метрики}]} → по записи на кампанию."""
+    rows = payload.get("rows") if isinstance(payload, dict) and isinstance(payload.get("rows"), list) else []
+    records = {}
+    for row in rows:
+        if not isinstance(row, dict):
+            continue
+        campaign_id = str(row.get("id") or "").strip()
+        if campaign_id:
+            records[campaign_id] = CampaignStatRecord(campaign_id, dict(row), [dict(row)])
+    return list(records.values())
+
+
+def parse_report_statistics(data, campaign_id=""):
+    """Отчёт по UUID: одиночный {"report": {rows, totals}} или {"<кампания>": {"report": {...}}}.
+
+    Возвращает (rows, totals) верхнего уровня для самого отчёта и записи по кампаниям.
+    """
+    data = data if isinstance(data, dict) else {}
+    report = data.get("report")
+    if report:
+        rows = report.get("rows") if isinstance(report.get("rows"), list) else None
+        totals = report.get("totals") if isinstance(report.get("totals"), dict) else None
+        records = [CampaignStatRecord(str(campaign_id), totals, rows)] if campaign_id else []
+        return rows, totals, records
+
+    records = []
+    for cid, payload in data.items():
+        if not isinstance(payload, dict):
+            continue
+        rep = payload.get("report") or {}
+        rows = rep.get("rows") if isinstance(rep.get("rows"), list) else None
+        totals = rep.get("totals") if isinstance(rep.get("totals"), dict) else None
+        if rows is None and totals is None:
+            continue
+        records.append(CampaignStatRecord(str(cid), totals, rows))
+    return None, None, records
+
+
+def upsert_entries(store, report_date: date, records, report_ids: dict) -> int:
+    """Записи кампаний магазина за день — одним upsert; возвращает число изменённых."""
+    if not records:
+        return 0
+    existing = {
+        campaign_id: (totals_hash, report_id)
+        for campaign_id, totals_hash, report_id in CampaignPerformanceReportEntry.objects.filter(
+            store=store, report_date=report_date, ozon_campaign_id__in=[r.campaign_id for r in records],
+        ).values_list("ozon_campaign_id", "totals_hash", "report_id")
+    }
+    changed = [
+        CampaignPerformanceReportEntry(
+            store=store,
+            report_id=report_ids[record.campaign_id],
+            ozon_campaign_id=record.campaign_id,
+            report_date=report_date,
+            totals=record.totals,
+            rows=record.rows,
+            totals_hash=record.totals_hash,
+        )
+        for record in records
+        if existing.get(record.campaign_id) != (record.totals_hash, report_ids[record.campaign_id])
+    ]
+    if changed:
+        CampaignPerformanceReportEntry.objects.bulk_create(
+            changed,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=["store", "ozon_campaign_id", "report_date"],
+            update_fields=["report", "totals", "rows", "totals_hash", "updated_at"],
+        )
+        # bulk_create минует save(), поэтому журнал расхода обновляем сами
+        CampaignDailySpend.record_entries(changed)
+    return len(changed)
+
+
+def upsert_daily_reports(store, target_date: date, day_start: datetime, day_end: datetime, records) -> dict:
+    """Отчёты daily/json (по одному на кампанию за день) пачкой; возвращает {кампания: id отчёта}."""
+    existing = {}
+    for report in CampaignPerformanceReport.objects.filter(
+        store=store, date_from=day_start, date_to=day_end, ozon_campaign_id__in=[r.campaign_id for r in records],
+    ).only("id", "ozon_campaign_id", "report_uuid", "status", "totals", "rows").order_by("id"):
+        existing.setdefault(report.ozon_campaign_id, report)
+
+    stale = [
+        record for record in records
+        if record.campaign_id not in existing
+        or existing[record.campaign_id].status != CampaignPerformanceReport.STATUS_READY
+        or stored_digest(existing[record.campaign_id], "rows") != payload_digest(record.rows)
+    ]
+    if stale:
+        # Тела ответов — в архив одним запросом, в отчёты идут готовые ссылки
+        bodies = [body for record in stale for body in (record.rows, {"source": DAILY_SOURCE, "rows": record.rows})]
+        digests = iter(store_payloads(bodies))
+
+        now = timezone.now()
+        created, updated = [], []
+        for record in stale:
+            report = existing.get(record.campaign_id) or CampaignPerformanceReport(
+                store=store,
+                ozon_campaign_id=record.campaign_id,
+                date_from=day_start,
+                date_to=day_end,
+                request_payload={
+                    "dateFrom": f"{target_date:%Y-%m-%d}",
+                    "dateTo": f"{target_date:%Y-%m-%d}",
+                    "source": DAILY_SOURCE,
+                },
+            )
+            report.report_uuid = report.report_uuid or f"daily-{store.id}-{record.campaign_id}-{target_date:%Y%m%d}"
+            report.status = CampaignPerformanceReport.STATUS_READY
+            report.ready_at = now
+            report.last_checked_at = now
+            report.error_message = ""
+            report.totals = record.totals
+            report.rows = PayloadRef(next(digests))
+            report.raw_response = PayloadRef(next(digests))
+            (updated if report.pk else created).append(report)
+
+        if created:
+            CampaignPerformanceReport.objects.bulk_create(created, batch_size=500)
+            existing.update((report.ozon_campaign_id, report) for report in created)
+        if updated:
+            CampaignPerformanceReport.objects.bulk_update(
+                updated,
+                ["report_uuid", "status", "ready_at", "last_checked_at", "error_message", "totals", "rows", "raw_response"],
+                batch_size=500,
+            )
+    return {campaign_id: report.pk for campaign_id, report in existing.items()}
@@ -0,0 +1,350 @@
+"""Снимок входных данных планнера по магазину: товары, продажи, остатки FBO/FBS и аналитика доставки.
+
+Planer_View (и PlanerPivotView поверх него) и ProductAnalyticsByItemView раньше каждый сам читали
+Product, Sale, WarehouseStock, FbsStock, DeliveryCluster и DeliveryClusterItemAnalytics и в своих
+циклах считали суммы остатков. Теперь данные магазина собираются один раз в компактный снимок:
+индекс SKU и индекс кластеров плюс массивы NumPy — продажи по (день, кластер, SKU), остатки по
+(кластер, SKU) со всеми одиннадцатью счётчиками, FBS по SKU, метрики доставки.
+
+Снимок привязан к версии данных магазина (ключ planner:version:<id> в общем кэше). Версию меняют
+post_save моделей-источников (OzonConfig.ready) и invalidate() после массовых записей, которые
+сигналов не шлют (bulk_create/bulk_update, delete по queryset). Собранный снимок лежит в общем кэше
+(pickle массивов) и в памяти процесса, поэтому страница, дёргающая несколько этих эндпоинтов,
+платит за загрузку один раз.
+"""
+import logging
+import time
+from collections import OrderedDict, namedtuple
+from datetime import timedelta, timezone as dt_timezone
+from functools import cached_property
+
+import numpy as np
+from django.core.cache import cache
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import (
+    DeliveryAnalyticsSummary,
+    DeliveryCluster,
+    DeliveryClusterItemAnalytics,
+    FbsStock,
+    Product,
+    Sale,
+    WarehouseStock,
+)
+
+logger = logging.getLogger(__name__)
+
+# Самый длинный период анализа, который принимают эндпоинты (дней)
+MAX_SALES_DAYS = 60
+# Страховка на записи в обход сигналов и invalidate(): снимок старше этого пересобирается
+SNAPSHOT_TTL_SECONDS = 900
+# Сколько снимков разных магазинов процесс держит в памяти
+LOCAL_SNAPSHOTS = 8
+
+NO_CLUSTER = "Без кластера"
+
+STOCK_COLUMNS = (
+    "available_stock_count",
+    "valid_stock_count",
+    "waiting_docs_stock_count",
+    "expiring_stock_count",
+    "transit_defect_stock_count",
+    "stock_defect_stock_count",
+    "excess_stock_count",
+    "other_stock_count",
+    "requested_stock_count",
+    "transit_stock_count",
+    "return_from_customer_stock_count",
+)
+# «Доступно» для аналитики по товару: доступно + в пути + возвраты от покупателей
+AVAILABLE_STOCK_COLUMNS = ("available_stock_count", "transit_stock_count", "return_from_customer_stock_count")
+
+ProductRow = namedtuple("ProductRow", "sku offer_id name primary_image category type_name price barcodes")
+ItemAnalytics = namedtuple("ItemAnalytics", "average_delivery_time impact_share recommended_supply")
+
+
+def version_key(store_id) -> str:
+    return f"planner:version:{store_id}"
+
+
+def snapshot_key(store_id) -> str:
+    return f"planner:snapshot:{store_id}"
+
+
+def _group(keys, *values):
+    """Суммы values по одинаковым keys: (уникальные ключи, суммы...)."""
+    unique, inverse = np.unique(keys, return_inverse=True)
+    sums = []
+    for value in values:
+        total = np.zeros((len(unique),) + value.shape[1:], dtype=value.dtype)
+        np.add.at(total, inverse, value)
+        sums.append(total)
+    return (unique, *sums)
+
+
+class PlannerSnapshot:
+    """Данные магазина для планнера. Массивы индексируются позициями в skus и clusters."""
+
+    def __init__(self, store_id, version, products, sales, stocks, fbs, delivery_clusters, item_analytics,
+                 average_delivery_time):
+        self.store_id = store_id
+        self.version = version
+        self.built_at = time.time()
+        self.average_delivery_time = average_delivery_time
+        self.delivery_clusters = {
+            name: {"average_delivery_time": avg_time, "impact_share": impact_share}
+            for name, avg_time, impact_share in delivery_clusters
+        }
+
+        sales_clusters = [cluster or NO_CLUSTER for cluster, *_ in sales]
+        stock_clusters = [cluster or NO_CLUSTER for cluster, *_ in stocks]
+        self.clusters = sorted(set(sales_clusters) | set(stock_clusters))
+        cluster_index = {name: idx for idx, name in enumerate(self.clusters)}
+
+        self.skus = np.unique(np.array(
+            [row[0] for row in products] + [row[1] for row in sales] + [row[1] for row in stocks] + [row[0] for row in fbs],
+            dtype=np.int64,
+        ))
+        n_skus = len(self.skus)
+
+        # Товары: порядок как у Product.objects.filter(store=...) (по id)
+        self.product_rows = [
+            ProductRow(sku, offer_id or "", name, image, category, type_name,
+                       float(price) if price is not None else None, barcodes or [])
+            for sku, offer_id, name, image, category, type_name, price, barcodes in products
+        ]
+        self.product_prices = np.array(
+            [row.price if row.price is not None else np.nan for row in self.product_rows], dtype=np.float64,
+        )
+
+        # Продажи: (день UTC, кластер, SKU) → количество и выручка
+        day = np.array([d.toordinal() for _, _, d, _, _ in sales], dtype=np.int32)
+        cluster = np.array([cluster_index[name] for name in sales_clusters], dtype=np.int64)
+        sku = self._sku_positions([s for _, s, _, _, _ in sales])
+        qty = np.array([q or 0 for *_, q, _ in sales], dtype=np.int64)
+        revenue = np.array([float(r or 0) for *_, r in sales], dtype=np.float64)
+        keys = (day.astype(np.int64) * len(self.clusters) + cluster) * max(n_skus, 1) + sku
+        keys, self.sale_qty, self.sale_revenue = _group(keys, qty, revenue)
+        per_day = len(self.clusters) * max(n_skus, 1)
+        self.sale_day = (keys // max(per_day, 1)).astype(np.int32)
+        self.sale_pair = keys % max(per_day, 1)
+
+        # Остатки FBO: (кластер, SKU) → одиннадцать счётчиков
+        pair = (
+            np.array([cluster_index[name] for name in stock_clusters], dtype=np.int64) * max(n_skus, 1)
+            + self._sku_positions([s for _, s, *_ in stocks])
+        )
+        counts = np.array([[c or 0 for c in counts] for _, _, *counts in stocks], dtype=np.int64).reshape(
+            len(stocks), len(STOCK_COLUMNS)
+        )
+        self.stock_pair, self.stock_counts = _group(pair, counts)
+
+        # FBS: SKU → сумма present
+        self.fbs_present = np.zeros(n_skus, dtype=np.int64)
+        self.fbs_mask = np.zeros(n_skus, dtype=bool)
+        positions = self._sku_positions([s for s, _ in fbs])
+        np.add.at(self.fbs_present, positions, np.array([p or 0 for _, p in fbs], dtype=np.int64))
+        self.fbs_mask[positions] = True
+
+        # Аналитика по товару в кластере: (название кластера, SKU), при повторах побеждает последняя
+        self.item_analytics_rows = list(item_analytics)
+
+    # ---------- индексы ----------
+
+    def _sku_positions(self, skus):
+        return np.searchsorted(self.skus, np.array(skus, dtype=np.int64)).astype(np.int64)
+
+    def _split_pairs(self, pairs):
+        n_skus = max(len(self.skus), 1)
+        return (pairs // n_skus).tolist(), self.skus[pairs % n_skus].tolist()
+
+    # ---------- товары ----------
+
+    def products(self, price_min=None, price_max=None, exclude_offer_ids=()):
+        """Товары магазина (ProductRow) в порядке id; с ценой — только с ценой в диапазоне."""
+        if price_min is None and price_max is None and not exclude_offer_ids:
+            return list(self.product_rows)
+        mask = np.ones(len(self.product_rows), dtype=bool)
+        if price_min is not None:
+            mask &= self.product_prices >= price_min
+        if price_max is not None:
+            mask &= self.product_prices <= price_max
+        excluded = set(exclude_offer_ids or ())
+        return [row for row, keep in zip(self.product_rows, mask.tolist()) if keep and row.offer_id not in excluded]
+
+    # ---------- продажи ----------
+
+    def sales(self, since):
+        """Продажи с даты since (aware-полночь UTC, как date__gte у Sale): [(кластер, sku, шт., выручка)]."""
+        mask = self.sale_day >= since.astimezone(dt_timezone.utc).date().toordinal()
+        pairs, qty, revenue = _group(self.sale_pair[mask], self.sale_qty[mask], self.sale_revenue[mask])
+        clusters, skus = self._split_pairs(pairs)
+        return [
+            (self.clusters[cluster], sku, q, r)
+            for cluster, sku, q, r in zip(clusters, skus, qty.tolist(), revenue.tolist())
+        ]
+
+    # ---------- остатки ----------
+
+    def _stocks(self, columns):
+        totals = self.stock_counts[:, [STOCK_COLUMNS.index(name) for name in columns]].sum(axis=1)
+        clusters, skus = self._split_pairs(self.stock_pair)
+        by_cluster = {}
+        for cluster, sku, total in zip(clusters, skus, totals.tolist()):
+            by_cluster.setdefault(self.clusters[cluster], {})[sku] = total
+        n_skus = max(len(self.skus), 1)
+        per_sku = np.bincount(self.stock_pair % n_skus, weights=totals, minlength=len(self.skus)).astype(np.int64)
+        present = np.unique(self.stock_pair % n_skus)
+        total_by_sku = dict(zip(self.skus[present].tolist(), per_sku[present].tolist()))
+        return by_cluster, total_by_sku
+
+    @cached_property
+    def stocks(self):
+        """Остатки FBO по всем счётчикам: ({кластер: {sku: шт.}}, {sku: шт. по всем кластерам})."""
+        return self._stocks(STOCK_COLUMNS)
+
+    @cached_property
+    def available_stocks(self):
+        """То же по AVAILABLE_STOCK_COLUMNS (доступно + в пути + возвраты)."""
+        return self._stocks(AVAILABLE_STOCK_COLUMNS)
+
+    @cached_property
+    def fbs_by_sku(self):
+        return dict(zip(self.skus[self.fbs_mask].tolist(), self.fbs_present[self.fbs_mask].tolist()))
+
+    # ---------- аналитика доставки ----------
+
+    @cached_property
+    def item_analytics(self):
+        """{(название кластера, sku): ItemAnalytics}."""
+        return {
+            (cluster_name, sku): ItemAnalytics(avg_time, impact_share, recommended_supply)
+            for cluster_name, sku, avg_time, impact_share, recommended_supply in self.item_analytics_rows
+        }
+
+    def __getstate__(self):
+        # Производные словари не кладём в кэш: они собираются заново в каждом процессе
+        state = dict(self.__dict__)
+        for name in ("stocks", "available_stocks", "fbs_by_sku", "item_analytics"):
+            state.pop(name, None)
+        return state
+
+
+def build_snapshot(store, version=None) -> PlannerSnapshot:
+    since = (timezone.now() - timedelta(days=MAX_SALES_DAYS - 1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    products = list(
+        Product.objects.filter(store=store).order_by("id").values_list(
+            "sku", "offer_id", "name", "primary_image", "category", "type_name", "price", "barcodes",
+        )
+    )
+    sales = list(
+        Sale.objects.filter(store=store, date__gte=since, sale_type__in=[Sale.FBO, Sale.FBS])
+        .annotate(day=TruncDate("date", tzinfo=dt_timezone.utc))
+        .values("cluster_to", "sku", "day")
+        .annotate(
+            qty=Sum("quantity"),
+            revenue=Sum(ExpressionWrapper(F("price") * F("quantity"), output_field=DecimalField(max_digits=20, decimal_places=2))),
+        )
+        .order_by()
+        .values_list("cluster_to", "sku", "day", "qty", "revenue")
+    )
+    stocks = list(
+        WarehouseStock.objects.filter(store=store)
+        .values("cluster_name", "sku")
+        .annotate(**{f"total_{name}": Sum(name) for name in STOCK_COLUMNS})
+        .order_by()
+        .values_list("cluster_name", "sku", *(f"total_{name}" for name in STOCK_COLUMNS))
+    )
+    fbs = list(
+        FbsStock.objects.filter(store=store).values("sku").annotate(total=Sum("present")).order_by().values_list("sku", "total")
+    )
+    delivery_clusters = list(
+        DeliveryCluster.objects.filter(store=store).order_by("id").values_list("name", "average_delivery_time", "impact_share")
+    )
+    item_analytics = list(
+        DeliveryClusterItemAnalytics.objects.filter(store=store).order_by("id").values_list(
+            "cluster_name", "sku", "average_delivery_time", "impact_share", "recommended_supply",
+        )
+    )
+    average_delivery_time = (
+        DeliveryAnalyticsSummary.objects.filter(store=store).values_list("average_delivery_time", flat=True).first()
+    )
+    return PlannerSnapshot(
+        store.id, version, products, sales, stocks, fbs, delivery_clusters, item_analytics, average_delivery_time,
+    )
+
+
+_local = OrderedDict()
+
+
+def _current_version(store_id):
+    try:
+        version = cache.get(version_key(store_id))
+        if version is None:
+            version = time.time_ns()
+            cache.set(version_key(store_id), version, timeout=None)
+        return version
+    except Exception:
+        # Без кэша версию не сверить — снимок собирается на каждый запрос, как раньше
+        return None
+
+
+def _fresh(snapshot, version):
+    return (
+        snapshot is not None
+        and version is not None
+        and snapshot.version == version
+        and time.time() - snapshot.built_at < SNAPSHOT_TTL_SECONDS
+    )
+
+
+def get_snapshot(store) -> PlannerSnapshot:
+    """Снимок магазина для текущей версии данных: из памяти процесса, из общего кэша или новый."""
+    version = _current_version(store.id)
+    snapshot = _local.get(store.id)
+    if not _fresh(snapshot, version):
+        try:
+            snapshot = cache.get(snapshot_key(store.id)) if version is not None else None
+        except Exception:
+            snapshot = None
+        if not _fresh(snapshot, version):
+            started = time.perf_counter()
+            # Версия прочитана до сборки: запись во время сборки сменит её, и следующий запрос пересоберёт
+            snapshot = build_snapshot(store, version)
+            logger.info(
+                "Planner snapshot store=%s skus=%s clusters=%s sales=%s sec=%s",
+                store.id, len(snapshot.skus), len(snapshot.clusters), len(snapshot.sale_day),
+                round(time.perf_counter() - started, 4),
+            )
+            if version is not None:
+                try:
+                    cache.set(snapshot_key(store.id), snapshot, timeout=SNAPSHOT_TTL_SECONDS)
+                except Exception:
+                    logger.warning("Planner snapshot store=%s: не удалось положить в кэш", store.id)
+    _local[store.id] = snapshot
+    _local.move_to_end(store.id)
+    while len(_local) > LOCAL_SNAPSHOTS:
+        _local.popitem(last=False)
+    return snapshot
+
+
+def invalidate(store_id):
+    """Данные магазина изменились: следующий запрос соберёт снимок заново."""
+    _local.pop(store_id, None)
+    try:
+        cache.set(version_key(store_id), time.time_ns(), timeout=None)
+    except Exception:
+        pass
+
+
+def invalidate_for_instance(sender, instance, **kwargs):
+    """Обработчик post_save моделей-источников снимка."""
+    if instance.store_id:
+        invalidate(instance.store_id)
+
+
+def invalidate_for_store(sender, instance, **kwargs):
+    """Обработчик post_save OzonStore: id магазина мог достаться от удалённого."""
+    invalidate(instance.pk)
@@ -38,6 +38,7 @@ class DraftCreateSerializer(serializers.Serializer):
 
 class SupplyDraftSerializer(serializers.ModelSerializer):
     supply_order_states = serializers.SerializerMethodField()
+    timeslot_response = serializers.JSONField(required=False, allow_null=True)
 
     class Meta:
         model = OzonSupplyDraft
@@ -94,7 +95,7 @@ class SupplyBatchStatusSerializer(serializers.ModelSerializer):
         ]
 
     def get_drafts(self, obj):
-        qs = obj.drafts.exclude(status="created")
+        qs = obj.drafts.exclude(status="created").with_payloads("timeslot_response")
         return SupplyDraftSerializer(qs, many=True).data
 
 
@@ -116,7 +117,7 @@ class SupplyBatchConfirmedSerializer(serializers.ModelSerializer):
         ]
 
     def get_drafts(self, obj):
-        qs = obj.drafts.filter(status="created")
+        qs = obj.drafts.filter(status="created").with_payloads("timeslot_response")
         return SupplyDraftSerializer(qs, many=True).data
 
 
@@ -134,6 +135,10 @@ class FbsPostingSerializer(serializers.ModelSerializer):
     label_status = serializers.SerializerMethodField()
     label_file_url = serializers.SerializerMethodField()
     label_file_path = serializers.SerializerMethodField()
+    # Поля из архива ответов (ArchivedJSONField) — для DRF это обычный JSON
+    products = serializers.JSONField(required=False, allow_null=True)
+    available_actions = serializers.JSONField(required=False, allow_null=True)
+    cancellation = serializers.JSONField(required=False, allow_null=True)
 
     class Meta:
         model = OzonFbsPosting
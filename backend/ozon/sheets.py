@@ -0,0 +1,290 @@
+"""Снимок листа Google Sheets на время прогона задачи.
+
+Лист читается один раз целиком (один ranged-запрос), дальше задачи читают ячейки из памяти
+теми же методами, что у gspread.Worksheet (acell, col_values, get, batch_get), а записи
+(update, batch_update, batch_clear) применяются к снимку и копятся в одном диффе. Дифф уходит
+в таблицу одним batch_update на каждый value_input_option при flush().
+
+Внутри sheet_run() снимок листа общий для всех задач прогона (почасовой прогон магазина:
+статистика → KPI авто → KPI ручных), а запись выполняется один раз в конце прогона.
+
+С GOOGLE_SHEETS_STUB_URL лист читается и пишется через локальный стаб (ozon/stub_server.py).
+"""
+import logging
+import os
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+import gspread
+import requests
+from django.conf import settings
+from google.oauth2.service_account import Credentials
+from gspread.cell import Cell
+from gspread.utils import a1_range_to_grid_range, rowcol_to_a1
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_SCOPES = [
+    'https://www.googleapis.com/auth/spreadsheets',
+    'https://www.googleapis.com/auth/drive',
+]
+DEFAULT_SA_JSON_PATH = "/workspace/ozon-469708-c5f1eca77c02.json"
+
+RAW = "RAW"
+
+_run = threading.local()
+
+
+def _display(value):
+    """Значение так, как его вернёт чтение листа (строкой)."""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    return str(value)
+
+
+def _rectangles(cells):
+    """{(row, col): value} → [(top, left, bottom, right)], соседние ячейки склеены в прямоугольники."""
+    spans_by_row = defaultdict(list)
+    for row, col in sorted(cells):
+        spans = spans_by_row[row]
+        if spans and spans[-1][1] == col - 1:
+            spans[-1][1] = col
+        else:
+            spans.append([col, col])
+
+    rects = []
+    open_rects = {}
+    for row in sorted(spans_by_row):
+        current = {}
+        for left, right in spans_by_row[row]:
+            rect = open_rects.get((left, right))
+            if rect and rect[2] == row - 1:
+                rect[2] = row
+            else:
+                rect = [row, left, row, right]
+                rects.append(rect)
+            current[(left, right)] = rect
+        open_rects = current
+    return rects
+
+
+class SheetSnapshot:
+    """Лист в памяти с интерфейсом чтения/записи gspread.Worksheet. Остальные атрибуты
+    (id, title, spreadsheet — например, для format_cell_ranges) берутся у исходного листа."""
+
+    def __init__(self, worksheet, values):
+        self.worksheet = worksheet
+        self._grid = [list(row) for row in values]
+        self._original = {}
+        self._pending = {}
+        self.deferred = False
+
+    @classmethod
+    def load(cls, worksheet):
+        return cls(worksheet, worksheet.get(pad_values=False) or [])
+
+    def __getattr__(self, name):
+        if name == "worksheet":
+            raise AttributeError(name)
+        return getattr(self.worksheet, name)
+
+    # --- чтение -------------------------------------------------------------
+
+    def _cell(self, row, col):
+        if row <= len(self._grid) and col <= len(self._grid[row - 1]):
+            return self._grid[row - 1][col - 1]
+        return ""
+
+    def _bounds(self, range_name=None):
+        grid_range = a1_range_to_grid_range(range_name) if range_name else {}
+        width = max((len(row) for row in self._grid), default=0)
+        top = grid_range.get("startRowIndex", 0) + 1
+        left = grid_range.get("startColumnIndex", 0) + 1
+        bottom = grid_range.get("endRowIndex", max(len(self._grid), top - 1))
+        right = grid_range.get("endColumnIndex", max(width, left - 1))
+        return top, left, bottom, right
+
+    def get(self, range_name=None, **kwargs):
+        top, left, bottom, right = self._bounds(range_name)
+        rows = []
+        for row in range(top, bottom + 1):
+            values = [self._cell(row, col) for col in range(left, right + 1)]
+            while values and values[-1] == "":
+                values.pop()
+            rows.append(values)
+        while rows and not rows[-1]:
+            rows.pop()
+        return rows
+
+    def batch_get(self, ranges, **kwargs):
+        return [self.get(range_name) for range_name in ranges]
+
+    def acell(self, label, **kwargs):
+        top, left, _, _ = self._bounds(label)
+        value = self._cell(top, left)
+        return Cell(top, left, value if value != "" else None)
+
+    def col_values(self, col, **kwargs):
+        values = [self._cell(row, col) for row in range(1, len(self._grid) + 1)]
+        while values and values[-1] == "":
+            values.pop()
+        return values
+
+    # --- запись -------------------------------------------------------------
+
+    def _write(self, row, col, value, option):
+        while len(self._grid) < row:
+            self._grid.append([])
+        line = self._grid[row - 1]
+        if len(line) < col:
+            line.extend([""] * (col - len(line)))
+        original = self._original.setdefault((row, col), line[col - 1])
+        line[col - 1] = _display(value)
+        if line[col - 1] == original:
+            self._pending.pop((row, col), None)
+        else:
+            self._pending[(row, col)] = (value, option)
+
+    def update(self, range_name=None, values=None, value_input_option=None, raw=True, **kwargs):
+        # Поддерживаем оба порядка аргументов, как gspread: update('A1', [[...]]) и update([[...]], 'A1')
+        if isinstance(range_name, list):
+            range_name, values = values, range_name
+        option = value_input_option or (RAW if raw else "USER_ENTERED")
+        top, left, _, _ = self._bounds(range_name or "A1")
+        for i, row_values in enumerate(values or []):
+            for j, value in enumerate(row_values):
+                self._write(top + i, left + j, value, option)
+        return {}
+
+    def batch_update(self, data, value_input_option=None, raw=True, **kwargs):
+        for item in data:
+            self.update(item["range"], item["values"], value_input_option=value_input_option, raw=raw)
+        return {}
+
+    def batch_clear(self, ranges):
+        for range_name in ranges:
+            top, left, bottom, right = self._bounds(range_name)
+            bottom = min(bottom, len(self._grid))
+            for row in range(top, bottom + 1):
+                for col in range(left, min(right, len(self._grid[row - 1])) + 1):
+                    self._write(row, col, "", RAW)
+        return {}
+
+    @property
+    def pending_cells(self):
+        return len(self._pending)
+
+    def flush(self, force=False):
+        """Отправляет накопленный дифф. Снимок прогона (deferred) пишется только из sheet_run().
+
+        Ошибку записи логирует и возвращает 0, как раньше делали задачи вокруг каждого ws.update.
+        """
+        if (self.deferred and not force) or not self._pending:
+            return 0
+        by_option = defaultdict(dict)
+        for (row, col), (value, option) in self._pending.items():
+            by_option[option][(row, col)] = value
+
+        try:
+            self._send(by_option)
+        except Exception as e:
+            logger.error(f"[❌] Не удалось записать изменения листа {self.worksheet.title}: {e}")
+            return 0
+
+        written = len(self._pending)
+        self._original = {}
+        self._pending = {}
+        return written
+
+    def _send(self, by_option):
+        for option, cells in by_option.items():
+            data = [
+                {
+                    "range": f"{rowcol_to_a1(top, left)}:{rowcol_to_a1(bottom, right)}",
+                    "values": [
+                        [cells[(row, col)] for col in range(left, right + 1)]
+                        for row in range(top, bottom + 1)
+                    ],
+                }
+                for top, left, bottom, right in _rectangles(cells)
+            ]
+            self.worksheet.batch_update(data, value_input_option=option)
+            logger.info(f"[📝] {self.worksheet.title}: записано ячеек {len(cells)} ({len(data)} диапазонов, {option})")
+
+
+class StubSpreadsheet:
+    """Таблица стаба: форматирование (format_cell_ranges → spreadsheet.batch_update) стаб не хранит."""
+
+    def __init__(self, spreadsheet_url):
+        self.url = spreadsheet_url
+
+    def batch_update(self, body):
+        return {"replies": [{} for _ in (body or {}).get("requests") or []]}
+
+
+class StubWorksheet:
+    """Лист на локальном стабе (GOOGLE_SHEETS_STUB_URL, ozon/stub_server.py): чтение целиком и batch_update."""
+
+    id = 0
+
+    def __init__(self, base_url, spreadsheet_url, title):
+        self.base_url = base_url
+        self.spreadsheet_url = spreadsheet_url
+        self.title = title
+        self.spreadsheet = StubSpreadsheet(spreadsheet_url)
+
+    def _params(self):
+        return {"url": self.spreadsheet_url, "worksheet": self.title}
+
+    def get(self, range_name=None, **kwargs):
+        resp = requests.get(f"{self.base_url}/sheets/values", params=self._params(), timeout=30)
+        resp.raise_for_status()
+        return resp.json().get("values") or []
+
+    def batch_update(self, data, value_input_option=None, **kwargs):
+        resp = requests.post(
+            f"{self.base_url}/sheets/batch_update",
+            params=self._params(),
+            json={"data": data, "value_input_option": value_input_option},
+            timeout=30,
+        )
+        resp.raise_for_status()
+        return resp.json()
+
+
+def open_sheet_snapshot(spreadsheet_url: str, worksheet_name: str = "Main_ADV", sa_json_path: str = None):
+    """Снимок листа; внутри sheet_run() повторное открытие того же листа берёт снимок из прогона."""
+    snapshots = getattr(_run, "snapshots", None)
+    key = (spreadsheet_url, worksheet_name)
+    if snapshots is not None and key in snapshots:
+        return snapshots[key]
+
+    if settings.GOOGLE_SHEETS_STUB_URL:
+        worksheet = StubWorksheet(settings.GOOGLE_SHEETS_STUB_URL, spreadsheet_url, worksheet_name)
+    else:
+        sa_json_path = sa_json_path or os.getenv("GOOGLE_SA_JSON_PATH", DEFAULT_SA_JSON_PATH)
+        creds = Credentials.from_service_account_file(sa_json_path, scopes=GOOGLE_SCOPES)
+        worksheet = gspread.authorize(creds).open_by_url(spreadsheet_url).worksheet(worksheet_name)
+    snapshot = SheetSnapshot.load(worksheet)
+    if snapshots is not None:
+        snapshot.deferred = True
+        snapshots[key] = snapshot
+    return snapshot
+
+
+@contextmanager
+def sheet_run():
+    """Общие снимки листов на время прогона; дифф каждого листа пишется при выходе."""
+    if getattr(_run, "snapshots", None) is not None:
+        yield
+        return
+    _run.snapshots = {}
+    try:
+        yield
+    finally:
+        snapshots, _run.snapshots = _run.snapshots, None
+        for snapshot in snapshots.values():
+            snapshot.flush(force=True)
@@ -0,0 +1,411 @@
+"""Локальный стаб Ozon Seller, Performance API и Google Sheets для нагрузочных и регрессионных прогонов.
+
+Синхронизации ведут себя по-настоящему только на пагинации, ограничении частоты и медленных отчётах,
+поэтому стаб воспроизводит именно это:
+- задержка ответа latency_ms ± jitter_ms;
+- не больше rps запросов в секунду на клиента (Client-Id или токен): Seller отвечает 429 с {"code": 8},
+  как настоящий API, Performance — 429;
+- постраничная выдача FBO/FBS-отправлений (offset/limit, has_next), analytics/data (offset/limit),
+  product/list (last_id);
+- отчёт Performance по UUID первые report_pending_polls опросов отвечает 202, затем
+  report_missing_polls раз 404 и только потом 200;
+- поставки: draft/create → create/info (report_pending_polls раз CALCULATION_STATUS_IN_PROGRESS, затем
+  записанный ответ ozon_response.json), timeslot/info — записанный timeslot.json;
+- лист Google: GET /sheets/values и POST /sheets/batch_update, значения листов держатся в памяти.
+
+Ответы на остальные пути можно подложить файлами в recordings_dir: путь /v1/foo/bar → v1_foo_bar.json.
+Генерируемые данные детерминированы seed. GET /_stub/stats — счётчики запросов и отказов по путям.
+
+Запуск: python manage.py ozon_stub_server --port 8765, затем OZON_API_STUB_URL=http://localhost:8765
+и GOOGLE_SHEETS_STUB_URL=http://localhost:8765 в окружении backend/воркеров.
+"""
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+import zlib
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+from django.conf import settings
+from gspread.utils import a1_range_to_grid_range
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_BODY = {"code": 8, "message": "You have reached request rate limit per second", "details": []}
+
+# Записанные ответы из репозитория: путь → (файл в корне проекта, извлечение тела)
+RECORDED = {
+    "/v1/draft/create/info": ("ozon_response.json", lambda data: data),
+    "/v1/draft/timeslot/info": (
+        "timeslot.json",
+        lambda data: ((data.get("drafts") or [{}])[0].get("timeslot_response") or {}),
+    ),
+}
+
+
+@dataclass
+class StubConfig:
+    latency_ms: int = 50
+    jitter_ms: int = 20
+    rps: int = 0  # 0 — без ограничения
+    products: int = 500
+    postings_per_day: int = 200
+    campaigns: int = 50
+    report_pending_polls: int = 2
+    report_missing_polls: int = 1
+    max_page_size: int = 1000
+    recordings_dir: str = ""
+    seed: int = 1
+    project_dir: Path = field(default_factory=lambda: Path(settings.BASE_DIR).parent)
+
+
+class StubState:
+    """Состояние стаба между запросами: окна частоты, опросы отчётов и операций, листы, счётчики."""
+
+    def __init__(self, config: StubConfig):
+        self.config = config
+        self.lock = threading.Lock()
+        self.windows = defaultdict(deque)
+        self.polls = defaultdict(int)
+        self.reports = {}
+        self.sheets = {}
+        self.stats = defaultdict(lambda: {"requests": 0, "throttled": 0})
+        self.recorded = {}
+        for path, (filename, extract) in RECORDED.items():
+            file = config.project_dir / filename
+            if file.exists():
+                self.recorded[path] = extract(json.loads(file.read_text()))
+
+    def throttled(self, client) -> bool:
+        if not self.config.rps:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            window = self.windows[client]
+            while window and now - window[0] >= 1:
+                window.popleft()
+            if len(window) >= self.config.rps:
+                return True
+            window.append(now)
+            return False
+
+    def poll(self, key) -> int:
+        with self.lock:
+            self.polls[key] += 1
+            return self.polls[key]
+
+    def count(self, path, throttled=False):
+        with self.lock:
+            self.stats[path]["requests"] += 1
+            if throttled:
+                self.stats[path]["throttled"] += 1
+
+    def recording(self, path):
+        if self.config.recordings_dir:
+            file = Path(self.config.recordings_dir) / (path.strip("/").replace("/", "_") + ".json")
+            if file.exists():
+                return json.loads(file.read_text())
+        return self.recorded.get(path)
+
+
+# --- генерация данных --------------------------------------------------------
+
+
+def _sku(config, index):
+    return 100_000_000 + config.seed * 1_000_000 + index
+
+
+def _parse_moment(value):
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return datetime.now(dt_timezone.utc)
+
+
+def _postings(config, since, to, prefix):
+    """Отправления в [since, to): postings_per_day в сутки, детерминированно по номеру суток."""
+    since, to = _parse_moment(since), _parse_moment(to)
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=dt_timezone.utc)
+    if to.tzinfo is None:
+        to = to.replace(tzinfo=dt_timezone.utc)
+    postings = []
+    day = since.replace(hour=0, minute=0, second=0, microsecond=0)
+    step = timedelta(days=1) / max(config.postings_per_day, 1)
+    while day < to:
+        rnd = random.Random(f"{config.seed}:{prefix}:{day.date()}")
+        for i in range(config.postings_per_day):
+            moment = day + step * i
+            if not since <= moment < to:
+                continue
+            index = rnd.randrange(config.products)
+            price = 300 + index % 4700
+            quantity = 1 + rnd.randrange(3)
+            postings.append({
+                "posting_number": f"{prefix}{day:%y%m%d}-{i:05d}-1",
+                "status": "delivered",
+                "created_at": moment.isoformat(),
+                "in_process_at": moment.isoformat(),
+                "shipment_date": (moment + timedelta(days=1)).isoformat(),
+                "products": [{"sku": _sku(config, index), "offer_id": f"STUB-{index:05d}", "price": str(price), "quantity": quantity}],
+                "financial_data": {
+                    "cluster_from": f"Кластер {index % 7 + 1}",
+                    "cluster_to": f"Кластер {rnd.randrange(20) + 1}",
+                    "products": [{
+                        "product_id": _sku(config, index),
+                        "price": price,
+                        "quantity": quantity,
+                        "payout": round(price * 0.8, 2),
+                        "commission_amount": round(price * 0.2, 2),
+                        "customer_price": price,
+                    }],
+                },
+                "analytics_data": {"warehouse_id": 1000 + index % 20},
+                "delivery_method": {"tpl_provider": "Ozon"},
+            })
+        day += timedelta(days=1)
+    return postings
+
+
+def _page(items, body, config):
+    offset = int(body.get("offset") or 0)
+    limit = min(int(body.get("limit") or config.max_page_size), config.max_page_size)
+    return items[offset:offset + limit], offset + limit < len(items)
+
+
+def _campaign_totals(config, campaign_id, day):
+    rnd = random.Random(f"{config.seed}:campaign:{campaign_id}:{day}")
+    orders = rnd.randrange(10)
+    return {
+        "orders": str(orders),
+        "ordersMoney": str(orders * (300 + rnd.randrange(4700))),
+        "moneySpent": f"{rnd.uniform(0, 1500):.2f}",
+        "clicks": str(rnd.randrange(500)),
+        "views": str(rnd.randrange(20000)),
+    }
+
+
+def _campaign_ids(config):
+    return [str(9_000_000 + config.seed * 10_000 + i) for i in range(config.campaigns)]
+
+
+# --- обработчики -------------------------------------------------------------
+
+
+def seller_fbo_list(state, body, query):
+    flt = body.get("filter") or {}
+    items, _ = _page(_postings(state.config, flt.get("since"), flt.get("to"), "FBO"), body, state.config)
+    return 200, {"result": items}
+
+
+def seller_fbs_list(state, body, query):
+    flt = body.get("filter") or {}
+    items, has_next = _page(_postings(state.config, flt.get("since"), flt.get("to"), "FBS"), body, state.config)
+    return 200, {"result": {"postings": items, "has_next": has_next}}
+
+
+def seller_analytics_data(state, body, query):
+    config = state.config
+    start = date.fromisoformat(str(body.get("date_from"))[:10])
+    end = date.fromisoformat(str(body.get("date_to"))[:10])
+    rows = []
+    day = start
+    while day <= end:
+        rnd = random.Random(f"{config.seed}:analytics:{day}")
+        for index in range(config.products):
+            units = rnd.randrange(5)
+            rows.append({
+                "dimensions": [{"id": str(_sku(config, index)), "name": f"Товар {index}"}, {"id": day.isoformat()}],
+                "metrics": [units * (300 + index % 4700), units],
+            })
+        day += timedelta(days=1)
+    # В analytics/data offset начинается с 1 (см. _iter_analytics_pages)
+    offset = max(int(body.get("offset") or 0) - 1, 0)
+    limit = min(int(body.get("limit") or config.max_page_size), config.max_page_size)
+    return 200, {"result": {"data": rows[offset:offset + limit], "totals": [0, 0]}}
+
+
+def seller_product_list(state, body, query):
+    config = state.config
+    last_id = int(body.get("last_id") or 0)
+    limit = min(int(body.get("limit") or config.max_page_size), config.max_page_size)
+    items = [
+        {"product_id": _sku(config, index), "offer_id": f"STUB-{index:05d}", "archived": False}
+        for index in range(last_id, min(last_id + limit, config.products))
+    ]
+    next_id = last_id + len(items)
+    return 200, {"result": {"items": items, "total": config.products, "last_id": str(next_id) if next_id < config.products else ""}}
+
+
+def seller_draft_create(state, body, query):
+    return 200, {"operation_id": str(uuid.uuid4())}
+
+
+def seller_draft_info(state, body, query):
+    attempt = state.poll(("draft_info", body.get("operation_id")))
+    if attempt <= state.config.report_pending_polls:
+        return 200, {"status": "CALCULATION_STATUS_IN_PROGRESS", "clusters": [], "errors": []}
+    return 200, state.recording("/v1/draft/create/info") or {"status": "CALCULATION_STATUS_SUCCESS", "clusters": []}
+
+
+def seller_supply_create(state, body, query):
+    return 200, {"operation_id": str(uuid.uuid4())}
+
+
+def seller_supply_status(state, body, query):
+    order_id = zlib.crc32(str(body.get("operation_id")).encode("utf-8"))
+    return 200, {"status": "SUCCESS", "result": {"order_ids": [order_id]}}
+
+
+def performance_token(state, body, query):
+    return 200, {"access_token": f"stub-{body.get('client_id', '')}", "expires_in": 1800, "token_type": "Bearer"}
+
+
+def performance_statistics_json(state, body, query):
+    report_uuid = str(uuid.uuid4())
+    with state.lock:
+        state.reports[report_uuid] = ([str(c) for c in body.get("campaigns") or []], body.get("dateFrom"))
+    return 200, {"UUID": report_uuid}
+
+
+def performance_report(state, body, query):
+    report_uuid = (query.get("UUID") or [""])[0]
+    config = state.config
+    attempt = state.poll(("report", report_uuid))
+    if attempt <= config.report_pending_polls:
+        return 202, {"UUID": report_uuid, "state": "IN_PROGRESS"}
+    if attempt <= config.report_pending_polls + config.report_missing_polls:
+        return 404, {"error": "report not found"}
+    campaigns, day = state.reports.get(report_uuid) or ([], None)
+    campaigns = campaigns or _campaign_ids(config)[:1]
+    day = day or date.today().isoformat()
+    result = {}
+    for campaign_id in campaigns:
+        totals = _campaign_totals(config, campaign_id, day)
+        result[campaign_id] = {"report": {"rows": [totals], "totals": totals}}
+    return 200, result
+
+
+def performance_daily(state, body, query):
+    day = (query.get("dateFrom") or [date.today().isoformat()])[0]
+    rows = [
+        {"id": campaign_id, "date": day, **_campaign_totals(state.config, campaign_id, day)}
+        for campaign_id in _campaign_ids(state.config)
+    ]
+    return 200, {"rows": rows}
+
+
+def sheets_values(state, body, query):
+    key = ((query.get("url") or [""])[0], (query.get("worksheet") or [""])[0])
+    with state.lock:
+        return 200, {"values": [list(row) for row in state.sheets.get(key, [])]}
+
+
+def sheets_batch_update(state, body, query):
+    key = ((query.get("url") or [""])[0], (query.get("worksheet") or [""])[0])
+    updated = 0
+    with state.lock:
+        grid = state.sheets.setdefault(key, [])
+        for item in body.get("data") or []:
+            grid_range = a1_range_to_grid_range(item["range"])
+            top, left = grid_range.get("startRowIndex", 0), grid_range.get("startColumnIndex", 0)
+            for i, row_values in enumerate(item.get("values") or []):
+                while len(grid) <= top + i:
+                    grid.append([])
+                line = grid[top + i]
+                for j, value in enumerate(row_values):
+                    if len(line) <= left + j:
+                        line.extend([""] * (left + j + 1 - len(line)))
+                    line[left + j] = "" if value is None else str(value)
+                    updated += 1
+    return 200, {"totalUpdatedCells": updated}
+
+
+ROUTES = {
+    ("POST", "/v2/posting/fbo/list"): seller_fbo_list,
+    ("POST", "/v3/posting/fbs/list"): seller_fbs_list,
+    ("POST", "/v1/analytics/data"): seller_analytics_data,
+    ("POST", "/v3/product/list"): seller_product_list,
+    ("POST", "/v1/draft/create"): seller_draft_create,
+    ("POST", "/v1/draft/create/info"): seller_draft_info,
+    ("POST", "/v1/draft/supply/create"): seller_supply_create,
+    ("POST", "/v1/draft/supply/create/status"): seller_supply_status,
+    ("POST", "/api/client/token"): performance_token,
+    ("POST", "/api/client/statistics/json"): performance_statistics_json,
+    ("GET", "/api/client/statistics/report"): performance_report,
+    ("GET", "/api/client/statistics/daily/json"): performance_daily,
+    ("GET", "/sheets/values"): sheets_values,
+    ("POST", "/sheets/batch_update"): sheets_batch_update,
+}
+
+# Лист и служебные пути не ограничиваются по частоте
+UNTHROTTLED_PREFIXES = ("/sheets/", "/_stub/", "/api/client/token")
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    state: StubState = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        logger.debug("stub %s", fmt % args)
+
+    def _send(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, method):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}") if length else {}
+        except ValueError:
+            body = {}
+
+        if url.path == "/_stub/stats":
+            with self.state.lock:
+                return self._send(200, dict(self.state.stats))
+
+        config = self.state.config
+        if config.latency_ms or config.jitter_ms:
+            time.sleep(max(0, config.latency_ms + random.uniform(-config.jitter_ms, config.jitter_ms)) / 1000)
+
+        client = self.headers.get("Client-Id") or self.headers.get("Authorization") or self.client_address[0]
+        if not url.path.startswith(UNTHROTTLED_PREFIXES) and self.state.throttled(client):
+            self.state.count(url.path, throttled=True)
+            performance = url.path.startswith("/api/client")
+            return self._send(429, {"error": "Too Many Requests"} if performance else RATE_LIMIT_BODY)
+        self.state.count(url.path)
+
+        handler = ROUTES.get((method, url.path))
+        if handler is None:
+            recorded = self.state.recording(url.path)
+            if recorded is not None:
+                return self._send(200, recorded)
+            return self._send(404, {"code": 5, "message": f"stub: нет ответа для {method} {url.path}"})
+        status, payload = handler(self.state, body, query)
+        return self._send(status, payload)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+
+def make_server(config: StubConfig, host="127.0.0.1", port=8765) -> ThreadingHTTPServer:
+    handler = type("BoundStubHandler", (StubHandler,), {"state": StubState(config)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
@@ -1,11 +1,9 @@
 import requests
-from celery import shared_task
+from celery import shared_task, chord, group
 from django.utils import timezone
 from users.models import OzonStore
+from users.store_index import resolve_store, store_by_sheet_url
 from .models import (
-    DeliveryCluster,
-    DeliveryClusterItemAnalytics,
-    DeliveryAnalyticsSummary,
     Category,
     ProductType,
     Product,
@@ -20,21 +18,34 @@ from .models import (
     AdPlanItem,
     ManualCampaign,
     CampaignPerformanceReportEntry,
+    CampaignDailySpend,
 )
 
 from .utils import create_cpc_product_campaign, update_campaign_budget, activate_campaign, deactivate_campaign
+from .utils import acquire_rate_slot, performance_rate_key, run_campaign_operations, run_campaign_operations_for_store
+from .utils import invalidate_cluster_map
+from .utils import PERFORMANCE_API_URL, SELLER_API_URL
+from .sheets import open_sheet_snapshot, sheet_run
+from .abc import abc_classify
+from .partitions import maintain_partitions
+from .payloads import prune_payload_blobs
+from .delivery_analytics import sync_cluster_item_analytics, sync_delivery_clusters
+from .planner_snapshot import invalidate as invalidate_planner_snapshot
+from .performance_stats import parse_daily_statistics, parse_report_statistics, upsert_daily_reports, upsert_entries
+from backend.celery_routing import QUEUE_ADS_SHEETS
+from backend.metrics import observe
 
-import json
 from collections import defaultdict
 import time
 from decimal import Decimal, ROUND_HALF_UP
-from django.db.models import Sum, F, ExpressionWrapper, DecimalField, Count
+from django.db.models import Sum, F, ExpressionWrapper, DecimalField, Count, Q, Min, Case, When, Value
+from django.db.models.functions import Greatest
 from django.utils import timezone
 from datetime import date as dt_date, timedelta
 from math import ceil
-from functools import reduce
-from operator import or_
-from django.db import models, transaction
+from django.db import transaction, connection
+from django.core.cache import cache
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, date, timedelta
 import calendar
 import gspread
@@ -43,15 +54,16 @@ from gspread_formatting import CellFormat, Color, format_cell_ranges
 from gspread.utils import rowcol_to_a1
 
 import time
+import threading
 
 import logging
 import os
 logger = logging.getLogger(__name__)
 
 
-OZON_DRAFT_CREATE_URL = "https://api-seller.ozon.ru/v1/draft/create"
-OZON_DRAFT_INFO_URL = "https://api-seller.ozon.ru/v1/draft/create/info"
-OZON_SUPPLY_CREATE_URL = "https://api-seller.ozon.ru/v1/draft/supply/create"
+OZON_DRAFT_CREATE_URL = f"{SELLER_API_URL}/v1/draft/create"
+OZON_DRAFT_INFO_URL = f"{SELLER_API_URL}/v1/draft/create/info"
+OZON_SUPPLY_CREATE_URL = f"{SELLER_API_URL}/v1/draft/supply/create"
 MIN_INTERVAL_SECONDS = 30  # 2 запроса в минуту
 SUPPLY_MIN_INTERVAL_SECONDS = 2
 RETRY_429_SECONDS = 60
@@ -60,6 +72,21 @@ MAX_ATTEMPTS = 3
 INFO_RETRY_SECONDS = 10
 STALE_DRAFT_MINUTES = 60
 
+OZON_TIMESLOT_URL = f"{SELLER_API_URL}/v1/draft/timeslot/info"
+OZON_SUPPLY_STATUS_URL = f"{SELLER_API_URL}/v1/draft/supply/create/status"
+OZON_SUPPLY_GET_URL = f"{SELLER_API_URL}/v3/supply-order/get"
+OZON_SUPPLY_BUNDLE_URL = f"{SELLER_API_URL}/v1/supply-order/bundle"
+# Бюджет запросов чтения (таймслоты, статусы поставок) на магазин в секунду, общий для всех воркеров.
+SUPPLY_READ_RPS = 2
+# Сколько черновиков батча обрабатывается одновременно.
+SUPPLY_READ_CONCURRENCY = 4
+SUPPLY_READ_MAX_RETRIES = 2
+SUPPLY_READ_RETRY_SECONDS = 2.0
+# Сколько хранится прогресс фоновой загрузки по батчу.
+SUPPLY_JOB_TTL_SECONDS = 3600
+SUPPLY_JOB_TIMESLOTS = "timeslots"
+SUPPLY_JOB_SUPPLY_STATUS = "supply_status"
+
 
 
 
@@ -117,11 +144,12 @@ def sync_ozon_warehouses_for_store(store):
                 )
                 updated += 1
 
+    invalidate_cluster_map(store)
     logger.info(f"[📦] Обновлено {updated} складов для {store}")
 
 
 def fetch_ozon_clusters(client_id, api_key):
-    url = "https://api-seller.ozon.ru/v1/cluster/list"
+    url = f"{SELLER_API_URL}/v1/cluster/list"
     headers = {
         "Client-Id": client_id,
         "Api-Key": api_key,
@@ -162,7 +190,7 @@ def sync_all_ozon_categories():
         except Exception as e:
             logger.error(f"[❌] Ошибка для магазина {store}: {e}")
 def fetch_and_save_category_tree(client_id, api_key):
-    url = "https://api-seller.ozon.ru/v1/description-category/tree"
+    url = f"{SELLER_API_URL}/v1/description-category/tree"
     headers = {
         "Client-Id": client_id,
         "Api-Key": api_key,
@@ -270,7 +298,7 @@ def fetch_all_products_from_ozon(client_id, api_key):
         "Content-Type": "application/json"
     }
 
-    url = "https://api-seller.ozon.ru/v3/product/list"
+    url = f"{SELLER_API_URL}/v3/product/list"
     last_id = ""
     all_items = []
 
@@ -323,6 +351,7 @@ def sync_warehouse_stock_for_store(store):
 
     # Удаляем старые остатки
     WarehouseStock.objects.filter(store=store).delete()
+    invalidate_planner_snapshot(store.id)
 
     updated_count = 0
     for item in stock_items:
@@ -355,7 +384,7 @@ def sync_warehouse_stock_for_store(store):
 
     logger.info(f"[📦] Обновлено {updated_count} остатков для магазина {store}")
 def fetch_warehouse_stock(client_id, api_key, skus: list):
-    url = "https://api-seller.ozon.ru/v1/analytics/stocks"
+    url = f"{SELLER_API_URL}/v1/analytics/stocks"
     headers = {
         "Client-Id": client_id,
         "Api-Key": api_key,
@@ -458,6 +487,7 @@ def _sync_fbs_stock_for_store(store):
     ]
 
     FbsStock.objects.bulk_create(stock_objects)
+    invalidate_planner_snapshot(store.id)
     logger.info(f"[📦] Сохранено {len(stock_objects)} FBS-остатков для {store}")
 
 
@@ -544,6 +574,8 @@ def _bulk_upsert_sales(store, sales_payload, batch_size=5000):
                 ],
                 batch_size=batch_size,
             )
+    if to_create or to_update:
+        invalidate_planner_snapshot(store.id)
 
     return created, updated
 
@@ -552,7 +584,7 @@ def fetch_detailed_products_from_ozon(client_id, api_key, product_ids):
     """
     Делает батч-запросы по 1000 product_id к Ozon /v3/product/info/list
     """
-    url = "https://api-seller.ozon.ru/v3/product/info/list"
+    url = f"{SELLER_API_URL}/v3/product/info/list"
     headers = {
         "Client-Id": client_id,
         "Api-Key": api_key,
@@ -578,264 +610,37 @@ def fetch_detailed_products_from_ozon(client_id, api_key, product_ids):
 
 
 # ОБЩАЯ АНАЛИТИКА ПО КЛАСТЕРУ выгрузка в БД
-OZON_ANALYTICS_URL = "https://api-seller.ozon.ru/v1/analytics/average-delivery-time"
-OZON_CLUSTER_URL = "https://api-seller.ozon.ru/v1/cluster/list"
-
-def chunked(iterable, size):
-    for i in range(0, len(iterable), size):
-        yield iterable[i:i + size]
-        
 @shared_task
 def update_delivery_clusters():
     for store in OzonStore.objects.all():
-        headers = {
-            "Client-Id": store.client_id,
-            "Api-Key": store.api_key,
-            "Content-Type": "application/json"
-        }
-
         try:
-            # 1. Получаем метрики доставки
-            response = requests.post(OZON_ANALYTICS_URL, json={"delivery_schema": "ALL"}, headers=headers)
-            response.raise_for_status()
-            
-            
-            # Сохраняем общий total-блок
-            total = response.json().get("total", {})
-
-            if total:
-                orders_count = total.get("orders_count", {})
-                total_orders = orders_count.get("total", 0)
-
-                DeliveryAnalyticsSummary.objects.update_or_create(
-                    store=store,
-                    defaults={
-                        "average_delivery_time": total.get("average_delivery_time", 0),
-                        "average_delivery_time_status": total.get("average_delivery_time_status", ""),
-                        "total_orders": total_orders,
-                        "lost_profit": total.get("lost_profit", 0),
-                        "impact_share": total.get("exact_impact_share", 0),
-                        "attention_level": total.get("attention_level", ""),
-                        "recommended_supply": total.get("recommended_supply", 0),
-                    }
-    )
-            
-            
-            data = response.json().get("data", [])
-            cluster_ids = []
-            metrics_map = {}
-
-            for item in data:
-                cluster_id = item["delivery_cluster_id"]
-                metrics = item["metrics"]
-                cluster_ids.append(cluster_id)
-                metrics_map[cluster_id] = metrics
-
-            if not cluster_ids:
-                continue
-
-            # 2. Получаем названия кластеров
-            valid_cluster_ids = [cid for cid in cluster_ids if cid and int(cid) > 0]
-
-            for cluster_ids_chunk in chunked(valid_cluster_ids, 10):
-                print(json.dumps([str(cid) for cid in cluster_ids_chunk]))
-                cluster_resp = requests.post(OZON_CLUSTER_URL, json={
-                    "cluster_ids": [str(cid) for cid in cluster_ids_chunk],
-                    "cluster_type": "CLUSTER_TYPE_OZON"
-                }, headers=headers)
-                
-                cluster_resp.raise_for_status()
-                cluster_info = cluster_resp.json().get("clusters", [])
-
-                for cluster in cluster_info:
-                    cid = cluster["id"]
-                    name = cluster["name"]
-                    ctype = cluster["type"]
-                    metrics = metrics_map.get(cid)
-                    if not metrics:
-                        continue
-
-                    DeliveryCluster.objects.update_or_create(
-                        store=store,
-                        delivery_cluster_id=cid,
-                        defaults={
-                            "name": name,
-                            "type": ctype,
-                            "average_delivery_time": metrics["average_delivery_time"],
-                            "impact_share": metrics["exact_impact_share"],
-                            "lost_profit": metrics["lost_profit"],
-                            "recommended_supply": metrics["recommended_supply"]
-                        }
-                    )
+            count = sync_delivery_clusters(store)
+            logger.info(f"[🗺️] Кластеры доставки {store}: {count}")
         except Exception as e:
-            print(f"[{store}] Ошибка при обновлении кластеров: {e}")
-
+            logger.error(f"[{store}] Ошибка при обновлении кластеров: {e}")
 
 
 # ЧАСТНАЯ АНАЛИТИКА ПО КЛАСТЕРУ
 @shared_task(name="ЧАСТНАЯ АНАЛИТИКА ПО КЛАСТЕРУ")
 def update_cluster_item_analytics():
     for store in OzonStore.objects.all():
-        headers = {
-            "Client-Id": store.client_id,
-            "Api-Key": store.api_key,
-            "Content-Type": "application/json"
-        }
-        cluster_names = {
-            c.delivery_cluster_id: c.name
-            for c in DeliveryCluster.objects.filter(store=store)
-        }
-
-        all_skus_seen = set()
-        print(cluster_names)
-        for cluster_id in cluster_names:
-            print(f"Обновление аналитики для кластера {cluster_id} ({cluster_names[cluster_id]}) в магазине {store}")
-            
-            # Цикл для FBS
-            print(f"Получение данных FBS для кластера {cluster_id}")
-            offset = 0
-            limit = 1000
-            while True:
-                payload = {
-                    "cluster_id": cluster_id,
-                    "limit": limit,
-                    "offset": offset,
-                    "filters": {
-                        "delivery_schema": "FBS",
-                        "supply_period": "FOUR_WEEKS"
-                    }
-                }
-
-                try:
-                    resp = requests.post(
-                        "https://api-seller.ozon.ru/v1/analytics/average-delivery-time/details",
-                        json=payload,
-                        headers=headers
-                    )
-                    resp.raise_for_status()
-                    data = resp.json().get("data", [])
-
-                    if not data:
-                        break
-
-                    for entry in data:
-                        item = entry["item"]
-                        metrics = entry["metrics"]
-                        if cluster_id == 154 and item["sku"] == 787678187:
-                            logging.info(f"Получено FBS для {item['sku']}: {metrics['recommended_supply']}")
-                        # Получаем существующую запись или создаем новую
-                        analytics_obj, created = DeliveryClusterItemAnalytics.objects.update_or_create(
-                            store=store,
-                            cluster_id=cluster_id,
-                            sku=item["sku"],
-                            defaults={
-                                "offer_id": item["offer_id"],
-                                "cluster_name": cluster_names.get(cluster_id, ""),
-                                "delivery_schema": item["delivery_schema"],
-                                "average_delivery_time": metrics["average_delivery_time"],
-                                "average_delivery_time_status": metrics["average_delivery_time_status"],
-                                "impact_share": metrics["exact_impact_share"],
-                                "attention_level": metrics["attention_level"],
-                                "recommended_supply": metrics["recommended_supply"],
-                                "recommended_supply_FBS": metrics["recommended_supply"]
-                            }
-                        )
-                        
-                        # Если запись уже существовала, обновляем только FBS поле
-                        if not created:
-                            analytics_obj.recommended_supply_FBS = metrics["recommended_supply"]
-                            analytics_obj.save(update_fields=['recommended_supply_FBS'])
-
-                        all_skus_seen.add((store.id, cluster_id, item["sku"]))
-
-                    if len(data) < limit:
-                        break
-                    offset += limit
-                except Exception as e:
-                    print(f"[{store}] Ошибка при получении деталей FBS по кластеру {cluster_id}: {e}")
-                    break
-
-            # Цикл для FBO
-            print(f"Получение данных FBO для кластера {cluster_id}")
-            offset = 0
-            while True:
-                payload = {
-                    "cluster_id": cluster_id,
-                    "limit": limit,
-                    "offset": offset,
-                    "filters": {
-                        "delivery_schema": "FBO",
-                        "supply_period": "FOUR_WEEKS"
-                    }
-                }
-
-                try:
-                    resp = requests.post(
-                        "https://api-seller.ozon.ru/v1/analytics/average-delivery-time/details",
-                        json=payload,
-                        headers=headers
-                    )
-                    resp.raise_for_status()
-                    data = resp.json().get("data", [])
-
-                    if not data:
-                        break
-
-                    for entry in data:
-                        item = entry["item"]
-                        metrics = entry["metrics"]
-                        
-                        # Получаем существующую запись или создаем новую
-                        analytics_obj, created = DeliveryClusterItemAnalytics.objects.update_or_create(
-                            store=store,
-                            cluster_id=cluster_id,
-                            sku=item["sku"],
-                            defaults={
-                                "offer_id": item["offer_id"],
-                                "cluster_name": cluster_names.get(cluster_id, ""),
-                                "delivery_schema": item["delivery_schema"],
-                                "average_delivery_time": metrics["average_delivery_time"],
-                                "average_delivery_time_status": metrics["average_delivery_time_status"],
-                                "impact_share": metrics["exact_impact_share"],
-                                "attention_level": metrics["attention_level"],
-                                "recommended_supply": metrics["recommended_supply"],
-                                "recommended_supply_FBO": metrics["recommended_supply"]
-                            }
-                        )
-                        
-                        # Если запись уже существовала, обновляем только FBO поле
-                        if not created:
-                            analytics_obj.recommended_supply_FBO = metrics["recommended_supply"]
-                            analytics_obj.save(update_fields=['recommended_supply_FBO'])
-
-                        all_skus_seen.add((store.id, cluster_id, item["sku"]))
+        try:
+            result = sync_cluster_item_analytics(store)
+            logger.info(
+                f"[🗺️] Аналитика по кластерам {store}: записано {result.written}, без изменений {result.unchanged}, "
+                f"удалено {result.deleted}, не загружены кластеры {result.failed_clusters or '-'}"
+            )
+        except Exception as e:
+            logger.error(f"[{store}] Ошибка при обновлении аналитики по кластерам: {e}")
 
-                    if len(data) < limit:
-                        break
-                    offset += limit
-                except Exception as e:
-                    print(f"[{store}] Ошибка при получении деталей FBO по кластеру {cluster_id}: {e}")
-                    break
 
-        # Обновляем recommended_supply максимальным значением между FBO и FBS
-        print(f"Обновление recommended_supply для магазина {store}")
-        analytics_records = DeliveryClusterItemAnalytics.objects.filter(store=store)
-        
-        for record in analytics_records:
-            fbo_supply = record.recommended_supply_FBO if record.recommended_supply_FBO is not None else 0
-            fbs_supply = record.recommended_supply_FBS if record.recommended_supply_FBS is not None else 0
-            max_supply = max(fbo_supply, fbs_supply)
-            
-            if record.recommended_supply != max_supply:
-                record.recommended_supply = max_supply
-                record.save(update_fields=['recommended_supply'])
+@shared_task(name="Обновление аналитики доставки по кластерам")
+def refresh_delivery_analytics():
+    """Кластеры и детализация по товарам подряд — входные данные планнера в течение дня."""
+    update_delivery_clusters()
+    update_cluster_item_analytics()
 
-        # Удаляем неактуальные записи
-        to_keep = reduce(or_, [models.Q(cluster_id=cid, sku=sku) for (_, cid, sku) in all_skus_seen], models.Q(pk=None))
 
-        DeliveryClusterItemAnalytics.objects.filter(store=store).exclude(to_keep).delete()
-        
-        
 @shared_task(name="При создании нового магазина запускается этот таск")
 def sync_full_store_data(store_id):
     try:
@@ -864,7 +669,7 @@ def sync_full_store_data(store_id):
 # АНАЛИТИКА: /v1/analytics/data
 # =========================
 
-ANALYTICS_DATA_URL = "https://api-seller.ozon.ru/v1/analytics/data"
+ANALYTICS_DATA_URL = f"{SELLER_API_URL}/v1/analytics/data"
 
 def _ozon_headers(store: OzonStore) -> dict:
     return {
@@ -1043,17 +848,21 @@ def sync_product_daily_analytics():
 # =========================
 
 
-def _update_campaign_from_ozon_response(ad_plan_item: AdPlanItem, api_response: dict):
+def _update_campaign_from_ozon_response(ad_plan_item: AdPlanItem, api_response: dict, save: bool = True):
     """
     Обновляет данные кампании AdPlanItem из ответа Ozon Performance API.
     
     Args:
         ad_plan_item: Экземпляр AdPlanItem для обновления
         api_response: Ответ от API активации кампании
+        save: Сохранить сразу; False — только заполнить поля (для bulk_update)
+
+    Returns:
+        list[str]: Измененные поля
     """
     if not api_response or not isinstance(api_response, dict):
         logger.warning(f"[⚠️] Пустой или некорректный ответ API для кампании {ad_plan_item.ozon_campaign_id}")
-        return
+        return []
     
     update_fields = []
     
@@ -1136,11 +945,12 @@ def _update_campaign_from_ozon_response(ad_plan_item: AdPlanItem, api_response:
             logger.warning(f"[⚠️] Некорректная дата обновления: {api_response['updatedAt']}")
     
     # Сохраняем изменения
-    if update_fields:
+    if update_fields and save:
         ad_plan_item.save(update_fields=update_fields)
         logger.info(f"[💾] Обновлены поля кампании {ad_plan_item.ozon_campaign_id}: {', '.join(update_fields)}")
-    else:
+    elif not update_fields:
         logger.debug(f"[ℹ️] Нет данных для обновления кампании {ad_plan_item.ozon_campaign_id}")
+    return update_fields
 
 def fetch_campaigns_from_ozon(store: OzonStore) -> list:
     """
@@ -1156,7 +966,7 @@ def fetch_campaigns_from_ozon(store: OzonStore) -> list:
             logger.error(f"[❌] Не удалось получить access_token для магазина {store}")
             return []
         
-        url = "https://api-performance.ozon.ru:443/api/client/campaign"
+        url = f"{PERFORMANCE_API_URL}/api/client/campaign"
         headers = {
             "Authorization": f"Bearer {access_token}",
             "Content-Type": "application/json",
@@ -1204,7 +1014,7 @@ def fetch_campaign_objects_from_ozon(store: OzonStore, campaign_id: str) -> list
             logger.error(f"[❌] Не удалось получить access_token для магазина {store}")
             return []
         
-        url = f"https://api-performance.ozon.ru:443/api/client/campaign/{campaign_id}/objects"
+        url = f"{PERFORMANCE_API_URL}/api/client/campaign/{campaign_id}/objects"
         headers = {
             "Authorization": f"Bearer {access_token}",
             "Content-Type": "application/json",
@@ -1342,12 +1152,7 @@ def update_abc_sheet(spreadsheet_url: str = None, sa_json_path: str = None, cons
     store_name_value = (_get('V23') or '').strip()
     store = None
     if store_name_value:
-        store = (
-            OzonStore.objects.filter(name__iexact=store_name_value).first()
-            or OzonStore.objects.filter(client_id__iexact=store_name_value).first()
-            or OzonStore.objects.filter(name__icontains=store_name_value).first()
-            or OzonStore.objects.filter(client_id__icontains=store_name_value).first()
-        )
+        store = resolve_store(store_name_value)
     # Сохраняем текущие значения ручных бюджетов (колонка K) по SKU
     def _extract_sku(value) -> int | None:
         if value is None:
@@ -1421,21 +1226,6 @@ def update_abc_sheet(spreadsheet_url: str = None, sa_json_path: str = None, cons
     logger.info(f"min_fbs_stock = {min_fbs_stock} min_fbo_stock = {min_fbo_stock}")
     logger.info(f"ABC проценты: A={a_share*100}%, B={b_share*100}%, C={c_share*100}%")
 
-    # Готовим словари остатков по SKU для фильтрации
-    fbs_by_sku = {
-        row['sku']: row['total'] or 0
-        for row in FbsStock.objects.filter(store=store)
-            .values('sku')
-            .annotate(total=Sum('present'))
-    }
-    fbo_by_sku = {
-        row['sku']: row['total'] or 0
-        for row in WarehouseStock.objects.filter(store=store)
-            .values('sku')
-            .annotate(total=Sum('available_stock_count'))
-    }
-    logger.info(f"[ℹ️] Загружены остатки: FBS для {len(fbs_by_sku)} SKU, FBO для {len(fbo_by_sku)} SKU")
-
     # Больше не используем AdPlanRequest - работаем только с AdPlanItem
     logger.info(f"[ℹ️] Работаем напрямую с AdPlanItem для магазина {store}")
 
@@ -1444,24 +1234,17 @@ def update_abc_sheet(spreadsheet_url: str = None, sa_json_path: str = None, cons
     date_to = today - timedelta(days=1)
     date_from = date_to - timedelta(days=days - 1)
     logger.info(f"date_from = {date_from} date_to = {date_to}")
-    # Агрегация и сортировка на стороне БД
-    base_qs = ProductDailyAnalytics.objects.filter(store=store, date__gte=date_from, date__lte=date_to)
-    total_revenue_val = base_qs.aggregate(t=Sum('revenue'))['t'] or 0
-    #Сумарная выручка
-    total_revenue = Decimal(str(total_revenue_val))
-
-    # Агрегаты + вычисление кумулятивной суммы по выручке в БД
-    agg_qs = (
-        base_qs.values('offer_id', 'name', 'sku')
-        .annotate(revenue_sum=Sum('revenue'), units_sum=Sum('ordered_units'))
-        .filter(revenue_sum__gt=0)
-        .order_by('-revenue_sum')
+    # Ранжирование, кумулятивная доля, ABC, остатки и кампании по SKU — одним запросом в БД
+    abc = abc_classify(
+        store, date_from, date_to, (a_share, b_share, c_share),
+        min_fbs_stock=min_fbs_stock, min_fbo_stock=min_fbo_stock,
     )
-    t_qs = time.perf_counter(); logger.info(f"[⏱] ORM агрегация+сортировка: {t_qs - t_params:.3f}s (rows={agg_qs.count()})")
-    
-    # Получаем данные о рекламных кампаниях для добавления в ABC
+    #Сумарная выручка
+    total_revenue = abc.total_revenue
+    t_qs = time.perf_counter(); logger.info(f"[⏱] ABC в БД (abc_classify): {t_qs - t_params:.3f}s (rows={len(abc.rows)})")
+
     from .models import ManualCampaign
-    
+
     # Функция для перевода статусов на русский язык
     def _translate_campaign_status(status, is_manual=True):
         """Переводит статус кампании на русский язык"""
@@ -1504,169 +1287,79 @@ def update_abc_sheet(spreadsheet_url: str = None, sa_json_path: str = None, cons
             }
         
         return status_translations.get(status, status)
-    
-    # Получаем все SKU из результатов для поиска кампаний
-    all_skus = [v['sku'] for v in agg_qs if v['sku']]
-    logger.info(f"[ℹ️] Обрабатываем {len(all_skus)} уникальных SKU для поиска кампаний")
-    
-    # Получаем ручные кампании по SKU
+
+    # Остатки, прохождение порогов V26/V27 и кампании по SKU — из строк abc_classify
+    fbs_by_sku: dict[int, int] = {}
+    fbo_by_sku: dict[int, int] = {}
+    stock_ok_by_sku: dict[int, bool] = {}
     manual_campaigns_dict: dict[int, list[dict]] = defaultdict(list)
-    manual_campaign_entries_total = 0
-    if all_skus:
-        # Учитываем только запущенные и остановленные кампании
-        active_states = [
-            'CAMPAIGN_STATE_RUNNING',
-            'CAMPAIGN_STATE_STOPPED'
-        ]
-        logger.info(f"[ℹ️] Ищем кампании только со статусами: {active_states}")
-        
-        # Получаем кампании по основному SKU
-        manual_campaigns_by_sku = ManualCampaign.objects.filter(
-            store=store, 
-            sku__in=all_skus,
-            state__in=active_states
-        ).select_related('store')
-        
-        # Получаем кампании, где SKU есть в sku_list
-        manual_campaigns_by_sku_list = ManualCampaign.objects.filter(
-            store=store,
-            sku_list__overlap=all_skus,
-            state__in=active_states
-        ).select_related('store')
-        
-        # Объединяем результаты
-        manual_campaigns = list(manual_campaigns_by_sku) + list(manual_campaigns_by_sku_list)
-        # Убираем дубликаты по ID кампании
-        seen_ids = set()
-        unique_campaigns = []
-        for campaign in manual_campaigns:
-            if campaign.id not in seen_ids:
-                seen_ids.add(campaign.id)
-                unique_campaigns.append(campaign)
-        manual_campaigns = unique_campaigns
-        
-        for campaign in manual_campaigns:
-            campaign_sku_count = 0
-            # Добавляем основной SKU
-            if campaign.sku:
-                manual_campaigns_dict[campaign.sku].append({
+    auto_campaigns_dict = {}
+    sku_to_name_dict = {}
+    rows = []
+    for abc_row in abc.rows:
+        sku = abc_row.sku
+        fbs_by_sku[sku] = abc_row.fbs_stock
+        fbo_by_sku[sku] = abc_row.fbo_stock
+        stock_ok_by_sku[sku] = stock_ok_by_sku.get(sku, True) and abc_row.stock_ok
+        # Сохраняем соответствие SKU -> название товара
+        sku_to_name_dict[sku] = abc_row.offer_id or abc_row.name
+
+        if sku and abc_row.manual_campaigns and sku not in manual_campaigns_dict:
+            for campaign in abc_row.manual_campaigns:
+                manual_campaigns_dict[sku].append({
                     'name': campaign.name,
                     'type': 'Ручное',  # Ручная
                     'ozon_updated_at': campaign.ozon_updated_at,
                     'status': _translate_campaign_status(campaign.state, is_manual=True),
-                    'ozon_campaign_id': campaign.ozon_campaign_id or '',
-                    'store_id': campaign.store_id,
+                    'ozon_campaign_id': campaign.ozon_campaign_id,
+                    'store_id': store.id,
                 })
-                manual_campaign_entries_total += 1
-                campaign_sku_count += 1
-            
-            # Добавляем все SKU из sku_list
-            if campaign.sku_list and isinstance(campaign.sku_list, list):
-                for sku_item in campaign.sku_list:
-                    if sku_item:
-                        manual_campaigns_dict[sku_item].append({
-                            'name': campaign.name,
-                            'type': 'Ручное',  # Ручная
-                            'ozon_updated_at': campaign.ozon_updated_at,
-                            'status': _translate_campaign_status(campaign.state, is_manual=True),
-                            'ozon_campaign_id': campaign.ozon_campaign_id or '',
-                            'store_id': campaign.store_id,
-                        })
-                        manual_campaign_entries_total += 1
-                        campaign_sku_count += 1
-            
-            # Логируем информацию о кампании
-            campaign_sku_count = 1 if campaign.sku else 0
-            if campaign.sku_list and isinstance(campaign.sku_list, list):
-                campaign_sku_count += len([sku for sku in campaign.sku_list if sku])
-            logger.info(f"[ℹ️] Кампания {campaign.name} (ID: {campaign.ozon_campaign_id}) содержит {campaign_sku_count} SKU")
-    
-    # Логируем количество найденных ручных кампаний
-    logger.info(f"[ℹ️] Найдено {manual_campaign_entries_total} ручных кампаний по SKU для магазина {store} (уникальных SKU: {len(manual_campaigns_dict)})")
-    if manual_campaigns_dict:
-        logger.info(f"[ℹ️] SKU с ручными кампаниями: {list(manual_campaigns_dict.keys())[:10]}{'...' if len(manual_campaigns_dict) > 10 else ''}")
-
-    def _get_first_manual_campaign(sku):
-        entries = manual_campaigns_dict.get(sku)
-        return entries[0] if entries else {}
-    
-    # Получаем автоматические кампании по SKU (если ручных нет)
-    auto_campaigns_dict = {}
-    if all_skus:
-        auto_campaigns = AdPlanItem.objects.filter(
-            store=store,
-            sku__in=all_skus
-        ).exclude(
-            sku__in=manual_campaigns_dict.keys()  # Исключаем SKU, для которых уже есть ручные кампании
-        ).select_related('store')
-        
-        for campaign in auto_campaigns:
-            if campaign.sku and campaign.sku not in auto_campaigns_dict:
-                # Получаем реальный статус автоматической кампании из базы данных
-                auto_status = campaign.state if campaign.state else 'CAMPAIGN_STATE_UNKNOWN'
-                
-                auto_campaigns_dict[campaign.sku] = {
-                    # Предпочитаем явное название кампании из модели
-                    'name': (campaign.campaign_name or campaign.name or campaign.offer_id),
-                    'type': 'Авто',  # Автоматическая
-                    'ozon_updated_at': None,  # У автоматических кампаний нет ozon_updated_at
-                    'status': _translate_campaign_status(auto_status, is_manual=False),
-                    'ozon_campaign_id': campaign.ozon_campaign_id or '',
-                    'is_active_in_sheet': 1 if campaign.is_active_in_sheets else 0,
-                }
-    
-    # Логируем количество найденных автоматических кампаний
-    logger.info(f"[ℹ️] Найдено {len(auto_campaigns_dict)} SKU с автоматическими кампаниями для магазина {store}")
+        elif sku and abc_row.auto_campaign and not abc_row.manual_campaigns and sku not in auto_campaigns_dict:
+            campaign = abc_row.auto_campaign
+            auto_campaigns_dict[sku] = {
+                'name': campaign.name,
+                'type': 'Авто',  # Автоматическая
+                'ozon_updated_at': None,  # У автоматических кампаний нет ozon_updated_at
+                'status': _translate_campaign_status(campaign.state, is_manual=False),
+                'ozon_campaign_id': campaign.ozon_campaign_id,
+                'is_active_in_sheet': 1 if campaign.is_active_in_sheets else 0,
+            }
 
-    rows = []
-    # Создаем словарь для быстрого поиска названий товаров по SKU
-    sku_to_name_dict = {}
-    for v in agg_qs:
-        revenue = Decimal(str(v['revenue_sum'] or 0))
-        units = int(v['units_sum'] or 0)
-        avg_price = (revenue / units) if units else Decimal('0')
-        avg_price = avg_price.quantize(Decimal('0.1'), rounding=ROUND_HALF_UP)
-        
-        # Сохраняем соответствие SKU -> название товара
-        sku_to_name_dict[v['sku']] = v['offer_id'] or v['name']
-        
-        # Получаем информацию о кампании для текущего SKU
-        sku = v['sku']
+        # Кампания для строки ABC: ручная в приоритете, иначе автоматическая
         campaign_name = ''
         management_type = ''
         last_update_date = ''
         campaign_status = ''
-        
-        if sku:
-            # Проверяем сначала ручные кампании (приоритет)
-            if sku in manual_campaigns_dict:
-                campaign_info = _get_first_manual_campaign(sku)
-                campaign_name = campaign_info['name']
-                management_type = campaign_info['type']
-                campaign_status = campaign_info['status']
-                if campaign_info['ozon_updated_at']:
-                    last_update_date = campaign_info['ozon_updated_at'].strftime('%d-%m-%Y')
-            # Если ручных нет, проверяем автоматические
-            elif sku in auto_campaigns_dict:
-                campaign_info = auto_campaigns_dict[sku]
-                campaign_name = campaign_info['name']
-                management_type = campaign_info['type']
-                campaign_status = campaign_info['status']
-                # У автоматических кампаний нет даты обновления из Ozon
-        
+        if sku in manual_campaigns_dict:
+            campaign_info = manual_campaigns_dict[sku][0]
+        else:
+            campaign_info = auto_campaigns_dict.get(sku) if sku else None
+        if campaign_info:
+            campaign_name = campaign_info['name']
+            management_type = campaign_info['type']
+            campaign_status = campaign_info['status']
+            if campaign_info['ozon_updated_at']:
+                last_update_date = campaign_info['ozon_updated_at'].strftime('%d-%m-%Y')
+
         # Формируем строку: [Артикул, SKU, Продажи руб., Продажи шт., Цена товара, ABC, Название РК, Тип управления, Дата обновления, Статус]
         rows.append([
-            v['offer_id'] or v['name'],  # A: Артикул
-            v['sku'],                    # B: SKU
-            float(revenue),              # C: Продажи, руб.
-            units,                       # D: Продажи, шт.
-            float(avg_price),            # E: Цена товара, руб.
-            '',                          # F: ABC (будет заполнено позже)
-            campaign_name,               # G: Название рекламной кампании
-            management_type,             # H: Тип управления (Р/А)
-            last_update_date,            # I: Дата последнего обновления в Ozon
-            campaign_status              # J: Статус кампании
+            abc_row.offer_id or abc_row.name,  # A: Артикул
+            sku,                               # B: SKU
+            float(abc_row.revenue),            # C: Продажи, руб.
+            abc_row.units,                     # D: Продажи, шт.
+            float(abc_row.avg_price),          # E: Цена товара, руб.
+            abc_row.abc,                       # F: ABC (посчитан в БД)
+            campaign_name,                     # G: Название рекламной кампании
+            management_type,                   # H: Тип управления (Р/А)
+            last_update_date,                  # I: Дата последнего обновления в Ozon
+            campaign_status                    # J: Статус кампании
         ])
+
+    def _get_first_manual_campaign(sku):
+        entries = manual_campaigns_dict.get(sku)
+        return entries[0] if entries else {}
+
+    logger.info(f"[ℹ️] Найдено ручных кампаний по SKU: {len(manual_campaigns_dict)}, автоматических: {len(auto_campaigns_dict)}")
     t_agg = time.perf_counter(); logger.info(f"[⏱] Подготовка строк из результатов БД: {t_agg - t_qs:.3f}s (rows={len(rows)})")
 
     # Больше не создаем AdPlanRequest - работаем только с AdPlanItem
@@ -1806,8 +1499,7 @@ def update_abc_sheet(spreadsheet_url: str = None, sa_json_path: str = None, cons
     # Сортировка уже выполнена в БД
     t_sort = t_after_main; logger.info(f"[⏱] Сортировка: {t_sort - t_after_main:.3f}s")
 
-    # ABC по выручке: кумулятив по float с тонким логированием суб-этапов
-    _abc_t0 = time.perf_counter()
+    # ABC-метки уже посчитаны в БД (abc_classify): кумулятивная выручка против долей A и A+B
     total_revenue_float = float(total_revenue)
     a_cap = total_revenue_float * float(a_share)
     ab_cap = a_cap + total_revenue_float * float(b_share)
@@ -1815,27 +1507,6 @@ def update_abc_sheet(spreadsheet_url: str = None, sa_json_path: str = None, cons
     logger.info(f"Целевая сумма A: {a_cap}")
     logger.info(f"Целевая сумма B: {ab_cap - a_cap}")
     logger.info(f"Целевая сумма C: {total_revenue_float - ab_cap}")
-    _abc_t1 = time.perf_counter()
-
-    # Быстрый префикс-суммы
-    revs = [float(r[2]) for r in rows]
-    _abc_t2 = time.perf_counter()
-    cum = 0.0
-    cum_sums = [0.0] * len(revs)
-    for i in range(len(revs)):
-        cum += revs[i]
-        cum_sums[i] = cum
-    _abc_t3 = time.perf_counter()
-    labels = ['C'] * len(rows)
-    for i, cs in enumerate(cum_sums):
-        if cs <= a_cap:
-            labels[i] = 'A'
-        elif cs <= ab_cap:
-            labels[i] = 'B'
-    for i in range(len(rows)):
-        rows[i][5] = labels[i]  # Устанавливаем ABC метку в позицию F (индекс 5)
-    _abc_t4 = time.perf_counter()
-    logger.info(f"[⏱] ABC substeps: caps={_abc_t1-_abc_t0:.3f}s, revs={_abc_t2-_abc_t1:.3f}s, cum={_abc_t3-_abc_t2:.3f}s, label={_abc_t4-_abc_t3:.3f}s")
 
     t_abc = time.perf_counter(); logger.info(f"[⏱] Расчёт ABC и присвоение категорий: {t_abc - t_sort:.3f}s")
 
@@ -1958,20 +1629,13 @@ def update_abc_sheet(spreadsheet_url: str = None, sa_json_path: str = None, cons
             if price_max and price_max > 0 and avg_price_val > price_max:
                 continue
             
-            # Проверяем остатки FBS и FBO, если настройки заданы
-            if min_fbs_stock > 0 or min_fbo_stock > 0:
-                fbs_stock = fbs_by_sku.get(sku, 0)
-                fbo_stock = fbo_by_sku.get(sku, 0)
-                logger.info(f"[ℹ️] SKU {sku} проверяем остатки FBS = {fbs_stock} FBO = {fbo_stock}")
-                # Если остатки отсутствуют, пропускаем товар
-                
-                if min_fbs_stock > 0 and fbs_stock < min_fbs_stock:
-                    logger.info(f"[🚫] SKU {sku} исключен: остаток FBS {fbs_stock} < минимального {min_fbs_stock}")
-                    continue
-                    
-                if min_fbo_stock > 0 and fbo_stock < min_fbo_stock:
-                    logger.info(f"[🚫] SKU {sku} исключен: остаток FBO {fbo_stock} < минимального {min_fbo_stock}")
-                    continue            
+            # Пороги остатков FBS и FBO проверены в БД (stock_ok)
+            if not stock_ok_by_sku.get(sku, True):
+                logger.info(
+                    f"[🚫] SKU {sku} исключен по остаткам: FBS {fbs_by_sku.get(sku, 0)} (min {min_fbs_stock}), "
+                    f"FBO {fbo_by_sku.get(sku, 0)} (min {min_fbo_stock})"
+                )
+                continue
             # T24: Добавлять товар, если уже есть РК (0 - не добавлять, 1 - добавлять)
             if add_existing_campaigns == 0:
                 # Проверяем, есть ли уже кампания для этого SKU
@@ -2063,19 +1727,12 @@ def update_abc_sheet(spreadsheet_url: str = None, sa_json_path: str = None, cons
             if candidate:
                 # проверяем фильтр по остаткам, чтобы не нарушать логику FBS/FBO
                 sku_candidate = candidate[1]
-                if min_fbs_stock > 0 or min_fbo_stock > 0:
-                    fbs_candidate = fbs_by_sku.get(sku_candidate, 0)
-                    fbo_candidate = fbo_by_sku.get(sku_candidate, 0)
-                    if min_fbs_stock > 0 and fbs_candidate < min_fbs_stock:
-                        logger.info(
-                            f"[⚠️] Обязательный offer_id '{offer_id}' пропущен: FBS остаток {fbs_candidate} < {min_fbs_stock}"
-                        )
-                        continue
-                    if min_fbo_stock > 0 and fbo_candidate < min_fbo_stock:
-                        logger.info(
-                            f"[⚠️] Обязательный offer_id '{offer_id}' пропущен: FBO остаток {fbo_candidate} < {min_fbo_stock}"
-                        )
-                        continue
+                if not stock_ok_by_sku.get(sku_candidate, True):
+                    logger.info(
+                        f"[⚠️] Обязательный offer_id '{offer_id}' пропущен: остатки FBS {fbs_by_sku.get(sku_candidate, 0)}, "
+                        f"FBO {fbo_by_sku.get(sku_candidate, 0)} ниже порогов {min_fbs_stock}/{min_fbo_stock}"
+                    )
+                    continue
                 selected.append(candidate)
                 selected_offer_ids.add(offer_id)
                 mandatory_added += 1
@@ -2430,7 +2087,13 @@ def update_abc_sheet(spreadsheet_url: str = None, sa_json_path: str = None, cons
             
             # Заполняем столбцы F-G (артикул и SKU), H (остаток FBS), I (остаток FBO) и J-L (бюджеты)
             cols_FG = [[row[0], row[1]] for row in out_rows]
-            # Остатки по порядку items_to_save
+            # Остатки по порядку items_to_save; SKU ручных кампаний вне ABC дочитываем отдельно
+            missing_skus = {int(sku_i) for (sku_i, _offer, _w, _d, _meta) in items_to_save} - fbs_by_sku.keys()
+            if missing_skus:
+                for row in FbsStock.objects.filter(store=store, sku__in=missing_skus).values('sku').annotate(total=Sum('present')):
+                    fbs_by_sku[row['sku']] = row['total'] or 0
+                for row in WarehouseStock.objects.filter(store=store, sku__in=missing_skus).values('sku').annotate(total=Sum('available_stock_count')):
+                    fbo_by_sku[row['sku']] = row['total'] or 0
             fbs_col_H = [[int(fbs_by_sku.get(int(sku_i), 0))] for (sku_i, _offer, _w, _d, _meta) in items_to_save]
             fbo_col_I = [[int(fbo_by_sku.get(int(sku_i), 0))] for (sku_i, _offer, _w, _d, _meta) in items_to_save]
             cols_JKL = [[row[2], row[3], row[4]] for row in out_rows]
@@ -2632,12 +2295,7 @@ def rebalance_auto_weekly_budgets(
             logger.error("[❌] Ячейка V23 пустая — магазин не указан")
             return {"error": "store not set"}
 
-        store = (
-            OzonStore.objects.filter(name__iexact=store_name).first()
-            or OzonStore.objects.filter(client_id__iexact=store_name).first()
-            or OzonStore.objects.filter(name__icontains=store_name).first()
-            or OzonStore.objects.filter(client_id__icontains=store_name).first()
-        )
+        store = resolve_store(store_name)
         if not store:
             logger.error(f"[❌] Магазин '{store_name}' не найден")
             return {"error": f"store '{store_name}' not found"}
@@ -3445,7 +3103,7 @@ def sync_manual_campaigns(store_id: int = None):
 # Данная функция считывает данные с гугл таблицы и на основе этих данных создает и обновялет 
 # автоматические рекламные компании
 # Не зависит от флага включена или выключена компнаия
-# @shared_task(name="Чтение данных из Google Sheets и создание рекламной компании")
+@shared_task(name="Чтение данных из Google Sheets и создание рекламной компании")
 def create_or_update_AD(spreadsheet_url: str = None, sa_json_path: str = None, worksheet_name: str = "Main_ADV", start_row: int = 13, block_size: int = 100):
     """
     Читает данные из Google Sheets до тех пор, пока не встретит 5 пустых строк подряд.
@@ -3466,19 +3124,11 @@ def create_or_update_AD(spreadsheet_url: str = None, sa_json_path: str = None, w
     
     logger.info(f"[📖] Начинаем чтение данных из Google Sheets: {worksheet_name}, строка {start_row}")
     
+    ws = None
     try:
-        # Авторизация в Google Sheets
-        scopes = [
-            'https://www.googleapis.com/auth/spreadsheets',
-            'https://www.googleapis.com/auth/drive'
-        ]
-        creds = Credentials.from_service_account_file(sa_json_path, scopes=scopes)
-        gc = gspread.authorize(creds)
+        # Открываем лист одним чтением; дальше блоки читаются из снимка, записи уходят одним диффом
         t0 = time.perf_counter()
-        
-        # Открываем таблицу и лист
-        sh = gc.open_by_url(spreadsheet_url)
-        ws = sh.worksheet(worksheet_name)
+        ws = open_sheet_snapshot(spreadsheet_url, worksheet_name, sa_json_path)
 
         t_open = time.perf_counter()
         logger.info(f"[⏱] Открытие таблицы: {t_open - t0:.3f}s")
@@ -3744,6 +3394,12 @@ def create_or_update_AD(spreadsheet_url: str = None, sa_json_path: str = None, w
                                 logger.debug(f"[📝] Проставлен тип кампании 'Авто' в E{row_number}")
                             except Exception as e_type:
                                 logger.warning(f"[⚠️] Не удалось проставить тип 'Авто' в E{row_number}: {e_type}")
+
+                            # ID созданной кампании пишем в лист сразу, не дожидаясь конца прогона:
+                            # без него следующий запуск создаст по этой строке ещё одну кампанию
+                            ws.flush(force=True)
+                            if ws.pending_cells:
+                                logger.error(f"[❌] ID кампании {campaign_id} не записан в {cell_a}, повторим в конце прогона")
                             
                             # Создаем запись в AdPlanItem для отслеживания этой кампании
                             try:
@@ -3970,19 +3626,32 @@ def create_or_update_AD(spreadsheet_url: str = None, sa_json_path: str = None, w
                 AdPlanItem.CAMPAIGN_STATE_PLANNED,
             ]
             # Берём все авто-кампании магазина с ID
-            stale_ads = AdPlanItem.objects.filter(store=store).exclude(ozon_campaign_id='')
-            for ad in stale_ads:
-                cid = str(ad.ozon_campaign_id)
-                if cid not in present_auto_ids:
-                    try:
-                        # Деактивируем через Performance API
-                        deact_resp = deactivate_campaign(access_token=access_token, campaign_id=cid)
-                        _update_campaign_from_ozon_response(ad, deact_resp)
-                        ad.save(update_fields=['state', 'payment_type', 'total_budget', 'week_budget', 'day_budget', 'from_date', 'to_date', 'placement', 'product_autopilot_strategy', 'ozon_created_at', 'ozon_updated_at'])
-                        stopped_count += 1
-                        logger.info(f"[🛑] Отключили кампанию {cid}, отсутствует в листе")
-                    except Exception as e:
-                        logger.error(f"[❌] Ошибка деактивации кампании {cid}: {e}")
+            stale_ads = {
+                str(ad.ozon_campaign_id): ad
+                for ad in AdPlanItem.objects.filter(store=store).exclude(ozon_campaign_id='')
+                if str(ad.ozon_campaign_id) not in present_auto_ids
+            }
+            # Деактивируем через Performance API параллельно, состояние в БД сохраняем одним bulk_update
+            results = run_campaign_operations(
+                access_token,
+                [(cid, "deactivate", None) for cid in stale_ads],
+                rate_key=performance_rate_key(store),
+                attempts=1,
+            )
+            stopped_ads = []
+            changed_fields = set()
+            for result in results:
+                cid = result["campaign_id"]
+                if not result["ok"]:
+                    logger.error(f"[❌] Ошибка деактивации кампании {cid}: {result['error']}")
+                    continue
+                ad = stale_ads[cid]
+                changed_fields.update(_update_campaign_from_ozon_response(ad, result["response"], save=False))
+                stopped_ads.append(ad)
+                logger.info(f"[🛑] Отключили кампанию {cid}, отсутствует в листе")
+            if stopped_ads and changed_fields:
+                AdPlanItem.objects.bulk_update(stopped_ads, sorted(changed_fields), batch_size=500)
+            stopped_count = len(stopped_ads)
             if stopped_count:
                 logger.info(f"[📉] Остановлено кампаний, отсутствующих в листе: {stopped_count}")
         except Exception as e:
@@ -3994,6 +3663,11 @@ def create_or_update_AD(spreadsheet_url: str = None, sa_json_path: str = None, w
     except Exception as e:
         logger.error(f"[❌] Ошибка при чтении данных из Google Sheets: {e}")
         return []
+    finally:
+        if ws is not None:
+            ws.flush()
+            if ws.pending_cells:
+                logger.error(f"[❌] Изменения листа {worksheet_name} не записаны: ячеек {ws.pending_cells}")
 
 # =============================
 # sync_campaign_activity_with_sheets
@@ -4083,20 +3757,16 @@ def sync_campaign_activity_with_sheets(
             logger.warning(f"[⚠️] У магазина {store_hint} отсутствует google_sheet_url")
             return {"skipped": True, "reason": "no google_sheet_url", "store_id": store_hint.id}
     else:
-        store_hint = OzonStore.objects.filter(google_sheet_url=spreadsheet_url).first()
+        store_hint = store_by_sheet_url(spreadsheet_url)
 
     if not spreadsheet_url:
         logger.error("[❌] Не указан spreadsheet_url для синхронизации")
         return {"error": "spreadsheet_url not provided"}
 
+    ws = None
     try:
-        scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-        creds = Credentials.from_service_account_file(sa_json_path, scopes=scope)
-        client = gspread.authorize(creds)
-        
-        # Открываем таблицу и лист
-        spreadsheet = client.open_by_url(spreadsheet_url)
-        ws = spreadsheet.worksheet(worksheet_name)
+        # Снимок листа: одно чтение, записи уходят одним диффом в конце
+        ws = open_sheet_snapshot(spreadsheet_url, worksheet_name, sa_json_path)
         
         # Получаем название магазина из ячейки V23
         try:
@@ -4105,12 +3775,9 @@ def sync_campaign_activity_with_sheets(
                 logger.error(f"[❌] Ячейка V23 пустая - не указан магазин")
                 return {"error": "Не указан магазин в V23"}
             
-            store = store_hint or OzonStore.objects.filter(google_sheet_url=spreadsheet_url).first()
+            store = store_hint or store_by_sheet_url(spreadsheet_url)
             if not store:
-                store = (
-                    OzonStore.objects.filter(name__iexact=store_name.strip()).first()
-                    or OzonStore.objects.filter(client_id__iexact=store_name.strip()).first()
-                )
+                store = resolve_store(store_name, fuzzy=False)
             if not store:
                 logger.error(f"[❌] Магазин '{store_name}' не найден в базе данных")
                 return {"error": f"Магазин '{store_name}' не найден"}
@@ -4665,7 +4332,7 @@ def sync_campaign_activity_with_sheets(
         
         # Пытаемся записать дату ошибки в K4, если есть доступ к Google Sheets
         try:
-            if 'ws' in locals():
+            if ws is not None:
                 now = datetime.now()
                 formatted_datetime = now.strftime("%d-%m-%Y %H:%M")
                 ws.update('K4', [[f"ОШИБКА {formatted_datetime}"]])
@@ -4674,6 +4341,9 @@ def sync_campaign_activity_with_sheets(
             logger.warning(f"[⚠️] Не удалось записать дату ошибки в K4: {date_error}")
         
         return {"error": str(e)}
+    finally:
+        if ws is not None:
+            ws.flush()
     
     
 
@@ -4768,12 +4438,6 @@ def toggle_store_ads_status(
         # Логика: если выключили систему — деактивируем ВСЕ АВТОкампании в Ozon и фиксируем состояние в БД
         if not desired and previous != desired:
             try:
-                from .utils import get_store_performance_token
-                token_info = get_store_performance_token(store)
-                access_token = token_info.get("access_token")
-                if not access_token:
-                    raise Exception("Не удалось получить access_token для магазина")
-
                 # Собираем только автоматические кампании (AdPlanItem) по магазину
                 from .models import AdPlanItem
                 campaign_ids = set(
@@ -4783,27 +4447,18 @@ def toggle_store_ads_status(
                     .values_list('ozon_campaign_id', flat=True)
                 )
 
-                # Деактивируем авто-кампании через Performance API (с ретраями)
-                deactivated = 0
-                failed_ids = []
-                for cid in campaign_ids:
-                    ok = False
-                    for attempt in range(3):
-                        try:
-                            deactivate_campaign(access_token=access_token, campaign_id=str(cid))
-                            # Обновляем модель: помечаем как остановлена и выключена в Sheets
-                            from .models import AdPlanItem as _Ad
-                            _Ad.objects.filter(store=store, ozon_campaign_id=str(cid)).update(
-                                state=_Ad.CAMPAIGN_STATE_INACTIVE,
-                            )
-                            deactivated += 1
-                            ok = True
-                            break
-                        except Exception as api_err:
-                            logger.warning(f"[⚠️] Деактивация {cid} (попытка {attempt+1}/3) не удалась: {api_err}")
-                            time.sleep(2)
-                    if not ok:
-                        failed_ids.append(str(cid))
+                # Деактивируем авто-кампании параллельно в пределах лимита Performance API (с ретраями)
+                results = run_campaign_operations_for_store(
+                    store, [(cid, "deactivate", None) for cid in campaign_ids]
+                )
+                deactivated_ids = [r["campaign_id"] for r in results if r["ok"]]
+                failed_ids = [r["campaign_id"] for r in results if not r["ok"]]
+                # Помечаем остановленные кампании одним запросом
+                if deactivated_ids:
+                    AdPlanItem.objects.filter(store=store, ozon_campaign_id__in=deactivated_ids).update(
+                        state=AdPlanItem.CAMPAIGN_STATE_INACTIVE,
+                    )
+                deactivated = len(deactivated_ids)
 
                 if failed_ids:
                     logger.error(f"[🔴] Выключение {store}: деактивировано={deactivated}, ошибок={len(failed_ids)}: {failed_ids}")
@@ -4812,10 +4467,12 @@ def toggle_store_ads_status(
             except Exception as off_err:
                 logger.error(f"[❌] Ошибка при массовой деактивации кампаний для {store}: {off_err}")
         elif desired and previous != desired:
-            # Если включили систему — полная актуализация из листа одним запуском
+            # Если включили систему — полная актуализация из листа одним запуском.
+            # Прогон по всему листу занимает минуты, поэтому уходит в очередь ads-sheets с её лимитами,
+            # а сама кнопка укладывается в лимиты interactive.
             try:
-                logger.info(f"[▶️] Система включена для {store}. Запускаем create_or_update_AD для актуализации кампаний")
-                create_or_update_AD(
+                logger.info(f"[▶️] Система включена для {store}. Ставим create_or_update_AD для актуализации кампаний")
+                create_or_update_AD.delay(
                     spreadsheet_url=spreadsheet_url,
                     sa_json_path=sa_json_path,
                     worksheet_name=worksheet_name,
@@ -4823,7 +4480,7 @@ def toggle_store_ads_status(
                     block_size=100,
                 )
             except Exception as on_err:
-                logger.error(f"[❌] Ошибка запуска create_or_update_AD для {store}: {on_err}")
+                logger.error(f"[❌] Не удалось поставить create_or_update_AD для {store}: {on_err}")
 
         # После переключения состояния — проставляем актуальные статусы кампаний в колонку C одним запросом
         try:
@@ -4971,7 +4628,7 @@ def fetch_performance_reports(max_reports: int = 50):
                 "Authorization": f"Bearer {access_token}",
                 "Accept": "application/json",
             }
-            url = f"https://api-performance.ozon.ru:443/api/client/statistics/report?UUID={obj.report_uuid}"
+            url = f"{PERFORMANCE_API_URL}/api/client/statistics/report?UUID={obj.report_uuid}"
             max_attempts = 30
             retry_delay_sec = 10
             report_ready = False
@@ -5036,49 +4693,10 @@ def fetch_performance_reports(max_reports: int = 50):
             data = resp.json() if resp.text else {}
             obj.raw_response = data
 
-            # Поддерживаем 2 формата: одиночный и множественный по кампаниям
-            top_level_report = data.get('report')
+            # Поддерживаем 2 формата: одиночный и множественный по кампаниям — разбор в parse_report_statistics
             report_date = timezone.localtime(obj.date_from).date() if obj.date_from else timezone.localdate()
-
-            if top_level_report:
-                # Считаем, что это одиночная кампания (или неизвестная) — используем parent.ozon_campaign_id
-                obj.rows = top_level_report.get('rows') if isinstance(top_level_report.get('rows'), list) else None
-                obj.totals = top_level_report.get('totals') if isinstance(top_level_report.get('totals'), dict) else None
-                # Создаём/обновляем entry для связанной кампании, если известно
-                camp_id = obj.ozon_campaign_id or ''
-                if camp_id:
-                    CampaignPerformanceReportEntry.objects.update_or_create(
-                        store=obj.store,
-                        ozon_campaign_id=str(camp_id),
-                        report_date=report_date,
-                        defaults={
-                            'report': obj,
-                            'rows': obj.rows,
-                            'totals': obj.totals,
-                        }
-                    )
-            else:
-                # Ожидаем словарь { "<campaignId>": { title, report: { rows, totals } }, ... }
-                obj.rows = None
-                obj.totals = None
-                for cid, payload in data.items():
-                    if not isinstance(payload, dict):
-                        continue
-                    rep = payload.get('report') or {}
-                    rows = rep.get('rows') if isinstance(rep.get('rows'), list) else None
-                    totals = rep.get('totals') if isinstance(rep.get('totals'), dict) else None
-                    if rows is None and totals is None:
-                        continue
-                    CampaignPerformanceReportEntry.objects.update_or_create(
-                        store=obj.store,
-                        ozon_campaign_id=str(cid),
-                        report_date=report_date,
-                        defaults={
-                            'report': obj,
-                            'rows': rows,
-                            'totals': totals,
-                        }
-                    )
+            obj.rows, obj.totals, records = parse_report_statistics(data, obj.ozon_campaign_id or '')
+            upsert_entries(obj.store, report_date, records, {record.campaign_id: obj.id for record in records})
 
             obj.status = CampaignPerformanceReport.STATUS_READY
             obj.ready_at = timezone.now()
@@ -5102,8 +4720,6 @@ def fetch_daily_campaign_statistics(date_str: str, store_id: int | None = None):
     и обновляет CampaignPerformanceReport/CampaignPerformanceReportEntry.
     """
     from .models import (
-        CampaignPerformanceReport,
-        CampaignPerformanceReportEntry,
         AdPlanItem,
         ManualCampaign,
     )
@@ -5124,7 +4740,7 @@ def fetch_daily_campaign_statistics(date_str: str, store_id: int | None = None):
         logger.info("[ℹ️] Нет магазинов с настройками Performance API для мгновенного отчёта")
         return {"processed": 0, "updated": 0, "errors": 0, "reason": "no stores"}
 
-    url_base = "https://api-performance.ozon.ru:443/api/client/statistics/daily/json"
+    url_base = f"{PERFORMANCE_API_URL}/api/client/statistics/daily/json"
     query = f"?dateFrom={target_date:%Y-%m-%d}&dateTo={target_date:%Y-%m-%d}"
 
     processed = 0
@@ -5176,8 +4792,8 @@ def fetch_daily_campaign_statistics(date_str: str, store_id: int | None = None):
                 continue
 
             payload = resp.json() if resp.text else {}
-            rows = payload.get('rows') if isinstance(payload.get('rows'), list) else []
-            if not rows:
+            records = parse_daily_statistics(payload)
+            if not records:
                 logger.info(
                     f"[ℹ️] Магазин {store}: в daily/json за {target_date:%Y-%m-%d} нет данных"
                 )
@@ -5187,88 +4803,22 @@ def fetch_daily_campaign_statistics(date_str: str, store_id: int | None = None):
             day_start = _make_aware(datetime.combine(target_date, datetime.min.time()))
             day_end = _make_aware(datetime.combine(target_date, datetime.max.time()))
 
-            store_updates = 0
-            manual_found = 0
-            auto_found = 0
-            unknown_found = 0
-            for row in rows:
-                if not isinstance(row, dict):
-                    continue
-                campaign_id = str(row.get('id') or '').strip()
-                if not campaign_id:
-                    continue
-
-                totals_payload = dict(row)
-                rows_payload = [dict(row)]
-
-                report_uuid = f"daily-{store.id}-{campaign_id}-{target_date:%Y%m%d}"
-                report_defaults = {
-                    'status': CampaignPerformanceReport.STATUS_READY,
-                    'ready_at': timezone.now(),
-                    'last_checked_at': timezone.now(),
-                    'error_message': '',
-                    'raw_response': {
-                        'source': 'daily_json',
-                        'rows': rows_payload,
-                    },
-                    'totals': totals_payload,
-                    'rows': rows_payload,
-                    'request_payload': {
-                        'dateFrom': f"{target_date:%Y-%m-%d}",
-                        'dateTo': f"{target_date:%Y-%m-%d}",
-                        'source': 'daily_json',
-                    },
-                }
-
-                report_obj, created_report = CampaignPerformanceReport.objects.get_or_create(
-                    store=store,
-                    ozon_campaign_id=campaign_id,
-                    date_from=day_start,
-                    date_to=day_end,
-                    defaults={
-                        'report_uuid': report_uuid,
-                        **report_defaults,
-                    }
-                )
-                if not created_report:
-                    update_fields = []
-                    for field, value in report_defaults.items():
-                        current = getattr(report_obj, field, None)
-                        if current != value:
-                            setattr(report_obj, field, value)
-                            update_fields.append(field)
-                    if not report_obj.report_uuid:
-                        report_obj.report_uuid = report_uuid
-                        update_fields.append('report_uuid')
-                    if update_fields:
-                        report_obj.save(update_fields=update_fields)
-
-                entry_defaults = {
-                    'report': report_obj,
-                    'rows': rows_payload,
-                    'totals': totals_payload,
-                }
-                entry_obj, _ = CampaignPerformanceReportEntry.objects.update_or_create(
-                    store=store,
-                    ozon_campaign_id=campaign_id,
-                    report_date=target_date,
-                    defaults=entry_defaults,
-                )
-
-                store_updates += 1
-                updated_entries += 1
+            # Отчёты и записи по всем кампаниям дня — пачкой, неизменившиеся не перезаписываются
+            with transaction.atomic():
+                report_ids = upsert_daily_reports(store, target_date, day_start, day_end, records)
+                changed = upsert_entries(store, target_date, records, report_ids)
 
-                if campaign_id in manual_ids:
-                    manual_found += 1
-                elif campaign_id in auto_ids:
-                    auto_found += 1
-                else:
-                    unknown_found += 1
+            store_updates = len(records)
+            updated_entries += store_updates
+            manual_found = sum(1 for record in records if record.campaign_id in manual_ids)
+            auto_found = sum(1 for record in records if record.campaign_id not in manual_ids and record.campaign_id in auto_ids)
+            unknown_found = store_updates - manual_found - auto_found
 
             results.append(
                 {
                     "store_id": store.id,
                     "updated": store_updates,
+                    "changed": changed,
                     "manual": manual_found,
                     "auto": auto_found,
                     "unknown": unknown_found,
@@ -5385,7 +4935,7 @@ def submit_campaign_reports_for_day(
             "Content-Type": "application/json",
             "Accept": "application/json",
         }
-        url = "https://api-performance.ozon.ru:443/api/client/statistics/json"
+        url = f"{PERFORMANCE_API_URL}/api/client/statistics/json"
 
         # Батчами по batch_size
         for i in range(0, len(all_ids), batch_size):
@@ -5493,15 +5043,138 @@ def submit_campaign_reports_for_day(
 #         retry_interval_sec=retry_interval_sec,
 #         campaign_kind="manual",
 #     )
+#-------------------------------------
+#--------Почасовые задачи по магазинам: отдельная подзадача на магазин в своей очереди---------------
+# Очередь тяжелых задач по отчётам и таблицам. Её обслуживает отдельный воркер с ограниченной
+# конкурентностью (docker-compose: celery_sheets), поэтому почасовой прогон по всем магазинам
+# не занимает слоты основного воркера, где идут FBS и поставки.
+SHEETS_QUEUE = QUEUE_ADS_SHEETS
+STORE_JOB_SUMMARY_TTL_SECONDS = 24 * 3600
+
+
+def _store_job_daily_statistics(store: OzonStore, date_str: str):
+    return fetch_daily_campaign_statistics(date_str, store_id=store.id)
+
+
+def _store_job_auto_kpis(store: OzonStore):
+    return update_auto_campaign_kpis_in_sheets(spreadsheet_url=(store.google_sheet_url or '').strip())
+
+
+def _store_job_manual_kpis(store: OzonStore):
+    return update_manual_campaign_kpis_in_sheets(spreadsheet_url=(store.google_sheet_url or '').strip())
+
+
+def _store_job_hourly_report(store: OzonStore, date_str: str):
+    """Статистика магазина за день, затем KPI авто- и ручных кампаний в его таблице.
+
+    Обе KPI-задачи работают с одним снимком листа (sheet_run): одно чтение и одна запись за прогон.
+    """
+    result = {}
+    if store.performance_client_id:
+        result["statistics"] = _store_job_daily_statistics(store, date_str)
+    if (store.google_sheet_url or '').strip():
+        with sheet_run():
+            result["auto_kpis"] = _store_job_auto_kpis(store)
+            result["manual_kpis"] = _store_job_manual_kpis(store)
+    return result
+
+
+STORE_JOBS = {
+    "daily_statistics": _store_job_daily_statistics,
+    "auto_kpis": _store_job_auto_kpis,
+    "manual_kpis": _store_job_manual_kpis,
+    "hourly_report": _store_job_hourly_report,
+}
+
+
+def _store_job_error(result):
+    """Первая ошибка в ответе задачи (ответы бывают вложенными: hourly_report)."""
+    if not isinstance(result, dict):
+        return None
+    if result.get("error"):
+        return str(result["error"])
+    for value in result.values():
+        error = _store_job_error(value)
+        if error:
+            return error
+    return None
+
+
+@shared_task(name="Магазин: подзадача почасового прогона", ignore_result=False)
+def run_store_job(job: str, store_id: int, **kwargs):
+    """Выполняет STORE_JOBS[job] для одного магазина и замеряет длительность."""
+    store = OzonStore.objects.filter(id=store_id).first()
+    if not store:
+        return {"job": job, "store_id": store_id, "seconds": 0, "error": "store not found"}
+
+    started = time.perf_counter()
+    try:
+        error = _store_job_error(STORE_JOBS[job](store, **kwargs))
+    except Exception as exc:
+        logger.error(f"[❌] {job} для {store}: {exc}")
+        error = str(exc)
+    seconds = round(time.perf_counter() - started, 3)
+    observe("store_job_duration_seconds", seconds, job=job, store=store_id)
+    logger.info(f"[⏱] {job} store={store_id} ({store}) sec={seconds}{' error' if error else ''}")
+    return {"job": job, "store_id": store_id, "seconds": seconds, "error": error}
+
+
+@shared_task(name="Магазин: сводка почасового прогона")
+def summarize_store_jobs(results, job: str):
+    """Итог прогона по магазинам: длительности по магазинам (самые медленные первыми) и ошибки."""
+    results = sorted((r for r in results if isinstance(r, dict)), key=lambda r: r["seconds"], reverse=True)
+    summary = {
+        "job": job,
+        "stores": len(results),
+        "errors": [r for r in results if r.get("error")],
+        "total_seconds": round(sum(r["seconds"] for r in results), 3),
+        "durations": {r["store_id"]: r["seconds"] for r in results},
+        "finished_at": timezone.now().isoformat(),
+    }
+    cache.set(f"store_jobs_summary:{job}", summary, timeout=STORE_JOB_SUMMARY_TTL_SECONDS)
+    slowest = ", ".join(f"{r['store_id']}={r['seconds']}s" for r in results[:5])
+    logger.info(
+        f"[📊] {job}: магазинов={summary['stores']}, ошибок={len(summary['errors'])}, "
+        f"суммарно={summary['total_seconds']}s, самые медленные: {slowest}"
+    )
+    return summary
+
+
+def get_store_jobs_summary(job: str):
+    return cache.get(f"store_jobs_summary:{job}")
+
+
+def dispatch_store_jobs(job: str, stores, **kwargs):
+    """Ставит по подзадаче на магазин в SHEETS_QUEUE и сводку по их завершении (chord)."""
+    store_ids = [store.id for store in stores]
+    if not store_ids:
+        return {"job": job, "dispatched": 0}
+    header = group(run_store_job.s(job, store_id, **kwargs).set(queue=SHEETS_QUEUE) for store_id in store_ids)
+    chord(header)(summarize_store_jobs.s(job).set(queue=SHEETS_QUEUE))
+    logger.info(f"[📤] {job}: поставлено подзадач по магазинам: {len(store_ids)} (очередь {SHEETS_QUEUE})")
+    return {"job": job, "dispatched": len(store_ids), "queue": SHEETS_QUEUE}
+
+
+def _performance_stores():
+    return OzonStore.objects.exclude(performance_client_id__isnull=True).exclude(performance_client_id='')
+
+
+def _sheet_stores():
+    return OzonStore.objects.exclude(google_sheet_url__isnull=True).exclude(google_sheet_url='')
+
+
 #-------------------------------------
 #--------Performance: — дневной отчёт за вчера по всем компаниям каждый день запуск в 01:00
 @shared_task(name="Performance: — дневной отчёт за вчера по всем компаниям каждый день запуск в 01:00")
 def submit_all_reports_for_yesterday(store_id: int | None = None, batch_size: int = 10, retry_interval_sec: int = 10):    
     """
     Запрашивает отчёт за вчерашний день по всем  кампаниям .
+    Без store_id — по подзадаче на магазин в очереди SHEETS_QUEUE.
     """
     date_str = (timezone.localdate() - timedelta(days=1)).strftime("%Y-%m-%d")
-    fetch_daily_campaign_statistics(date_str)
+    if store_id:
+        return fetch_daily_campaign_statistics(date_str, store_id=store_id)
+    return dispatch_store_jobs("daily_statistics", _performance_stores(), date_str=date_str)
 
 #-------------------------------------
 #--------Performance: прод — обёртка на вчерашний день (ручные кампании)---------------
@@ -5521,9 +5194,9 @@ def submit_all_reports_for_today():
     date_str = timezone.localdate().strftime("%Y-%m-%d")
     # submit_auto_reports_for_day(date_str, store_id=store_id, batch_size=batch_size, retry_interval_sec=retry_interval_sec)
     # fetch_performance_reports()
-    fetch_daily_campaign_statistics(date_str)
-    update_auto_campaign_kpis_in_sheets()
-    update_manual_campaign_kpis_in_sheets()
+    # По подзадаче на магазин: статистика за сегодня, затем KPI авто- и ручных кампаний в его таблице
+    stores = _performance_stores() | _sheet_stores()
+    return dispatch_store_jobs("hourly_report", stores.distinct(), date_str=date_str)
 #-------------------------------------
 #--------Performance: прод — обёртка на сегодня (ручные кампании)---------------
 # @shared_task(name="Performance: прод — дневной отчёт за сегодня (ручные кампании)")
@@ -5572,37 +5245,7 @@ def update_auto_campaign_kpis_in_sheets(
             return {"processed": 0, "results": [], "skipped": [{"reason": "no stores"}]}
 
         if len(stores) > 1:
-            results: list[dict] = []
-            errors: list[dict] = []
-            skipped: list[dict] = []
-            for store in stores:
-                sheet_url = (store.google_sheet_url or '').strip()
-                if not sheet_url:
-                    skipped.append({"store_id": store.id, "reason": "no google_sheet_url"})
-                    continue
-                res = update_auto_campaign_kpis_in_sheets(
-                    spreadsheet_url=sheet_url,
-                    sa_json_path=sa_json_path,
-                    worksheet_name=worksheet_name,
-                    start_row=start_row,
-                    block_size=block_size,
-                )
-                entry = {"store_id": store.id}
-                if isinstance(res, dict):
-                    entry.update(res)
-                if entry.get("error"):
-                    errors.append(entry)
-                elif entry.get("skipped"):
-                    skipped.append(entry)
-                else:
-                    results.append(entry)
-
-            summary = {"processed": len(results), "results": results}
-            if skipped:
-                summary["skipped"] = skipped
-            if errors:
-                summary["errors"] = errors
-            return summary
+            return dispatch_store_jobs("auto_kpis", stores)
 
         store_hint = stores[0]
         spreadsheet_url = (store_hint.google_sheet_url or '').strip()
@@ -5610,23 +5253,16 @@ def update_auto_campaign_kpis_in_sheets(
             logger.warning(f"[⚠️] У магазина {store_hint} отсутствует google_sheet_url")
             return {"skipped": True, "reason": "no google_sheet_url", "store_id": store_hint.id}
     else:
-        store_hint = OzonStore.objects.filter(google_sheet_url=spreadsheet_url).first()
+        store_hint = store_by_sheet_url(spreadsheet_url)
 
     if not spreadsheet_url:
         logger.error("[❌] Не указан spreadsheet_url для обновления KPI")
         return {"error": "spreadsheet_url not provided"}
 
+    ws = None
     try:
-        scopes = [
-            'https://www.googleapis.com/auth/spreadsheets',
-            'https://www.googleapis.com/auth/drive'
-        ]
-        creds = Credentials.from_service_account_file(sa_json_path, scopes=scopes)
-        gc = gspread.authorize(creds)
-
         t0 = time.perf_counter()
-        sh = gc.open_by_url(spreadsheet_url)
-        ws = sh.worksheet(worksheet_name)
+        ws = open_sheet_snapshot(spreadsheet_url, worksheet_name, sa_json_path)
         logger.info(f"[⏱] Открытие таблицы: {time.perf_counter() - t0:.3f}s")
 
         store_name = (ws.acell('V23').value or '').strip()
@@ -5634,14 +5270,9 @@ def update_auto_campaign_kpis_in_sheets(
             logger.error("[❌] V23 (store) пусто — прерывание")
             return {"error": "store not set in V23"}
 
-        store = store_hint or (
-            OzonStore.objects.filter(google_sheet_url=spreadsheet_url).first()
-        )
+        store = store_hint or store_by_sheet_url(spreadsheet_url)
         if not store:
-            store = (
-                OzonStore.objects.filter(name__iexact=store_name).first()
-                or OzonStore.objects.filter(client_id__iexact=store_name).first()
-            )
+            store = resolve_store(store_name, fuzzy=False)
         if not store:
             logger.error(f"[❌] Магазин '{store_name}' не найден")
             return {"error": f"store '{store_name}' not found"}
@@ -5985,6 +5616,9 @@ def update_auto_campaign_kpis_in_sheets(
     except Exception as e:
         logger.error(f"[❌] Ошибка update_auto_campaign_kpis_in_sheets: {e}")
         return {"error": str(e)}
+    finally:
+        if ws is not None:
+            ws.flush()
 
 
 def _update_campaign_statuses_in_sheets(store):
@@ -6101,41 +5735,43 @@ def monitor_auto_campaigns_weekly(reenable_hour: int = 9):
         except Exception:
             return Decimal('0')
 
-    def _parse_money_spent(val) -> Decimal:
-        s = str(val or '').replace('\u00A0','').replace('\u202F','').replace('\xa0','').replace(' ', '').replace(',', '.')
-        try:
-            return Decimal(s)
-        except Exception:
-            return Decimal('0')
+    # Расход всех кампаний с начала недели — одним запросом к журналу CampaignDailySpend.
+    # Окно обучения в этой неделе и сегодняшний день лежат внутри него.
+    daily_spend = defaultdict(dict)
+    ledger = CampaignDailySpend.objects.filter(date__gte=week_start, date__lte=today).values_list(
+        'store_id', 'ozon_campaign_id', 'date', 'spend'
+    )
+    for store_id, campaign_id, day, spend in ledger:
+        daily_spend[(store_id, campaign_id)][day] = spend
 
     def _sum_spend_for_period(ad: AdPlanItem, d_from: dt_date, d_to: dt_date) -> Decimal:
-        total = Decimal('0')
-        qs = CampaignPerformanceReportEntry.objects.filter(
-            store=ad.store,
-            ozon_campaign_id=str(ad.ozon_campaign_id),
-            report_date__gte=d_from,
-            report_date__lte=d_to,
-        ).only('totals')
-        for e in qs.iterator():
-            tot = e.totals or {}
-            total += _parse_money_spent(tot.get('moneySpent'))
-        return total
+        by_day = daily_spend.get((ad.store_id, str(ad.ozon_campaign_id)), {})
+        return sum((spend for day, spend in by_day.items() if d_from <= day <= d_to), Decimal('0'))
 
     def _today_spend(ad: AdPlanItem) -> Decimal:
         return _sum_spend_for_period(ad, today, today)
 
-    for ad in AdPlanItem.objects.filter(ozon_campaign_id__isnull=False).exclude(ozon_campaign_id=''):
+    # Магазины с выключенной системой — одним запросом, а не на каждую кампанию
+    disabled_store_ids = set(
+        StoreAdControl.objects.filter(is_system_enabled=False).values_list('store_id', flat=True)
+    )
+    # Решения по кампаниям копим по магазинам и выполняем пачкой после обхода:
+    # store_id -> {'store': ..., 'resume': [ad, ...], 'stop': [ad, ...]}
+    planned = {}
+
+    ads = (
+        AdPlanItem.objects.filter(ozon_campaign_id__isnull=False)
+        .exclude(ozon_campaign_id='')
+        .select_related('store')
+    )
+    for ad in ads:
         try:
             checked += 1
 
             # Пропускаем магазин, если система выключена
-            try:
-                ctrl = StoreAdControl.objects.filter(store=ad.store).first()
-                if ctrl and not ctrl.is_system_enabled:
-                    logger.info(f"[⛔] Пропуск кампании {ad.ozon_campaign_id} (SKU {ad.sku}): система магазина выключена")
-                    continue
-            except Exception:
-                pass
+            if ad.store_id in disabled_store_ids:
+                logger.info(f"[⛔] Пропуск кампании {ad.ozon_campaign_id} (SKU {ad.sku}): система магазина выключена")
+                continue
 
             started_at = ad.ozon_created_at or ad.created_at
             if not started_at:
@@ -6192,43 +5828,57 @@ def monitor_auto_campaigns_weekly(reenable_hour: int = 9):
                 and can_resume_now
                 and today_spend <= day_limit + Decimal('0.01')
             ):
-                try:
-                    from .utils import activate_campaign_for_store
-
-                    activate_campaign_for_store(ad.store, ad.ozon_campaign_id)
-                    AdPlanItem.objects.filter(id=ad.id).update(state=AdPlanItem.CAMPAIGN_STATE_ACTIVE)
-                    ad.state = AdPlanItem.CAMPAIGN_STATE_ACTIVE
-                    resumed += 1
-                    logger.info(
-                        f"[✅] Возобновили кампанию {ad.ozon_campaign_id} (SKU {ad.sku}) — условия для перезапуска выполнены"
-                    )
-                except Exception as e:
-                    logger.error(f"[❌] Ошибка при повторном запуске кампании {ad.ozon_campaign_id}: {e}")
+                planned.setdefault(ad.store_id, {'store': ad.store, 'resume': [], 'stop': []})['resume'].append(ad)
 
             if today_spend > day_limit + Decimal('0.01'):
                 # Превышение — останавливаем до завтра
-                try:
-                    from .utils import deactivate_campaign_for_store
-                    deactivate_campaign_for_store(ad.store, ad.ozon_campaign_id)
-                    AdPlanItem.objects.filter(id=ad.id).update(state=AdPlanItem.CAMPAIGN_STATE_STOPPED)
-                    ad.state = AdPlanItem.CAMPAIGN_STATE_STOPPED
-                    stopped += 1
-                    logger.info(f"[🛑] Превышен лимит. Остановили кампанию {ad.ozon_campaign_id} до завтра")
-                except Exception as e:
-                    logger.error(f"[❌] Ошибка деактивации {ad.ozon_campaign_id}: {e}")
+                planned.setdefault(ad.store_id, {'store': ad.store, 'resume': [], 'stop': []})['stop'].append(ad)
         except Exception as e:
             logger.error(f"[❌] Ошибка мониторинга кампании {getattr(ad,'ozon_campaign_id','?')}: {e}")
 
+    # Выполняем остановки/возобновления пачкой на магазин: параллельно в пределах лимита Performance API,
+    # новые состояния пишем в БД одним UPDATE на действие
+    changed_stores = set()
+    for plan in planned.values():
+        store = plan['store']
+        operations = [(ad.ozon_campaign_id, 'activate', None) for ad in plan['resume']]
+        operations += [(ad.ozon_campaign_id, 'deactivate', None) for ad in plan['stop']]
+        try:
+            results = run_campaign_operations_for_store(store, operations, attempts=1)
+        except Exception as e:
+            logger.error(f"[❌] Ошибка смены активности кампаний магазина {store}: {e}")
+            continue
+
+        ok_ids = {'activate': [], 'deactivate': []}
+        for result in results:
+            cid = result['campaign_id']
+            if result['ok']:
+                ok_ids[result['action']].append(cid)
+            elif result['action'] == 'activate':
+                logger.error(f"[❌] Ошибка при повторном запуске кампании {cid}: {result['error']}")
+            else:
+                logger.error(f"[❌] Ошибка деактивации {cid}: {result['error']}")
+
+        if ok_ids['activate']:
+            AdPlanItem.objects.filter(store=store, ozon_campaign_id__in=ok_ids['activate']).update(
+                state=AdPlanItem.CAMPAIGN_STATE_ACTIVE
+            )
+            resumed += len(ok_ids['activate'])
+            logger.info(f"[✅] Возобновили кампании {ok_ids['activate']} — условия для перезапуска выполнены")
+        if ok_ids['deactivate']:
+            AdPlanItem.objects.filter(store=store, ozon_campaign_id__in=ok_ids['deactivate']).update(
+                state=AdPlanItem.CAMPAIGN_STATE_STOPPED
+            )
+            stopped += len(ok_ids['deactivate'])
+            logger.info(f"[🛑] Превышен лимит. Остановили кампании {ok_ids['deactivate']} до завтра")
+        if ok_ids['activate'] or ok_ids['deactivate']:
+            changed_stores.add(store)
+
     logger.info(f"[📊] Мониторинг: проверено={checked}, обучение={skipped_training}, остановлено={stopped}, возобновлено={resumed}")
     
     # Обновляем статусы в Google Sheets для измененных кампаний
     if stopped > 0 or resumed > 0:
         try:
-            # Получаем уникальные магазины из измененных кампаний
-            changed_stores = set()
-            for ad in AdPlanItem.objects.filter(ozon_campaign_id__isnull=False).exclude(ozon_campaign_id=''):
-                changed_stores.add(ad.store)
-            
             for store in changed_stores:
                 try:
                     _update_campaign_statuses_in_sheets(store)
@@ -6248,36 +5898,30 @@ def update_manual_campaign_kpis_in_sheets(
 ):
     """
     Обновляет блок ручных кампаний в Google Sheets (Main_ADV).
-    Если URL не передан, перебирает все магазины с заполненным `google_sheet_url`.
+    Если URL не передан, ставит по подзадаче на каждый магазин с заполненным `google_sheet_url`.
     """
 
+    if not spreadsheet_url:
+        stores = list(_sheet_stores())
+        if not stores:
+            logger.info("[ℹ️] Нет магазинов с заполненным google_sheet_url — обновление пропущено")
+            return {"processed": 0, "results": [], "errors": []}
+        return dispatch_store_jobs("manual_kpis", stores)
+
     sa_json_path = sa_json_path or os.getenv(
         "GOOGLE_SA_JSON_PATH",
         "/workspace/ozon-469708-c5f1eca77c02.json",
     )
 
-    scopes = [
-        'https://www.googleapis.com/auth/spreadsheets',
-        'https://www.googleapis.com/auth/drive'
-    ]
-
-    try:
-        creds = Credentials.from_service_account_file(sa_json_path, scopes=scopes)
-    except Exception as cred_err:
-        logger.error(f"[❌] Ошибка чтения сервисного аккаунта для Sheets: {cred_err}")
-        return {"error": f"service account error: {cred_err}"}
-
-    gc = gspread.authorize(creds)
-
     def _process_store(store_obj: OzonStore | None, sheet_url: str) -> dict:
         if not sheet_url:
             logger.warning("[⚠️] Пропускаем обновление: не указан URL Google Sheets")
             return {"error": "spreadsheet url not set"}
 
+        ws = None
         try:
             t0 = time.perf_counter()
-            sh = gc.open_by_url(sheet_url)
-            ws = sh.worksheet(worksheet_name)
+            ws = open_sheet_snapshot(sheet_url, worksheet_name, sa_json_path)
             logger.info(
                 f"[⏱] Открытие таблицы (ручные кампании) {sheet_url}: {time.perf_counter() - t0:.3f}s"
             )
@@ -6731,56 +6375,153 @@ def update_manual_campaign_kpis_in_sheets(
                 f"[❌] Ошибка обновления ручных кампаний в таблице {sheet_url}: {e}"
             )
             return {"error": str(e)}
+        finally:
+            if ws is not None:
+                ws.flush()
+
+    store = store_by_sheet_url(spreadsheet_url)
+    return _process_store(store, spreadsheet_url)
+
+
+# Группы статусов черновика: по ним ведутся счетчики батча и считается его итоговый статус.
+DRAFT_ACTIVE_STATUSES = ("queued", "in_progress", "draft_created", "supply_queued", "supply_in_progress")
+DRAFT_FAILED_STATUSES = ("failed", "supply_failed")
+DRAFT_DONE_STATUSES = ("info_loaded", "created")
+
+# Допустимые переходы черновика. Остаться в том же статусе (перенос попытки) можно всегда.
+DRAFT_TRANSITIONS = {
+    "queued": {"in_progress"},
+    "failed": {"queued", "in_progress"},
+    "in_progress": {"queued", "failed", "draft_created"},
+    "draft_created": {"info_loaded"},
+    "info_loaded": {"supply_queued"},
+    "supply_queued": {"supply_in_progress", "supply_failed"},
+    "supply_in_progress": {"supply_queued", "supply_failed", "created"},
+    "supply_failed": {"supply_queued", "supply_in_progress"},
+    "created": set(),
+}
+
+# Скользящее окно лимита черновиков: минутные счетчики в общем кеше.
+DRAFT_QUOTA_BUCKET_SECONDS = 60
+DRAFT_QUOTA_WINDOW_SECONDS = 3600
+
+
+class InvalidDraftTransition(ValueError):
+    pass
+
+
+def _draft_status_group(status):
+    if status in DRAFT_ACTIVE_STATUSES:
+        return "active"
+    if status in DRAFT_FAILED_STATUSES:
+        return "failed"
+    return "done"
+
+
+def _batch_status_from_counters():
+    """Итоговый статус батча из счетчиков, считается в самом UPDATE."""
+    return Case(
+        When(active_drafts__gt=0, then=Value("processing")),
+        When(failed_drafts__gt=0, then=Value("partial")),
+        default=Value("completed"),
+    )
 
-    if spreadsheet_url:
-        store = OzonStore.objects.filter(google_sheet_url=spreadsheet_url).first()
-        return _process_store(store, spreadsheet_url)
-
-    stores = OzonStore.objects.exclude(google_sheet_url__isnull=True).exclude(google_sheet_url='')
-    if not stores:
-        logger.info("[ℹ️] Нет магазинов с заполненным google_sheet_url — обновление пропущено")
-        return {"processed": 0, "results": [], "errors": []}
-
-    results: list[dict] = []
-    errors: list[dict] = []
-    for store in stores:
-        sheet_url = store.google_sheet_url
-        result = _process_store(store, sheet_url)
-        if result.get('error'):
-            errors.append({"store_id": store.id, "error": result['error']})
-            continue
-        success_result = dict(result)
-        success_result["store_id"] = store.id
-        results.append(success_result)
-
-    summary = {"processed": len(results), "results": results}
-    if errors:
-        summary["errors"] = errors
-    return summary
 
+def transition_draft(draft: OzonSupplyDraft, new_status: str, **fields):
+    """Переводит черновик в new_status и сохраняет переданные поля.
 
-def _hourly_created_count(store):
-    """Считает количество созданных черновиков за час для контроля лимитов."""
-    since = timezone.now() - timedelta(hours=1)
-    return OzonSupplyDraft.objects.filter(
-        store=store,
-        operation_id__gt="",
-        created_at__gte=since,
-    ).count()
+    Если меняется группа статуса, счетчики батча сдвигаются атомарным UPDATE,
+    и статус батча пересчитывается по ним же — остальные черновики не читаются.
+    """
+    old_status = draft.status
+    if new_status != old_status and new_status not in DRAFT_TRANSITIONS.get(old_status, ()):
+        raise InvalidDraftTransition(f"Недопустимый переход черновика {draft.id}: {old_status} → {new_status}")
+
+    for name, value in fields.items():
+        setattr(draft, name, value)
+    draft.status = new_status
+    draft.save(update_fields=["status", *fields, "updated_at"])
+
+    old_group = _draft_status_group(old_status)
+    new_group = _draft_status_group(new_status)
+    if old_group == new_group:
+        return
+    batches = OzonSupplyBatch.objects.filter(pk=draft.batch_id)
+    batches.update(**{
+        f"{old_group}_drafts": Greatest(F(f"{old_group}_drafts") - 1, 0),
+        f"{new_group}_drafts": F(f"{new_group}_drafts") + 1,
+    })
+    batches.update(status=_batch_status_from_counters(), updated_at=timezone.now())
 
 
 def _update_batch_status(batch: OzonSupplyBatch):
-    """Сводит статусы черновиков в итоговый статус батча."""
-    drafts = list(batch.drafts.all())
-    if any(d.status in ("queued", "in_progress", "draft_created", "supply_queued", "supply_in_progress") for d in drafts):
+    """Пересчитывает счетчики батча одним агрегатом и сводит их в итоговый статус.
+
+    Нужен, когда черновики удаляются или переносятся между батчами;
+    обычные переходы статусов двигают счетчики сами (transition_draft).
+    """
+    counts = batch.drafts.aggregate(
+        active=Count("id", filter=Q(status__in=DRAFT_ACTIVE_STATUSES)),
+        failed=Count("id", filter=Q(status__in=DRAFT_FAILED_STATUSES)),
+        total=Count("id"),
+    )
+    batch.active_drafts = counts["active"]
+    batch.failed_drafts = counts["failed"]
+    batch.done_drafts = counts["total"] - counts["active"] - counts["failed"]
+    if batch.active_drafts:
         batch.status = "processing"
-    elif any(d.status in ("failed", "supply_failed") for d in drafts):
+    elif batch.failed_drafts:
         batch.status = "partial"
-    elif all(d.status in ("info_loaded", "created") for d in drafts):
-        batch.status = "completed"
     else:
-        batch.status = "processing"
-    batch.save(update_fields=["status", "updated_at"])
+        batch.status = "completed"
+    batch.save(update_fields=["status", "active_drafts", "failed_drafts", "done_drafts", "updated_at"])
+
+
+def _draft_quota_key(store_id, bucket):
+    return f"ozon_draft_quota:{store_id}:{bucket}"
+
+
+def _record_draft_created(store_id, count=1):
+    """Учитывает созданные черновики в минутном счетчике скользящего окна."""
+    key = _draft_quota_key(store_id, int(time.time()) // DRAFT_QUOTA_BUCKET_SECONDS)
+    timeout = DRAFT_QUOTA_WINDOW_SECONDS + DRAFT_QUOTA_BUCKET_SECONDS
+    cache.add(key, 0, timeout=timeout)
+    try:
+        cache.incr(key, count)
+    except ValueError:
+        cache.set(key, count, timeout=timeout)
+
+
+def _hourly_created_count(store):
+    """Сколько черновиков магазин создал за последний час (скользящее окно в кеше).
+
+    Если окна в кеше еще нет (первый запуск, сброс Redis), оно один раз заполняется из БД.
+    """
+    if cache.add(f"ozon_draft_quota_seeded:{store.id}", True, timeout=DRAFT_QUOTA_WINDOW_SECONDS * 24):
+        since = timezone.now() - timedelta(hours=1)
+        seeded = OzonSupplyDraft.objects.filter(store=store, operation_id__gt="", created_at__gte=since).count()
+        if seeded:
+            _record_draft_created(store.id, seeded)
+
+    current = int(time.time()) // DRAFT_QUOTA_BUCKET_SECONDS
+    buckets = DRAFT_QUOTA_WINDOW_SECONDS // DRAFT_QUOTA_BUCKET_SECONDS
+    keys = [_draft_quota_key(store.id, bucket) for bucket in range(current - buckets + 1, current + 1)]
+    return sum(cache.get_many(keys).values())
+
+
+def _throttle_wait(store_id, kind, interval):
+    """Сколько секунд ждать до следующего вызова kind для магазина; 0 — можно сейчас.
+
+    Отметка последнего вызова общая для всех процессов. Когда вызов разрешен,
+    она сразу сдвигается на текущее время.
+    """
+    key = f"ozon_supply_last_call:{kind}:{store_id}"
+    now = time.time()
+    last_call = cache.get(key)
+    if last_call is not None and now - last_call < interval:
+        return interval - (now - last_call)
+    cache.set(key, now, timeout=int(interval) + 60)
+    return 0
 
 
 def _call_ozon(url, headers, payload):
@@ -6818,104 +6559,504 @@ def _normalize_supply_warehouses(draft: OzonSupplyDraft):
     return flat
 
 
-def _process_supply_create(batch: OzonSupplyBatch):
-    """Фоновое создание финальных поставок (draft/supply/create)."""
-    drafts_qs = batch.drafts.filter(status__in=["supply_queued", "supply_failed", "supply_in_progress"]).order_by("created_at")
-    last_call = None
+def _acquire_ozon_rate_slot(store_id, rps=SUPPLY_READ_RPS):
+    """Ждет свободное место в бюджете запросов магазина, общем для всех потоков и воркеров."""
+    acquire_rate_slot(f"ozon_rate:{store_id}", rps)
 
-    for draft in drafts_qs:
-        now = timezone.now()
-        if draft.next_attempt_at and draft.next_attempt_at > now:
-            continue
 
-        if draft.attempts >= MAX_ATTEMPTS and draft.status == "supply_failed":
+def _call_ozon_budgeted(store, url, payload):
+    """POST в OZON в пределах бюджета магазина с повтором на 429 (Retry-After)."""
+    headers = _ozon_headers(store)
+    attempt = 0
+    while True:
+        attempt += 1
+        _acquire_ozon_rate_slot(store.id)
+        resp, data = _call_ozon(url, headers, payload)
+        if resp.status_code == 429 and attempt < SUPPLY_READ_MAX_RETRIES:
+            try:
+                delay = float(resp.headers.get("Retry-After"))
+            except (TypeError, ValueError):
+                delay = SUPPLY_READ_RETRY_SECONDS
+            time.sleep(delay)
             continue
+        return resp, data
 
-        if not draft.draft_id:
-            draft.status = "supply_failed"
-            draft.error_message = "draft_id missing (info not loaded)"
-            draft.attempts = MAX_ATTEMPTS
-            draft.save(update_fields=["status", "error_message", "attempts", "updated_at"])
-            continue
 
-        if not draft.selected_timeslot:
-            draft.status = "supply_failed"
-            draft.error_message = "timeslot missing"
-            draft.attempts = MAX_ATTEMPTS
-            draft.save(update_fields=["status", "error_message", "attempts", "updated_at"])
-            continue
+def _fetch_draft_timeslots(draft: OzonSupplyDraft, warehouse_id, date_from_iso: str, date_to_iso: str):
+    """Загружает таймслоты черновика и сохраняет их. Возвращает описание ошибки или None."""
+    payload = {
+        "date_from": date_from_iso,
+        "date_to": date_to_iso,
+        "draft_id": draft.draft_id,
+        "warehouse_ids": [str(warehouse_id)],
+    }
+    try:
+        resp, resp_data = _call_ozon_budgeted(draft.store, OZON_TIMESLOT_URL, payload)
+    except requests.RequestException as exc:
+        return {"draft_id": draft.id, "error": f"Request error: {exc}"}
+    if resp.status_code >= 400:
+        return {"draft_id": draft.id, "status_code": resp.status_code, "error": resp_data}
 
-        warehouses = _normalize_supply_warehouses(draft)
-        selected = draft.selected_supply_warehouse or (warehouses[0] if warehouses else None)
-        if not selected:
-            draft.status = "supply_failed"
-            draft.error_message = "No warehouse selected"
-            draft.attempts = MAX_ATTEMPTS
-            draft.save(update_fields=["status", "error_message", "attempts", "updated_at"])
-            continue
+    draft.timeslot_response = resp_data
+    draft.timeslot_updated_at = timezone.now()
+    draft.save(update_fields=["timeslot_response", "timeslot_updated_at", "updated_at"])
+    return None
 
-        warehouse_id = selected.get("warehouse_id") or selected.get("id")
-        if not warehouse_id:
-            draft.status = "supply_failed"
-            draft.error_message = "warehouse_id missing"
-            draft.attempts = MAX_ATTEMPTS
-            draft.save(update_fields=["status", "error_message", "attempts", "updated_at"])
-            continue
 
-        # Троттлинг вызовов создания поставок для магазина.
-        if last_call:
-            diff = (timezone.now() - last_call).total_seconds()
-            if diff < SUPPLY_MIN_INTERVAL_SECONDS:
-                time.sleep(SUPPLY_MIN_INTERVAL_SECONDS - diff)
+def _fetch_draft_supply_status(draft: OzonSupplyDraft):
+    """Загружает заявки и товары созданной поставки и сохраняет их. Возвращает описание ошибки или None."""
+    store = draft.store
+    try:
+        # 1) статус создания заявки
+        resp, status_data = _call_ozon_budgeted(
+            store, OZON_SUPPLY_STATUS_URL, {"operation_id": draft.operation_id_supply}
+        )
+        if resp.status_code >= 400:
+            return {"draft_id": draft.id, "error": status_data, "status_code": resp.status_code}
+        order_ids = (status_data.get("result") or {}).get("order_ids") or []
+        if not order_ids:
+            return {"draft_id": draft.id, "error": "order_ids empty"}
+
+        # 2) детали заказов
+        resp, orders_data = _call_ozon_budgeted(store, OZON_SUPPLY_GET_URL, {"order_ids": order_ids})
+        if resp.status_code >= 400:
+            return {"draft_id": draft.id, "error": orders_data, "status_code": resp.status_code}
+        orders = orders_data.get("orders") or []
+
+        # Собираем bundle_ids и склады
+        bundle_ids = []
+        storage_ids = set()
+        dropoff_id = None
+        for order in orders:
+            drop = order.get("drop_off_warehouse") or {}
+            if drop.get("warehouse_id"):
+                dropoff_id = drop.get("warehouse_id")
+            for supply in order.get("supplies") or []:
+                if supply.get("bundle_id"):
+                    bundle_ids.append(supply["bundle_id"])
+                storage = (supply.get("storage_warehouse") or {}).get("warehouse_id")
+                if storage:
+                    storage_ids.add(str(storage))
+
+        error = None
+        bundle_items = []
+        if bundle_ids:
+            bundle_payload = {
+                "bundle_ids": bundle_ids,
+                "is_asc": True,
+                "item_tags_calculation": {
+                    "dropoff_warehouse_id": dropoff_id or 0,
+                    "storage_warehouse_ids": list(storage_ids) if storage_ids else [],
+                },
+                "limit": 100,
+                "sort_field": "UNSPECIFIED",
+            }
+            resp, bundle_data = _call_ozon_budgeted(store, OZON_SUPPLY_BUNDLE_URL, bundle_payload)
+            if resp.status_code >= 400:
+                error = {"draft_id": draft.id, "error": bundle_data, "status_code": resp.status_code}
+            else:
+                for item in bundle_data.get("items") or []:
+                    bundle_items.append(
+                        {
+                            "sku": item.get("sku"),
+                            "quantity": item.get("quantity"),
+                            "offer_id": item.get("offer_id"),
+                            "icon_path": item.get("icon_path"),
+                            "name": item.get("name"),
+                            "barcode": item.get("barcode"),
+                            "product_id": item.get("product_id"),
+                        }
+                    )
+    except requests.RequestException as exc:
+        return {"draft_id": draft.id, "error": f"Request error: {exc}"}
 
-        headers = {
-            "Client-Id": draft.store.client_id,
-            "Api-Key": draft.store.api_key,
-            "Content-Type": "application/json",
-        }
+    draft.supply_order_ids = order_ids
+    draft.supply_order_response = orders_data
+    draft.supply_bundle_items = bundle_items
+    draft.supply_status_updated_at = timezone.now()
+    draft.save(update_fields=[
+        "supply_order_ids",
+        "supply_order_response",
+        "supply_bundle_items",
+        "supply_status_updated_at",
+        "updated_at",
+    ])
+    return error
 
-        draft.status = "supply_in_progress"
-        draft.attempts += 1
-        draft.next_attempt_at = None
-        draft.error_message = ""
-        draft.save(update_fields=["status", "attempts", "next_attempt_at", "error_message", "updated_at"])
 
-        payload = {
-            "draft_id": draft.draft_id,
-            "timeslot": draft.selected_timeslot,
-            "warehouse_id": int(warehouse_id),
-        }
+def _supply_job_key(batch_uuid, kind):
+    return f"supply_job:{kind}:{batch_uuid}"
+
+
+def _supply_job_lock_key(batch_uuid, kind):
+    return f"supply_job_lock:{kind}:{batch_uuid}"
 
+
+def get_supply_job(batch_uuid, kind):
+    """Прогресс фоновой загрузки по батчу (None, если загрузок не было)."""
+    return cache.get(_supply_job_key(batch_uuid, kind))
+
+
+def start_supply_job(batch_uuid, kind, draft_ids) -> bool:
+    """Регистрирует фоновую загрузку по батчу. False — такая загрузка уже идет."""
+    if not cache.add(_supply_job_lock_key(batch_uuid, kind), True, timeout=SUPPLY_JOB_TTL_SECONDS):
+        return False
+    cache.set(_supply_job_key(batch_uuid, kind), {
+        "kind": kind,
+        "status": "queued",
+        "total": len(draft_ids),
+        "done": 0,
+        "draft_ids": list(draft_ids),
+        "succeeded": [],
+        "errors": [],
+        "started_at": timezone.now().isoformat(),
+        "finished_at": None,
+    }, timeout=SUPPLY_JOB_TTL_SECONDS)
+    return True
+
+
+def finish_supply_job(batch_uuid, kind, error=None):
+    """Закрывает загрузку: снимает блокировку и отмечает прогресс завершенным."""
+    state = get_supply_job(batch_uuid, kind) or {}
+    state["status"] = "failed" if error else "done"
+    state["finished_at"] = timezone.now().isoformat()
+    if error:
+        state.setdefault("errors", []).append({"error": error})
+    cache.set(_supply_job_key(batch_uuid, kind), state, timeout=SUPPLY_JOB_TTL_SECONDS)
+    cache.delete(_supply_job_lock_key(batch_uuid, kind))
+
+
+def _run_supply_job(batch_uuid, kind, drafts, handler):
+    """Обрабатывает черновики параллельно; результат каждого сохраняется сразу, прогресс — в кеш."""
+    state = get_supply_job(batch_uuid, kind) or {}
+    state.update(status="running", total=len(drafts), done=0, succeeded=[], errors=[])
+    cache.set(_supply_job_key(batch_uuid, kind), state, timeout=SUPPLY_JOB_TTL_SECONDS)
+    state_lock = threading.Lock()
+
+    def run(draft):
         try:
-            resp, resp_data = _call_ozon(OZON_SUPPLY_CREATE_URL, headers, payload)
-        except requests.RequestException as exc:
-            draft.status = "supply_failed"
-            draft.error_message = f"Ошибка запроса: {exc}"
-            draft.next_attempt_at = now + timedelta(minutes=1)
-            draft.save(update_fields=["status", "error_message", "next_attempt_at", "updated_at"])
-            continue
+            error = handler(draft)
+        except Exception as exc:
+            logger.exception(f"[❌] Ошибка загрузки {kind} для черновика {draft.id}")
+            error = {"draft_id": draft.id, "error": str(exc)}
+        with state_lock:
+            state["done"] += 1
+            if error:
+                state["errors"].append(error)
+            else:
+                state["succeeded"].append(draft.id)
+            cache.set(_supply_job_key(batch_uuid, kind), state, timeout=SUPPLY_JOB_TTL_SECONDS)
 
-        last_call = timezone.now()
+    def run_in_pool(draft):
+        try:
+            run(draft)
+        finally:
+            # Потоки пула держат собственные соединения с БД.
+            connection.close()
 
-        # Лимит 429: ставим в очередь с задержкой.
-        if resp.status_code == 429:
-            draft.status = "supply_queued"
-            draft.next_attempt_at = now + timedelta(seconds=RETRY_429_SECONDS)
-            draft.error_message = "Превышен лимит 429, повтор через 60с."
-            draft.save(update_fields=["status", "next_attempt_at", "error_message", "updated_at"])
-            continue
+    try:
+        workers = min(SUPPLY_READ_CONCURRENCY, len(drafts))
+        if workers <= 1:
+            for draft in drafts:
+                run(draft)
+        else:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"supply-{kind}") as pool:
+                list(pool.map(run_in_pool, drafts))
+    finally:
+        finish_supply_job(batch_uuid, kind)
+
+
+@shared_task(name="Поставки: загрузка таймслотов черновиков батча")
+def fetch_batch_timeslots(batch_uuid: str, targets: list, date_from_iso: str, date_to_iso: str):
+    """targets — список пар [id черновика, warehouse_id]."""
+    warehouse_by_draft = {draft_id: warehouse_id for draft_id, warehouse_id in targets}
+    drafts = list(
+        OzonSupplyDraft.objects.filter(batch__batch_id=batch_uuid, id__in=warehouse_by_draft)
+        .select_related("store")
+    )
+    _run_supply_job(
+        batch_uuid,
+        SUPPLY_JOB_TIMESLOTS,
+        drafts,
+        lambda draft: _fetch_draft_timeslots(draft, warehouse_by_draft[draft.id], date_from_iso, date_to_iso),
+    )
 
-        if resp.status_code >= 400:
-            draft.status = "supply_failed"
-            draft.error_message = str(resp_data)[:500]
-            draft.save(update_fields=["status", "error_message", "updated_at"])
-            continue
 
-        operation_id_supply = resp_data.get("operation_id") or ""
-        draft.operation_id_supply = operation_id_supply
-        draft.status = "created"
-        draft.error_message = ""
-        draft.save(update_fields=["operation_id_supply", "status", "error_message", "updated_at"])
+@shared_task(name="Поставки: обновление данных созданных поставок батча")
+def refresh_batch_supply_status(batch_uuid: str, draft_ids: list):
+    drafts = list(
+        OzonSupplyDraft.objects.filter(batch__batch_id=batch_uuid, id__in=draft_ids)
+        .select_related("store")
+    )
+    _run_supply_job(batch_uuid, SUPPLY_JOB_SUPPLY_STATUS, drafts, _fetch_draft_supply_status)
+
+
+def _draft_failed_final(draft: OzonSupplyDraft, status: str, message: str):
+    """Ошибка, которую повтор не исправит: попытки исчерпаны сразу."""
+    transition_draft(draft, status, error_message=message, attempts=MAX_ATTEMPTS)
+
+
+def _step_create_draft(draft: OzonSupplyDraft, now):
+    """queued/failed/in_progress → draft/create. False, если магазин сейчас троттлится."""
+    # Глобальный лимит OZON: максимум 50 черновиков в час.
+    if _hourly_created_count(draft.store) >= MAX_HOURLY_LIMIT:
+        transition_draft(
+            draft,
+            "queued",
+            next_attempt_at=now + timedelta(hours=1),
+            error_message="Достигнут лимит 50 черновиков в час.",
+        )
+        return True
+
+    if _throttle_wait(draft.store_id, "draft_create", MIN_INTERVAL_SECONDS):
+        return False
+
+    transition_draft(draft, "in_progress", attempts=draft.attempts + 1, next_attempt_at=None, error_message="")
+    try:
+        resp, resp_data = _call_ozon(OZON_DRAFT_CREATE_URL, _ozon_headers(draft.store), draft.request_payload)
+    except requests.RequestException as exc:
+        transition_draft(
+            draft,
+            "failed",
+            error_message=f"Ошибка запроса: {exc}",
+            next_attempt_at=now + timedelta(minutes=1),
+        )
+        return True
+
+    if resp.status_code == 429:
+        transition_draft(
+            draft,
+            "queued",
+            next_attempt_at=now + timedelta(seconds=RETRY_429_SECONDS),
+            error_message="Превышен лимит 429, повтор через 60с.",
+        )
+        return True
+
+    if resp.status_code >= 400:
+        transition_draft(draft, "failed", response_payload=resp_data, error_message=resp.text[:500])
+        return True
+
+    _record_draft_created(draft.store_id)
+    transition_draft(
+        draft,
+        "draft_created",
+        operation_id=resp_data.get("operation_id") or resp_data.get("result") or "",
+        response_payload=resp_data,
+        next_attempt_at=now + timedelta(seconds=INFO_RETRY_SECONDS),
+    )
+    return True
+
+
+def _step_poll_info(draft: OzonSupplyDraft, now):
+    """draft_created → опрос /draft/create/info до готовности расчета."""
+    try:
+        resp, info_data = _call_ozon(
+            OZON_DRAFT_INFO_URL, _ozon_headers(draft.store), {"operation_id": draft.operation_id}
+        )
+    except requests.RequestException as exc:
+        transition_draft(
+            draft,
+            draft.status,
+            error_message=f"Ошибка info-запроса: {exc}",
+            next_attempt_at=now + timedelta(seconds=INFO_RETRY_SECONDS),
+        )
+        return True
+
+    if resp.status_code == 429:
+        transition_draft(
+            draft,
+            draft.status,
+            next_attempt_at=now + timedelta(seconds=RETRY_429_SECONDS),
+            error_message="429 на info, повтор позже.",
+        )
+        return True
+
+    if resp.status_code >= 400:
+        transition_draft(
+            draft,
+            draft.status,
+            error_message=f"Ошибка info: {resp.text[:500]}",
+            next_attempt_at=now + timedelta(seconds=INFO_RETRY_SECONDS),
+        )
+        return True
+
+    status_flag = info_data.get("status")
+    response_payload = {"create": draft.response_payload, "info": info_data}
+    if status_flag != "CALCULATION_STATUS_SUCCESS":
+        transition_draft(
+            draft,
+            draft.status,
+            response_payload=response_payload,
+            next_attempt_at=now + timedelta(seconds=INFO_RETRY_SECONDS),
+            error_message=f"Статус {status_flag}, повтор позже.",
+        )
+        return True
+
+    # Приводим список складов к плоскому виду с warehouse_id
+    warehouses = []
+    raw_wh = info_data.get("warehouses") or []
+    if raw_wh:
+        for w in raw_wh:
+            if w.get("warehouse_id"):
+                warehouses.append(w)
+    else:
+        clusters = info_data.get("clusters") or []
+        for c in clusters:
+            for w in c.get("warehouses", []):
+                sw = w.get("supply_warehouse") or {}
+                if sw.get("warehouse_id"):
+                    sw = {
+                        **sw,
+                        "status": w.get("status"),
+                        "bundle_ids": w.get("bundle_ids"),
+                        "travel_time_days": w.get("travel_time_days"),
+                    }
+                    warehouses.append(sw)
+
+    transition_draft(
+        draft,
+        "info_loaded",
+        draft_id=info_data.get("draft_id"),
+        supply_warehouse=warehouses,
+        selected_supply_warehouse=warehouses[0] if warehouses else draft.selected_supply_warehouse,
+        response_payload=response_payload,
+        next_attempt_at=None,
+        error_message="",
+    )
+    return True
+
+
+def _step_create_supply(draft: OzonSupplyDraft, now):
+    """supply_queued/supply_failed/supply_in_progress → draft/supply/create."""
+    if not draft.draft_id:
+        _draft_failed_final(draft, "supply_failed", "draft_id missing (info not loaded)")
+        return True
+
+    if not draft.selected_timeslot:
+        _draft_failed_final(draft, "supply_failed", "timeslot missing")
+        return True
+
+    warehouses = _normalize_supply_warehouses(draft)
+    selected = draft.selected_supply_warehouse or (warehouses[0] if warehouses else None)
+    if not selected:
+        _draft_failed_final(draft, "supply_failed", "No warehouse selected")
+        return True
+
+    warehouse_id = selected.get("warehouse_id") or selected.get("id")
+    if not warehouse_id:
+        _draft_failed_final(draft, "supply_failed", "warehouse_id missing")
+        return True
+
+    if _throttle_wait(draft.store_id, "supply_create", SUPPLY_MIN_INTERVAL_SECONDS):
+        return False
+
+    transition_draft(draft, "supply_in_progress", attempts=draft.attempts + 1, next_attempt_at=None, error_message="")
+    payload = {
+        "draft_id": draft.draft_id,
+        "timeslot": draft.selected_timeslot,
+        "warehouse_id": int(warehouse_id),
+    }
+    try:
+        resp, resp_data = _call_ozon(OZON_SUPPLY_CREATE_URL, _ozon_headers(draft.store), payload)
+    except requests.RequestException as exc:
+        transition_draft(
+            draft,
+            "supply_failed",
+            error_message=f"Ошибка запроса: {exc}",
+            next_attempt_at=now + timedelta(minutes=1),
+        )
+        return True
+
+    # Лимит 429: ставим в очередь с задержкой.
+    if resp.status_code == 429:
+        transition_draft(
+            draft,
+            "supply_queued",
+            next_attempt_at=now + timedelta(seconds=RETRY_429_SECONDS),
+            error_message="Превышен лимит 429, повтор через 60с.",
+        )
+        return True
+
+    if resp.status_code >= 400:
+        transition_draft(draft, "supply_failed", error_message=str(resp_data)[:500])
+        return True
+
+    transition_draft(draft, "created", operation_id_supply=resp_data.get("operation_id") or "", error_message="")
+    return True
+
+
+# Шаг, который выполняется для черновика в данном статусе, когда подошел его next_attempt_at.
+SUPPLY_DRAFT_STEPS = {
+    "queued": _step_create_draft,
+    "failed": _step_create_draft,
+    "in_progress": _step_create_draft,
+    "draft_created": _step_poll_info,
+    "supply_queued": _step_create_supply,
+    "supply_failed": _step_create_supply,
+    "supply_in_progress": _step_create_supply,
+}
+SUPPLY_STORE_LOCK_SECONDS = 600
+
+
+def _waiting_drafts():
+    """Черновики, которым еще предстоит шаг (без исчерпавших попытки)."""
+    return (
+        OzonSupplyDraft.objects
+        .filter(status__in=SUPPLY_DRAFT_STEPS)
+        .exclude(status__in=DRAFT_FAILED_STATUSES, attempts__gte=MAX_ATTEMPTS)
+    )
+
+
+def due_supply_drafts(now=None, **filters):
+    """Очередь таймеров: черновики, у которых наступил next_attempt_at, в порядке срока."""
+    now = now or timezone.now()
+    return (
+        _waiting_drafts()
+        .filter(Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now), **filters)
+        .select_related("store")
+        .order_by(F("next_attempt_at").asc(nulls_first=True), "created_at")
+    )
+
+
+def due_supply_store_ids(now=None):
+    return list(due_supply_drafts(now).order_by().values_list("store_id", flat=True).distinct())
+
+
+def next_supply_due_at():
+    """Ближайший срок в очереди таймеров (None — отложенных черновиков нет)."""
+    return _waiting_drafts().aggregate(due=Min("next_attempt_at"))["due"]
+
+
+def process_due_supply_drafts(store_id, **filters):
+    """Продвигает на один шаг черновики магазина, чей срок наступил.
+
+    Магазин обрабатывает один процесс (блокировка в кеше). Черновики, упершиеся
+    в троттлинг магазина, остаются в очереди до следующего прохода.
+    Возвращает число выполненных шагов.
+    """
+    lock_key = f"ozon_supply_store_lock:{store_id}"
+    if not cache.add(lock_key, True, timeout=SUPPLY_STORE_LOCK_SECONDS):
+        return 0
+
+    processed = 0
+    throttled = set()
+    try:
+        for draft in due_supply_drafts(store_id=store_id, **filters):
+            step = SUPPLY_DRAFT_STEPS[draft.status]
+            if step in throttled:
+                continue
+            try:
+                done = step(draft, timezone.now())
+            except Exception as exc:  # noqa: BLE001
+                logger.error(f"[❌] Черновик {draft.id} ({draft.status}): {exc}")
+                continue
+            if done:
+                processed += 1
+            else:
+                throttled.add(step)
+    finally:
+        cache.delete(lock_key)
+    return processed
 
 
 def _cleanup_stale_drafts():
@@ -6923,9 +7064,10 @@ def _cleanup_stale_drafts():
     cutoff = timezone.now() - timedelta(minutes=STALE_DRAFT_MINUTES)
     stale = OzonSupplyDraft.objects.filter(created_at__lt=cutoff).exclude(status="created")
 
-    logger.info(f"{stale}")
-    deleted = stale.count()
-    if deleted:
+    batch_ids = set(stale.values_list("batch_id", flat=True))
+    deleted = 0
+    if batch_ids:
+        deleted = stale.count()
         stale.delete()
     empty_batches = (
         OzonSupplyBatch.objects
@@ -6935,9 +7077,28 @@ def _cleanup_stale_drafts():
     empty_count = empty_batches.count()
     if empty_count:
         empty_batches.delete()
+    for batch in OzonSupplyBatch.objects.filter(id__in=batch_ids):
+        _update_batch_status(batch)
     return deleted, empty_count
 
 
+@shared_task(name="Обслуживание партиций продаж и аналитики")
+def maintain_sales_partitions():
+    """Партиции Sale/ProductDailyAnalytics на месяцы вперёд и срок хранения старых (ozon/partitions.py)."""
+    result = maintain_partitions()
+    for table, changes in result.items():
+        logger.info(f"[🧱] {table}: создано партиций {len(changes['created'])}, убрано по сроку хранения {len(changes['removed'])}")
+    return result
+
+
+@shared_task(name="Очистка архива ответов Ozon")
+def prune_payload_archive():
+    """Удаляет из PayloadBlob тела, на которые больше не ссылаются постинги, отчёты и черновики."""
+    deleted = prune_payload_blobs()
+    logger.info(f"[🧹] Архив ответов Ozon: удалено тел без ссылок {deleted}")
+    return deleted
+
+
 def _cleanup_old_postings(days=45):
     cutoff = timezone.now() - timedelta(days=days)
     qs = OzonFbsPosting.objects.filter(archived_at__lt=cutoff)
@@ -6948,152 +7109,14 @@ def _cleanup_old_postings(days=45):
 
 
 def process_supply_batch_sync(batch_uuid: str):
-    """Основной воркер: create draft -> info -> очередь поставок -> обновление батча."""
+    """Продвигает черновики батча, чей срок наступил: create draft -> info -> создание поставки."""
     try:
         batch = OzonSupplyBatch.objects.get(batch_id=batch_uuid)
     except OzonSupplyBatch.DoesNotExist:
         logger.error(f"[❌] Batch {batch_uuid} not found")
         return
 
-    last_call = None
-    drafts_qs = batch.drafts.filter(status__in=["queued", "failed", "in_progress", "draft_created"]).order_by("created_at")
-
-    for draft in drafts_qs:
-        now = timezone.now()
-        if draft.next_attempt_at and draft.next_attempt_at > now:
-            continue
-
-        if draft.attempts >= MAX_ATTEMPTS and draft.status == "failed":
-            continue
-
-        if draft.status == "draft_created":
-            # Опрашиваем /draft/create/info до готовности расчета.
-            # Проверяем готовность info спустя паузу
-            info_payload = {"operation_id": draft.operation_id}
-            headers = {
-                "Client-Id": draft.store.client_id,
-                "Api-Key": draft.store.api_key,
-                "Content-Type": "application/json",
-            }
-            try:
-                resp, info_data = _call_ozon(OZON_DRAFT_INFO_URL, headers, info_payload)
-            except requests.RequestException as exc:
-                draft.error_message = f"Ошибка info-запроса: {exc}"
-                draft.next_attempt_at = now + timedelta(seconds=INFO_RETRY_SECONDS)
-                draft.save(update_fields=["error_message", "next_attempt_at", "updated_at"])
-                continue
-
-            if resp.status_code == 429:
-                draft.next_attempt_at = now + timedelta(seconds=RETRY_429_SECONDS)
-                draft.error_message = "429 на info, повтор позже."
-                draft.save(update_fields=["next_attempt_at", "error_message", "updated_at"])
-                continue
-
-            if resp.status_code >= 400:
-                draft.error_message = f"Ошибка info: {resp.text[:500]}"
-                draft.next_attempt_at = now + timedelta(seconds=INFO_RETRY_SECONDS)
-                draft.save(update_fields=["error_message", "next_attempt_at", "updated_at"])
-                continue
-
-            status_flag = info_data.get("status")
-            draft.response_payload = {"create": draft.response_payload, "info": info_data}
-            if status_flag != "CALCULATION_STATUS_SUCCESS":
-                draft.next_attempt_at = now + timedelta(seconds=INFO_RETRY_SECONDS)
-                draft.error_message = f"Статус {status_flag}, повтор позже."
-                draft.save(update_fields=["response_payload", "next_attempt_at", "error_message", "updated_at"])
-                continue
-
-            draft.draft_id = info_data.get("draft_id")
-            # Приводим список складов к плоскому виду с warehouse_id
-            warehouses = []
-            raw_wh = info_data.get("warehouses") or []
-            if raw_wh:
-                for w in raw_wh:
-                    if w.get("warehouse_id"):
-                        warehouses.append(w)
-            else:
-                clusters = info_data.get("clusters") or []
-                for c in clusters:
-                    for w in c.get("warehouses", []):
-                        sw = w.get("supply_warehouse") or {}
-                        if sw.get("warehouse_id"):
-                            sw = {
-                                **sw,
-                                "status": w.get("status"),
-                                "bundle_ids": w.get("bundle_ids"),
-                                "travel_time_days": w.get("travel_time_days"),
-                            }
-                            warehouses.append(sw)
-
-            draft.supply_warehouse = warehouses
-            if warehouses:
-                draft.selected_supply_warehouse = warehouses[0]
-            draft.status = "info_loaded"
-            draft.error_message = ""
-            draft.save(update_fields=["draft_id", "supply_warehouse", "selected_supply_warehouse", "response_payload", "status", "error_message", "updated_at"])
-            continue
-
-        # Глобальный лимит OZON: максимум 50 черновиков в час.
-        if _hourly_created_count(draft.store) >= MAX_HOURLY_LIMIT:
-            draft.status = "queued"
-            draft.next_attempt_at = now + timedelta(hours=1)
-            draft.error_message = "Достигнут лимит 50 черновиков в час."
-            draft.save(update_fields=["status", "next_attempt_at", "error_message", "updated_at"])
-            continue
-
-        # Троттлинг запросов создания черновиков для магазина.
-        if last_call:
-            diff = (timezone.now() - last_call).total_seconds()
-            if diff < MIN_INTERVAL_SECONDS:
-                time.sleep(MIN_INTERVAL_SECONDS - diff)
-
-        headers = {
-            "Client-Id": draft.store.client_id,
-            "Api-Key": draft.store.api_key,
-            "Content-Type": "application/json",
-        }
-
-        draft.status = "in_progress"
-        draft.attempts += 1
-        draft.next_attempt_at = None
-        draft.error_message = ""
-        draft.save(update_fields=["status", "attempts", "next_attempt_at", "error_message", "updated_at"])
-
-        try:
-            resp, resp_data = _call_ozon(OZON_DRAFT_CREATE_URL, headers, draft.request_payload)
-        except requests.RequestException as exc:
-            draft.status = "failed"
-            draft.error_message = f"Ошибка запроса: {exc}"
-            draft.next_attempt_at = now + timedelta(minutes=1)
-            draft.save(update_fields=["status", "error_message", "next_attempt_at", "updated_at"])
-            continue
-
-        last_call = timezone.now()
-
-        if resp.status_code == 429:
-            draft.status = "queued"
-            draft.next_attempt_at = now + timedelta(seconds=RETRY_429_SECONDS)
-            draft.error_message = "Превышен лимит 429, повтор через 60с."
-            draft.save(update_fields=["status", "next_attempt_at", "error_message", "updated_at"])
-            continue
-
-        if resp.status_code >= 400:
-            draft.status = "failed"
-            draft.response_payload = resp_data
-            draft.error_message = resp.text[:500]
-            draft.save(update_fields=["status", "response_payload", "error_message", "updated_at"])
-            continue
-
-        operation_id = resp_data.get("operation_id") or resp_data.get("result") or ""
-        draft.operation_id = operation_id
-        draft.response_payload = resp_data
-        draft.status = "draft_created"
-        draft.next_attempt_at = now + timedelta(seconds=INFO_RETRY_SECONDS)
-        draft.save(update_fields=["operation_id", "response_payload", "status", "next_attempt_at", "updated_at"])
-
-    _process_supply_create(batch)
-    _update_batch_status(batch)
-    _cleanup_stale_drafts()
+    process_due_supply_drafts(batch.store_id, batch=batch)
 
 
 @shared_task
@@ -1,7 +1,14 @@
+from datetime import date, timedelta
 from decimal import Decimal
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.test import APIRequestFactory, APITestCase
 
 from users.models import (
     User,
@@ -10,7 +17,39 @@ from users.models import (
     StoreRequiredProduct,
     StoreExcludedProduct,
 )
-from ozon.models import OzonWarehouseDirectory, OzonSupplyDraft
+from ozon.models import (
+    OzonWarehouseDirectory,
+    OzonSupplyBatch,
+    OzonSupplyDraft,
+    OzonFbsPosting,
+    CampaignPerformanceReport,
+    CampaignPerformanceReportEntry,
+    CampaignDailySpend,
+    ProductDailyAnalytics,
+    FbsStock,
+    WarehouseStock,
+    ManualCampaign,
+    AdPlanItem,
+    PayloadBlob,
+    Product,
+    Sale,
+)
+from ozon.utils import run_campaign_operations
+from ozon.tasks import (
+    SUPPLY_JOB_TIMESLOTS,
+    InvalidDraftTransition,
+    _hourly_created_count,
+    due_supply_drafts,
+    fetch_batch_timeslots,
+    get_store_jobs_summary,
+    get_supply_job,
+    process_due_supply_drafts,
+    run_store_job,
+    start_supply_job,
+    summarize_store_jobs,
+    transition_draft,
+    update_manual_campaign_kpis_in_sheets,
+)
 
 
 class PlannerViewTests(APITestCase):
@@ -152,3 +191,885 @@ class CreateSupplyDraftViewTests(APITestCase):
         self.assertEqual(OzonSupplyDraft.objects.count(), 2)
         self.assertIn("batch_id", resp.data)
         self.assertEqual(len(resp.data.get("drafts", [])), 2)
+
+    def test_batch_seq_increments_per_store(self):
+        self.client.force_authenticate(self.user)
+        first = self.client.post(self.url, self.payload, format="json")
+        second = self.client.post(self.url, self.payload, format="json")
+
+        self.assertEqual(first.data["batch_seq"], 1)
+        self.assertEqual(second.data["batch_seq"], 2)
+        self.assertTrue(all(d["draft_id"] for d in second.data["drafts"]))
+
+
+class FbsPostingListViewTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(telegram_id=4004, password="pass")
+        self.store = OzonStore.objects.create(user=self.user, name="FbsStore", client_id="cid", api_key="akey")
+        self.url = reverse("ozon-postings-list")
+        now = timezone.now()
+        for index in range(3):
+            OzonFbsPosting.objects.create(
+                store=self.store,
+                posting_number=f"P-{index}",
+                status=OzonFbsPosting.STATUS_AWAITING_PACKAGING,
+                status_changed_at=now - timedelta(minutes=index),
+            )
+        OzonFbsPosting.objects.create(
+            store=self.store,
+            posting_number="P-delivered",
+            status=OzonFbsPosting.STATUS_DELIVERED,
+            status_changed_at=now,
+        )
+        self.client.force_authenticate(self.user)
+
+    @mock.patch("ozon.views._schedule_status_refresh", return_value=True)
+    @mock.patch("ozon.views._sync_fbs_postings_for_status")
+    def test_answers_from_db_and_refreshes_in_background(self, sync_mock, schedule_mock):
+        resp = self.client.get(self.url, {"store_id": self.store.id, "status": "awaiting_packaging", "lite": 1})
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        sync_mock.assert_not_called()
+        schedule_mock.assert_called_once()
+        self.assertTrue(resp.data["refreshing"])
+        self.assertIsNone(resp.data["last_synced_at"])
+        self.assertEqual(resp.data["count"], 3)
+        self.assertEqual(resp.data["total"], 4)
+        self.assertEqual(resp.data["counts"]["delivered"], 1)
+        self.assertEqual(len(resp.data["postings"]), 3)
+
+    @mock.patch("ozon.views._schedule_status_refresh", return_value=False)
+    def test_cursor_pagination(self, schedule_mock):
+        params = {"store_id": self.store.id, "status": "awaiting_packaging", "lite": 1, "page_size": 2}
+        first = self.client.get(self.url, params)
+
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(first.data["count"], 3)
+        self.assertEqual([p["posting_number"] for p in first.data["postings"]], ["P-0", "P-1"])
+        self.assertIsNotNone(first.data["next"])
+
+        second = self.client.get(first.data["next"])
+        self.assertEqual([p["posting_number"] for p in second.data["postings"]], ["P-2"])
+        self.assertIsNone(second.data["next"])
+
+
+    @mock.patch("ozon.views.SYNC_LOCK_WAIT_SECONDS", 0)
+    @mock.patch("ozon.views._acquire_bg_sync_lock", return_value=False)
+    @mock.patch("ozon.views._acquire_sync_lock", return_value=None)
+    @mock.patch("ozon.views._sync_fbs_postings_for_status")
+    def test_refresh_and_labels_report_sync_held_by_another_worker(self, sync_mock, lock_mock, bg_mock):
+        refresh = self.client.post(reverse("ozon-postings-refresh"), {"store_id": self.store.id}, format="json")
+
+        self.assertEqual(refresh.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(refresh.data["sync"]["awaiting_packaging"], {"skipped": "locked"})
+        self.assertEqual(refresh.data["sync"]["awaiting_deliver"], {"skipped": "locked"})
+
+        labels = self.client.post(
+            reverse("ozon-postings-labels"), {"store_id": self.store.id, "posting_numbers": ["P-0"]}, format="json",
+        )
+        self.assertEqual(labels.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(labels.data["skipped"], "locked")
+        sync_mock.assert_not_called()
+
+
+class SupplyDraftBackgroundFetchTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(telegram_id=5005, password="pass")
+        self.store = OzonStore.objects.create(user=self.user, name="SupplyStore", client_id="cid", api_key="akey")
+        self.batch = OzonSupplyBatch.objects.create(
+            store=self.store,
+            batch_seq=1,
+            supply_type="CREATE_TYPE_CROSSDOCK",
+            drop_off_point_warehouse_id=1,
+        )
+        self.cached_draft = self._create_draft(
+            status="created",
+            operation_id_supply="op-1",
+            supply_order_ids=[1],
+            supply_order_response={"orders": [{"state": "READY_TO_SUPPLY"}]},
+            supply_status_updated_at=timezone.now(),
+        )
+        self.client.force_authenticate(self.user)
+
+    def _create_draft(self, **fields):
+        return OzonSupplyDraft.objects.create(
+            batch=self.batch,
+            store=self.store,
+            supply_type="CREATE_TYPE_CROSSDOCK",
+            logistic_cluster_id=154,
+            logistic_cluster_name="Москва",
+            drop_off_point_warehouse_id=1,
+            request_payload={},
+            **fields,
+        )
+
+    @mock.patch("ozon.views.refresh_batch_supply_status")
+    def test_supply_info_serves_cached_drafts_without_ozon(self, task_mock):
+        url = reverse("ozon-draft-supply-info", args=[self.batch.batch_id])
+        resp = self.client.get(url)
+
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        task_mock.delay.assert_not_called()
+        self.assertEqual(resp.data["results"][0]["order_states"], ["READY_TO_SUPPLY"])
+        self.assertTrue(resp.data["results"][0]["cached"])
+
+    @mock.patch("ozon.views.refresh_batch_supply_status")
+    def test_supply_info_refresh_runs_in_background(self, task_mock):
+        pending_draft = self._create_draft(status="created", operation_id_supply="op-2")
+        url = reverse("ozon-draft-supply-info", args=[self.batch.batch_id])
+        resp = self.client.get(url)
+
+        self.assertEqual(resp.status_code, status.HTTP_202_ACCEPTED)
+        task_mock.delay.assert_called_once_with(str(self.batch.batch_id), [pending_draft.id])
+        self.assertEqual(resp.data["pending"], [pending_draft.id])
+        self.assertEqual(len(resp.data["results"]), 1)
+
+        # Пока загрузка идет, повторный опрос не запускает вторую.
+        self.client.get(url)
+        task_mock.delay.assert_called_once()
+
+    @mock.patch("ozon.tasks._call_ozon")
+    def test_fetch_batch_timeslots_saves_each_draft(self, call_mock):
+        draft = self._create_draft(status="info_loaded", draft_id=77)
+        call_mock.return_value = (mock.Mock(status_code=200), {"drop_off_warehouse_timeslots": []})
+        batch_uuid = str(self.batch.batch_id)
+        start_supply_job(batch_uuid, SUPPLY_JOB_TIMESLOTS, [draft.id])
+
+        fetch_batch_timeslots(batch_uuid, [[draft.id, 555]], "2025-12-19T00:00:00Z", "2025-12-20T00:00:00Z")
+
+        draft.refresh_from_db()
+        self.assertEqual(draft.timeslot_response, {"drop_off_warehouse_timeslots": []})
+        self.assertEqual(call_mock.call_args[0][2]["warehouse_ids"], ["555"])
+        job = get_supply_job(batch_uuid, SUPPLY_JOB_TIMESLOTS)
+        self.assertEqual(job["status"], "done")
+        self.assertEqual(job["succeeded"], [draft.id])
+
+
+class SupplyDraftStateMachineTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(telegram_id=6006, password="pass")
+        self.store = OzonStore.objects.create(user=self.user, name="MachineStore", client_id="cid", api_key="akey")
+        self.batch = OzonSupplyBatch.objects.create(
+            store=self.store,
+            batch_seq=1,
+            supply_type="CREATE_TYPE_CROSSDOCK",
+            drop_off_point_warehouse_id=1,
+            active_drafts=2,
+        )
+        self.drafts = [
+            OzonSupplyDraft.objects.create(
+                batch=self.batch,
+                store=self.store,
+                supply_type="CREATE_TYPE_CROSSDOCK",
+                logistic_cluster_id=cluster_id,
+                logistic_cluster_name=f"Кластер {cluster_id}",
+                drop_off_point_warehouse_id=1,
+                request_payload={"cluster_ids": [cluster_id]},
+            )
+            for cluster_id in (1, 2)
+        ]
+
+    @mock.patch("ozon.tasks._call_ozon")
+    def test_due_drafts_are_throttled_per_store(self, call_mock):
+        call_mock.return_value = (mock.Mock(status_code=200), {"operation_id": "op-1"})
+
+        self.assertEqual(process_due_supply_drafts(self.store.id), 1)
+
+        # Второй черновик ждет интервал магазина, а не спит внутри прохода.
+        call_mock.assert_called_once()
+        first, second = (OzonSupplyDraft.objects.get(pk=d.pk) for d in self.drafts)
+        self.assertEqual(first.status, "draft_created")
+        self.assertEqual(second.status, "queued")
+        self.assertEqual(list(due_supply_drafts()), [second])
+        self.assertEqual(_hourly_created_count(self.store), 1)
+
+    def test_transitions_update_batch_counters(self):
+        first, second = self.drafts
+        transition_draft(first, "in_progress")
+        transition_draft(first, "failed", error_message="boom")
+        transition_draft(second, "in_progress")
+        transition_draft(second, "draft_created")
+        transition_draft(second, "info_loaded")
+
+        self.batch.refresh_from_db()
+        self.assertEqual(
+            (self.batch.active_drafts, self.batch.failed_drafts, self.batch.done_drafts, self.batch.status),
+            (0, 1, 1, "partial"),
+        )
+        with self.assertRaises(InvalidDraftTransition):
+            transition_draft(second, "created")
+
+
+class CampaignBulkOperationsTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+
+    @mock.patch("ozon.utils.PERFORMANCE_BULK_RETRY_SECONDS", 0)
+    def test_results_keep_order_and_report_failures(self):
+        def deactivate(access_token, campaign_id):
+            if campaign_id == "2":
+                raise Exception("Deactivate campaign error: 400")
+            return {"state": "CAMPAIGN_STATE_INACTIVE"}
+
+        with mock.patch.dict("ozon.utils.CAMPAIGN_OPERATIONS", {"deactivate": deactivate}):
+            results = run_campaign_operations(
+                "token", [(cid, "deactivate", None) for cid in ("1", "2", "3")], rate_key="test", attempts=2
+            )
+
+        self.assertEqual([r["campaign_id"] for r in results], ["1", "2", "3"])
+        self.assertEqual([r["ok"] for r in results], [True, False, True])
+        self.assertIn("400", results[1]["error"])
+        self.assertEqual(results[0]["response"], {"state": "CAMPAIGN_STATE_INACTIVE"})
+
+
+class CampaignDailySpendTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(telegram_id=7007, password="pass")
+        self.store = OzonStore.objects.create(user=self.user, name="AdsStore", client_id="cid", api_key="akey")
+        now = timezone.now()
+        self.report = CampaignPerformanceReport.objects.create(
+            store=self.store, ozon_campaign_id="42", report_uuid="uuid-1", date_from=now, date_to=now
+        )
+
+    def test_saving_report_entry_updates_ledger(self):
+        day = timezone.localdate()
+        for totals in ({"moneySpent": "1 234,50", "orders": "3", "ordersMoney": "9 000"}, {"moneySpent": "1500"}):
+            CampaignPerformanceReportEntry.objects.update_or_create(
+                store=self.store,
+                ozon_campaign_id="42",
+                report_date=day,
+                defaults={"report": self.report, "totals": totals},
+            )
+            spend = CampaignDailySpend.objects.get(store=self.store, ozon_campaign_id="42", date=day)
+            self.assertEqual(spend.spend, Decimal(str(totals["moneySpent"]).replace(" ", "").replace(",", ".")))
+
+        self.assertEqual((spend.orders, spend.revenue), (0, Decimal("0")))
+        self.assertEqual(CampaignDailySpend.objects.count(), 1)
+
+
+class StoreJobsTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(telegram_id=8008, password="pass")
+        self.stores = [
+            OzonStore.objects.create(user=self.user, name=f"Sheet{i}", client_id=f"cid{i}", api_key="akey")
+            for i in range(2)
+        ]
+
+    @mock.patch("ozon.tasks.update_auto_campaign_kpis_in_sheets")
+    def test_store_job_reports_duration_and_error(self, kpis_mock):
+        kpis_mock.return_value = {"error": "store not set in V23"}
+        result = run_store_job("auto_kpis", self.stores[0].id)
+
+        self.assertEqual(result["error"], "store not set in V23")
+        self.assertGreaterEqual(result["seconds"], 0)
+
+        summary = summarize_store_jobs([result, {"job": "auto_kpis", "store_id": 2, "seconds": 5.0, "error": None}], "auto_kpis")
+        self.assertEqual(list(summary["durations"]), [2, self.stores[0].id])
+        self.assertEqual(len(summary["errors"]), 1)
+        self.assertEqual(get_store_jobs_summary("auto_kpis")["stores"], 2)
+
+    @mock.patch("ozon.tasks.chord")
+    def test_hourly_run_fans_out_per_store(self, chord_mock):
+        for store in self.stores:
+            store.google_sheet_url = f"https://sheets/{store.id}"
+            store.save(update_fields=["google_sheet_url"])
+
+        result = update_manual_campaign_kpis_in_sheets(sa_json_path=__file__)
+
+        self.assertEqual(result["dispatched"], 2)
+        header = chord_mock.call_args[0][0]
+        self.assertEqual([sig.args[1] for sig in header.tasks], [s.id for s in self.stores])
+
+
+class QueueRoutingTests(APITestCase):
+    def test_tasks_routed_by_function_name(self):
+        from backend.celery import app, ping_queue
+        from backend.celery_routing import QUEUES
+        from ozon.tasks import process_supply_batch, sync_all_sales, toggle_store_ads_status
+
+        router = app.amqp.router
+        self.assertEqual(router.route({}, process_supply_batch.name)["queue"].name, "supply")
+        self.assertEqual(router.route({}, run_store_job.name)["queue"].name, "ads-sheets")
+        self.assertEqual(router.route({}, sync_all_sales.name)["queue"].name, "nightly-sync")
+        self.assertEqual(router.route({}, toggle_store_ads_status.name)["queue"].name, "interactive")
+        # Явная очередь при постановке важнее маршрута
+        self.assertEqual(router.route({"queue": "supply"}, sync_all_sales.name)["queue"].name, "supply")
+
+        self.assertEqual(sync_all_sales.soft_time_limit, QUEUES["nightly-sync"]["soft_time_limit"])
+        self.assertEqual(ping_queue.time_limit, QUEUES["interactive"]["time_limit"])
+
+    def test_compose_workers_match_queue_settings(self):
+        import re
+        from pathlib import Path
+
+        from django.conf import settings
+
+        from backend.celery_routing import QUEUES
+
+        compose = Path(settings.BASE_DIR).parent / "docker-compose.yml"
+        if not compose.exists():
+            self.skipTest("docker-compose.yml рядом с backend нет")
+        commands = re.findall(r"celery -A backend worker .*", compose.read_text(encoding="utf-8"))
+        served = set()
+        for command in commands:
+            queues = re.search(r"-Q (\S+)", command).group(1).split(",")
+            concurrency = int(re.search(r"--concurrency=(\d+)", command).group(1))
+            prefetch = int(re.search(r"--prefetch-multiplier=(\d+)", command).group(1))
+            for queue in queues:
+                # Очереди одного воркера делят его слоты: в QUEUES у них одинаковые настройки
+                self.assertEqual(QUEUES[queue]["concurrency"], concurrency, queue)
+                self.assertEqual(QUEUES[queue]["prefetch_multiplier"], prefetch, queue)
+            served.update(queues)
+        self.assertEqual(served, set(QUEUES))
+
+    @mock.patch("ozon.tasks.gspread")
+    @mock.patch("ozon.tasks.Credentials")
+    def test_enabling_ads_queues_sheet_sync_instead_of_running_it(self, creds_mock, gspread_mock):
+        from backend.celery import app
+        from backend.celery_routing import QUEUES
+        from ozon.models import StoreAdControl
+        from ozon.tasks import create_or_update_AD, toggle_store_ads_status
+
+        user = User.objects.create_user(telegram_id=4848, password="pass")
+        store = OzonStore.objects.create(user=user, name="Toggle", client_id="cid", api_key="key")
+        StoreAdControl.objects.create(store=store, is_system_enabled=False)
+        gspread_mock.authorize.return_value.open_by_url.return_value.worksheet.return_value.col_values.return_value = []
+
+        with mock.patch("ozon.tasks.create_or_update_AD") as create_mock:
+            toggle_store_ads_status(store.id, spreadsheet_url="https://sheets.invalid/x", sa_json_path="sa.json", mode="on")
+
+        create_mock.assert_not_called()
+        create_mock.delay.assert_called_once()
+        self.assertEqual(create_mock.delay.call_args.kwargs["spreadsheet_url"], "https://sheets.invalid/x")
+        # Сама актуализация идёт в ads-sheets с её лимитами, а не под лимитом interactive
+        self.assertEqual(app.amqp.router.route({}, create_or_update_AD.name)["queue"].name, "ads-sheets")
+        self.assertEqual(create_or_update_AD.soft_time_limit, QUEUES["ads-sheets"]["soft_time_limit"])
+        self.assertEqual(toggle_store_ads_status.soft_time_limit, QUEUES["interactive"]["soft_time_limit"])
+
+    def test_every_routed_name_is_a_task(self):
+        import backend.celery
+        import ozon.tasks
+        from backend.celery_routing import TASK_QUEUES
+
+        for name in TASK_QUEUES:
+            task = getattr(ozon.tasks, name, None) or getattr(backend.celery, name, None)
+            self.assertTrue(hasattr(task, "delay"), name)
+
+
+class MetricsTests(APITestCase):
+    def setUp(self):
+        from backend.metrics import registry
+
+        cache.clear()
+        registry.series.clear()
+
+    def test_metrics_endpoint_merges_views_and_stages(self):
+        from backend.metrics import record_stage_timings
+
+        self.client.get("/missing-page/")
+        record_stage_timings("planner", {"sales_sec": 0.3, "note": "skip"})
+
+        response = self.client.get("/metrics")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        body = response.content.decode()
+        self.assertIn('http_request_duration_seconds_count{method="GET",status="404",view="unmatched"}', body)
+        self.assertIn('http_request_db_queries_bucket{view="unmatched",le="+Inf"} 1', body)
+        self.assertIn('view_stage_duration_seconds_bucket{stage="sales_sec",view="planner",le="0.5"} 1', body)
+        self.assertNotIn('stage="note"', body)
+
+    def test_outbound_endpoint_drops_identifiers(self):
+        from backend.metrics import outbound_endpoint
+
+        self.assertEqual(outbound_endpoint("/api/client/campaign/123/objects"), "/api/client/campaign/:id/objects")
+        self.assertEqual(outbound_endpoint("/v2/product/list"), "/v2/product/list")
+        self.assertEqual(
+            outbound_endpoint("/v4/spreadsheets/1aBc9xYz:batchUpdate"), "/v4/spreadsheets/:id:batchUpdate"
+        )
+
+
+class SheetSnapshotTests(APITestCase):
+    class FakeWorksheet:
+        title = "Main_ADV"
+
+        def __init__(self, values):
+            self.values = values
+            self.reads = 0
+            self.writes = []
+
+        def get(self, range_name=None, **kwargs):
+            self.reads += 1
+            return self.values
+
+        def batch_update(self, data, value_input_option=None, **kwargs):
+            self.writes.append((value_input_option, data))
+
+    def test_reads_from_memory_and_writes_one_diff(self):
+        from ozon.sheets import SheetSnapshot
+
+        worksheet = self.FakeWorksheet([
+            ["", "", "", "", "", "", "", "", "", "", "", "", "", "", "", "", "", "", "", "", "", "Shop"],
+            ["101", "TRUE", "Активна", "", "Авто"],
+            ["102", "TRUE", "Активна", "", "Ручная"],
+        ])
+        ws = SheetSnapshot.load(worksheet)
+
+        self.assertEqual(ws.acell("V1").value, "Shop")
+        self.assertIsNone(ws.acell("V2").value)
+        self.assertEqual(ws.col_values(5), ["", "Авто", "Ручная"])
+        self.assertEqual(ws.get("A2:C9"), [["101", "TRUE", "Активна"], ["102", "TRUE", "Активна"]])
+        self.assertEqual(ws.get("A5:C9"), [])
+
+        ws.update("C2", [["Активна"]])  # без изменений — в дифф не попадает
+        ws.batch_update([{"range": "C3", "values": [["Неактивна"]]}])
+        ws.update("M2:N3", [[1.5, 2], [3, 4]], value_input_option="USER_ENTERED")
+        ws.batch_clear(["E3:E3"])
+        self.assertEqual(ws.get("C3:E3"), [["Неактивна"]])
+
+        self.assertEqual(ws.flush(), 6)
+        self.assertEqual(worksheet.reads, 1)
+        self.assertEqual(
+            sorted(worksheet.writes, key=lambda w: w[0]),
+            [
+                ("RAW", [{"range": "C3:C3", "values": [["Неактивна"]]}, {"range": "E3:E3", "values": [[""]]}]),
+                ("USER_ENTERED", [{"range": "M2:N3", "values": [[1.5, 2], [3, 4]]}]),
+            ],
+        )
+        self.assertEqual(ws.flush(), 0)
+
+    def test_sheet_run_shares_snapshot_and_defers_write(self):
+        from ozon import sheets
+
+        worksheet = self.FakeWorksheet([["1"]])
+        with mock.patch.object(sheets, "Credentials"), mock.patch.object(sheets, "gspread") as gspread_mock:
+            gspread_mock.authorize.return_value.open_by_url.return_value.worksheet.return_value = worksheet
+            with sheets.sheet_run():
+                first = sheets.open_sheet_snapshot("url", sa_json_path="sa.json")
+                first.update("A1", [["2"]])
+                first.flush()
+                second = sheets.open_sheet_snapshot("url", sa_json_path="sa.json")
+                self.assertIs(first, second)
+                self.assertEqual(second.acell("A1").value, "2")
+                self.assertEqual(worksheet.writes, [])
+
+        self.assertEqual(gspread_mock.authorize.call_count, 1)
+        self.assertEqual(worksheet.writes, [("RAW", [{"range": "A1:A1", "values": [["2"]]}])])
+
+
+class AbcClassifyTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(telegram_id=9009, password="pass")
+        self.store = OzonStore.objects.create(user=self.user, name="AbcStore", client_id="cid", api_key="akey")
+        self.day = timezone.localdate()
+        for sku, revenue, units in ((1, "700", 7), (2, "200", 4), (3, "100", 1), (4, "0", 0)):
+            ProductDailyAnalytics.objects.create(
+                store=self.store, sku=sku, offer_id=f"OF-{sku}", name=f"Item {sku}",
+                date=self.day, revenue=Decimal(revenue), ordered_units=units,
+            )
+        FbsStock.objects.create(store=self.store, product_id=1, sku=1, fbs_sku=1, present=5, warehouse_id=1, warehouse_name="W")
+        WarehouseStock.objects.create(store=self.store, sku=2, warehouse_id=2, warehouse_name="F", available_stock_count=3)
+        ManualCampaign.objects.create(
+            store=self.store, name="Manual", ozon_campaign_id="m-1", sku_list=[2, 3],
+            state=ManualCampaign.CAMPAIGN_STATE_RUNNING,
+        )
+        AdPlanItem.objects.create(store=self.store, sku=1, offer_id="OF-1", ozon_campaign_id="a-1", campaign_name="Auto")
+
+    def test_labels_stock_and_campaigns_from_one_query(self):
+        from ozon.abc import abc_classify
+
+        result = abc_classify(
+            self.store, self.day, self.day, (Decimal("0.7"), Decimal("0.2"), Decimal("0.1")), min_fbs_stock=1,
+        )
+
+        self.assertEqual(result.total_revenue, Decimal("1000"))
+        self.assertEqual([row.sku for row in result.rows], [1, 2, 3])
+        self.assertEqual([row.abc for row in result.rows], ["A", "B", "C"])
+        self.assertEqual([row.cumulative_revenue for row in result.rows], [Decimal("700"), Decimal("900"), Decimal("1000")])
+        self.assertEqual([row.stock_ok for row in result.rows], [True, False, False])
+        self.assertEqual((result.rows[1].fbs_stock, result.rows[1].fbo_stock), (0, 3))
+        self.assertEqual(result.rows[1].avg_price, Decimal("50.0"))
+
+        self.assertEqual(result.rows[0].campaign.ozon_campaign_id, "a-1")
+        self.assertFalse(result.rows[0].campaign.manual)
+        self.assertEqual([c.ozon_campaign_id for c in result.rows[2].manual_campaigns], ["m-1"])
+
+
+class PartitionRetentionTests(APITestCase):
+    class FakeCursor:
+        def __init__(self, names):
+            self.names = names
+            self.statements = []
+
+        def execute(self, sql, params=None):
+            self.statements.append(sql)
+
+        def fetchall(self):
+            return [(name,) for name in self.names]
+
+    def test_month_arithmetic(self):
+        from ozon.partitions import add_months, partition_name
+
+        self.assertEqual(add_months(date(2026, 11, 1), 3), date(2027, 2, 1))
+        self.assertEqual(add_months(date(2026, 1, 1), -1), date(2025, 12, 1))
+        self.assertEqual(partition_name("ozon_sale", date(2026, 3, 1)), "ozon_sale_p202603")
+
+    @mock.patch("ozon.partitions.timezone.localdate", return_value=date(2026, 10, 19))
+    def test_old_partitions_detached_and_archived(self, _localdate):
+        from ozon.partitions import apply_retention
+
+        cursor = self.FakeCursor(["ozon_sale_p202603", "ozon_sale_p202604", "ozon_sale_default"])
+        removed = apply_retention(cursor, "ozon_sale", months=6, action="archive")
+
+        self.assertEqual(removed, ["ozon_sale_p202603"])
+        self.assertIn('ALTER TABLE "ozon_sale" DETACH PARTITION "ozon_sale_p202603"', cursor.statements)
+        self.assertFalse(any("p202604" in sql for sql in cursor.statements if "DETACH" in sql))
+        self.assertEqual(apply_retention(cursor, "ozon_sale", months=0), [])
+
+
+class PayloadArchiveTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(telegram_id=9010, password="pass")
+        self.store = OzonStore.objects.create(user=self.user, name="ArchiveStore", client_id="cid", api_key="akey")
+        self.products = [{"sku": 1, "name": "Кружка", "quantity": 2}]
+
+    def _posting(self, number):
+        return OzonFbsPosting.objects.create(
+            store=self.store,
+            posting_number=number,
+            status=OzonFbsPosting.STATUS_AWAITING_PACKAGING,
+            products=self.products,
+            raw_payload={"posting_number": "same", "products": self.products},
+        )
+
+    def test_payloads_deduplicated_and_loaded_lazily(self):
+        from ozon.payloads import PayloadRef, payload_digest
+
+        self._posting("P-1")
+        self._posting("P-2")
+
+        # Одинаковые ответы двух постингов хранятся одним телом
+        self.assertEqual(PayloadBlob.objects.count(), 2)
+        row = OzonFbsPosting.objects.values_list("products", flat=True).first()
+        self.assertEqual(row, PayloadRef(payload_digest(self.products)))
+
+        postings = list(OzonFbsPosting.objects.order_by("posting_number").with_payloads("products"))
+        with self.assertNumQueries(0):
+            self.assertEqual([p.products for p in postings], [self.products, self.products])
+        with self.assertNumQueries(1):
+            self.assertEqual(postings[0].raw_payload["posting_number"], "same")
+
+    def test_unchanged_payload_not_rewritten_and_orphans_pruned(self):
+        from ozon.payloads import prune_payload_blobs
+
+        posting = self._posting("P-1")
+        posting = OzonFbsPosting.objects.get(pk=posting.pk)
+        posting.products = [dict(item) for item in self.products]
+        with self.assertNumQueries(1):
+            posting.save(update_fields=["products"])
+
+        posting.raw_payload = {"posting_number": "changed"}
+        posting.save()
+        PayloadBlob.objects.update(seen_at=timezone.now() - timedelta(days=30))
+
+        self.assertEqual(prune_payload_blobs(), 1)
+        self.assertEqual(OzonFbsPosting.objects.get(pk=posting.pk).raw_payload, {"posting_number": "changed"})
+
+
+class PerformanceIngestionTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(telegram_id=9011, password="pass")
+        self.store = OzonStore.objects.create(user=self.user, name="PerfStore", client_id="cid", api_key="akey")
+        self.day = timezone.localdate()
+        self.day_start = timezone.make_aware(timezone.datetime.combine(self.day, timezone.datetime.min.time()))
+        self.day_end = timezone.make_aware(timezone.datetime.combine(self.day, timezone.datetime.max.time()))
+
+    def _ingest(self, payload):
+        from ozon.performance_stats import parse_daily_statistics, upsert_daily_reports, upsert_entries
+
+        records = parse_daily_statistics(payload)
+        report_ids = upsert_daily_reports(self.store, self.day, self.day_start, self.day_end, records)
+        return upsert_entries(self.store, self.day, records, report_ids)
+
+    def _payload(self, campaigns, spend="100"):
+        return {"rows": [{"id": str(cid), "title": f"C{cid}", "moneySpent": spend} for cid in range(campaigns)]}
+
+    def test_bulk_upsert_skips_unchanged_and_updates_ledger(self):
+        self.assertEqual(self._ingest(self._payload(5)), 5)
+        self.assertEqual(CampaignPerformanceReportEntry.objects.filter(store=self.store).count(), 5)
+        self.assertEqual(CampaignPerformanceReport.objects.filter(store=self.store).count(), 5)
+
+        # Повторная загрузка тех же данных: только два чтения, без записей
+        with self.assertNumQueries(2):
+            self.assertEqual(self._ingest(self._payload(5)), 0)
+
+        self.assertEqual(self._ingest(self._payload(5, spend="250,5")), 5)
+        spend = CampaignDailySpend.objects.get(store=self.store, ozon_campaign_id="3", date=self.day)
+        self.assertEqual(spend.spend, Decimal("250.50"))
+
+    def test_query_count_independent_of_campaign_count(self):
+        with CaptureQueriesContext(connection) as few:
+            self._ingest(self._payload(3))
+        CampaignPerformanceReportEntry.objects.all().delete()
+        CampaignPerformanceReport.objects.all().delete()
+        with CaptureQueriesContext(connection) as many:
+            self._ingest(self._payload(60))
+        self.assertEqual(len(few), len(many))
+
+
+class BenchmarkSuiteTests(APITestCase):
+    def test_scenarios_run_offline_on_synthetic_store(self):
+        from ozon.benchmarks import (
+            SCENARIOS,
+            OfflineError,
+            ScenarioFailed,
+            SyntheticStoreSpec,
+            compare,
+            generate_store,
+            offline,
+            report,
+            run_benchmarks,
+        )
+
+        spec = SyntheticStoreSpec(skus=20, clusters=3, days=5, manual_campaigns=3, postings_per_day=2)
+        synthetic = generate_store(spec)
+        self.assertEqual(CampaignPerformanceReportEntry.objects.filter(store=synthetic.store).count(), 5 * (6 + 3))
+        self.assertEqual(OzonFbsPosting.objects.filter(store=synthetic.store).count(), 10)
+
+        # run_benchmarks падает на первом сценарии с ошибкой, поэтому дошедшие сюда сценарии успешны
+        results = run_benchmarks(synthetic, repeat=1)
+        self.assertEqual([result.name for result in results], list(SCENARIOS))
+        self.assertTrue(all(result.queries > 0 for result in results))
+
+        with mock.patch.dict(SCENARIOS, {"kpi_manual": lambda synthetic: {"error": "boom"}}), \
+                self.assertRaisesMessage(ScenarioFailed, "kpi_manual: boom"):
+            run_benchmarks(synthetic, names=["kpi_manual"], repeat=1)
+
+        with offline(synthetic), self.assertRaises(OfflineError):
+            import requests
+            requests.get("https://api-seller.ozon.ru/v1/ping")
+
+        data = report(synthetic, results)
+        self.assertEqual(compare(data, data), [])
+        slower = {**data, "results": {name: {**r, "queries": r["queries"] + 1} for name, r in data["results"].items()}}
+        self.assertEqual(len(compare(slower, data)), 6)
+
+
+class StubServerTests(APITestCase):
+    def _start(self, **options):
+        import threading
+        from ozon.stub_server import StubConfig, make_server
+
+        server = make_server(StubConfig(latency_ms=0, jitter_ms=0, **options), port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    def test_fbo_sync_pages_and_backs_off_on_rate_limit(self):
+        import time
+        from ozon.utils import fetch_fbo_sales
+
+        base_url = self._start(rps=2, postings_per_day=30, max_page_size=20)
+        real_sleep = time.sleep
+        with mock.patch("ozon.utils.SELLER_API_URL", base_url), \
+                mock.patch("ozon.utils.time.sleep", side_effect=lambda seconds: real_sleep(min(seconds, 0.5))) as sleep:
+            sales = fetch_fbo_sales("cid", "key", days=2)
+
+        numbers = [sale["posting_number"] for sale in sales]
+        self.assertGreaterEqual(len(numbers), 30)
+        self.assertEqual(len(numbers), len(set(numbers)))
+        # rps=2: часть страниц получила 429 {"code": 8} и ушла в экспоненциальный backoff
+        self.assertIn(mock.call(1), sleep.call_args_list)
+
+    def test_report_is_slow_then_ready_and_sheet_round_trip(self):
+        import requests
+        from django.test import override_settings
+        from ozon import sheets
+
+        base_url = self._start(report_pending_polls=2, report_missing_polls=1)
+        created = requests.post(
+            f"{base_url}/api/client/statistics/json", json={"campaigns": ["11", "12"], "dateFrom": "2026-01-05"},
+        ).json()
+        statuses = []
+        for _ in range(4):
+            resp = requests.get(f"{base_url}/api/client/statistics/report", params={"UUID": created["UUID"]})
+            statuses.append(resp.status_code)
+        self.assertEqual(statuses, [202, 202, 404, 200])
+        self.assertEqual(sorted(resp.json()), ["11", "12"])
+
+        with override_settings(GOOGLE_SHEETS_STUB_URL=base_url):
+            ws = sheets.open_sheet_snapshot("https://sheets.invalid/x", "Main_ADV")
+            ws.update("B2", [["7", "8"]])
+            ws.flush()
+            again = sheets.open_sheet_snapshot("https://sheets.invalid/x", "Main_ADV")
+        self.assertEqual(again.get("B2:C2"), [["7", "8"]])
+
+
+    def test_manual_kpis_run_against_stub_sheet(self):
+        import requests
+        from django.test import override_settings
+        from ozon.benchmarks import SyntheticStoreSpec, generate_store, sheet_values
+        from ozon.tasks import update_manual_campaign_kpis_in_sheets
+
+        base_url = self._start()
+        synthetic = generate_store(SyntheticStoreSpec(skus=10, clusters=2, days=5, manual_campaigns=3, postings_per_day=1))
+        sheet_url = synthetic.store.google_sheet_url
+        requests.post(
+            f"{base_url}/sheets/batch_update", params={"url": sheet_url, "worksheet": "Main_ADV"},
+            json={"data": [{"range": "A1", "values": sheet_values(synthetic)}]},
+        ).raise_for_status()
+
+        with override_settings(GOOGLE_SHEETS_STUB_URL=base_url):
+            result = update_manual_campaign_kpis_in_sheets(spreadsheet_url=sheet_url)
+
+        self.assertNotIn("error", result)
+        self.assertGreater(result["written"], 0)
+
+
+class DeliveryAnalyticsSyncTests(APITestCase):
+    def setUp(self):
+        from ozon.models import DeliveryCluster
+
+        cache.clear()
+        self.user = User.objects.create_user(telegram_id=9013, password="pass")
+        self.store = OzonStore.objects.create(user=self.user, name="DeliveryStore", client_id="cid", api_key="akey")
+        OzonWarehouseDirectory.objects.create(
+            store=self.store, warehouse_id=1, warehouse_type="FULL_FILLMENT", name="Склад",
+            logistic_cluster_id=11, logistic_cluster_name="Москва", logistic_cluster_type="CLUSTER_TYPE_OZON",
+        )
+        self.DeliveryCluster = DeliveryCluster
+        self.details = {
+            (11, "FBS"): [self._entry(1, "FBS", 5), self._entry(2, "FBS", 7)],
+            (11, "FBO"): [self._entry(1, "FBO", 9)],
+            (22, "FBS"): [],
+            (22, "FBO"): [self._entry(3, "FBO", 4)],
+        }
+        self.cluster_list_calls = []
+
+    def _entry(self, sku, schema, supply):
+        return {
+            "item": {"sku": sku, "offer_id": f"OF-{sku}", "delivery_schema": schema},
+            "metrics": {
+                "average_delivery_time": 30, "average_delivery_time_status": "GOOD", "exact_impact_share": 0.1,
+                "attention_level": "LOW", "recommended_supply": supply,
+            },
+        }
+
+    def _post(self, url, headers=None, json=None, timeout=None):
+        response = mock.Mock(status_code=200, headers={})
+        if url.endswith("/details"):
+            key = (json["cluster_id"], json["filters"]["delivery_schema"])
+            if key not in self.details:
+                response.raise_for_status.side_effect = Exception("500")
+            response.json.return_value = {"data": self.details.get(key, [])[json["offset"]:]}
+        elif url.endswith("/cluster/list"):
+            self.cluster_list_calls.append(json["cluster_ids"])
+            response.json.return_value = {"clusters": [{"id": 22, "name": "Казань", "type": "CLUSTER_TYPE_OZON"}]}
+        else:
+            metrics = {"average_delivery_time": 30, "exact_impact_share": 0.1, "lost_profit": 0, "recommended_supply": 1}
+            response.json.return_value = {
+                "total": {"average_delivery_time": 30, "orders_count": {"total": 5}},
+                "data": [{"delivery_cluster_id": 11, "metrics": metrics}, {"delivery_cluster_id": 22, "metrics": metrics}],
+            }
+        return response
+
+    def _sync(self):
+        from ozon.delivery_analytics import sync_cluster_item_analytics, sync_delivery_clusters
+
+        with mock.patch("ozon.delivery_analytics.requests.post", side_effect=self._post), \
+                mock.patch("ozon.delivery_analytics.acquire_rate_slot"):
+            sync_delivery_clusters(self.store)
+            return sync_cluster_item_analytics(self.store)
+
+    def test_bulk_sync_merges_schemas_and_skips_unchanged(self):
+        from ozon.models import DeliveryClusterItemAnalytics
+
+        result = self._sync()
+        # Название кластера 11 — из справочника складов, в cluster/list уходит только 22
+        self.assertEqual(self.cluster_list_calls, [["22"]])
+        self.assertEqual(
+            dict(self.DeliveryCluster.objects.filter(store=self.store).values_list("delivery_cluster_id", "name")),
+            {11: "Москва", 22: "Казань"},
+        )
+        self.assertEqual((result.written, result.unchanged, result.deleted), (3, 0, 0))
+        row = DeliveryClusterItemAnalytics.objects.get(store=self.store, cluster_id=11, sku=1)
+        self.assertEqual((row.recommended_supply_FBS, row.recommended_supply_FBO, row.recommended_supply), (5, 9, 9))
+        self.assertEqual(row.delivery_schema, "FBO")
+
+        result = self._sync()
+        self.assertEqual((result.written, result.unchanged, result.deleted), (0, 3, 0))
+
+        # sku 2 пропал из выдачи, кластер 22 не загрузился — его строки остаются
+        self.details[(11, "FBS")] = [self._entry(1, "FBS", 12)]
+        del self.details[(22, "FBS")]
+        result = self._sync()
+        self.assertEqual((result.written, result.deleted, result.failed_clusters), (1, 1, [22]))
+        self.assertEqual(
+            sorted(DeliveryClusterItemAnalytics.objects.filter(store=self.store).values_list("cluster_id", "sku", "recommended_supply")),
+            [(11, 1, 12), (22, 3, 4)],
+        )
+
+
+class PlannerSnapshotTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(telegram_id=9014, password="pass")
+        self.store = OzonStore.objects.create(user=self.user, name="SnapStore", client_id="cid", api_key="akey")
+        Product.objects.create(store=self.store, product_id=1, sku=101, offer_id="A", price=Decimal("200"))
+        Product.objects.create(store=self.store, product_id=2, sku=102, offer_id="B", price=Decimal("900"))
+        now = timezone.now()
+        for days_ago, qty in ((1, 2), (1, 3), (20, 5)):
+            Sale.objects.create(
+                store=self.store, sale_type=Sale.FBO, sku=101, date=now - timedelta(days=days_ago), quantity=qty,
+                price=Decimal("10"), payout=0, commission_amount=0, cluster_to="Москва", status="delivered",
+            )
+        WarehouseStock.objects.create(
+            store=self.store, sku=101, warehouse_id=1, warehouse_name="W", cluster_name="",
+            available_stock_count=4, requested_stock_count=6, transit_stock_count=1,
+        )
+        FbsStock.objects.create(store=self.store, product_id=1, sku=101, fbs_sku=101, present=7, warehouse_id=1)
+
+    def _since(self, days):
+        return (timezone.now() - timedelta(days=days - 1)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def test_snapshot_matrices_and_reuse(self):
+        from ozon.planner_snapshot import get_snapshot
+
+        snapshot = get_snapshot(self.store)
+        self.assertEqual(snapshot.sales(self._since(7)), [("Москва", 101, 5, 50.0)])
+        self.assertEqual(snapshot.sales(self._since(30)), [("Москва", 101, 10, 100.0)])
+        self.assertEqual(snapshot.stocks, ({"Без кластера": {101: 11}}, {101: 11}))
+        self.assertEqual(snapshot.available_stocks, ({"Без кластера": {101: 5}}, {101: 5}))
+        self.assertEqual(snapshot.fbs_by_sku, {101: 7})
+        self.assertEqual([p.sku for p in snapshot.products(100, 500)], [101])
+
+        # Та же версия данных: без запросов к БД, для всех эндпоинтов
+        with self.assertNumQueries(0):
+            self.assertIs(get_snapshot(self.store), snapshot)
+
+        # Новая продажа меняет версию: снимок собирается заново
+        Sale.objects.create(
+            store=self.store, sale_type=Sale.FBS, sku=102, date=timezone.now(), quantity=1,
+            price=Decimal("900"), payout=0, commission_amount=0, cluster_to="Казань", status="delivered",
+        )
+        rebuilt = get_snapshot(self.store)
+        self.assertIsNot(rebuilt, snapshot)
+        self.assertIn(("Казань", 102, 1, 900.0), rebuilt.sales(self._since(7)))
+
+    def test_views_share_one_snapshot(self):
+        from ozon.views import ProductAnalyticsByItemView
+
+        self.client.force_authenticate(self.user)
+        response = self.client.post(reverse("ozon-planner"), {"store_id": self.store.id}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        request = APIRequestFactory().post("/", {"Api-Key": "akey", "client_id": "cid", "days": 30}, format="json")
+        with CaptureQueriesContext(connection) as queries:
+            response = ProductAnalyticsByItemView.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([q for q in queries.captured_queries if "ozon_sale" in q["sql"]])
+        product = response.data["products"][0]
+        self.assertEqual((product["sku"], product["stock_total"], product["sales_total_fbo_fbs"]), (101, 5, 10))
@@ -1,15 +1,24 @@
 import requests
 from datetime import datetime, timedelta
 
-from .models import Category, ProductType
+from .models import Category, ProductType, OzonWarehouseDirectory
 from pprint import pprint
 import logging
 from time import sleep
 import time
 from django.utils import timezone
+from django.conf import settings
+from django.core.cache import cache
 from users.models import OzonStore
 logger = logging.getLogger(__name__)
 
+# Базовые адреса Seller и Performance API (в settings их можно направить на локальный стаб)
+SELLER_API_URL = settings.OZON_SELLER_API_URL
+PERFORMANCE_API_URL = settings.OZON_PERFORMANCE_API_URL
+
+# Сколько живет в кеше карта "название кластера → кластер" магазина.
+CLUSTER_MAP_CACHE_SECONDS = 3600
+
 
 class OzonApiError(Exception):
     def __init__(self, message, status_code=None, response_text=None):
@@ -17,6 +26,60 @@ class OzonApiError(Exception):
         self.status_code = status_code
         self.response_text = response_text
 
+def _cluster_map_cache_key(store_id):
+    return f"ozon_cluster_map:{store_id}"
+
+
+def _cluster_names_cache_key(store_id):
+    return f"ozon_cluster_names:{store_id}"
+
+
+def get_cluster_map(store):
+    """Карта логистических кластеров магазина: casefold-название → (id, название).
+
+    Одним запросом к справочнику складов вместо iexact-запроса на каждую отгрузку.
+    Кешируется до следующей синхронизации справочника (invalidate_cluster_map).
+    """
+    key = _cluster_map_cache_key(store.id)
+    cluster_map = cache.get(key)
+    if cluster_map is None:
+        cluster_map = {}
+        rows = (
+            OzonWarehouseDirectory.objects.filter(store=store)
+            .order_by("id")
+            .values_list("logistic_cluster_name", "logistic_cluster_id")
+        )
+        for cluster_name, cluster_id in rows:
+            cluster_map.setdefault(cluster_name.casefold(), (cluster_id, cluster_name))
+        cache.set(key, cluster_map, timeout=CLUSTER_MAP_CACHE_SECONDS)
+    return cluster_map
+
+
+def get_cluster_names(store):
+    """Названия логистических кластеров магазина из справочника складов: id → (название, тип).
+
+    Кешируется вместе с картой кластеров и сбрасывается тем же invalidate_cluster_map.
+    """
+    key = _cluster_names_cache_key(store.id)
+    names = cache.get(key)
+    if names is None:
+        names = {}
+        rows = (
+            OzonWarehouseDirectory.objects.filter(store=store)
+            .order_by("id")
+            .values_list("logistic_cluster_id", "logistic_cluster_name", "logistic_cluster_type")
+        )
+        for cluster_id, cluster_name, cluster_type in rows:
+            if cluster_name:
+                names.setdefault(cluster_id, (cluster_name, cluster_type))
+        cache.set(key, names, timeout=CLUSTER_MAP_CACHE_SECONDS)
+    return names
+
+
+def invalidate_cluster_map(store):
+    cache.delete_many([_cluster_map_cache_key(store.id), _cluster_names_cache_key(store.id)])
+
+
 def fetch_all_products_from_ozon(client_id, api_key):
     """
     Возвращает все товары с Ozon API.
@@ -27,7 +90,7 @@ def fetch_all_products_from_ozon(client_id, api_key):
         "Content-Type": "application/json"
     }
 
-    url = "https://api-seller.ozon.ru/v3/product/list"
+    url = f"{SELLER_API_URL}/v3/product/list"
     last_id = ""
     all_items = []
 
@@ -56,7 +119,7 @@ def fetch_detailed_products_from_ozon(client_id, api_key, product_ids):
     """
     Делает батч-запросы по 1000 product_id к Ozon /v3/product/info/list
     """
-    url = "https://api-seller.ozon.ru/v3/product/info/list"
+    url = f"{SELLER_API_URL}/v3/product/info/list"
     headers = {
         "Client-Id": client_id,
         "Api-Key": api_key,
@@ -80,7 +143,7 @@ def fetch_detailed_products_from_ozon(client_id, api_key, product_ids):
 
 
 def fetch_and_save_category_tree(client_id, api_key):
-    url = "https://api-seller.ozon.ru/v1/description-category/tree"
+    url = f"{SELLER_API_URL}/v1/description-category/tree"
     headers = {
         "Client-Id": client_id,
         "Api-Key": api_key,
@@ -123,7 +186,7 @@ def fetch_warehouse_stock(client_id, api_key, skus: list):
     """
     Делает запрос к Ozon API и возвращает данные по остаткам на складах по SKU.
     """
-    url = "https://api-seller.ozon.ru/v1/analytics/stocks"
+    url = f"{SELLER_API_URL}/v1/analytics/stocks"
     headers = {
         "Client-Id": client_id,
         "Api-Key": api_key,
@@ -151,7 +214,7 @@ def fetch_warehouse_stock(client_id, api_key, skus: list):
 
 def fetch_fbo_sales(client_id, api_key, days: int = 7):
     logging.info(f"Enter FBO: {days} days")
-    url = "https://api-seller.ozon.ru/v2/posting/fbo/list"
+    url = f"{SELLER_API_URL}/v2/posting/fbo/list"
     headers = {
         "Client-Id": client_id,
         "Api-Key": api_key,
@@ -242,7 +305,7 @@ def fetch_fbo_sales(client_id, api_key, days: int = 7):
 
 def fetch_fbs_sales(client_id, api_key, days: int = 7):
     logging.info(f"Enter FBS: {days} days")
-    url = "https://api-seller.ozon.ru/v3/posting/fbs/list"
+    url = f"{SELLER_API_URL}/v3/posting/fbs/list"
     headers = {
         "Client-Id": client_id,
         "Api-Key": api_key,
@@ -339,7 +402,7 @@ def fetch_fbs_sales(client_id, api_key, days: int = 7):
 
 
 def fetch_fbs_postings(client_id, api_key, status=None, since=None, to=None, limit=1000):
-    url = "https://api-seller.ozon.ru/v3/posting/fbs/list"
+    url = f"{SELLER_API_URL}/v3/posting/fbs/list"
     headers = {
         "Client-Id": client_id,
         "Api-Key": api_key,
@@ -397,7 +460,7 @@ def fetch_fbs_postings(client_id, api_key, status=None, since=None, to=None, lim
 
 def fetch_fbs_stocks(client_id, api_key, sku_list):
     
-    url = "https://api-seller.ozon.ru/v1/product/info/stocks-by-warehouse/fbs"
+    url = f"{SELLER_API_URL}/v1/product/info/stocks-by-warehouse/fbs"
     headers = {
         "Client-Id": client_id,
         "Api-Key": api_key,
@@ -442,7 +505,7 @@ def request_performance_token(client_id: str, client_secret: str) -> dict:
     if not client_id or not client_secret:
         raise ValueError("client_id и client_secret обязательны для получения токена Performance API")
 
-    url = "https://api-performance.ozon.ru/api/client/token"
+    url = f"{PERFORMANCE_API_URL}/api/client/token"
     headers = {
         "Content-Type": "application/json",
         "Accept": "application/json",
@@ -512,7 +575,7 @@ def create_cpc_product_campaign(
     auto_increase_percent: int = 0,
 ):
     """Создать кампанию и сразу добавить в неё SKU (правило: 1 кампания = 1 SKU)."""
-    url = "https://api-performance.ozon.ru/api/client/campaign/cpc/v2/product"
+    url = f"{PERFORMANCE_API_URL}/api/client/campaign/cpc/v2/product"
     headers = {
         "Authorization": f"Bearer {access_token}",
         "Content-Type": "application/json",
@@ -546,7 +609,7 @@ def create_cpc_product_campaign(
         logger.info(f"[ℹ️] Ответ создания кампании: {data}")
         raise Exception("Не удалось получить campaignId из ответа создания кампании")
     # Добавляем SKU в кампанию
-    add_url = f"https://api-performance.ozon.ru/api/client/campaign/{campaign_id}/products"
+    add_url = f"{PERFORMANCE_API_URL}/api/client/campaign/{campaign_id}/products"
     add_payload = {"bids": [{"sku": str(sku)}]}
     logger.info(f"[📦] Добавление товара SKU={sku} в кампанию {campaign_id}")
     add_resp = requests.post(add_url, headers=headers, json=add_payload, timeout=20)
@@ -620,7 +683,7 @@ def update_campaign_budget(
     Returns:
         dict: Ответ от API Ozon
     """
-    url = f"https://api-performance.ozon.ru/api/client/campaign/{campaign_id}"
+    url = f"{PERFORMANCE_API_URL}/api/client/campaign/{campaign_id}"
     headers = {
         "Authorization": f"Bearer {access_token}",
         "Content-Type": "application/json",
@@ -727,7 +790,7 @@ def activate_campaign(access_token: str, campaign_id: str):
     Returns:
         dict: Ответ от API Ozon
     """
-    url = f"https://api-performance.ozon.ru/api/client/campaign/{campaign_id}/activate"
+    url = f"{PERFORMANCE_API_URL}/api/client/campaign/{campaign_id}/activate"
     headers = {
         "Authorization": f"Bearer {access_token}",
         "Content-Type": "application/json",
@@ -784,7 +847,7 @@ def deactivate_campaign(access_token: str, campaign_id: str):
     Returns:
         dict: Ответ от API Ozon
     """
-    url = f"https://api-performance.ozon.ru/api/client/campaign/{campaign_id}/deactivate"
+    url = f"{PERFORMANCE_API_URL}/api/client/campaign/{campaign_id}/deactivate"
     headers = {
         "Authorization": f"Bearer {access_token}",
         "Content-Type": "application/json",
@@ -824,3 +887,101 @@ def deactivate_campaign_for_store(store: OzonStore, campaign_id: str):
         raise Exception("Не удалось получить access_token для магазина")
     
     return deactivate_campaign(access_token=access_token, campaign_id=campaign_id)
+
+
+# =============================
+# Performance API: массовые операции с кампаниями
+# =============================
+
+# Одновременных запросов к Performance API и запросов в секунду на магазин.
+PERFORMANCE_BULK_CONCURRENCY = 4
+PERFORMANCE_BULK_RPS = 5
+PERFORMANCE_BULK_ATTEMPTS = 3
+PERFORMANCE_BULK_RETRY_SECONDS = 2
+
+CAMPAIGN_OPERATIONS = {
+    "activate": activate_campaign,
+    "deactivate": deactivate_campaign,
+    "update_budget": update_campaign_budget,
+}
+
+
+def acquire_rate_slot(key: str, rps: int):
+    """Ждет свободное место в бюджете `rps` запросов в секунду для ключа.
+
+    Счетчик текущей секунды лежит в общем кеше, поэтому бюджет
+    соблюдается сразу всеми потоками и воркерами.
+    """
+    while True:
+        window = int(time.time())
+        window_key = f"{key}:{window}"
+        cache.add(window_key, 0, timeout=5)
+        try:
+            used = cache.incr(window_key)
+        except ValueError:
+            # Ключ истек между add и incr — пробуем в новом окне.
+            continue
+        if used <= rps:
+            return
+        time.sleep(max(0.0, window + 1 - time.time()))
+
+
+def performance_rate_key(store: OzonStore) -> str:
+    return f"performance_rate:{store.id}"
+
+
+def run_campaign_operations(
+    access_token: str,
+    operations: list,
+    rate_key: str,
+    concurrency: int = PERFORMANCE_BULK_CONCURRENCY,
+    rps: int = PERFORMANCE_BULK_RPS,
+    attempts: int = PERFORMANCE_BULK_ATTEMPTS,
+):
+    """
+    Выполняет операции с кампаниями параллельно в пределах лимита Performance API.
+
+    Args:
+        access_token: Токен доступа к Performance API
+        operations: Список (campaign_id, action, kwargs), action — ключ CAMPAIGN_OPERATIONS
+        rate_key: Ключ бюджета запросов (обычно по магазину)
+
+    Returns:
+        list[dict]: По операции на элемент, в порядке operations:
+            {"campaign_id", "action", "ok", "response" | "error"}
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    def _run(operation):
+        campaign_id, action, kwargs = operation
+        func = CAMPAIGN_OPERATIONS[action]
+        result = {"campaign_id": str(campaign_id), "action": action, "ok": False}
+        for attempt in range(1, attempts + 1):
+            acquire_rate_slot(rate_key, rps)
+            try:
+                result["response"] = func(access_token=access_token, campaign_id=str(campaign_id), **(kwargs or {}))
+                result["ok"] = True
+                return result
+            except Exception as exc:
+                result["error"] = str(exc)
+                logger.warning(f"[⚠️] {action} {campaign_id} (попытка {attempt}/{attempts}) не удалась: {exc}")
+                if attempt < attempts:
+                    time.sleep(PERFORMANCE_BULK_RETRY_SECONDS)
+        return result
+
+    if not operations:
+        return []
+    workers = max(1, min(concurrency, len(operations)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="perf-bulk") as pool:
+        return list(pool.map(_run, operations))
+
+
+def run_campaign_operations_for_store(store: OzonStore, operations: list, **kwargs):
+    """Удобная обёртка: один токен на все операции магазина и общий бюджет запросов магазина."""
+    if not operations:
+        return []
+    token_info = get_store_performance_token(store)
+    access_token = token_info.get("access_token")
+    if not access_token:
+        raise Exception("Не удалось получить access_token для магазина")
+    return run_campaign_operations(access_token, operations, rate_key=performance_rate_key(store), **kwargs)
@@ -1,12 +1,14 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import generics, permissions, status
+from rest_framework.pagination import CursorPagination
 from django.shortcuts import get_object_or_404
 from django.http import HttpResponse, FileResponse
 from django.conf import settings
 from django.core.cache import cache
-from django.db import close_old_connections
+from django.db import close_old_connections, transaction
 from users.models import User, OzonStore, StoreFilterSettings, StoreAccess
+from users.store_index import get_store_by_api_key, resolve_store
 from .models import (
     Product,
     Category,
@@ -14,6 +16,7 @@ from .models import (
     WarehouseStock,
     OzonWarehouseDirectory,
     OzonSupplyBatch,
+    OzonSupplyBatchSequence,
     OzonSupplyDraft,
     Sale,
     FbsStock,
@@ -35,7 +38,9 @@ from .utils import (
     fetch_fbo_sales,
     fetch_fbs_stocks,
     fetch_fbs_postings,
+    get_cluster_map,
     OzonApiError,
+    SELLER_API_URL,
 )
 from .serializers import (
     DraftCreateSerializer,
@@ -51,6 +56,7 @@ from .serializers import (
 )
 import time
 from django.db.models import Sum, F, Count, Q, Prefetch
+from django.db.models.functions import Coalesce
 from datetime import datetime, timedelta
 from django.utils import timezone
 from django.utils.dateparse import parse_datetime
@@ -58,9 +64,11 @@ from collections import defaultdict
 import csv
 import os
 import threading
+import uuid
 
 from PyPDF2 import PdfReader, PdfWriter
 import fitz
+from .planner_snapshot import get_snapshot, invalidate as invalidate_planner_snapshot
 from .tasks import (
     update_abc_sheet,
     create_or_update_AD,
@@ -69,10 +77,20 @@ from .tasks import (
     rebalance_auto_weekly_budgets,
     sync_warehouse_stock_for_store,
     _update_batch_status,
+    transition_draft,
+    InvalidDraftTransition,
+    fetch_batch_timeslots,
+    refresh_batch_supply_status,
+    get_supply_job,
+    start_supply_job,
+    finish_supply_job,
+    SUPPLY_JOB_TIMESLOTS,
+    SUPPLY_JOB_SUPPLY_STATUS,
 )
 
 import logging
 import requests
+from backend.metrics import record_stage_timings
 
 
 def user_store_queryset(user):
@@ -125,6 +143,15 @@ POSTING_STATUS_FIELDS = {
 AUTO_SYNC_MIN_SECONDS = 30
 # Минимальный интервал для фонового синка delivering/delivered/cancelled (в секундах).
 BACKGROUND_SYNC_MIN_SECONDS = 600
+# Сколько живет блокировка синка одного статуса магазина, если воркер упал не освободив ее.
+SYNC_LOCK_TIMEOUT_SECONDS = 300
+# Сколько запрос ждет синк, уже запущенный другим воркером, прежде чем отдать данные из БД.
+SYNC_LOCK_WAIT_SECONDS = 20
+SYNC_LOCK_POLL_SECONDS = 0.5
+# Результат _sync_status_once, если за SYNC_LOCK_WAIT_SECONDS другой воркер так и не отпустил синк
+SYNC_SKIPPED_LOCKED = "locked"
+# Сколько живет блокировка фонового синка магазина (все фоновые статусы подряд).
+BACKGROUND_SYNC_LOCK_SECONDS = 900
 
 
 def _sync_cache_key(store_id, status):
@@ -143,6 +170,7 @@ def _get_last_sync_time(store_id, status):
 
 def _set_last_sync_time(store_id, status, sync_time):
     # FBS: сохранить время последней синхронизации статуса.
+    # Время хранится в общем кеше (Redis), поэтому его видят все веб-воркеры и Celery.
     key = _sync_cache_key(store_id, status)
     cache.set(key, sync_time.timestamp(), timeout=3600)
 
@@ -163,7 +191,7 @@ def _sync_bg_lock_key(store_id):
 
 def _acquire_bg_sync_lock(store_id):
     # FBS: пробует взять блокировку фонового синка.
-    return cache.add(_sync_bg_lock_key(store_id), True, timeout=60)
+    return cache.add(_sync_bg_lock_key(store_id), True, timeout=BACKGROUND_SYNC_LOCK_SECONDS)
 
 
 def _release_bg_sync_lock(store_id):
@@ -171,6 +199,57 @@ def _release_bg_sync_lock(store_id):
     cache.delete(_sync_bg_lock_key(store_id))
 
 
+def _sync_lock_key(store_id, status):
+    # FBS: ключ блокировки синка одного статуса магазина.
+    return f"fbs_sync_lock:{store_id}:{status}"
+
+
+def _acquire_sync_lock(store_id, status):
+    # FBS: пробует взять блокировку синка статуса, возвращает токен владельца или None.
+    token = uuid.uuid4().hex
+    if cache.add(_sync_lock_key(store_id, status), token, timeout=SYNC_LOCK_TIMEOUT_SECONDS):
+        return token
+    return None
+
+
+def _release_sync_lock(store_id, status, token):
+    # FBS: освобождает блокировку, только если она еще наша (не истекла и не перехвачена).
+    key = _sync_lock_key(store_id, status)
+    if cache.get(key) == token:
+        cache.delete(key)
+
+
+def _sync_status_once(store, status_value, since, to, limit, min_seconds=None, force=False):
+    # FBS: синк статуса, который выполняется один раз на весь кластер.
+    # Если тот же статус магазина уже синкает другой воркер, ждем его и используем результат.
+    # Возвращает результат синка или None, если синк не понадобился или его сделал другой воркер;
+    # {"skipped": "locked"}, если другой воркер не закончил синк за SYNC_LOCK_WAIT_SECONDS.
+    requested_at = timezone.now()
+    if not force and not _should_sync(store.id, status_value, min_seconds=min_seconds):
+        return None
+
+    deadline = time.monotonic() + SYNC_LOCK_WAIT_SECONDS
+    token = _acquire_sync_lock(store.id, status_value)
+    while token is None:
+        if time.monotonic() >= deadline:
+            logging.info("FBS sync %s/%s is still running elsewhere, serving stored data", store.id, status_value)
+            return {"skipped": SYNC_SKIPPED_LOCKED}
+        time.sleep(SYNC_LOCK_POLL_SECONDS)
+        token = _acquire_sync_lock(store.id, status_value)
+
+    try:
+        last = _get_last_sync_time(store.id, status_value)
+        if last and last >= requested_at:
+            return None
+        if not force and not _should_sync(store.id, status_value, min_seconds=min_seconds):
+            return None
+        result = _sync_fbs_postings_for_status(store, status_value, since, to, limit)
+        _set_last_sync_time(store.id, status_value, result["sync_time"])
+        return result
+    finally:
+        _release_sync_lock(store.id, status_value, token)
+
+
 def _resolve_sync_window(since, to):
     # FBS: вычисляет окно синка (по умолчанию 3 месяца).
     if since is None and to is None:
@@ -310,15 +389,31 @@ def _sync_fbs_postings_for_status(store, status_value, since, to, limit, sync_ti
         "posting_numbers": posting_numbers,
     }
 
-# FBS: считает количества постингов по статусам.
-def _get_posting_counts(store, include_archived=True):
+# FBS: считает количества постингов по статусам одним агрегатным запросом.
+# match — фильтр списка постингов, его количество возвращается третьим значением.
+def _aggregate_posting_counts(store, include_archived=True, match=None):
     qs = OzonFbsPosting.objects.filter(store=store)
     if not include_archived:
         qs = qs.filter(archived_at__isnull=True)
-    counts = {item["status"]: item["count"] for item in qs.values("status").annotate(count=Count("id"))}
-    response_counts = {status: counts.get(status, 0) for status in POSTING_STATUSES}
-    response_counts["unknown"] = counts.get(OzonFbsPosting.STATUS_UNKNOWN, 0)
-    return response_counts, sum(counts.values())
+    statuses = sorted(POSTING_STATUSES)
+    aggregates = {
+        f"status_{index}": Count("id", filter=Q(status=status_value))
+        for index, status_value in enumerate(statuses)
+    }
+    aggregates["unknown"] = Count("id", filter=Q(status=OzonFbsPosting.STATUS_UNKNOWN))
+    aggregates["total"] = Count("id")
+    if match is not None:
+        aggregates["matched"] = Count("id", filter=match)
+    row = qs.aggregate(**aggregates)
+    response_counts = {status_value: row[f"status_{index}"] for index, status_value in enumerate(statuses)}
+    response_counts["unknown"] = row["unknown"]
+    return response_counts, row["total"], row.get("matched")
+
+
+# FBS: считает количества постингов по статусам.
+def _get_posting_counts(store, include_archived=True):
+    response_counts, total, _ = _aggregate_posting_counts(store, include_archived=include_archived)
+    return response_counts, total
 
 # FBS: фоновой синк delivering/delivered/cancelled.
 def _background_sync_statuses(store_id, statuses, since_str, to_str, limit):
@@ -331,17 +426,15 @@ def _background_sync_statuses(store_id, statuses, since_str, to_str, limit):
 
     try:
         for status_value in statuses:
-            if not _should_sync(store_id, status_value, min_seconds=BACKGROUND_SYNC_MIN_SECONDS):
-                continue
             try:
-                result = _sync_fbs_postings_for_status(
+                _sync_status_once(
                     store,
                     status_value,
                     since_str,
                     to_str,
                     limit,
+                    min_seconds=BACKGROUND_SYNC_MIN_SECONDS,
                 )
-                _set_last_sync_time(store_id, status_value, result["sync_time"])
             except OzonApiError as exc:
                 if exc.status_code in (401, 403):
                     store.api_key_invalid_at = timezone.now()
@@ -351,6 +444,53 @@ def _background_sync_statuses(store_id, statuses, since_str, to_str, limit):
         _release_bg_sync_lock(store_id)
         close_old_connections()
 
+def _refresh_lock_key(store_id, status):
+    # FBS: ключ "обновление статуса уже запланировано".
+    return f"fbs_sync_refresh:{store_id}:{status}"
+
+
+# FBS: stale-while-revalidate — фоновое обновление статусов, которые показывает список.
+def _refresh_statuses(store_id, statuses, since_str, to_str, force):
+    close_old_connections()
+    try:
+        store = OzonStore.objects.get(id=store_id)
+        for status_value in statuses:
+            try:
+                _sync_status_once(store, status_value, since_str, to_str, limit=1000, force=force)
+            except OzonApiError as exc:
+                if exc.status_code in (401, 403):
+                    store.api_key_invalid_at = timezone.now()
+                    store.save(update_fields=["api_key_invalid_at"])
+                logging.error("Refresh sync error for %s: %s", status_value, exc)
+    except OzonStore.DoesNotExist:
+        pass
+    finally:
+        for status_value in statuses:
+            cache.delete(_refresh_lock_key(store_id, status_value))
+        close_old_connections()
+
+
+def _schedule_status_refresh(store, statuses, since_str, to_str, force=False):
+    # FBS: запускает фоновое обновление устаревших статусов и сразу возвращается.
+    # Один статус магазина обновляется одним потоком на весь кластер.
+    # Возвращает True, если обновление идет (запущено сейчас или раньше).
+    stale = [
+        status_value for status_value in statuses
+        if force or _should_sync(store.id, status_value)
+    ]
+    to_start = [
+        status_value for status_value in stale
+        if cache.add(_refresh_lock_key(store.id, status_value), True, timeout=SYNC_LOCK_TIMEOUT_SECONDS)
+    ]
+    if to_start:
+        threading.Thread(
+            target=_refresh_statuses,
+            args=(store.id, to_start, since_str, to_str, force),
+            daemon=True,
+        ).start()
+    return bool(stale)
+
+
 # FBS: создает директорию для файлов этикеток.
 def _ensure_label_dir(store_id):    
     labels_dir = os.path.join(settings.MEDIA_ROOT, "ozon", "labels", str(store_id))
@@ -366,7 +506,7 @@ def _download_label_file(file_url, target_path):
 
 # FBS: проверяет статус задачи этикетки в OZON.
 def _fetch_label_task_status(store, task_id):    
-    url = "https://api-seller.ozon.ru/v1/posting/fbs/package-label/get"
+    url = f"{SELLER_API_URL}/v1/posting/fbs/package-label/get"
     headers = {
         "Client-Id": store.client_id,
         "Api-Key": store.api_key,
@@ -487,7 +627,7 @@ class SyncOzonProductView(APIView):
             return Response({"error": "Missing Api-Key header"}, status=status.HTTP_401_UNAUTHORIZED)
 
         try:
-            ozon_store = OzonStore.objects.get(api_key=api_key, client_id=client_id)
+            ozon_store = get_store_by_api_key(api_key, client_id)
 
         except OzonStore.DoesNotExist:
             return Response({"error": "Invalid Api-Key"}, status=status.HTTP_403_FORBIDDEN)
@@ -555,7 +695,7 @@ class SyncOzonCategoryTreeView(APIView):
             return Response({"error": "Missing Api-Key"}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            ozon_store = OzonStore.objects.get(api_key=api_key, client_id=client_id)
+            ozon_store = get_store_by_api_key(api_key, client_id)
         except OzonStore.DoesNotExist:
             return Response({"error": "Invalid Api-Key"}, status=status.HTTP_403_FORBIDDEN)
 
@@ -575,7 +715,7 @@ class SyncOzonWarehouseStockView(APIView):
             return Response({"error": "Missing Api-Key"}, status=400)
 
         try:
-            ozon_store = OzonStore.objects.get(api_key=api_key, client_id=client_id)
+            ozon_store = get_store_by_api_key(api_key, client_id)
         except OzonStore.DoesNotExist:
             return Response({"error": "Invalid Api-Key"}, status=403)
 
@@ -596,6 +736,7 @@ class SyncOzonWarehouseStockView(APIView):
 
         # Удаляем старые записи, которых больше нет
         WarehouseStock.objects.filter(store=ozon_store).delete()
+        invalidate_planner_snapshot(ozon_store.id)
 
 
         updated_count = 0
@@ -634,7 +775,7 @@ class SyncOzonSalesView(APIView):
             return Response({"error": "Missing Api-Key"}, status=400)
 
         try:
-            ozon_store = OzonStore.objects.get(api_key=api_key, client_id=client_id)
+            ozon_store = get_store_by_api_key(api_key, client_id)
         except OzonStore.DoesNotExist:
             return Response({"error": "Invalid Api-Key"}, status=403)
 
@@ -729,7 +870,7 @@ class OzonFboWarehouseSearchView(APIView):
 
         try:
             resp = requests.post(
-                "https://api-seller.ozon.ru/v1/warehouse/fbo/list",
+                f"{SELLER_API_URL}/v1/warehouse/fbo/list",
                 json=payload,
                 headers=headers,
                 timeout=30,
@@ -751,7 +892,7 @@ class SyncFbsStockView(APIView):
             return Response({"error": "Missing Api-Key"}, status=400)
 
         try:
-            ozon_store = OzonStore.objects.get(api_key=api_key, client_id=client_id)
+            ozon_store = get_store_by_api_key(api_key, client_id)
         except OzonStore.DoesNotExist:
             return Response({"error": "Invalid Api-Key"}, status=403)
 
@@ -789,10 +930,23 @@ class SyncFbsStockView(APIView):
             created += 1
 
         FbsStock.objects.bulk_create(stock_objects)
+        invalidate_planner_snapshot(ozon_store.id)
 
         return Response({"status": "ok", "stocks_saved": created})
 
 # Создание черновиков поставок (по одному на кластер)
+def _next_batch_seq(store):
+    # Выдает следующий номер батча магазина. Вызывать внутри transaction.atomic():
+    # строка счетчика заблокирована до конца транзакции, параллельные запросы ждут ее.
+    sequence, created = OzonSupplyBatchSequence.objects.select_for_update().get_or_create(store=store)
+    if created:
+        last_batch = OzonSupplyBatch.objects.filter(store=store).order_by("-batch_seq").first()
+        sequence.last_seq = last_batch.batch_seq if last_batch else 0
+    sequence.last_seq += 1
+    sequence.save(update_fields=["last_seq"])
+    return sequence.last_seq
+
+
 class CreateSupplyDraftView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
@@ -826,27 +980,15 @@ class CreateSupplyDraftView(APIView):
 
         destination = data["destinationWarehouse"]
         supply_type = data["supplyType"]
-
-        last_seq = OzonSupplyBatch.objects.filter(store=store).order_by("-batch_seq").first()
-        next_seq = (last_seq.batch_seq + 1) if last_seq else 1
-        batch = OzonSupplyBatch.objects.create(
-            store=store,
-            batch_seq=next_seq,
-            supply_type=supply_type,
-            drop_off_point_warehouse_id=destination["warehouse_id"],
-            drop_off_point_name=destination.get("name", ""),
-            status="queued",
-        )
+        cluster_map = get_cluster_map(store)
         excluded_count = 0
 
+        drafts = []
         for shipment in data["shipments"]:
-            cluster_name = shipment["warehouse"]
-            cluster = OzonWarehouseDirectory.objects.filter(
-                store=store,
-                logistic_cluster_name__iexact=cluster_name,
-            ).first()
+            cluster = cluster_map.get(shipment["warehouse"].casefold())
             if not cluster:
                 continue
+            cluster_id, cluster_name = cluster
 
             items = []
             for item in shipment["items"]:
@@ -861,26 +1003,39 @@ class CreateSupplyDraftView(APIView):
                 continue
 
             payload = {
-                "cluster_ids": [str(cluster.logistic_cluster_id)],
+                "cluster_ids": [str(cluster_id)],
                 "drop_off_point_warehouse_id": destination["warehouse_id"],
                 "items": items,
                 "type": supply_type,
             }
 
-            OzonSupplyDraft.objects.create(
-                batch=batch,
+            drafts.append(OzonSupplyDraft(
                 store=store,
                 supply_type=supply_type,
-                logistic_cluster_id=cluster.logistic_cluster_id,
-                logistic_cluster_name=cluster.logistic_cluster_name,
+                logistic_cluster_id=cluster_id,
+                logistic_cluster_name=cluster_name,
                 drop_off_point_warehouse_id=destination["warehouse_id"],
                 drop_off_point_name=destination.get("name", ""),
                 request_payload=payload,
                 status="queued",
-            )
+            ))
         if excluded_count:
             logging.info("Supply drafts: excluded %s items by planner exclusions (store=%s)", excluded_count, store.id)
 
+        with transaction.atomic():
+            batch = OzonSupplyBatch.objects.create(
+                store=store,
+                batch_seq=_next_batch_seq(store),
+                supply_type=supply_type,
+                drop_off_point_warehouse_id=destination["warehouse_id"],
+                drop_off_point_name=destination.get("name", ""),
+                status="queued",
+                active_drafts=len(drafts),
+            )
+            for draft in drafts:
+                draft.batch = batch
+            drafts = OzonSupplyDraft.objects.bulk_create(drafts)
+
         try:
             from .tasks import process_supply_batch
             process_supply_batch.delay(str(batch.batch_id))
@@ -896,7 +1051,7 @@ class CreateSupplyDraftView(APIView):
                 "cluster_id": d.logistic_cluster_id,
                 "status": d.status,
             }
-            for d in batch.drafts.all()
+            for d in drafts
         ]
 
         return Response(
@@ -1048,15 +1203,12 @@ class SupplyDraftDeleteView(APIView):
             batch.delete()
             return Response({"deleted": True, "batch_deleted": True}, status=status.HTTP_200_OK)
 
+        _update_batch_status(batch)
         return Response({"deleted": True, "batch_deleted": False}, status=status.HTTP_200_OK)
 
 
 class SupplyDraftTimeslotFetchView(APIView):
     permission_classes = [permissions.IsAuthenticated]
-    OZON_TIMESLOT_URL = "https://api-seller.ozon.ru/v1/draft/timeslot/info"
-    REQUEST_DELAY_SECONDS = 1.0
-    MAX_RETRIES = 2
-    RETRY_DELAY_SECONDS = 2.0
 
     @staticmethod
     def _normalize(draft: OzonSupplyDraft):
@@ -1082,6 +1234,18 @@ class SupplyDraftTimeslotFetchView(APIView):
             draft.save(update_fields=["supply_warehouse", "selected_supply_warehouse", "updated_at"])
         return flat
 
+    def get(self, request):
+        # Прогресс фоновой загрузки таймслотов батча.
+        batch_id = request.query_params.get("batch_id")
+        if not batch_id:
+            return Response({"error": "batch_id is required"}, status=status.HTTP_400_BAD_REQUEST)
+        batch = get_object_or_404(
+            OzonSupplyBatch,
+            batch_id=batch_id,
+            store__in=user_store_queryset(request.user),
+        )
+        return Response({"job": get_supply_job(str(batch.batch_id), SUPPLY_JOB_TIMESLOTS)}, status=status.HTTP_200_OK)
+
     def post(self, request):
         batch_id = request.data.get("batch_id")
         date_from = request.data.get("date_from")
@@ -1109,12 +1273,10 @@ class SupplyDraftTimeslotFetchView(APIView):
         date_from_iso = dt_from.isoformat().replace("+00:00", "Z")
         date_to_iso = dt_to.isoformat().replace("+00:00", "Z")
 
-        results = []
+        # Проверки без запросов в OZON делаем сразу, сами таймслоты грузятся в фоне.
+        targets = []
         errors = []
-
-        drafts = list(batch.drafts.all())
-        total = len(drafts)
-        for idx, draft in enumerate(drafts):
+        for draft in batch.drafts.all():
             if not draft.draft_id:
                 errors.append({"draft_id": draft.id, "error": "draft_id missing (info not loaded)"})
                 continue
@@ -1128,59 +1290,32 @@ class SupplyDraftTimeslotFetchView(APIView):
             if not warehouse_id:
                 errors.append({"draft_id": draft.id, "error": "warehouse_id missing"})
                 continue
+            targets.append([draft.id, warehouse_id])
 
-            payload = {
-                "date_from": date_from_iso,
-                "date_to": date_to_iso,
-                "draft_id": draft.draft_id,
-                "warehouse_ids": [str(warehouse_id)],
-            }
-            headers = {
-                "Client-Id": draft.store.client_id,
-                "Api-Key": draft.store.api_key,
-                "Content-Type": "application/json",
-            }
-            attempt = 0
-            while True:
-                attempt += 1
-                try:
-                    resp = requests.post(self.OZON_TIMESLOT_URL, headers=headers, json=payload, timeout=30)
-                except requests.RequestException as exc:
-                    if attempt < self.MAX_RETRIES:
-                        time.sleep(self.RETRY_DELAY_SECONDS)
-                        continue
-                    errors.append({"draft_id": draft.id, "error": f"Request error: {exc}"})
-                    break
-
-                if resp.status_code == 429 and attempt < self.MAX_RETRIES:
-                    retry_after = resp.headers.get("Retry-After")
-                    try:
-                        delay = float(retry_after)
-                    except (TypeError, ValueError):
-                        delay = self.RETRY_DELAY_SECONDS
-                    time.sleep(delay)
-                    continue
-
-                try:
-                    resp_data = resp.json()
-                except ValueError:
-                    resp_data = {"raw": resp.text}
+        if not targets:
+            return Response({"results": [], "errors": errors}, status=status.HTTP_400_BAD_REQUEST)
 
-                if resp.status_code >= 400:
-                    errors.append({"draft_id": draft.id, "status_code": resp.status_code, "error": resp_data})
-                else:
-                    draft.timeslot_response = resp_data
-                    draft.timeslot_updated_at = timezone.now()
-                    draft.save(update_fields=["timeslot_response", "timeslot_updated_at", "updated_at"])
-                    results.append({"draft_id": draft.id, "timeslot_response": resp_data})
-                break
-            if idx < total - 1:
-                time.sleep(self.REQUEST_DELAY_SECONDS)
+        batch_uuid = str(batch.batch_id)
+        started = start_supply_job(batch_uuid, SUPPLY_JOB_TIMESLOTS, [draft_id for draft_id, _ in targets])
+        if started:
+            try:
+                fetch_batch_timeslots.delay(batch_uuid, targets, date_from_iso, date_to_iso)
+            except Exception as exc:
+                logging.error(f"Не удалось запустить загрузку таймслотов: {exc}")
+                finish_supply_job(batch_uuid, SUPPLY_JOB_TIMESLOTS, error=str(exc))
+                return Response(
+                    {"error": "Не удалось запустить загрузку таймслотов", "errors": errors},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                )
 
-        status_code = status.HTTP_207_MULTI_STATUS if errors and results else status.HTTP_200_OK
-        if errors and not results:
-            status_code = status.HTTP_400_BAD_REQUEST
-        return Response({"results": results, "errors": errors}, status=status_code)
+        return Response(
+            {
+                "started": started,
+                "job": get_supply_job(batch_uuid, SUPPLY_JOB_TIMESLOTS),
+                "errors": errors,
+            },
+            status=status.HTTP_202_ACCEPTED,
+        )
 
 
 class SupplyDraftTimeslotListView(APIView):
@@ -1193,7 +1328,7 @@ class SupplyDraftTimeslotListView(APIView):
             store__in=user_store_queryset(request.user),
         )
 
-        drafts = batch.drafts.all()
+        drafts = batch.drafts.with_payloads("timeslot_response")
         common_dates = None
         common_timeslots = None
 
@@ -1308,29 +1443,17 @@ class SupplyDraftTimeslotListView(APIView):
             "drafts": drafts_data,
             "common_dates": sorted(list(common_dates or [])),
             "common_timeslots": common_slots_serialized,
+            "job": get_supply_job(str(batch.batch_id), SUPPLY_JOB_TIMESLOTS),
         }, status=status.HTTP_200_OK)
 
 
 class SupplyDraftSupplyStatusView(APIView):
     """
-    Загружает данные по созданным заявкам (status=created) и возвращает товары поставки.
+    Возвращает данные по созданным заявкам (status=created) и товары поставки.
+    Сохраненные данные отдаются сразу, загрузка из OZON идет фоном (см. refresh_batch_supply_status).
     """
 
     permission_classes = [permissions.IsAuthenticated]
-    OZON_SUPPLY_STATUS_URL = "https://api-seller.ozon.ru/v1/draft/supply/create/status"
-    OZON_SUPPLY_GET_URL = "https://api-seller.ozon.ru/v3/supply-order/get"
-    OZON_SUPPLY_BUNDLE_URL = "https://api-seller.ozon.ru/v1/supply-order/bundle"
-    REQUEST_DELAY_SECONDS = 1.0
-    MAX_RETRIES = 2
-    RETRY_DELAY_SECONDS = 2.0
-
-    def _call(self, url, headers, payload):
-        resp = requests.post(url, headers=headers, json=payload, timeout=30)
-        try:
-            data = resp.json()
-        except ValueError:
-            data = {"raw": resp.text}
-        return resp, data
 
     def get(self, request, batch_id: str):
         batch = get_object_or_404(
@@ -1340,16 +1463,23 @@ class SupplyDraftSupplyStatusView(APIView):
         )
 
         results = []
-        errors = []
+        pending = []
         refresh = str(request.query_params.get("refresh", "")).lower() in ("1", "true", "yes")
+        batch_uuid = str(batch.batch_id)
+        job = get_supply_job(batch_uuid, SUPPLY_JOB_SUPPLY_STATUS)
+        job_running = bool(job and job.get("status") in ("queued", "running"))
+        # Без refresh не повторяем черновики, на которых упала прошлая загрузка: иначе каждый опрос
+        # фронта снова ходил бы в OZON.
+        failed_ids = {e.get("draft_id") for e in (job or {}).get("errors") or []} if not refresh else set()
 
-        drafts = list(batch.drafts.all())
-        total = len(drafts)
-        for idx, draft in enumerate(drafts):
+        for draft in batch.drafts.all():
             if draft.status != "created" or not draft.operation_id_supply:
                 continue
 
-            if not refresh and draft.supply_status_updated_at and draft.supply_order_response:
+            has_data = bool(draft.supply_status_updated_at and draft.supply_order_response)
+            if refresh or (not has_data and draft.id not in failed_ids):
+                pending.append(draft.id)
+            if has_data:
                 orders = (draft.supply_order_response or {}).get("orders") or []
                 results.append(
                     {
@@ -1362,155 +1492,29 @@ class SupplyDraftSupplyStatusView(APIView):
                         "supply_status_updated_at": draft.supply_status_updated_at,
                     }
                 )
-                if idx < total - 1:
-                    time.sleep(self.REQUEST_DELAY_SECONDS)
-                continue
-
-            headers = {
-                "Client-Id": draft.store.client_id,
-                "Api-Key": draft.store.api_key,
-                "Content-Type": "application/json",
-            }
 
-            # 1) статус создания заявки
-            status_payload = {"operation_id": draft.operation_id_supply}
-            attempt = 0
-            while True:
-                attempt += 1
-                resp, status_data = self._call(self.OZON_SUPPLY_STATUS_URL, headers, status_payload)
-                if resp.status_code == 429 and attempt < self.MAX_RETRIES:
-                    retry_after = resp.headers.get("Retry-After")
-                    try:
-                        delay = float(retry_after)
-                    except (TypeError, ValueError):
-                        delay = self.RETRY_DELAY_SECONDS
-                    time.sleep(delay)
-                    continue
-                if resp.status_code >= 400:
-                    errors.append({"draft_id": draft.id, "error": status_data, "status_code": resp.status_code})
-                    break
-                break
-            if resp.status_code >= 400:
-                if idx < total - 1:
-                    time.sleep(self.REQUEST_DELAY_SECONDS)
-                continue
-            order_ids = (status_data.get("result") or {}).get("order_ids") or []
-            if not order_ids:
-                errors.append({"draft_id": draft.id, "error": "order_ids empty"})
-                if idx < total - 1:
-                    time.sleep(self.REQUEST_DELAY_SECONDS)
-                continue
-
-            # 2) детали заказов
-            get_payload = {"order_ids": order_ids}
-            attempt = 0
-            while True:
-                attempt += 1
-                resp, orders_data = self._call(self.OZON_SUPPLY_GET_URL, headers, get_payload)
-                if resp.status_code == 429 and attempt < self.MAX_RETRIES:
-                    retry_after = resp.headers.get("Retry-After")
-                    try:
-                        delay = float(retry_after)
-                    except (TypeError, ValueError):
-                        delay = self.RETRY_DELAY_SECONDS
-                    time.sleep(delay)
-                    continue
-                if resp.status_code >= 400:
-                    errors.append({"draft_id": draft.id, "error": orders_data, "status_code": resp.status_code})
-                    break
-                break
-            if resp.status_code >= 400:
-                if idx < total - 1:
-                    time.sleep(self.REQUEST_DELAY_SECONDS)
-                continue
-            orders = orders_data.get("orders") or []
-
-            # Собираем bundle_ids и склады
-            bundle_ids = []
-            storage_ids = set()
-            dropoff_id = None
-            for order in orders:
-                drop = order.get("drop_off_warehouse") or {}
-                if drop.get("warehouse_id"):
-                    dropoff_id = drop.get("warehouse_id")
-                for supply in order.get("supplies") or []:
-                    if supply.get("bundle_id"):
-                        bundle_ids.append(supply["bundle_id"])
-                    storage = (supply.get("storage_warehouse") or {}).get("warehouse_id")
-                    if storage:
-                        storage_ids.add(str(storage))
-
-            bundle_items = []
-            if bundle_ids:
-                bundle_payload = {
-                    "bundle_ids": bundle_ids,
-                    "is_asc": True,
-                    "item_tags_calculation": {
-                        "dropoff_warehouse_id": dropoff_id or 0,
-                        "storage_warehouse_ids": list(storage_ids) if storage_ids else [],
-                    },
-                    "limit": 100,
-                    "sort_field": "UNSPECIFIED",
-                }
-                attempt = 0
-                while True:
-                    attempt += 1
-                    resp, bundle_data = self._call(self.OZON_SUPPLY_BUNDLE_URL, headers, bundle_payload)
-                    if resp.status_code == 429 and attempt < self.MAX_RETRIES:
-                        retry_after = resp.headers.get("Retry-After")
-                        try:
-                            delay = float(retry_after)
-                        except (TypeError, ValueError):
-                            delay = self.RETRY_DELAY_SECONDS
-                        time.sleep(delay)
-                        continue
-                    if resp.status_code >= 400:
-                        errors.append({"draft_id": draft.id, "error": bundle_data, "status_code": resp.status_code})
-                    else:
-                        for item in bundle_data.get("items") or []:
-                            bundle_items.append(
-                                {
-                                    "sku": item.get("sku"),
-                                    "quantity": item.get("quantity"),
-                                    "offer_id": item.get("offer_id"),
-                                    "icon_path": item.get("icon_path"),
-                                    "name": item.get("name"),
-                                    "barcode": item.get("barcode"),
-                                    "product_id": item.get("product_id"),
-                                }
-                            )
-                    break
-
-            draft.supply_order_ids = order_ids
-            draft.supply_order_response = orders_data
-            draft.supply_bundle_items = bundle_items
-            draft.supply_status_updated_at = timezone.now()
-            draft.save(update_fields=[
-                "supply_order_ids",
-                "supply_order_response",
-                "supply_bundle_items",
-                "supply_status_updated_at",
-                "updated_at",
-            ])
-
-            results.append(
-                {
-                    "draft_id": draft.id,
-                    "order_ids": order_ids,
-                    "orders": orders,
-                    "order_states": [o.get("state") for o in orders if isinstance(o, dict)],
-                    "bundle_items": bundle_items,
-                    "cached": False,
-                    "supply_status_updated_at": draft.supply_status_updated_at,
-                }
-            )
-            if idx < total - 1:
-                time.sleep(self.REQUEST_DELAY_SECONDS)
-
-        status_code = status.HTTP_207_MULTI_STATUS if errors and results else status.HTTP_200_OK
-        if errors and not results:
+        if pending and not job_running and start_supply_job(batch_uuid, SUPPLY_JOB_SUPPLY_STATUS, pending):
+            try:
+                refresh_batch_supply_status.delay(batch_uuid, pending)
+            except Exception as exc:
+                logging.error(f"Не удалось запустить обновление поставок: {exc}")
+                finish_supply_job(batch_uuid, SUPPLY_JOB_SUPPLY_STATUS, error=str(exc))
+            job = get_supply_job(batch_uuid, SUPPLY_JOB_SUPPLY_STATUS)
+            job_running = job.get("status") in ("queued", "running")
+
+        errors = (job or {}).get("errors") or []
+        if job_running:
+            status_code = status.HTTP_202_ACCEPTED
+        elif errors and results:
+            status_code = status.HTTP_207_MULTI_STATUS
+        elif errors:
             status_code = status.HTTP_400_BAD_REQUEST
-        return Response({"results": results, "errors": errors}, status=status_code)
+        else:
+            status_code = status.HTTP_200_OK
+        return Response(
+            {"results": results, "errors": errors, "pending": pending, "job": job},
+            status=status_code,
+        )
 
 
 class SupplyDraftCreateSupplyView(APIView):
@@ -1578,37 +1582,29 @@ class SupplyDraftCreateSupplyView(APIView):
                 errors.append({"draft_id": draft.id, "error": "draft_id missing (info not loaded)"})
                 continue
 
-            draft.operation_id_supply = ""
-            draft.supply_order_ids = None
-            draft.supply_order_response = None
-            draft.supply_bundle_items = None
-            draft.selected_timeslot = timeslot
-            draft.status = "supply_queued"
-            draft.attempts = 0
-            draft.next_attempt_at = None
-            draft.error_message = ""
-            draft.save(update_fields=[
-                "operation_id_supply",
-                "supply_order_ids",
-                "supply_order_response",
-                "supply_bundle_items",
-                "selected_timeslot",
-                "status",
-                "attempts",
-                "next_attempt_at",
-                "error_message",
-                "updated_at",
-            ])
+            try:
+                # Переход двигает счетчики батча, статус батча пересчитывается вместе с ним.
+                transition_draft(
+                    draft,
+                    "supply_queued",
+                    operation_id_supply="",
+                    supply_order_ids=None,
+                    supply_order_response=None,
+                    supply_bundle_items=None,
+                    selected_timeslot=timeslot,
+                    attempts=0,
+                    next_attempt_at=None,
+                    error_message="",
+                )
+            except InvalidDraftTransition:
+                errors.append({"draft_id": draft.id, "error": f"cannot queue supply from status {draft.status}"})
+                continue
 
             results.append({
                 "draft_id": draft.id,
                 "status": "supply_queued",
             })
 
-        if results:
-            batch.status = "processing"
-            batch.save(update_fields=["status", "updated_at"])
-
         status_code = status.HTTP_207_MULTI_STATUS if errors and results else status.HTTP_200_OK
         if errors and not results:
             status_code = status.HTTP_400_BAD_REQUEST
@@ -1641,20 +1637,18 @@ class SupplyDraftMoveToNewBatchView(APIView):
             return Response({"error": "Draft already created, cannot be moved"}, status=status.HTTP_400_BAD_REQUEST)
 
         store = draft.store
-        last_seq = OzonSupplyBatch.objects.filter(store=store).order_by("-batch_seq").first()
-        next_seq = (last_seq.batch_seq + 1) if last_seq else 1
-
-        new_batch = OzonSupplyBatch.objects.create(
-            store=store,
-            batch_seq=next_seq,
-            supply_type=draft.supply_type,
-            drop_off_point_warehouse_id=draft.drop_off_point_warehouse_id,
-            drop_off_point_name=draft.drop_off_point_name,
-            status="processing",
-        )
+        with transaction.atomic():
+            new_batch = OzonSupplyBatch.objects.create(
+                store=store,
+                batch_seq=_next_batch_seq(store),
+                supply_type=draft.supply_type,
+                drop_off_point_warehouse_id=draft.drop_off_point_warehouse_id,
+                drop_off_point_name=draft.drop_off_point_name,
+                status="processing",
+            )
 
-        draft.batch = new_batch
-        draft.save(update_fields=["batch", "updated_at"])
+            draft.batch = new_batch
+            draft.save(update_fields=["batch", "updated_at"])
 
         if not batch.drafts.exists():
             batch.delete()
@@ -1716,7 +1710,7 @@ class ProductAnalytics_V2_View(APIView):
         if price_max < price_min:
             return Response({"error": "Минимальная цена не может быть больше максимальной"}, status=400)
         try:
-            ozon_store = OzonStore.objects.get(api_key=api_key, client_id=client_id)
+            ozon_store = get_store_by_api_key(api_key, client_id)
         except OzonStore.DoesNotExist:
             return Response({"error": "Invalid Api-Key"}, status=403)
 
@@ -2142,6 +2136,7 @@ class ProductAnalytics_V2_View(APIView):
         execution_time = round(time.time() - start_time, 3)
         logging.info(f"[⏱] Время выполнения запроса: {execution_time}s")
         logging.info("Analytics timings store=%s %s", ozon_store.id, timings)
+        record_stage_timings("analytics_v2", timings)
         resp = Response({
             "clusters": cluster_list,
             "summary": summary,
@@ -2181,59 +2176,40 @@ class ProductAnalyticsByItemView(APIView):
             return Response({"error": "Период анализа должен быть от 0 до 60 дней"}, status=400)
 
         try:
-            store = OzonStore.objects.get(api_key=api_key, client_id=client_id)
+            store = get_store_by_api_key(api_key, client_id)
         except OzonStore.DoesNotExist:
             return Response({"error": "Invalid Api-Key"}, status=403)
 
         since_date = timezone.now() - timedelta(days=days-1)
         since_date = since_date.replace(hour=0, minute=0, second=0, microsecond=0)
 
-        products = Product.objects.filter(store=store)
-        products_by_sku = {p.sku: p for p in products}
+        # Общий с планнером снимок магазина (planner_snapshot)
+        snapshot = get_snapshot(store)
 
-        sales = Sale.objects.filter(store=store, date__gte=since_date, sale_type__in=[Sale.FBO, Sale.FBS])
         sales_by_sku_cluster = defaultdict(lambda: defaultdict(lambda: {"qty": 0, "price": 0}))
         revenue_by_cluster = defaultdict(float)
 
-        for s in sales:
-            cluster = s.cluster_to or "Без кластера"
-            sales_by_sku_cluster[s.sku][cluster]["qty"] += s.quantity
-            sales_by_sku_cluster[s.sku][cluster]["price"] += float(s.price) * s.quantity
-            revenue_by_cluster[cluster] += float(s.price) * s.quantity
-
-        stocks = WarehouseStock.objects.filter(store=store)
-        stocks_by_sku_cluster = defaultdict(lambda: defaultdict(int))
-        total_stock_by_sku = defaultdict(int)
-
-        for stock in stocks:
-            cluster = stock.cluster_name or "Без кластера"
-            stock_sum = stock.available_stock_count + stock.transit_stock_count + stock.return_from_customer_stock_count
-            stocks_by_sku_cluster[stock.sku][cluster] += stock_sum
-            total_stock_by_sku[stock.sku] += stock_sum
+        for cluster, sku, qty, price in snapshot.sales(since_date):
+            sales_by_sku_cluster[sku][cluster] = {"qty": qty, "price": price}
+            revenue_by_cluster[cluster] += price
 
-        fbs_stocks = FbsStock.objects.filter(store=store)
-        fbs_by_sku = defaultdict(int)
-        for fbs in fbs_stocks:
-            fbs_by_sku[fbs.sku] += fbs.present
+        # Остатки: доступно + в пути + возвраты от покупателей
+        stocks_by_cluster, total_stock_by_sku = snapshot.available_stocks
+        stocks_by_sku_cluster = defaultdict(dict)
+        for cluster, stocks in stocks_by_cluster.items():
+            for sku, stock_sum in stocks.items():
+                stocks_by_sku_cluster[sku][cluster] = stock_sum
 
-        delivery_cluster_data = {
-            dc.name: {
-                "average_delivery_time": dc.average_delivery_time,
-                "impact_share": dc.impact_share
-            }
-            for dc in DeliveryCluster.objects.filter(store=store)
-        }
-
-        item_analytics_map = {
-            (a.cluster_name, a.sku): a
-            for a in DeliveryClusterItemAnalytics.objects.filter(store=store)
-        }
+        fbs_by_sku = snapshot.fbs_by_sku
+        delivery_cluster_data = snapshot.delivery_clusters
+        item_analytics_map = snapshot.item_analytics
 
         total_revenue = sum(revenue_by_cluster.values()) or 1
 
         result_products = []
 
-        for sku, product in products_by_sku.items():
+        for product in snapshot.products():
+            sku = product.sku
             item = {
                 "sku": sku,
                 "name": product.name,
@@ -2295,10 +2271,7 @@ class ProductAnalyticsByItemView(APIView):
         ]
         cluster_summary.sort(key=lambda c: c["cluster_revenue"], reverse=True)
 
-        try:
-            average_time = DeliveryAnalyticsSummary.objects.get(store=store).average_delivery_time
-        except DeliveryAnalyticsSummary.DoesNotExist:
-            average_time = None
+        average_time = snapshot.average_delivery_time
 
         execution_time = round(time.time() - start_time, 3)
         return Response({
@@ -2402,12 +2375,7 @@ class TriggerRebalanceAutoBudgetsView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        store = (
-            OzonStore.objects.filter(name__iexact=store_name).first()
-            or OzonStore.objects.filter(client_id__iexact=store_name).first()
-            or OzonStore.objects.filter(name__icontains=store_name).first()
-            or OzonStore.objects.filter(client_id__icontains=store_name).first()
-        )
+        store = resolve_store(store_name)
         if not store:
             return Response(
                 {"error": f"store '{store_name}' not found"},
@@ -2496,8 +2464,7 @@ class ToggleStoreAdsStatusView(APIView):
         if not store_name:
             return Response({"error": "store_name is required"}, status=status.HTTP_400_BAD_REQUEST)
 
-        store = (OzonStore.objects.filter(name__iexact=store_name).first() or
-                 OzonStore.objects.filter(client_id__iexact=store_name).first())
+        store = resolve_store(store_name, fuzzy=False)
         if not store:
             return Response({"error": f"Store '{store_name}' not found"}, status=status.HTTP_404_NOT_FOUND)
 
@@ -2531,7 +2498,7 @@ class UpdateWarehouseStockView(APIView):
             
             # Получаем магазин
             try:
-                ozon_store = OzonStore.objects.get(api_key=api_key, client_id=client_id)
+                ozon_store = get_store_by_api_key(api_key, client_id)
             except OzonStore.DoesNotExist:
                 return Response({
                     "error": "Магазин не найден"
@@ -2654,183 +2621,40 @@ class Planer_View(APIView):
 
         since_date = timezone.now() - timedelta(days=days-1)
         since_date = since_date.replace(hour=0, minute=0, second=0, microsecond=0)
-        # Все товары
-        products_qs = Product.objects.filter(
-            store=ozon_store,
-            price__gte=price_min,
-            price__lte=price_max
+
+        # Товары, продажи, остатки и аналитика доставки — из общего снимка магазина (planner_snapshot)
+        snapshot = get_snapshot(ozon_store)
+        stage_start = mark(
+            "snapshot_sec",
+            stage_start,
+            f"skus={len(snapshot.skus)} clusters={len(snapshot.clusters)} version={snapshot.version}",
         )
 
-        # Исключаем товары по артикулам, если указаны
-        if exclude_offer_ids:
-            products_qs = products_qs.exclude(offer_id__in=exclude_offer_ids)
-        query_start = time.perf_counter()
-        products = list(products_qs)
-        products_query_sec = round(time.perf_counter() - query_start, 4)
-        timings["products_query_sec"] = products_query_sec
-        logging.info("Planner products_query_sec=%s products=%s", products_query_sec, len(products))
-        map_start = time.perf_counter()
+        # Товары в диапазоне цен, без исключенных артикулов
+        products = snapshot.products(price_min, price_max, exclude_offer_ids)
         products_by_sku = {p.sku: p for p in products}
-        # logging.info(f" Target SKU ={products_by_sku.get(2909660721)}")
         # Создаем словарь для получения barcode по offer_id
         offer_id_to_barcode = {p.offer_id: p.barcodes[0] if p.barcodes else None for p in products}
-        products_map_sec = round(time.perf_counter() - map_start, 4)
-        timings["products_map_sec"] = products_map_sec
-        logging.info("Planner products_map_sec=%s products=%s", products_map_sec, len(products_by_sku))
         product_count = len(products_by_sku)
         stage_start = mark("products_sec", stage_start, f"products={product_count}")
-        
-        
 
         # Продажи
         logging.info(f"Дата до которой смотрим {since_date}")
-        sales_qs = (
-            Sale.objects.filter(
-                store=ozon_store,
-                date__gte=since_date,
-                sale_type__in=[Sale.FBO, Sale.FBS]
-            )
-            .values_list("cluster_to", "sku", "quantity", "price")
-        )
-        query_start = time.perf_counter()
-        sales = list(sales_qs)
-        sales_query_sec = round(time.perf_counter() - query_start, 4)
-        timings["sales_query_sec"] = sales_query_sec
-        logging.info("Planner sales_query_sec=%s sales=%s", sales_query_sec, len(sales))
         sales_by_cluster = {}
-        sales_count = len(sales)
-        agg_start = time.perf_counter()
-        for cluster, sku, quantity, price in sales:
-            cluster = cluster or "Без кластера"
-            sales_by_cluster.setdefault(cluster, {})
-            sales_by_cluster[cluster].setdefault(sku, {"qty": 0, "price": 0})
-            sales_by_cluster[cluster][sku]["qty"] += quantity
-            sales_by_cluster[cluster][sku]["price"] += float(price) * quantity
-        sales_agg_sec = round(time.perf_counter() - agg_start, 4)
-        timings["sales_agg_sec"] = sales_agg_sec
-        logging.info("Planner sales_agg_sec=%s clusters=%s", sales_agg_sec, len(sales_by_cluster))
-
-        logging.info(f"Кол-во продаж {sales_count}")
-        logging.info(f"Кол-во кластеров  {len(sales_by_cluster)}")
-        
-        # Посчитаем количество продаж по каждой позиции SKU и получим по каждому товару количество продаж
-        rollup_start = time.perf_counter()
         product_revenue_map_qty = {}
-        for cluster in sales_by_cluster:
-            for sku, data in sales_by_cluster[cluster].items():
-                product_revenue_map_qty.setdefault(sku, 0)
-                product_revenue_map_qty[sku] += data["qty"]
-        sales_rollup_sec = round(time.perf_counter() - rollup_start, 4)
-        timings["sales_rollup_sec"] = sales_rollup_sec
-        logging.info("Planner sales_rollup_sec=%s unique_skus=%s", sales_rollup_sec, len(product_revenue_map_qty))
-                
-        logging.info(f"Количество уникальных SKU product_revenue_map_qty =  {len(product_revenue_map_qty)}")  
-        stage_start = mark("sales_sec", stage_start, f"sales={sales_count} clusters={len(sales_by_cluster)}")
-              
-        # Остатки товаров по складам
-        stocks_qs = (
-            WarehouseStock.objects.filter(store=ozon_store)
-            .values_list(
-                "cluster_name",
-                "sku",
-                "available_stock_count",
-                "valid_stock_count",
-                "waiting_docs_stock_count",
-                "expiring_stock_count",
-                "transit_defect_stock_count",
-                "stock_defect_stock_count",
-                "excess_stock_count",
-                "other_stock_count",
-                "requested_stock_count",
-                "transit_stock_count",
-                "return_from_customer_stock_count",
-            )
-        )
-        query_start = time.perf_counter()
-        stocks = list(stocks_qs)
-        stocks_query_sec = round(time.perf_counter() - query_start, 4)
-        timings["stocks_query_sec"] = stocks_query_sec
-        logging.info("Planner stocks_query_sec=%s stocks=%s", stocks_query_sec, len(stocks))
-        stocks_by_cluster = {}
-        total_stock_all_clusters = {}
-        requested_stock_by_sku = {}  # Отдельный расчет товаров в заявках на поставку
-        stocks_count = len(stocks)
-        agg_start = time.perf_counter()
-        for (
-            cluster_name,
-            sku,
-            available_stock_count,
-            valid_stock_count,
-            waiting_docs_stock_count,
-            expiring_stock_count,
-            transit_defect_stock_count,
-            stock_defect_stock_count,
-            excess_stock_count,
-            other_stock_count,
-            requested_stock_count,
-            transit_stock_count,
-            return_from_customer_stock_count,
-        ) in stocks:
-            cluster = cluster_name or "Без кластера"
-            stock_sum = (
-                available_stock_count +
-                valid_stock_count +
-                waiting_docs_stock_count +
-                expiring_stock_count +
-                transit_defect_stock_count +
-                stock_defect_stock_count +
-                excess_stock_count +
-                other_stock_count +
-                requested_stock_count +
-                transit_stock_count +
-                return_from_customer_stock_count
-            )
-            
-            # По кластеру
-            if cluster not in stocks_by_cluster:
-                stocks_by_cluster[cluster] = {}
-            if sku not in stocks_by_cluster[cluster]:
-                stocks_by_cluster[cluster][sku] = 0
-            stocks_by_cluster[cluster][sku] += stock_sum
+        for cluster, sku, qty, price in snapshot.sales(since_date):
+            sales_by_cluster.setdefault(cluster, {})[sku] = {"qty": qty, "price": price}
+            product_revenue_map_qty[sku] = product_revenue_map_qty.get(sku, 0) + qty
+        logging.info(f"Кол-во кластеров  {len(sales_by_cluster)}")
+        logging.info(f"Количество уникальных SKU product_revenue_map_qty =  {len(product_revenue_map_qty)}")
+        stage_start = mark("sales_sec", stage_start, f"clusters={len(sales_by_cluster)}")
 
-            # По всем кластерам
-            if sku not in total_stock_all_clusters:
-                total_stock_all_clusters[sku] = 0
-            total_stock_all_clusters[sku] += stock_sum
-            
-            # Отдельный расчет товаров в заявках на поставку по SKU
-            if sku not in requested_stock_by_sku:
-                requested_stock_by_sku[sku] = 0
-            requested_stock_by_sku[sku] += requested_stock_count
-        stocks_agg_sec = round(time.perf_counter() - agg_start, 4)
-        timings["stocks_agg_sec"] = stocks_agg_sec
-        logging.info("Planner stocks_agg_sec=%s clusters=%s", stocks_agg_sec, len(stocks_by_cluster))
-            
-        logging.info(f"Остатки товаров по складам  {stocks_count}")
-        # logging.info(f"Заявки на поставку по SKU 1928741963 {requested_stock_by_sku[1928741963]}")
-        stage_start = mark("stocks_sec", stage_start, f"stocks={stocks_count}")
+        # Остатки товаров по складам: сумма всех счетчиков по кластеру и по всем кластерам
+        stocks_by_cluster, total_stock_all_clusters = snapshot.stocks
+        stage_start = mark("stocks_sec", stage_start, f"clusters={len(stocks_by_cluster)}")
         # FBS остатки
-        fbs_qs = (
-            FbsStock.objects.filter(store=ozon_store)
-            .values_list("sku", "present")
-        )
-        query_start = time.perf_counter()
-        fbs_stocks = list(fbs_qs)
-        fbs_query_sec = round(time.perf_counter() - query_start, 4)
-        timings["fbs_query_sec"] = fbs_query_sec
-        logging.info("Planner fbs_query_sec=%s fbs=%s", fbs_query_sec, len(fbs_stocks))
-        fbs_by_sku = {}
-        fbs_count = len(fbs_stocks)
-        agg_start = time.perf_counter()
-        for sku, present in fbs_stocks:
-            fbs_by_sku.setdefault(sku, 0)
-            fbs_by_sku[sku] += present
-        fbs_agg_sec = round(time.perf_counter() - agg_start, 4)
-        timings["fbs_agg_sec"] = fbs_agg_sec
-        logging.info("Planner fbs_agg_sec=%s fbs=%s", fbs_agg_sec, len(fbs_by_sku))
-        stage_start = mark("fbs_stocks_sec", stage_start, f"fbs_stocks={fbs_count}")
-
-
+        fbs_by_sku = snapshot.fbs_by_sku
+        stage_start = mark("fbs_stocks_sec", stage_start, f"fbs_stocks={len(fbs_by_sku)}")
 
         # 1. Подсчёт выручки по всем кластерам и всем товарам
         total_revenue = 0
@@ -2848,57 +2672,17 @@ class Planer_View(APIView):
         total_revenue = sum(revenue_by_cluster.values()) or 1  # защита от деления на 0
         stage_start = mark("revenue_sec", stage_start, f"total_revenue={round(total_revenue, 2)}")
 
-
-        
-        # Получаем данные по кластерам доставки average_delivery_time impact_share
-        delivery_qs = DeliveryCluster.objects.filter(store=ozon_store)
-        query_start = time.perf_counter()
-        delivery_clusters = list(delivery_qs)
-        delivery_cluster_query_sec = round(time.perf_counter() - query_start, 4)
-        timings["delivery_cluster_query_sec"] = delivery_cluster_query_sec
-        logging.info(
-            "Planner delivery_cluster_query_sec=%s clusters=%s",
-            delivery_cluster_query_sec,
-            len(delivery_clusters),
-        )
-        map_start = time.perf_counter()
+        # Данные по кластерам доставки average_delivery_time impact_share
         delivery_cluster_data = {
-            dc.name: {
-                "average_delivery_time": dc.average_delivery_time,
-                "impact_share": self._round_share(dc.impact_share),
+            name: {
+                "average_delivery_time": info["average_delivery_time"],
+                "impact_share": self._round_share(info["impact_share"]),
             }
-            for dc in delivery_clusters
+            for name, info in snapshot.delivery_clusters.items()
         }
-        delivery_cluster_map_sec = round(time.perf_counter() - map_start, 4)
-        timings["delivery_cluster_map_sec"] = delivery_cluster_map_sec
-        logging.info(
-            "Planner delivery_cluster_map_sec=%s clusters=%s",
-            delivery_cluster_map_sec,
-            len(delivery_cluster_data),
-        )
-
-        
-        # Получаем аналитику по товарам в кластерах доставки
+        # Аналитика по товарам в кластерах доставки
         # ЧАСТНАЯ АНАЛИТИКА ПО КЛАСТЕРУ
-        analytics_qs = DeliveryClusterItemAnalytics.objects.filter(store=ozon_store)
-        query_start = time.perf_counter()
-        analytics_items = list(analytics_qs)
-        delivery_item_analytics_query_sec = round(time.perf_counter() - query_start, 4)
-        timings["delivery_item_analytics_query_sec"] = delivery_item_analytics_query_sec
-        logging.info(
-            "Planner delivery_item_analytics_query_sec=%s items=%s",
-            delivery_item_analytics_query_sec,
-            len(analytics_items),
-        )
-        map_start = time.perf_counter()
-        item_analytics_map = {(a.cluster_name, a.sku): a for a in analytics_items}
-        delivery_item_analytics_map_sec = round(time.perf_counter() - map_start, 4)
-        timings["delivery_item_analytics_map_sec"] = delivery_item_analytics_map_sec
-        logging.info(
-            "Planner delivery_item_analytics_map_sec=%s items=%s",
-            delivery_item_analytics_map_sec,
-            len(item_analytics_map),
-        )
+        item_analytics_map = snapshot.item_analytics
         stage_start = mark(
             "delivery_analytics_sec",
             stage_start,
@@ -3179,13 +2963,11 @@ class Planer_View(APIView):
 
 
         # Сводная аналитика доставки
-        try:
-            average_time = DeliveryAnalyticsSummary.objects.get(store=ozon_store).average_delivery_time
-        except DeliveryAnalyticsSummary.DoesNotExist:
-            average_time = None        
+        average_time = snapshot.average_delivery_time
         execution_time = round(time.time() - start_time, 3)
         logging.info(f"[⏱] Время выполнения запроса: {execution_time}s")
         logging.info("Planner timings store=%s %s", ozon_store.id, timings)
+        record_stage_timings("planner", timings)
         resp = Response({
             "clusters": cluster_list,
             "summary": summary,
@@ -3329,9 +3111,18 @@ class FbsPostingSyncView(APIView):
 
 
 # FBS: список постингов из БД (с авто-синком для ключевых статусов).
+class FbsPostingCursorPagination(CursorPagination):
+    # FBS: курсорная пагинация списка, включается параметром cursor или page_size.
+    page_size = 200
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+    ordering = ("-sort_at", "-id")
+
+
 class FbsPostingListView(generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = FbsPostingSerializer
+    pagination_class = FbsPostingCursorPagination
 
     def _is_lite(self):
         return self.request.query_params.get("lite") in ("1", "true", "True")
@@ -3350,31 +3141,48 @@ class FbsPostingListView(generics.ListAPIView):
             context["label_type"] = label_type
         return context
 
+    def paginate_queryset(self, queryset):
+        # Без cursor/page_size список отдается целиком, как раньше.
+        params = self.request.query_params
+        if "cursor" not in params and "page_size" not in params:
+            return None
+        return super().paginate_queryset(queryset)
+
     def get_queryset(self):
+        self._store = None
+        self._match = Q()
+        self._sync_statuses = []
+        self._refreshing = False
         store_id = self.request.query_params.get("store_id")
         if not store_id:
             return OzonFbsPosting.objects.none()
 
         store = get_object_or_404(user_store_queryset(self.request.user), id=store_id)
+        self._store = store
         qs = OzonFbsPosting.objects.filter(store=store)
         if self._is_lite():
-            qs = qs.defer("raw_payload", "available_actions", "cancellation")
+            qs = qs.with_payloads("products")
         else:
+            # Полные ответы Ozon в строке — только ссылки; тела нужных полей читаем пачкой на страницу
+            qs = qs.with_payloads("products", "available_actions", "cancellation")
             label_type = self.request.query_params.get("label_type") or OzonFbsPostingLabel.TASK_TYPE_BIG
             self._label_type = label_type
             labels_qs = OzonFbsPostingLabel.objects.filter(task_type=label_type).order_by("-updated_at")
             qs = qs.prefetch_related(
                 Prefetch("labels", queryset=labels_qs, to_attr="prefetched_labels")
             )
+        # Фильтр собирается в Q, чтобы посчитать его количество в одном запросе со счетчиками.
+        match = Q()
         status_param = self.request.query_params.get("status")
         if status_param:
             statuses = [s.strip() for s in status_param.split(",") if s.strip()]
             if statuses:
-                sync_needed_statuses = set(statuses) & {
+                sync_needed_statuses = sorted(set(statuses) & {
                     OzonFbsPosting.STATUS_AWAITING_PACKAGING,
                     OzonFbsPosting.STATUS_AWAITING_DELIVER,
-                }
+                })
                 if sync_needed_statuses:
+                    # Список отвечает из БД, устаревшие статусы обновляются в фоне.
                     force_refresh = self.request.query_params.get("force_refresh") in ("1", "true", "True")
                     since_param = self.request.query_params.get("since")
                     to_param = self.request.query_params.get("to")
@@ -3383,79 +3191,87 @@ class FbsPostingListView(generics.ListAPIView):
                     since, to = _resolve_sync_window(since, to)
                     since_str = since.isoformat() if since else None
                     to_str = to.isoformat() if to else None
-                    for status_value in sync_needed_statuses:
-                        if force_refresh or _should_sync(store.id, status_value):
-                            result = _sync_fbs_postings_for_status(
-                                store,
-                                status_value,
-                                since_str,
-                                to_str,
-                                limit=1000,
-                            )
-                            _set_last_sync_time(store.id, status_value, result["sync_time"])
+                    self._sync_statuses = sync_needed_statuses
+                    self._refreshing = _schedule_status_refresh(
+                        store,
+                        sync_needed_statuses,
+                        since_str,
+                        to_str,
+                        force=force_refresh,
+                    )
 
-                qs = qs.filter(status__in=statuses)
+                match &= Q(status__in=statuses)
 
                 if len(statuses) == 1 and statuses[0] in sync_needed_statuses:
                     last_sync = _get_last_sync_time(store.id, statuses[0])
                     if last_sync:
-                        qs = qs.filter(last_seen_at__gte=last_sync)
+                        match &= Q(last_seen_at__gte=last_sync)
 
         needs_label = self.request.query_params.get("needs_label")
         if needs_label in ("1", "true", "True"):
-            qs = qs.filter(needs_label=True)
+            match &= Q(needs_label=True)
 
         include_archived = self.request.query_params.get("include_archived")
         if include_archived not in ("1", "true", "True"):
-            qs = qs.filter(archived_at__isnull=True)
+            match &= Q(archived_at__isnull=True)
 
+        self._match = match
+        qs = qs.filter(match).annotate(sort_at=Coalesce("status_changed_at", "created_at"))
         return qs.order_by("-status_changed_at", "-updated_at")
 
+    def _last_synced_at(self):
+        # Время самого старого синка среди запрошенных статусов (None, если какой-то еще не синкался).
+        sync_times = [_get_last_sync_time(self._store.id, status_value) for status_value in self._sync_statuses]
+        if not sync_times or None in sync_times:
+            return None
+        return min(sync_times)
+
     def list(self, request, *args, **kwargs):
         start_ts = time.perf_counter()
         queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
         qs_sec = time.perf_counter() - start_ts
         serialize_start = time.perf_counter()
-        serializer = self.get_serializer(queryset, many=True)
+        serializer = self.get_serializer(page if page is not None else queryset, many=True)
         postings_data = serializer.data
         serialize_sec = time.perf_counter() - serialize_start
 
-        store_id = request.query_params.get("store_id")
+        store = self._store
         status_param = request.query_params.get("status") or ""
         counts = None
         total = None
+        queryset_count = 0
         counts_start = time.perf_counter()
-        if store_id:
-            store = get_object_or_404(user_store_queryset(request.user), id=store_id)
-            counts, total = _get_posting_counts(store, include_archived=True)
+        if store:
+            counts, total, queryset_count = _aggregate_posting_counts(store, include_archived=True, match=self._match)
         counts_sec = time.perf_counter() - counts_start
-        count_start = time.perf_counter()
-        queryset_count = queryset.count()
-        count_sec = time.perf_counter() - count_start
         total_sec = time.perf_counter() - start_ts
         logging.info(
-            "FBS postings list timing store=%s status=%s qs_sec=%.4f serialize_sec=%.4f counts_sec=%.4f count_sec=%.4f total_sec=%.4f items=%s",
-            store_id,
+            "FBS postings list timing store=%s status=%s qs_sec=%.4f serialize_sec=%.4f counts_sec=%.4f total_sec=%.4f items=%s refreshing=%s",
+            store.id if store else None,
             status_param,
             qs_sec,
             serialize_sec,
             counts_sec,
-            count_sec,
             total_sec,
             len(postings_data),
+            self._refreshing,
         )
 
-        return Response(
-            {
-                "store_id": int(store_id) if store_id else None,
-                "status": status_param,
-                "count": queryset_count,
-                "counts": counts or {},
-                "total": total or 0,
-                "postings": postings_data,
-            },
-            status=status.HTTP_200_OK,
-        )
+        payload = {
+            "store_id": store.id if store else None,
+            "status": status_param,
+            "count": queryset_count,
+            "counts": counts or {},
+            "total": total or 0,
+            "last_synced_at": self._last_synced_at() if store else None,
+            "refreshing": self._refreshing,
+            "postings": postings_data,
+        }
+        if page is not None:
+            payload["next"] = self.paginator.get_next_link()
+            payload["previous"] = self.paginator.get_previous_link()
+        return Response(payload, status=status.HTTP_200_OK)
 
 
 # FBS: счетчики по статусам для табов.
@@ -3505,15 +3321,20 @@ class FbsPostingRefreshView(APIView):
                 OzonFbsPosting.STATUS_AWAITING_PACKAGING,
                 OzonFbsPosting.STATUS_AWAITING_DELIVER,
             ):
-                result = _sync_fbs_postings_for_status(
+                result = _sync_status_once(
                     store,
                     status_value,
                     since_str,
                     to_str,
                     limit,
+                    force=True,
                 )
-                _set_last_sync_time(store.id, status_value, result["sync_time"])
-                sync_results[status_value] = result
+                # None: этот статус только что синкнул другой воркер, берем его время синка;
+                # {"skipped": "locked"}: синк еще идет в другом воркере, отдаем как есть
+                sync_results[status_value] = result or {
+                    "reused": True,
+                    "sync_time": _get_last_sync_time(store.id, status_value),
+                }
         except OzonApiError as exc:
             if exc.status_code in (401, 403):
                 store.api_key_invalid_at = timezone.now()
@@ -3524,6 +3345,9 @@ class FbsPostingRefreshView(APIView):
                 )
             return Response({"error": str(exc)}, status=status.HTTP_502_BAD_GATEWAY)
 
+        sync_locked = any(
+            result.get("skipped") == SYNC_SKIPPED_LOCKED for result in sync_results.values()
+        )
         background_started = False
         bg_statuses = [
             OzonFbsPosting.STATUS_DELIVERING,
@@ -3570,7 +3394,8 @@ class FbsPostingRefreshView(APIView):
                 },
                 "postings": postings,
             },
-            status=status.HTTP_200_OK,
+            # 202: синк какого-то статуса еще идет в другом воркере, список может быть неактуален
+            status=status.HTTP_202_ACCEPTED if sync_locked else status.HTTP_200_OK,
         )
 
 
@@ -3656,15 +3481,24 @@ class FbsPostingLabelsView(APIView):
         since_str = since.isoformat() if since else None
         to_str = to.isoformat() if to else None
         try:
-            result = _sync_fbs_postings_for_status(
+            result = _sync_status_once(
                 store,
                 OzonFbsPosting.STATUS_AWAITING_DELIVER,
                 since_str,
                 to_str,
                 limit=1000,
+                force=True,
+            )
+            if result and result.get("skipped") == SYNC_SKIPPED_LOCKED:
+                # Без свежего синка нельзя отличить отмененные отправления от ожидающих отгрузки
+                return Response(
+                    {"error": "Синхронизация отправлений еще выполняется, повторите запрос", "skipped": SYNC_SKIPPED_LOCKED},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            last_sync = (
+                result["sync_time"] if result
+                else _get_last_sync_time(store.id, OzonFbsPosting.STATUS_AWAITING_DELIVER)
             )
-            _set_last_sync_time(store.id, OzonFbsPosting.STATUS_AWAITING_DELIVER, result["sync_time"])
-            last_sync = result["sync_time"]
         except OzonApiError as exc:
             if exc.status_code in (401, 403):
                 store.api_key_invalid_at = timezone.now()
@@ -3678,6 +3512,7 @@ class FbsPostingLabelsView(APIView):
         postings = list(
             OzonFbsPosting.objects.filter(store=store, posting_number__in=posting_numbers)
             .prefetch_related("labels")
+            .with_payloads("products")
         )
         postings_map = {p.posting_number: p for p in postings}
         missing = [num for num in posting_numbers if num not in postings_map]
@@ -3687,7 +3522,7 @@ class FbsPostingLabelsView(APIView):
         pending = []
         errors = []
 
-        create_url = "https://api-seller.ozon.ru/v2/posting/fbs/package-label/create"
+        create_url = f"{SELLER_API_URL}/v2/posting/fbs/package-label/create"
         headers = {
             "Client-Id": store.client_id,
             "Api-Key": store.api_key,
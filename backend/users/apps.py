@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+
+        from .models import OzonStore
+        from .store_index import invalidate
+
+        post_save.connect(invalidate, sender=OzonStore, dispatch_uid="store_index_save")
+        post_delete.connect(invalidate, sender=OzonStore, dispatch_uid="store_index_delete")
@@ -0,0 +1,130 @@
+"""Поиск магазина по названию из листа (V23), ссылке на таблицу и паре Api-Key + client_id.
+
+Вместо цепочки запросов name__iexact → client_id__iexact → name__icontains → client_id__icontains
+каждый процесс держит в памяти индекс «нормализованное значение → id магазина», собранный одним
+запросом. На сохранение/удаление OzonStore (сигналы в UsersConfig.ready) в общем кэше меняется
+версия индекса, и процессы пересобирают его при следующем обращении. API-ключи в индексе хранятся
+только как sha256.
+"""
+import hashlib
+import time
+
+from django.core.cache import cache
+
+from .models import OzonStore
+
+VERSION_KEY = "stores:index:version"
+
+
+def normalize(value) -> str:
+    return str(value or "").strip().casefold()
+
+
+def api_key_hash(api_key, client_id) -> str:
+    return hashlib.sha256(f"{str(client_id or '').strip()}:{api_key or ''}".encode("utf-8")).hexdigest()
+
+
+class StoreIndex:
+    def __init__(self, version, rows):
+        self.version = version
+        self.by_name = {}
+        self.by_client_id = {}
+        self.by_sheet_url = {}
+        self.by_api_key = {}
+        self.stores = []
+        # rows отсортированы по id: при совпадениях побеждает первый магазин, как у .first()
+        for store_id, name, client_id, sheet_url, api_key in rows:
+            name, client = normalize(name), normalize(client_id)
+            if name:
+                self.by_name.setdefault(name, store_id)
+            if client:
+                self.by_client_id.setdefault(client, store_id)
+            if sheet_url:
+                self.by_sheet_url.setdefault(sheet_url.strip(), store_id)
+            self.by_api_key.setdefault(api_key_hash(api_key, client_id), store_id)
+            self.stores.append((store_id, name, client))
+
+    def resolve_name(self, value, fuzzy=True):
+        """id магазина по V23: точное название, точный client_id, затем (fuzzy) вхождение в название/client_id."""
+        needle = normalize(value)
+        if not needle:
+            return None
+        store_id = self.by_name.get(needle) or self.by_client_id.get(needle)
+        if store_id or not fuzzy:
+            return store_id
+        for store_id, name, _ in self.stores:
+            if needle in name:
+                return store_id
+        for store_id, _, client in self.stores:
+            if needle in client:
+                return store_id
+        return None
+
+
+_local = None
+
+
+def _new_version():
+    version = time.time_ns()
+    cache.set(VERSION_KEY, version, timeout=None)
+    return version
+
+
+def get_index() -> StoreIndex:
+    global _local
+    try:
+        version = cache.get(VERSION_KEY)
+        if version is None:
+            version = _new_version()
+    except Exception:
+        # Без кэша версию не сверить — собираем индекс заново (один запрос)
+        version = None
+    if _local is None or version is None or _local.version != version:
+        rows = OzonStore.objects.order_by("id").values_list("id", "name", "client_id", "google_sheet_url", "api_key")
+        _local = StoreIndex(version, list(rows))
+    return _local
+
+
+def invalidate(**kwargs):
+    """Обработчик post_save/post_delete OzonStore."""
+    global _local
+    _local = None
+    try:
+        _new_version()
+    except Exception:
+        pass
+
+
+def _lookup(find, **filters):
+    """find(index) → id; магазин перечитывается по id и filters (индекс мог устареть: магазин удалён
+    в откатившейся транзакции или ключ сменён без сигнала) — если не нашёлся, индекс пересобирается."""
+    store_id = find(get_index())
+    if not store_id:
+        return None
+    store = OzonStore.objects.filter(pk=store_id, **filters).first()
+    if store is None:
+        invalidate()
+        store_id = find(get_index())
+        store = OzonStore.objects.filter(pk=store_id, **filters).first() if store_id else None
+    return store
+
+
+def resolve_store(value, fuzzy=True):
+    """Магазин по значению ячейки V23 (название или client_id) или None; fuzzy=False — только точное совпадение."""
+    return _lookup(lambda index: index.resolve_name(value, fuzzy=fuzzy))
+
+
+def store_by_sheet_url(url):
+    return _lookup(lambda index: index.by_sheet_url.get((url or "").strip()))
+
+
+def get_store_by_api_key(api_key, client_id):
+    """Как OzonStore.objects.get(api_key=..., client_id=...): нет магазина — OzonStore.DoesNotExist."""
+    store = _lookup(
+        lambda index: index.by_api_key.get(api_key_hash(api_key, client_id)),
+        api_key=api_key,
+        client_id=client_id,
+    )
+    if store is None:
+        raise OzonStore.DoesNotExist("Магазин с таким Api-Key и client_id не найден")
+    return store
@@ -1,9 +1,11 @@
 from decimal import Decimal
+from django.test import TestCase
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 
 from .models import User, OzonStore, StoreFilterSettings
+from .store_index import get_index, get_store_by_api_key, resolve_store, store_by_sheet_url
 
 
 class UserStoreAPITests(APITestCase):
@@ -131,3 +133,45 @@ class UserStoreAPITests(APITestCase):
         response = self.client.get(url)
 
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class StoreIndexTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(telegram_id=333333, password='testpass')
+        self.first = OzonStore.objects.create(
+            user=user, name='Main Store', client_id='1001', api_key='key-1', google_sheet_url='https://example.com/a',
+        )
+        self.second = OzonStore.objects.create(user=user, name='Second', client_id='2002', api_key='key-2')
+
+    def test_resolves_in_cascade_order(self):
+        self.assertEqual(resolve_store('  main store '), self.first)
+        self.assertEqual(resolve_store('2002'), self.second)
+        self.assertEqual(resolve_store('cond'), self.second)
+        self.assertEqual(resolve_store('200'), self.second)
+        self.assertIsNone(resolve_store('cond', fuzzy=False))
+        self.assertIsNone(resolve_store(''))
+        self.assertEqual(store_by_sheet_url('https://example.com/a'), self.first)
+
+    def test_api_key_lookup_keeps_does_not_exist(self):
+        self.assertEqual(get_store_by_api_key('key-2', '2002'), self.second)
+        with self.assertRaises(OzonStore.DoesNotExist):
+            get_store_by_api_key('key-2', '1001')
+
+    def test_rotated_api_key_is_rejected_by_stale_index(self):
+        get_index()
+        # update() минует сигналы: индекс процесса остаётся со старым ключом
+        OzonStore.objects.filter(pk=self.second.pk).update(api_key='key-2-rotated')
+
+        with self.assertRaises(OzonStore.DoesNotExist):
+            get_store_by_api_key('key-2', '2002')
+        self.assertEqual(get_store_by_api_key('key-2-rotated', '2002'), self.second)
+
+    def test_one_query_per_lookup_and_invalidation_on_save(self):
+        get_index()
+        with self.assertNumQueries(1):
+            self.assertEqual(resolve_store('Main Store'), self.first)
+
+        self.second.name = 'Renamed'
+        self.second.save()
+        self.assertEqual(resolve_store('renamed'), self.second)
+        self.assertIsNone(resolve_store('second', fuzzy=False))
@@ -0,0 +1,41 @@
+from datetime import datetime
+
+from pydantic import BaseModel
+
+
+class ProfilerLevelSchema(BaseModel):
+    level: int
+    slow_ms: int = 100
+
+
+class ProfilerLevelResponseSchema(BaseModel):
+    was: int
+    level: int
+    slow_ms: int
+
+
+class SlowQuerySchema(BaseModel):
+    op: str
+    ns: str
+    millis: int
+    plan_summary: str | None = None
+    docs_examined: int | None = None
+    keys_examined: int | None = None
+    nreturned: int | None = None
+    ts: datetime | None = None
+    command: str
+
+
+class CollectionScanSchema(BaseModel):
+    ns: str
+    count: int
+    total_millis: int
+    docs_examined: int
+
+
+class ProfilerReportResponseSchema(BaseModel):
+    status: str
+    level: int
+    slow_ms: int
+    slow_queries: list[SlowQuerySchema]
+    collection_scans: list[CollectionScanSchema]
@@ -0,0 +1,45 @@
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
+
+from apps.indexes.models import ProfilerLevelResponseSchema, ProfilerLevelSchema, ProfilerReportResponseSchema
+from apps.indexes.utils import get_profiler_report, set_profiling_level
+from config import settings
+from user.oauth2 import require_user
+
+debug_router = APIRouter()
+
+
+def require_admin(request: Request, user_id: str = Depends(require_user)) -> str:
+    try:
+        user = request.app.database2.user.find_one({'_id': ObjectId(user_id)})
+    except (InvalidId, TypeError):
+        user = None
+    if not user or not user.get('admin'):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail='Admin only',
+        )
+    return user_id
+
+
+@debug_router.get('/profiler', response_model=ProfilerReportResponseSchema)
+async def get_profiler(
+    request: Request,
+    slow_ms: int | None = None,
+    limit: int = 50,
+    user_id: str = Depends(require_user),
+):
+    slow_ms = settings.PROFILER_SLOW_MS if slow_ms is None else slow_ms
+    return await run_in_threadpool(get_profiler_report, request.app.database2, slow_ms, limit)
+
+
+@debug_router.put('/profiler', response_model=ProfilerLevelResponseSchema)
+async def put_profiler(request: Request, payload: ProfilerLevelSchema, user_id: str = Depends(require_admin)):
+    if payload.level not in (0, 1, 2):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Level must be 0, 1 or 2',
+        )
+    return await run_in_threadpool(set_profiling_level, request.app.database2, payload.level, payload.slow_ms)
@@ -0,0 +1,187 @@
+import logging
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+from pymongo.synchronous.database import Database
+
+from config import settings
+
+logger = logging.getLogger('indexes')
+
+# Коды ошибок Mongo, когда индекс с таким именем уже есть, но с другими опциями
+# (например, поменялся expireAfterSeconds у TTL-индекса).
+INDEX_CONFLICT_CODES = (85, 86)
+
+# Коллекции с товарами продавца называются `{keys_id}_{market}`,
+# а поле с артикулом маркетплейса использует сокращенное название (ya вместо yandex).
+SELLER_MARKETS = {
+    'ali': 'offer_id_ali',
+    'ozon': 'offer_id_ozon',
+    'sber': 'offer_id_sber',
+    'wb': 'offer_id_wb',
+    'yandex': 'offer_id_ya',
+}
+
+
+def _log_ttl_seconds() -> int:
+    return settings.LOG_TTL_DAYS * 24 * 60 * 60
+
+
+def get_index_registry() -> dict[str, list[IndexModel]]:
+    """Декларативный список индексов общих коллекций.
+
+    Массивы `offer_id` и `barcodes` индексируются как multikey, поэтому поиск
+    карточек и групп по `$in` не сканирует коллекцию целиком.
+    TTL-индекс на `log.created_at` удаляет документы по дате создания лога
+    (`utils.datetime_now()`); строковые даты логов, записанных до перехода
+    на BSON-даты, Mongo не трогает.
+    """
+    return {
+        'central': [
+            IndexModel([('keys_id', ASCENDING), ('_id', ASCENDING)], name='keys_id_id'),
+            IndexModel([('offer_id', ASCENDING)], name='offer_id'),
+            IndexModel([('barcodes', ASCENDING)], name='barcodes'),
+            IndexModel([('group_id', ASCENDING)], name='group_id'),
+            IndexModel([('tag.name', ASCENDING)], name='tag_name'),
+        ],
+        'central_groups': [
+            IndexModel([('offer_id', ASCENDING)], name='offer_id'),
+            IndexModel([('barcodes', ASCENDING)], name='barcodes'),
+            IndexModel([('card_ids', ASCENDING)], name='card_ids'),
+        ],
+        'log': [
+            IndexModel([('keys_id', ASCENDING), ('created_at', DESCENDING)], name='keys_id_created_at'),
+            IndexModel([('keys_id', ASCENDING), ('updated_at', DESCENDING)], name='keys_id_updated_at'),
+            IndexModel([('updated_at', DESCENDING)], name='updated_at'),
+            IndexModel([('created_at', ASCENDING)], name='created_at_ttl',
+                       expireAfterSeconds=_log_ttl_seconds()),
+        ],
+        'keys': [
+            IndexModel([('sber.merchant_id', ASCENDING)], name='sber_merchant_id'),
+        ],
+        'history': [
+            IndexModel([('user_id', ASCENDING)], name='user_id'),
+        ],
+        'last_query': [
+            IndexModel([('created_at', DESCENDING)], name='created_at'),
+        ],
+        'user': [
+            IndexModel([('username', ASCENDING)], name='username'),
+        ],
+    }
+
+
+def get_seller_indexes(market: str) -> list[IndexModel]:
+    """Индексы коллекции товаров продавца `{keys_id}_{market}`."""
+    return [
+        IndexModel([(SELLER_MARKETS[market], ASCENDING)], name='market_offer_id'),
+        IndexModel([('offer_id', ASCENDING)], name='offer_id'),
+        IndexModel([('barcodes', ASCENDING)], name='barcodes'),
+        IndexModel([('card_id', ASCENDING)], name='card_id'),
+    ]
+
+
+def _create_indexes(database: Database, collection_name: str, indexes: list[IndexModel]) -> None:
+    collection = database[collection_name]
+    try:
+        collection.create_indexes(indexes)
+    except OperationFailure as exc:
+        if exc.code not in INDEX_CONFLICT_CODES:
+            raise
+        # Опции индекса поменялись: пересоздаем по одному, чтобы не трогать остальные.
+        for index in indexes:
+            index_name = index.document['name']
+            try:
+                collection.create_indexes([index])
+            except OperationFailure as index_exc:
+                if index_exc.code not in INDEX_CONFLICT_CODES:
+                    raise
+                logger.info(f'Recreate index {collection_name}.{index_name}')
+                collection.drop_index(index_name)
+                collection.create_indexes([index])
+
+
+def ensure_seller_indexes(database: Database, keys_id: str, market: str) -> None:
+    if market not in SELLER_MARKETS:
+        return
+    _create_indexes(database, f'{keys_id}_{market}', get_seller_indexes(market))
+
+
+def ensure_indexes(database: Database) -> None:
+    """Создает индексы общих коллекций и коллекций товаров всех продавцов.
+
+    `create_indexes` идемпотентен, поэтому функция вызывается при каждом старте приложения.
+    """
+    for collection_name, indexes in get_index_registry().items():
+        _create_indexes(database, collection_name, indexes)
+
+    for seller in database.settings.find(projection=list(SELLER_MARKETS)):
+        keys_id = str(seller['_id'])
+        for market in SELLER_MARKETS:
+            if seller.get(market):
+                ensure_seller_indexes(database, keys_id, market)
+    logger.info('Indexes ensured')
+
+
+def set_profiling_level(database: Database, level: int, slow_ms: int) -> dict:
+    result = database.command('profile', level, slowms=slow_ms)
+    return {'was': result.get('was', 0), 'level': level, 'slow_ms': slow_ms}
+
+
+def get_profiler_report(database: Database, slow_ms: int, limit: int) -> dict:
+    """Медленные запросы и полные сканирования коллекций из `system.profile`.
+
+    Профайлер должен быть включен (`set_profiling_level`), иначе `system.profile` пуст.
+    """
+    status = database.command('profile', -1)
+    projection = {
+        'op': 1, 'ns': 1, 'millis': 1, 'planSummary': 1, 'docsExamined': 1,
+        'keysExamined': 1, 'nreturned': 1, 'ts': 1, 'command': 1,
+    }
+    slow_queries = list(
+        database['system.profile']
+        .find({'millis': {'$gte': slow_ms}}, projection)
+        .sort('ts', DESCENDING)
+        .limit(limit)
+    )
+    collection_scans = list(
+        database['system.profile'].aggregate([
+            {'$match': {'planSummary': 'COLLSCAN'}},
+            {'$group': {
+                '_id': '$ns',
+                'count': {'$sum': 1},
+                'total_millis': {'$sum': '$millis'},
+                'docs_examined': {'$sum': '$docsExamined'},
+            }},
+            {'$sort': {'total_millis': -1}},
+            {'$limit': limit},
+        ])
+    )
+    return {
+        'status': 'success',
+        'level': status.get('was', 0),
+        'slow_ms': status.get('slowms', slow_ms),
+        'slow_queries': [
+            {
+                'op': query.get('op', ''),
+                'ns': query.get('ns', ''),
+                'millis': query.get('millis', 0),
+                'plan_summary': query.get('planSummary'),
+                'docs_examined': query.get('docsExamined'),
+                'keys_examined': query.get('keysExamined'),
+                'nreturned': query.get('nreturned'),
+                'ts': query.get('ts'),
+                'command': str(query.get('command', ''))[:1000],
+            }
+            for query in slow_queries
+        ],
+        'collection_scans': [
+            {
+                'ns': scan['_id'],
+                'count': scan['count'],
+                'total_millis': scan['total_millis'],
+                'docs_examined': scan.get('docs_examined') or 0,
+            }
+            for scan in collection_scans
+        ],
+    }
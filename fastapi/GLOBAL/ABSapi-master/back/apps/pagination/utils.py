@@ -0,0 +1,47 @@
+import math
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pydantic import BaseModel
+
+
+def schema_projection(schema: type[BaseModel], *extra_fields: str) -> dict[str, int]:
+    """Проекция Mongo по полям схемы ответа, чтобы не тянуть документ целиком.
+
+    `id` схемы соответствует `_id`, который Mongo возвращает всегда.
+    """
+    fields = [field for field in schema.model_fields if field != 'id']
+    return {field: 1 for field in [*fields, *extra_fields]}
+
+
+async def keyset_page(
+    collection: AsyncIOMotorCollection,
+    query: dict,
+    projection: dict[str, int],
+    limit: int,
+    after: ObjectId | None = None,
+    page: int = 1,
+) -> tuple[list[dict], str | None]:
+    """Страница документов, отсортированных по `_id`.
+
+    С `after` выборка начинается сразу после переданного `_id` и идет по индексу,
+    поэтому стоимость страницы не растет с глубиной листания.
+    `page` оставлен для старых клиентов и работает через skip.
+    Возвращает документы и курсор следующей страницы (None, если страница последняя).
+    """
+    if after is not None:
+        query = {'$and': [query, {'_id': {'$gt': after}}]}
+    cursor = collection.find(query, projection).sort('_id', 1)
+    if after is None and page > 1:
+        cursor = cursor.skip(limit * (page - 1))
+    documents = await cursor.limit(limit + 1).to_list(None)
+    next_cursor = str(documents[limit - 1]['_id']) if len(documents) > limit else None
+    return documents[:limit], next_cursor
+
+
+async def count_pages(collection: AsyncIOMotorCollection, query: dict, limit: int) -> str:
+    if query:
+        total = await collection.count_documents(query)
+    else:
+        total = await collection.estimated_document_count()
+    return str(math.ceil(total / limit))
@@ -50,6 +50,8 @@ class Settings(BaseSettings):
     ALI_UPDATE: str
 
     LOG_MODE: str
+    LOG_TTL_DAYS: int = 90
+    PROFILER_SLOW_MS: int = 100
     TIMEZONE: str = 'Europe/Moscow'
     model_config = SettingsConfigDict(case_sensitive=True)
 
@@ -3,6 +3,7 @@ from motor.motor_asyncio import AsyncIOMotorClient
 from config import settings
 import logging
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 import subprocess
 from pathlib import Path
 import os
@@ -15,6 +16,8 @@ sys.path.append(f'{os.getcwd()}')
 from user.utils import *
 from user.routes import *
 from apps.groups.routes import group_router
+from apps.indexes.routes import debug_router
+from apps.indexes.utils import ensure_indexes
 
 origins = [
     "https://localhost",
@@ -49,6 +52,7 @@ async def lifespan(app: FastAPI):
     app.database = app.client[settings.DB_NAME]
     app.client2 = MongoClient(settings.DB_URI2)
     app.database2 = app.client2[settings.DB_NAME]
+    ensure_indexes(app.database2)
     #app.client.drop_database(settings.DB_NAME)
     user = await app.database.user.find_one({'username': 'admin'})
     if not user:
@@ -72,6 +76,8 @@ app.add_middleware(
     allow_methods=["POST", "GET", "PUT", "DELETE"],
     allow_headers=["*"],
 )
+# Сжимаем только ответы клиентам, приславшим Accept-Encoding: gzip.
+app.add_middleware(GZipMiddleware, minimum_size=1000)
 
 
 app.include_router(user_router, tags=["user"], prefix="/api/v2/user")
@@ -82,3 +88,4 @@ app.include_router(settings_router, tags=["settings"], prefix="/api/v2/settings"
 app.include_router(sync_router, tags=["sync"], prefix="/api/v2/sync")
 app.include_router(sber, tags=["sber"], prefix="/api/v2/sber")
 app.include_router(group_router, tags=['group'], prefix='/api/v2/group')
+app.include_router(debug_router, tags=['debug'], prefix='/api/v2/debug')
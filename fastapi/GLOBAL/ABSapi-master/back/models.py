@@ -181,7 +181,8 @@ class WbWarehouseResponseSchema(BaseModel):
 class WbListWarehouseResponseSchema(BaseModel):
     status: str
     warehouse: list[WbWarehouseResponseSchema]
-    pages: str
+    pages: str | None = None
+    next_cursor: str | None = None
 
 
 class OzonWarehouseResponseSchema(BaseModel):
@@ -216,7 +217,8 @@ class OzonWarehouseResponseSchema(BaseModel):
 class OzonListWarehouseResponseSchema(BaseModel):
     status: str
     warehouse: list[OzonWarehouseResponseSchema]
-    pages: str
+    pages: str | None = None
+    next_cursor: str | None = None
 
 
 class YaWarehouseResponseSchema(BaseModel):
@@ -253,7 +255,8 @@ class YaWarehouseResponseSchema(BaseModel):
 class YaListWarehouseResponseSchema(BaseModel):
     status: str
     warehouse: list[YaWarehouseResponseSchema]
-    pages: str
+    pages: str | None = None
+    next_cursor: str | None = None
 
 class AliWarehouseResponseSchema(BaseModel):
     id: str
@@ -275,7 +278,8 @@ class AliWarehouseResponseSchema(BaseModel):
 class AliListWarehouseResponseSchema(BaseModel):
     status: str
     warehouse: list[AliWarehouseResponseSchema]
-    pages: str
+    pages: str | None = None
+    next_cursor: str | None = None
 
 
 class Uni(BaseModel):
@@ -461,7 +465,8 @@ class CentralwarehouseResponseSchema(BaseModel):
 class CentralListWarehouseResponseSchema(BaseModel):
     status: str
     warehouse: list[CentralwarehouseResponseSchema]
-    pages: str
+    pages: str | None = None
+    next_cursor: str | None = None
 
 
 class CardProductShortSchema(BaseModel):
@@ -0,0 +1,41 @@
+from datetime import datetime
+
+from bson import ObjectId
+from fastapi.testclient import TestClient
+from pymongo.database import Database
+
+from config import settings as app_settings
+from tests.makers.base import API_PREFIX, SYNC_URL, get_random_markets
+
+
+def test_merge_log_created_at_is_date(
+    client: TestClient,
+    mongodb: Database,
+    settings_factory,
+):
+    """
+    Проверяет, что лог объединения пишет created_at датой,
+    иначе TTL-индекс created_at_ttl такой лог никогда не удалит.
+    """
+
+    settings = settings_factory(get_random_markets())
+
+    response = client.post(API_PREFIX + SYNC_URL + '/merge', json={'keys_ids': [settings['_id']]})
+    assert response.status_code == 200
+
+    log_id = response.json()['ids'][0]
+    log = mongodb.log.find_one({'_id': ObjectId(log_id)})
+    assert isinstance(log['created_at'], datetime)
+
+    ttl_index = mongodb.log.index_information()['created_at_ttl']
+    assert ttl_index['key'] == [('created_at', 1)]
+    assert ttl_index['expireAfterSeconds'] == app_settings.LOG_TTL_DAYS * 24 * 60 * 60
+
+
+def test_put_profiler_requires_admin(client: TestClient, mongodb: Database):
+    """
+    Проверяет, что уровень профилировщика может менять только администратор.
+    """
+
+    response = client.put(API_PREFIX + 'debug/profiler', json={'level': 1})
+    assert response.status_code == 403
@@ -9,7 +9,7 @@ from sse_starlette.sse import EventSourceResponse
 from user.userSerializers import *
 from user.oauth2 import AuthJWT, require_user
 from fastapi import APIRouter, Response, Depends, HTTPException, Request, UploadFile, status, Query as FastAPIQuery
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.exceptions import ResponseValidationError
 from bson.errors import InvalidId
@@ -25,6 +25,7 @@ from config import settings
 from user import utils
 
 from apps.groups.utils import group_cards, move_card_to_separate_group
+from apps.pagination.utils import count_pages, keyset_page, schema_projection
 from apps.cards.utils import merge_products_to_card, move_product_to_separate_card
 
 user_router = APIRouter()
@@ -34,6 +35,12 @@ sync_router = APIRouter()
 warehouse_router = APIRouter()
 logs_router = APIRouter()
 sber = APIRouter()
+
+WB_LIST_PROJECTION = schema_projection(WbWarehouseResponseSchema)
+OZON_LIST_PROJECTION = schema_projection(OzonWarehouseResponseSchema)
+YA_LIST_PROJECTION = schema_projection(YaWarehouseResponseSchema)
+ALI_LIST_PROJECTION = schema_projection(AliWarehouseResponseSchema, 'ali_id')
+CENTRAL_LIST_PROJECTION = schema_projection(CentralwarehouseResponseSchema)
 # USER
 
 
@@ -314,7 +321,7 @@ async def product_stock_update(request: Request, payload: ProductsUpdateRequest,
                 update_ya_pipeline["campaignid"] = result.options.ya.campaign_id
                 update_ya_pipeline["skus"].append({'items': [{"count": i['stock']['ya']['count']}],
                                                   'sku': str(result.options.ya.offer_id)})
-                log = request.app.database2.log.insert_one({'status': 0, 'created_at': utils.datetime_now_str(),
+                log = request.app.database2.log.insert_one({'status': 0, 'created_at': utils.datetime_now(),
                                                             "keys_id": result.keys_id})
                 update_ya_pipeline["log_id"] = str(log.inserted_id)
                 items = {"items": update_ya_pipeline}
@@ -334,7 +341,7 @@ async def product_stock_update(request: Request, payload: ProductsUpdateRequest,
                                                       "product_id": result.options.ozon.ozon_id,
                                                       "stock": i['stock']['ozon']['count'],
                                                       "warehouse_id": update_ozon_pipeline["warehouse_id"]})
-                log = request.app.database2.log.insert_one({'status': 0, 'created_at': utils.datetime_now_str(),
+                log = request.app.database2.log.insert_one({'status': 0, 'created_at': utils.datetime_now(),
                                                             "keys_id": result.keys_id})
                 update_ozon_pipeline["log_id"] = str(log.inserted_id)
                 items = {"items": update_ozon_pipeline}
@@ -351,7 +358,7 @@ async def product_stock_update(request: Request, payload: ProductsUpdateRequest,
                 update_wb_pipeline["warehouse_id"] = result.options.wb.warehouse_id
                 update_wb_pipeline["stocks"].append({"sku": str(result.options.wb.sku),
                                                     "amount": i['stock']['wb']['count']})
-                log = request.app.database2.log.insert_one({'status': 0, 'created_at': utils.datetime_now_str(),
+                log = request.app.database2.log.insert_one({'status': 0, 'created_at': utils.datetime_now(),
                                                             "keys_id": result.keys_id})
                 update_wb_pipeline["log_id"] = str(log.inserted_id)
                 items = {"items": update_wb_pipeline}
@@ -367,7 +374,7 @@ async def product_stock_update(request: Request, payload: ProductsUpdateRequest,
                 update_sber_pipeline["keys_id"] = result.keys_id
                 update_sber_pipeline["stocks"].append({"offerId": result.options.sber.offer_id,
                                                     "stocks": i['stock']['sber']['count']})
-                log = request.app.database2.log.insert_one({'status': 0, 'created_at': utils.datetime_now_str(),
+                log = request.app.database2.log.insert_one({'status': 0, 'created_at': utils.datetime_now(),
                                                             "keys_id": result.keys_id})
                 update_sber_pipeline["log_id"] = str(log.inserted_id)
                 items = {"items": update_sber_pipeline}
@@ -384,7 +391,7 @@ async def product_stock_update(request: Request, payload: ProductsUpdateRequest,
                 update_ali_pipeline["products"].append({"product_id": str(result.options.ali.ali_id),
                                                     "skus": [{"sku_code": str(result.options.ali.offer_id),
                                                               "inventory": str(i['stock']['ali']['count'])}]})
-                log = request.app.database2.log.insert_one({'status': 0, 'created_at': utils.datetime_now_str(),
+                log = request.app.database2.log.insert_one({'status': 0, 'created_at': utils.datetime_now(),
                                                             "keys_id": result.keys_id})
                 update_ali_pipeline["log_id"] = str(log.inserted_id)
                 items = {"items": update_ali_pipeline}
@@ -868,7 +875,7 @@ async def product_stock_update_from_payload(request: Request, payload: ListUpdat
         chunks = [update_ya_pipeline["skus"][x:x + 2000] for x in range(0, len(update_ya_pipeline["skus"]), 2000)]
         for chunk in chunks:
             update_ya_pipeline["skus"] = chunk
-            log = request.app.database2.log.insert_one({'status': 0, 'created_at': utils.datetime_now_str(),
+            log = request.app.database2.log.insert_one({'status': 0, 'created_at': utils.datetime_now(),
                                                         "keys_id": update_ya_pipeline["keys_id"]})
             update_ya_pipeline["log_id"] = str(log.inserted_id)
             items = {"items": update_ya_pipeline}
@@ -880,7 +887,7 @@ async def product_stock_update_from_payload(request: Request, payload: ListUpdat
         chunks = [update_ozon_pipeline["stocks"][x:x + 100] for x in range(0, len(update_ozon_pipeline["stocks"]), 100)]
         for chunk in chunks:
             update_ozon_pipeline["stocks"] = chunk
-            log = request.app.database2.log.insert_one({'status': 0, 'created_at': utils.datetime_now_str(),
+            log = request.app.database2.log.insert_one({'status': 0, 'created_at': utils.datetime_now(),
                                                         "keys_id": update_ozon_pipeline["keys_id"]})
             update_ozon_pipeline["log_id"] = str(log.inserted_id)
             items = {"items": update_ozon_pipeline}
@@ -892,7 +899,7 @@ async def product_stock_update_from_payload(request: Request, payload: ListUpdat
         chunks = [update_wb_pipeline["stocks"][x:x + 1000] for x in range(0, len(update_wb_pipeline["stocks"]), 1000)]
         for chunk in chunks:
             update_wb_pipeline["stocks"] = chunk
-            log = request.app.database2.log.insert_one({'status': 0, 'created_at': utils.datetime_now_str(),
+            log = request.app.database2.log.insert_one({'status': 0, 'created_at': utils.datetime_now(),
                                                         "keys_id": update_wb_pipeline["keys_id"]})
             update_wb_pipeline["log_id"] = str(log.inserted_id)
             items = {"items": update_wb_pipeline}
@@ -904,7 +911,7 @@ async def product_stock_update_from_payload(request: Request, payload: ListUpdat
         chunks = [update_sber_pipeline["stocks"][x:x + 300] for x in range(0, len(update_sber_pipeline["stocks"]), 300)]
         for chunk in chunks:
             update_sber_pipeline["stocks"] = chunk
-            log = request.app.database2.log.insert_one({'status': 0, 'created_at': utils.datetime_now_str(),
+            log = request.app.database2.log.insert_one({'status': 0, 'created_at': utils.datetime_now(),
                                                         "keys_id": update_sber_pipeline["keys_id"]})
             update_sber_pipeline["log_id"] = str(log.inserted_id)
             items = {"items": update_sber_pipeline}
@@ -917,7 +924,7 @@ async def product_stock_update_from_payload(request: Request, payload: ListUpdat
                                                                              1000)]
         for chunk in chunks:
             update_ali_pipeline["products"] = chunk
-            log = request.app.database2.log.insert_one({'status': 0, 'created_at': utils.datetime_now_str(),
+            log = request.app.database2.log.insert_one({'status': 0, 'created_at': utils.datetime_now(),
                                                         "keys_id": update_ali_pipeline["keys_id"]})
             update_ali_pipeline["log_id"] = str(log.inserted_id)
             items = {"items": update_ali_pipeline}
@@ -936,18 +943,14 @@ async def product_stock_update_from_payload(request: Request, payload: ListUpdat
 
 # warehouse routes
 
-@warehouse_router.get('/wb', response_model=WbListWarehouseResponseSchema)
-async def get_wb_stock(request: Request, keys_id: str, limit: int = 40, page: int = 1, user_id: str = Depends(require_user)):
+@warehouse_router.get('/wb', response_model=WbListWarehouseResponseSchema, response_class=ORJSONResponse)
+async def get_wb_stock(request: Request, keys_id: str, limit: int = 40, page: int = 1,
+                       after: PyObjectId | None = None, user_id: str = Depends(require_user)):
     collection = request.app.database[f"{keys_id}_wb"]
-    try:
-        warehouse = wbListResponseEntity(await (collection.find().skip(limit * (page - 1)).
-                                     limit(limit)).to_list(None))
-        count = wbListResponseEntity(await(collection.find()).to_list(None))
-        pages = math.ceil(len(count) / limit)
-        return {"status": "success", "warehouse": warehouse, "pages": str(pages)}
-    except IndexError:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail="Empty list")
+    documents, next_cursor = await keyset_page(collection, {}, WB_LIST_PROJECTION, limit, after, page)
+    warehouse = wbListResponseEntity(documents)
+    pages = await count_pages(collection, {}, limit) if after is None else None
+    return {"status": "success", "warehouse": warehouse, "pages": pages, "next_cursor": next_cursor}
 
 @warehouse_router.delete('/wb', response_model=DefStatus)
 async def delete_wb_stock(request: Request, keys_id: str, user_id: str = Depends(require_user)):
@@ -956,21 +959,14 @@ async def delete_wb_stock(request: Request, keys_id: str, user_id: str = Depends
     return {"status": "success"}
 
 
-@warehouse_router.get('/ozon', response_model=OzonListWarehouseResponseSchema)
-async def get_ozon_stock(request: Request, keys_id: str, limit: int = 40,
-                         page: int = 1, user_id: str = Depends(require_user)):
+@warehouse_router.get('/ozon', response_model=OzonListWarehouseResponseSchema, response_class=ORJSONResponse)
+async def get_ozon_stock(request: Request, keys_id: str, limit: int = 40, page: int = 1,
+                         after: PyObjectId | None = None, user_id: str = Depends(require_user)):
     collection = request.app.database[f"{keys_id}_ozon"]
-    try:
-        warehouse = ozonListResponseEntity(await(collection.find().skip(limit * (page - 1)).
-                                     limit(limit)).to_list(None))
-        df = pd.json_normalize(warehouse)
-        df.to_csv('ozon.csv', sep='|')
-        count = ozonListResponseEntity(await(collection.find()).to_list(None))
-        pages = math.ceil(len(count) / limit)
-        return {"status": "success", "warehouse": warehouse, "pages": str(pages)}
-    except IndexError:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail="Empty list")
+    documents, next_cursor = await keyset_page(collection, {}, OZON_LIST_PROJECTION, limit, after, page)
+    warehouse = ozonListResponseEntity(documents)
+    pages = await count_pages(collection, {}, limit) if after is None else None
+    return {"status": "success", "warehouse": warehouse, "pages": pages, "next_cursor": next_cursor}
 
 @warehouse_router.delete('/ozon', response_model=DefStatus)
 async def delete_ozon_stock(request: Request, keys_id: str, user_id: str = Depends(require_user)):
@@ -979,18 +975,14 @@ async def delete_ozon_stock(request: Request, keys_id: str, user_id: str = Depen
     return {"status": "success"}
 
 
-@warehouse_router.get('/ya', response_model=YaListWarehouseResponseSchema)
-async def get_ya_stock(request: Request, keys_id: str, limit: int = 40, page: int = 1, user_id: str = Depends(require_user)):
+@warehouse_router.get('/ya', response_model=YaListWarehouseResponseSchema, response_class=ORJSONResponse)
+async def get_ya_stock(request: Request, keys_id: str, limit: int = 40, page: int = 1,
+                       after: PyObjectId | None = None, user_id: str = Depends(require_user)):
     collection = request.app.database[f"{keys_id}_yandex"]
-    try:
-        warehouse = yaListResponseEntity(await (collection.find().skip(limit * (page - 1)).
-                                     limit(limit)).to_list(None))
-        count = yaListResponseEntity(await(collection.find()).to_list(None))
-        pages = math.ceil(len(count) / limit)
-        return {"status": "success", "warehouse": warehouse, "pages": str(pages)}
-    except IndexError:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail="Empty list")
+    documents, next_cursor = await keyset_page(collection, {}, YA_LIST_PROJECTION, limit, after, page)
+    warehouse = yaListResponseEntity(documents)
+    pages = await count_pages(collection, {}, limit) if after is None else None
+    return {"status": "success", "warehouse": warehouse, "pages": pages, "next_cursor": next_cursor}
 
 @warehouse_router.delete('/ya', response_model=DefStatus)
 async def delete_ya_stock(request: Request, keys_id: str, user_id: str = Depends(require_user)):
@@ -999,18 +991,14 @@ async def delete_ya_stock(request: Request, keys_id: str, user_id: str = Depends
     return {"status": "success"}
 
 
-@warehouse_router.get('/ali', response_model=AliListWarehouseResponseSchema)
-async def get_ali_stock(request: Request, keys_id: str, limit: int = 40, page: int = 1, user_id: str = Depends(require_user)):
+@warehouse_router.get('/ali', response_model=AliListWarehouseResponseSchema, response_class=ORJSONResponse)
+async def get_ali_stock(request: Request, keys_id: str, limit: int = 40, page: int = 1,
+                        after: PyObjectId | None = None, user_id: str = Depends(require_user)):
     collection = request.app.database[f"{keys_id}_ali"]
-    try:
-        warehouse = aliListResponseEntity(await (collection.find().skip(limit * (page - 1)).
-                                     limit(limit)).to_list(None))
-        count = aliListResponseEntity(await(collection.find()).to_list(None))
-        pages = math.ceil(len(count) / limit)
-        return {"status": "success", "warehouse": warehouse, "pages": str(pages)}
-    except IndexError:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail="Empty list")
+    documents, next_cursor = await keyset_page(collection, {}, ALI_LIST_PROJECTION, limit, after, page)
+    warehouse = aliListResponseEntity(documents)
+    pages = await count_pages(collection, {}, limit) if after is None else None
+    return {"status": "success", "warehouse": warehouse, "pages": pages, "next_cursor": next_cursor}
 
 @warehouse_router.delete('/ali', response_model=DefStatus)
 async def delete_ali_stock(request: Request, keys_id: str, user_id: str = Depends(require_user)):
@@ -1019,19 +1007,16 @@ async def delete_ali_stock(request: Request, keys_id: str, user_id: str = Depend
     return {"status": "success"}
 
 
-@warehouse_router.get('/central', response_model=CentralListWarehouseResponseSchema)
+@warehouse_router.get('/central', response_model=CentralListWarehouseResponseSchema,
+                     response_class=ORJSONResponse)
 async def get_central_stock_by_keys_id(request: Request, keys_id: str, limit: int = 40, page: int = 1,
-                                       user_id: str = Depends(require_user)):
-    try:
-        warehouse = centralListResponseEntity(await (request.app.database.central.find({"keys_id": keys_id}).
-                                              skip(limit * (page - 1)).
-                                     limit(limit)).to_list(None))
-        count = await(request.app.database.central.find({"keys_id": keys_id})).to_list(None)
-        pages = math.ceil(len(count) / limit)
-        return {"status": "success", "warehouse": warehouse, "pages": str(pages)}
-    except IndexError:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail="Empty list")
+                                       after: PyObjectId | None = None, user_id: str = Depends(require_user)):
+    collection = request.app.database.central
+    query = {"keys_id": keys_id}
+    documents, next_cursor = await keyset_page(collection, query, CENTRAL_LIST_PROJECTION, limit, after, page)
+    warehouse = centralListResponseEntity(documents)
+    pages = await count_pages(collection, query, limit) if after is None else None
+    return {"status": "success", "warehouse": warehouse, "pages": pages, "next_cursor": next_cursor}
 
 @warehouse_router.delete('/central', response_model=DefStatus)
 async def delete_central_stock_by_keys_id(request: Request, keys_id: str | None = None, drop_all: bool | None = False,
@@ -1064,11 +1049,17 @@ async def delete_logs_by_date_before(request: Request, before_date: datetime | N
                                      drop: bool = False, limit: int = 40,
                                   page: int = 1, user_id: str = Depends(require_user)):
     if drop:
-        request.app.database.log.drop()
+        await request.app.database.log.drop()
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail=f"Empty list")
     else:
-        request.app.database.log.delete_many({"created_at": {"$lt": before_date}})
+        if before_date is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail="before_date is required")
+        # created_at хранится как дата без таймзоны в локальном времени (utils.TZ)
+        if before_date.tzinfo is not None:
+            before_date = before_date.astimezone(utils.TZ).replace(tzinfo=None)
+        await request.app.database.log.delete_many({"created_at": {"$lt": before_date}})
         logs = await (request.app.database.log.find().skip(limit * (page - 1)).
                                      limit(limit)).to_list(None)
         count = await (request.app.database.log.find()).to_list(None)
@@ -1137,7 +1128,7 @@ async def delete_settings(
         log = request.app.database2.log.insert_one(
             {
                 'status': 0,
-                'created_at': utils.datetime_now_str(),
+                'created_at': utils.datetime_now(),
                 "keys_id": str(keys_id),
             }
         )
@@ -1303,7 +1294,7 @@ def get_update_warehouse(request: Request, payload: UpdateListSchema, user_id: s
         company = keysd['company']
         for key in keysd:
             if key == 'ozon' and keysd[key] is not None:
-                log = request.app.database2.log.insert_one({'status': 0, 'created_at': utils.datetime_now_str(),
+                log = request.app.database2.log.insert_one({'status': 0, 'created_at': utils.datetime_now(),
                                                             "keys_id": keys_id})
                 ozon_log = str(log.inserted_id)
                 p = multiprocessing.Process(target=utils.update_ozon_warehouse, args=(ozon_log,
@@ -1313,7 +1304,7 @@ def get_update_warehouse(request: Request, payload: UpdateListSchema, user_id: s
                 processes.append(p)
                 updatelist.append(ozon_log)
             if key == 'wb' and keysd[key] is not None:
-                log = request.app.database2.log.insert_one({'status': 0, 'created_at': utils.datetime_now_str(),
+                log = request.app.database2.log.insert_one({'status': 0, 'created_at': utils.datetime_now(),
                                                             "keys_id": keys_id})
                 wb_log = str(log.inserted_id)
                 p = multiprocessing.Process(target=utils.update_wb_warehouse, args=(wb_log, keys_id, company, keysd[key]))
@@ -1322,7 +1313,7 @@ def get_update_warehouse(request: Request, payload: UpdateListSchema, user_id: s
                 updatelist.append(wb_log)
             if key == 'yandex' and keysd[key] is not None:
                 urls = [settings.YA, settings.YA_BIZ]
-                log = request.app.database2.log.insert_one({'status': 0, 'created_at': utils.datetime_now_str(),
+                log = request.app.database2.log.insert_one({'status': 0, 'created_at': utils.datetime_now(),
                                                             "keys_id": keys_id})
                 ya_log = str(log.inserted_id)
                 p = multiprocessing.Process(target=utils.update_ya_warehouse, args=(ya_log, keys_id, company,
@@ -1332,7 +1323,7 @@ def get_update_warehouse(request: Request, payload: UpdateListSchema, user_id: s
                 updatelist.append(ya_log)
             if key == 'ali' and keysd.get(key, None) is not None and keysd.get(key, {}).get('token', '') != '':
                 urls = [settings.ALI_GOODS]
-                log = request.app.database2.log.insert_one({'status': 0, 'created_at': utils.datetime_now_str(),
+                log = request.app.database2.log.insert_one({'status': 0, 'created_at': utils.datetime_now(),
                                                             "keys_id": keys_id})
                 ali_log = str(log.inserted_id)
                 p = multiprocessing.Process(target=utils.update_ali_warehouse, args=(ali_log, keys_id, company,
@@ -1364,7 +1355,7 @@ def merge_products(request: Request, payload: UpdateListSchema, user_id: str = D
         log = request.app.database2.log.insert_one(
             {
                 'status': 0,
-                'created_at': utils.datetime_now_str(),
+                'created_at': utils.datetime_now(),
                 "keys_id": str(seller_id),
             }
         )
@@ -1427,7 +1418,7 @@ def move_product(
     log = request.app.database2.log.insert_one(
         {
             'status': 0,
-            'created_at': utils.datetime_now_str(),
+            'created_at': utils.datetime_now(),
             'keys_id': keys_id,
             'group_items': f'{market}-{product_id}',
         }
@@ -1492,7 +1483,7 @@ def group_cards_endpoint(request: Request, payload: GroupListSchema, user_id: st
         log = request.app.database2.log.insert_one(
             {
                 'status': 0,
-                'created_at': utils.datetime_now_str(),
+                'created_at': utils.datetime_now(),
                 "group_companies": str(seller_ids),
             }
         )
@@ -1533,7 +1524,7 @@ def group_cards_endpoint(request: Request, payload: GroupListSchema, user_id: st
         log = request.app.database2.log.insert_one(
             {
                 'status': 0,
-                'created_at': utils.datetime_now_str(),
+                'created_at': utils.datetime_now(),
                 "group_items": str(card_ids),
             }
         )
@@ -1591,7 +1582,7 @@ def move_card(
     log = request.app.database2.log.insert_one(
         {
             'status': 0,
-            'created_at': utils.datetime_now_str(),
+            'created_at': utils.datetime_now(),
             'group_items': group_id,
         }
     )
@@ -21,6 +21,7 @@ from typing import Annotated
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from config import settings
+from apps.indexes.utils import ensure_seller_indexes
 import re
 import pytz
 import random
@@ -52,8 +53,12 @@ def init_logging():
     )
 
 
+def datetime_now() -> datetime:
+    return datetime.now(TZ).replace(tzinfo=None)
+
+
 def datetime_now_str() -> str:
-    return str(datetime.now(TZ).replace(tzinfo=None))
+    return str(datetime_now())
 
 def hash_password(password: str):
     return pwd_context.hash(password)
@@ -88,6 +93,7 @@ def update_ozon_warehouse(log_id, keys_id, company, keys):
     db = dbconsync()
     log_id_obj = ObjectId(log_id)
     collection = db[f"{keys_id}_ozon"]
+    ensure_seller_indexes(db, keys_id, 'ozon')
     client_id = keys["client_id"]
     api_key = keys["api_key"]
     data = {"limit": 500, "filter": { "visibility": "ALL" }}
@@ -543,6 +549,7 @@ def update_wb_warehouse(log_id, keys_id, company, keys):
     db = dbconsync()
     log_id_obj = ObjectId(log_id)
     collection = db[f"{keys_id}_wb"]
+    ensure_seller_indexes(db, keys_id, 'wb')
     wb_token = keys["api_key"]
     warehouse_id = keys["warehouse_id"]
     headers = {
@@ -825,6 +832,7 @@ def update_ya_warehouse(log_id, keys_id, company, urls, keys):
     )
     db = dbconsync()
     collection = db[f"{keys_id}_yandex"]
+    ensure_seller_indexes(db, keys_id, 'yandex')
     campaign_id = keys["campaign_id"]
     api_key = keys["api_key"]
     warehouse_id = int(keys["warehouse_id"])
@@ -1068,6 +1076,7 @@ def update_ali_warehouse(log_id, keys_id, company, urls, keys):
     )
     db = dbconsync()
     collection = db[f"{keys_id}_ali"]
+    ensure_seller_indexes(db, keys_id, 'ali')
     token = keys["token"]
     
     headers = {
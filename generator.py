@@ -1,58 +1,139 @@
 import requests
 import json
 import time
-from pprint import pprint   
+import uuid
+from dataclasses import dataclass, field
+from pprint import pprint
 from datetime import datetime, timedelta
+from typing import Optional, TypedDict
 import random
-import os, glob
-
-HEADERS = None
-
-def get_categorys():
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from wb_api import cache, fetch_offset_pages, get_session, run_parallel, token_key
+from wb_orders import order_store
+
+
+# ------------------------------------------------------------------------------------------------------------
+# Структуры, которые стадии передают друг другу в памяти
+
+class PriceInfo(TypedDict):
+    size: Optional[str]
+    price: Optional[int]
+    discountedPrice: int
+    clubDiscountedPrice: int
+
+
+class CardItem(TypedDict, total=False):
+    photo: Optional[str]
+    vendorCode: Optional[str]
+    nmID: int
+    barcode: Optional[str]
+    category: str
+    subject: Optional[str]
+    brand: Optional[str]
+    link: str
+    available: bool
+    status: str
+    stocks: list
+    totalStock: int
+    prices: list[PriceInfo]
+    currency: Optional[int]
+    clubDiscount: Optional[int]
+
+
+# vendorCode → карточки с этим артикулом
+GroupedCards = dict[Optional[str], list[CardItem]]
+
+
+class SalesStats(TypedDict):
+    salesByWarehouse: dict[str, int]
+    totalSales: int
+    totalRevenue: int
+    avgDailySales: float
+
+
+class WarehouseWeight(TypedDict, total=False):
+    ordersCount: int
+    revenue: float
+    warehouseType: str
+    weight: float
+    col_index: int
+    col_letter: str
+    color: str
+    warehouse_total_delivery: int
+
+
+@dataclass
+class PlannerContext:
+    """Состояние одного запуска планировщика.
+
+    Каждый запрос получает свой контекст, поэтому параллельные запросы
+    с разными токенами не перетирают заголовки и файлы друг друга.
+    Если задан `checkpoint_dir`, результаты стадий дополнительно сохраняются
+    в отдельную папку запуска (для отладки), но следующая стадия их не читает.
+    """
+    headers: dict
+    checkpoint_dir: Optional[str] = None
+    session: requests.Session = field(default_factory=get_session)
+    run_id: str = field(default_factory=lambda: f"{datetime.now():%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:8]}")
+
+    def checkpoint(self, name, data):
+        if not self.checkpoint_dir:
+            return
+        run_dir = os.path.join(self.checkpoint_dir, self.run_id)
+        os.makedirs(run_dir, exist_ok=True)
+        with open(os.path.join(run_dir, name), "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+    @property
+    def token_key(self):
+        return token_key(self.headers.get("Authorization"))
+
+    def cached(self, name, loader):
+        # Кэш общий для всех запросов, но ключ включает токен: данные разных продавцов не смешиваются
+        return cache.get_or_load((self.token_key, name), loader)
+
+
+def get_categorys(ctx):
     url = "https://content-api.wildberries.ru/content/v2/object/all"
     limit = 1000
-    offset = 0
-    all_items = []
 
-    while True:
+    def fetch_page(offset):
         params = {
             "limit": limit,
             "offset": offset
         }
-        response = requests.get(url, headers=HEADERS, params=params)
+        response = ctx.session.get(url, headers=ctx.headers, params=params)
         if response.status_code != 200:
             print(f"❌ Ошибка {response.status_code}: {response.text}")
-            break
-
-        data = response.json()
-        items = data.get("data", [])
-        if not items:
-            break
+            return None
+        return response.json().get("data", [])
 
-        all_items.extend(items)
-        offset += limit
+    all_items = fetch_offset_pages(fetch_page, limit)
 
     # Строим subjectID → parentName
     subject_map = {item["subjectID"]: item["parentName"] for item in all_items}
     print(f"✅ Загружено категорий: {len(subject_map)}")
     return subject_map
 
-def get_warehouses():
+def get_warehouses(ctx):
 
     url = "https://marketplace-api.wildberries.ru/api/v3/warehouses"
-    response = requests.get(url, headers=HEADERS)
+    response = ctx.session.get(url, headers=ctx.headers)
     if response.status_code != 200:
-        print("❌ Ошибка запроса:", response.status_code, response.text)           
+        print("❌ Ошибка запроса:", response.status_code, response.text)
+        return []
 
     try:
-        data = response.json()
-        # pprint(data)
+        return response.json()
     except Exception as e:
         print("❌ Ошибка при разборе JSON:", e)
+        return []
 
-#1 Получаем все товары    
+#1 Получаем все товары
 
-def get_all_cards():
+def get_all_cards(ctx):
     def fetch_cards(url, status):
         limit = 100
         all_cards = []
@@ -66,7 +147,7 @@ def get_all_cards():
                     }
                 }
             }
-            response = requests.post(url, headers=HEADERS, json=body)
+            response = ctx.session.post(url, headers=ctx.headers, json=body)
             if response.status_code != 200:
                 print(f"❌ Ошибка запроса {status}: {response.status_code} {response.text}")
                 break
@@ -75,7 +156,7 @@ def get_all_cards():
                 cards = data.get("cards", [])
                 if not cards:
                     break
-                
+
                 for card in cards:
                     card["status"] = status  # ✅ добавляем статус
 
@@ -99,39 +180,35 @@ def get_all_cards():
 
         return all_cards
 
-    # Активные карточки
+    # Активные и архивные карточки листаются курсором независимо друг от друга
     active_url = "https://content-api.wildberries.ru/content/v2/get/cards/list"
-    active_cards = fetch_cards(active_url, "active")
-    print(f"Активных карточек {len(active_cards)} ")
-
-    # Архивные карточки
     archived_url = "https://content-api.wildberries.ru/content/v2/get/cards/trash"
-    archived_cards = fetch_cards(archived_url, "archived")
+    fetched = run_parallel(
+        active=(fetch_cards, active_url, "active"),
+        archived=(fetch_cards, archived_url, "archived"),
+    )
+    active_cards = fetched["active"]
+    archived_cards = fetched["archived"]
+    print(f"Активных карточек {len(active_cards)} ")
     print(f"Архивных карточек {len(archived_cards)} ")
 
     # 🧩 Объединяем всё
     all_cards = active_cards + archived_cards
+    ctx.checkpoint("cards_all.json", all_cards)
 
-    with open("json/cards_all.json", "w", encoding="utf-8") as f:
-        json.dump(all_cards, f, ensure_ascii=False, indent=2)
-
-    print(f"Сохранено {len(all_cards)} карточек (в том числе архивных)")
+    print(f"Получено {len(all_cards)} карточек (в том числе архивных)")
+    return all_cards
 
 #2 Приводим к общему виду
-def process_cards(input_file="json/cards_all.json", output_file="json/cards_grouped.json"):
-    with open(input_file, "r", encoding="utf-8") as f:
-        cards = json.load(f)
-
+def process_cards(cards, category_data) -> GroupedCards:
     grouped = {}
-    category_data = get_categorys()
-    # category_map = {item["subjectID"]: item["parentName"] for item in category_data.get("data", [])}
     for card in cards:
         vendor_code = card.get("vendorCode")
         nm_id = card.get("nmID")
         brand = card.get("brand")
         photos = card.get("photos", [])
         sizes = card.get("sizes", [])
-        subject_name = card.get("subjectName") 
+        subject_name = card.get("subjectName")
         subjectID = card.get("subjectID")
         if subjectID in category_data:
             category_name = category_data[subjectID]
@@ -156,7 +233,7 @@ def process_cards(input_file="json/cards_all.json", output_file="json/cards_grou
 
         available = bool(photo and barcode)
 
-        item = {
+        item: CardItem = {
             "photo": photo,
             "vendorCode": vendor_code,
             "nmID": nm_id,
@@ -174,38 +251,29 @@ def process_cards(input_file="json/cards_all.json", output_file="json/cards_grou
 
         grouped[vendor_code].append(item)
 
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(grouped, f, ensure_ascii=False, indent=2)
-
-    print(f"Сформирован файл {output_file}")
+    print(f"Сгруппировано артикулов: {len(grouped)}")
+    return grouped
 
 # Получить все коды товаров чтобы искать их на складе
-def get_all_barcodes_from_grouped(file_path="json/cards_grouped.json"):
-    with open(file_path, "r", encoding="utf-8") as f:
-        cards_grouped_json = json.load(f)
-
+def get_all_barcodes_from_grouped(grouped: GroupedCards):
     barcodes = set()
-    for group in cards_grouped_json.values():
+    for group in grouped.values():
         for item in group:
             barcode = item.get("barcode")
             if barcode:
                 barcodes.add(barcode)
-    return list(barcodes), cards_grouped_json
+    return list(barcodes)
 
 #------------------------------------------------------------------------------------------------------------
 
 #Получаем количестов товара на складе по штрихкодам АИЫ
 #Функция возвращает словарь, где ключ — штрихкод, а значение — список складов с остатками
-def get_stocks_by_barcode(barcodes):
+def get_stocks_by_barcode(ctx, barcodes, warehouses):
     stocks_by_barcode = {}
     chunk_size = 1000
 
-    # Получаем список складов
-    warehouses_url = "https://marketplace-api.wildberries.ru/api/v3/warehouses"
-    try:
-        warehouses = requests.get(warehouses_url, headers=HEADERS).json()
-    except Exception as e:
-        print("❌ Не удалось получить список складов:", e)
+    if not warehouses:
+        print("❌ Не удалось получить список складов")
         return {}
 
     print(f"🧱 Складов получено: {len(warehouses)}")
@@ -218,21 +286,26 @@ def get_stocks_by_barcode(barcodes):
 
         print(f"📦 Обработка склада: {wh_name} (ID: {wh_id})")
 
-        # Разбиваем штрихкоды на чанки по 1000
-        for i in range(0, len(barcodes), chunk_size):
-            chunk = barcodes[i:i+chunk_size]
-            url = f"https://marketplace-api.wildberries.ru/api/v3/stocks/{wh_id}"
+        url = f"https://marketplace-api.wildberries.ru/api/v3/stocks/{wh_id}"
+
+        def fetch_chunk(chunk):
             try:
-                response = requests.post(url, headers=HEADERS, json={"skus": chunk})
+                response = ctx.session.post(url, headers=ctx.headers, json={"skus": chunk})
                 if response.status_code != 200:
                     print(f"❌ Ошибка {response.status_code} на складе {wh_name}: {response.text}")
-                    continue
-                data = response.json()
+                    return []
+                return response.json().get("stocks", [])
             except Exception as e:
                 print(f"❌ Ошибка при запросе к складу {wh_name}:", e)
-                continue
+                return []
+
+        # Разбиваем штрихкоды на чанки по 1000 и запрашиваем их одновременно
+        chunks = [barcodes[i:i+chunk_size] for i in range(0, len(barcodes), chunk_size)]
+        with ThreadPoolExecutor(max_workers=max(1, min(len(chunks), 4)), thread_name_prefix="wb-stocks") as pool:
+            chunk_stocks = list(pool.map(fetch_chunk, chunks))
 
-            for stock in data.get("stocks", []):
+        for stocks in chunk_stocks:
+            for stock in stocks:
                 sku = stock.get("sku")
                 amount = stock.get("amount", 0)
                 if not sku:
@@ -251,76 +324,63 @@ def get_stocks_by_barcode(barcodes):
 
     print(f"✅ Остатки собраны по {len(stocks_by_barcode)} штрихкодам")
     return stocks_by_barcode
-def update_grouped_with_stocks():
-    barcodes, cards_grouped_json = get_all_barcodes_from_grouped()
+
+def update_grouped_with_stocks(ctx, grouped: GroupedCards, warehouses):
+    barcodes = get_all_barcodes_from_grouped(grouped)
     print(f"Всего баркодов: {len(barcodes)}")
 
    # Получаем остатки по всем штрихкодам
-    stocks = get_stocks_by_barcode(barcodes)
-    
+    stocks = get_stocks_by_barcode(ctx, barcodes, warehouses)
+
 
-    for group in cards_grouped_json.values():
+    for group in grouped.values():
         for item in group:
             barcode = item.get("barcode")
             stock_list = stocks.get(barcode, [])
             item["stocks"] = stock_list
             item["totalStock"] = sum(s["amount"] for s in stock_list)
 
-    with open("json/cards_grouped_with_stocks.json", "w", encoding="utf-8") as f:
-        json.dump(cards_grouped_json, f, ensure_ascii=False, indent=2)
+    ctx.checkpoint("cards_grouped_with_stocks.json", grouped)
 
 
-def get_prices():
+def get_prices(ctx):
     url = "https://discounts-prices-api.wildberries.ru/api/v2/list/goods/filter"
     prices_by_nmid = {}
-    offset = 0
     limit = 1000
 
-    while True:
+    def fetch_page(offset):
         params = {
             "offset": offset,
             "limit": limit
         }
-        # response = requests.get(url, headers=HEADERS_PRICE, params=params)            
-        response = requests.get(url, headers=HEADERS, params=params)
+        response = ctx.session.get(url, headers=ctx.headers, params=params)
 
         if response.status_code != 200:
             print("❌ Ошибка получения цен:", response.status_code, response.text)
-            break
-
-        data = response.json()
-        items = data.get("data", {}).get("listGoods", [])
-        if not items:
-            break
-
-        for item in items:
-            nmid = item.get("nmID")
-            prices_by_nmid[nmid] = {
-                "prices": [
-                    {
-                        "size": s.get("techSizeName"),
-                        "price": s.get("price"),
-                        "discountedPrice": int(s.get("discountedPrice")),
-                        "clubDiscountedPrice": int(s.get("clubDiscountedPrice"))
-                    }
-                    for s in item.get("sizes", [])
-                ],
-                "currency": item.get("currencyIsoCode4217"),
-                # "discount": item.get("discount"),
-                "clubDiscount": item.get("clubDiscount")
-            }
-
-        offset += limit
+            return None
+
+        return response.json().get("data", {}).get("listGoods", [])
+
+    for item in fetch_offset_pages(fetch_page, limit):
+        nmid = item.get("nmID")
+        prices_by_nmid[nmid] = {
+            "prices": [
+                {
+                    "size": s.get("techSizeName"),
+                    "price": s.get("price"),
+                    "discountedPrice": int(s.get("discountedPrice")),
+                    "clubDiscountedPrice": int(s.get("clubDiscountedPrice"))
+                }
+                for s in item.get("sizes", [])
+            ],
+            "currency": item.get("currencyIsoCode4217"),
+            # "discount": item.get("discount"),
+            "clubDiscount": item.get("clubDiscount")
+        }
 
     return prices_by_nmid
 
-def update_grouped_with_prices():
-    file_path="json/cards_grouped_with_stocks.json"
-    with open(file_path, "r", encoding="utf-8") as f:
-        grouped = json.load(f)
-#
-    prices_by_nmid = get_prices()
-
+def update_grouped_with_prices(ctx, grouped: GroupedCards, prices_by_nmid):
     updated = 0
     for group in grouped.values():
         for item in group:
@@ -330,16 +390,15 @@ def update_grouped_with_prices():
                 item.update(price_info)
                 updated += 1
 
-    with open("json/cards_grouped_full.json", "w", encoding="utf-8") as f:
-        json.dump(grouped, f, ensure_ascii=False, indent=2)
+    ctx.checkpoint("cards_grouped_full.json", grouped)
 
     print(f"✅ Обновлено товаров с ценами: {updated}")
 
 
 # ------------------------------------------------------------------------------------------------------------------------------------------------------
-def get_orders(days):
+# Возвращает заказы с lastChangeDate >= date_from и признак, что выгрузка дошла до конца
+def get_orders(ctx, date_from):
     url = "https://statistics-api.wildberries.ru/api/v1/supplier/orders"
-    date_from = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%dT%H:%M:%S")
     print(f"GET ORDERS FROM data {date_from}")
     all_orders = []
     while True:
@@ -347,15 +406,15 @@ def get_orders(days):
             "dateFrom": date_from
         }
 
-        response = requests.get(url, headers=HEADERS, params=params)
+        response = ctx.session.get(url, headers=ctx.headers, params=params)
         if response.status_code != 200:
             print("❌ Ошибка при получении заказов:", response.status_code, response.text)
-            break
+            return all_orders, False
 
         data = response.json()
         if not data:
             print("Заказы полностью загружены.")
-            break
+            return all_orders, True
 
         all_orders.extend(data)
         print(f"Получено {len(data)} заказов. Всего: {len(all_orders)}")
@@ -363,48 +422,28 @@ def get_orders(days):
         # Обновляем дату для следующего запроса
         date_from = data[-1]["lastChangeDate"]
 
-    return all_orders
-
-def group_sales_by_warehouse(orders, days):
-    grouped = {}
-
-    for order in orders:
-        warehouse = order.get("warehouseName")
-        finished_price = order.get("finishedPrice")
-        nmId = order.get("nmId")
-
-        if not nmId or not warehouse or finished_price is None:
-            continue
-
-        if nmId not in grouped:
-            grouped[nmId] = {
-                "salesByWarehouse": {},
-                "totalSales": 0,
-                "totalRevenue": 0
-            }
+class OrderAggregates(TypedDict):
+    sales_by_warehouse: dict[int, SalesStats]
+    warehouse_stats: dict[str, WarehouseWeight]
+    seller_orders_count: int
+    revenue_by_nm: dict[int, float]
 
-        # Увеличиваем количество продаж по складу
-        grouped[nmId]["salesByWarehouse"][warehouse] = grouped[nmId]["salesByWarehouse"].get(warehouse, 0) + 1
-        grouped[nmId]["totalSales"] += 1
-        grouped[nmId]["totalRevenue"] += finished_price
-        
-
-    # Вычисляем среднюю цену
-    for nmId, info in grouped.items():
-        info["totalRevenue"] = int(info["totalRevenue"]) if info["totalSales"] else 0
-        info["avgDailySales"] = round(info["totalSales"] / days, 2)
-        
-    return grouped
 
-
-def process_orders_and_save(days):
-    orders = get_orders(days)
-    with open("json/orders_raw.json", "w", encoding="utf-8") as f:
-        json.dump(orders, f, ensure_ascii=False, indent=2)
-
-    grouped_sales = group_sales_by_warehouse(orders, days)
-    with open("json/sales_by_warehouse.json", "w", encoding="utf-8") as f:
-        json.dump(grouped_sales, f, ensure_ascii=False, indent=2)
+# Заказы хранятся локально (wb_orders), у WB догружаются только новые с последнего запуска.
+# Агрегаты за окно в `days` дней считаются запросами к локальной истории.
+def process_orders(ctx, days) -> OrderAggregates:
+    date_from = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%dT%H:%M:%S")
+    order_store.sync(ctx.token_key, date_from, lambda since: get_orders(ctx, since))
+
+    grouped_sales = order_store.sales_by_warehouse(ctx.token_key, date_from, days)
+    ctx.checkpoint("sales_by_warehouse.json", grouped_sales)
+    warehouse_stats, seller_orders_count = order_store.warehouse_stats(ctx.token_key, date_from)
+    return {
+        "sales_by_warehouse": grouped_sales,
+        "warehouse_stats": warehouse_stats,
+        "seller_orders_count": seller_orders_count,
+        "revenue_by_nm": order_store.revenue_by_nm(ctx.token_key, date_from),
+    }
 
 
 
@@ -429,49 +468,16 @@ def generate_distinct_color():
     return "#{:02X}{:02X}{:02X}".format(channel(), channel(), channel())
 
 # Генерация веса для каждого склада
-def calculate_warehouse_weights(sklad_max=0):
-    orders_file="json/orders_raw.json"
-    output_file="json/warehouse_weights.json"
-    with open(orders_file, "r", encoding="utf-8") as f:
-        orders = json.load(f)
-
-    stats = {}
-    total_revenue = 0
-    count_sklad_prodavca = 0
-    count_skald_wb = 0
-    # Проходим по всем заказаным товарам и исключаем заказы со склада продавца
-    # Считаем количество и объем товара с каждого склада
-    for order in orders:
-        warehouse = order.get("warehouseName")
-        finished_price = order.get("finishedPrice", 0)
-        warehouse_type = order.get("warehouseType", "Склад WB")
-        
-        if not warehouse or finished_price is None:
-            continue
-
-#если скалада еще нет в данных то создаем его
-        if warehouse_type != "Склад продавца":
-            if warehouse not in stats:
-                stats[warehouse] = {
-                    "ordersCount": 0,
-                    "revenue": 0,
-                    "warehouseType": warehouse_type
-                }
+# stats — заказы и выручка по складам WB без склада продавца (OrderStore.warehouse_stats)
+def calculate_warehouse_weights(ctx, stats, count_sklad_prodavca=0, sklad_max=0) -> dict[str, WarehouseWeight]:
+    total_revenue = sum(data["revenue"] for data in stats.values())
+    count_skald_wb = sum(data["ordersCount"] for data in stats.values())
 
-        
-        if warehouse_type != "Склад продавца":
-            stats[warehouse]["ordersCount"] += 1
-            stats[warehouse]["revenue"] += finished_price
-            total_revenue += finished_price            
-            count_skald_wb +=1
-        else:
-            count_sklad_prodavca +=1
-            
     print(f"Заказов со склада продавца {count_sklad_prodavca}")
     print(f"Заказов со склада WB {count_skald_wb}")
     print(f"Общий объем заказов с складов WB {total_revenue}")
 
-    
+
 #определяем вес каждого скалада
     for warehouse in stats:
         revenue = stats[warehouse]["revenue"]
@@ -497,9 +503,9 @@ def calculate_warehouse_weights(sklad_max=0):
     else:
         wb_items = [item for item in sorted_items if item[1]["warehouseType"] != "Склад продавца"]
         seller_items = [item for item in sorted_items if item[1]["warehouseType"] == "Склад продавца"]
-        #  sorted_items = seller_items + wb_items        
-        sorted_items = wb_items    
-            
+        #  sorted_items = seller_items + wb_items
+        sorted_items = wb_items
+
     col_generator = generate_skipped_columns()
     used_colors = set()
     sorted_stats = {}
@@ -508,9 +514,9 @@ def calculate_warehouse_weights(sklad_max=0):
         col_index = next(col_generator)
         col_letter = number_to_column_letter(col_index)
 
-        # Генерация уникального цвета нужно для ячейки склада 
+        # Генерация уникального цвета нужно для ячейки склада
         if data["warehouseType"] == "Склад продавца":
-            color = "#b6d7a8"  
+            color = "#b6d7a8"
         else:
             color = generate_distinct_color()
             while color in used_colors:
@@ -524,31 +530,25 @@ def calculate_warehouse_weights(sklad_max=0):
         })
         sorted_stats[warehouse] = data
 
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(sorted_stats, f, ensure_ascii=False, indent=2)
-
-    print(f"✅ Сохранено в {output_file}")
+    ctx.checkpoint("warehouse_weights.json", sorted_stats)
     # pprint(sorted_stats)
     return sorted_stats
 
 
 
 
-def get_all_nmId():
-    cards_file="json/cards_grouped_full.json"
-    with open(cards_file, "r", encoding="utf-8") as f:
-        cards_grouped_full = json.load(f)
-    nmId = []    
-    for group in cards_grouped_full.values():
+def get_all_nmId(grouped: GroupedCards):
+    nmId = []
+    for group in grouped.values():
         for item in group:
             nmId.append(item.get("nmID"))
-    
+
     return nmId
 
 
 #----------Загружаем все остатки по складам и группируем их по товару--------------------------------------------------------------------------------------------------
-# На выходе получаем массив
-#   "2041917357625": {
+# На выходе получаем словарь
+#   2041917357625: {
 #     "Санкт-Петербург Шушары": 6,
 #     "Электросталь": 9,
 #     "Коледино": 6,
@@ -557,7 +557,7 @@ def get_all_nmId():
 #     "Казань": 17
 #   }
 
-def get_grouped_wb_stocks():
+def get_grouped_wb_stocks(ctx):
     url = "https://statistics-api.wildberries.ru/api/v1/supplier/stocks"
     date_from = "2023-01-09T00:00:00"
     grouped = {}
@@ -565,7 +565,7 @@ def get_grouped_wb_stocks():
 
     while True:
         print(f"Запрос с dateFrom = {date_from}")
-        response = requests.get(url, headers=HEADERS, params={"dateFrom": date_from})
+        response = ctx.session.get(url, headers=ctx.headers, params={"dateFrom": date_from})
 
         if response.status_code != 200:
             print("❌ Ошибка запроса:", response.status_code, response.text)
@@ -596,7 +596,6 @@ def get_grouped_wb_stocks():
         date_from = last_date
         print(f"Загружено строк: {len(data)} | Всего товаров: {len(grouped)}")
         time.sleep(1)
-        all_nmId = get_all_nmId()
     # --- ДОБАВЛЯЕМ ОТСУТСТВУЮЩИЕ СКЛАДЫ СО ЗНАЧЕНИЕМ 0 ---
     all_warehouses = set()
     for wh_data in grouped.values():
@@ -606,61 +605,36 @@ def get_grouped_wb_stocks():
         for warehouse in all_warehouses:
             if warehouse not in wh_data:
                 wh_data[warehouse] = 0
-                
+
+    return grouped
+
+
+def add_missing_nm_ids(ctx, grouped, all_nmId):
+    all_warehouses = set()
+    for wh_data in grouped.values():
+        all_warehouses.update(wh_data.keys())
+
     for nm_id in all_nmId:
         if nm_id not in grouped:
             grouped[nm_id] = {warehouse: 0 for warehouse in all_warehouses}
-    with open("json/wb_stocks_grouped.json", "w", encoding="utf-8") as f:
-        json.dump(grouped, f, ensure_ascii=False, indent=2)
 
-    print("Сохранено в json/wb_stocks_grouped.json")
+    ctx.checkpoint("wb_stocks_grouped.json", grouped)
     return grouped
 
 #------------------------------------------------------------------------------------------------------------
 def update_cards_with_sales_data(
-    cards_file="json/cards_grouped_full.json",
-    sales_file="json/sales_by_warehouse.json",
-    orders_file="json/orders_raw.json",
-    warehouse_weights_file="json/warehouse_weights.json",
-    wb_stocks_file="json/wb_stocks_grouped.json",
-    output_file="json/cards_final.json",
+    ctx,
+    cards_grouped_full: GroupedCards,
+    sales_by_warehouse: dict[int, SalesStats],
+    revenue_by_nm: dict[int, float],
+    warehouse_weights: dict[str, WarehouseWeight],
+    wb_stocks: dict[int, dict[str, int]],
     days=60, period_analiz=15, B7=1, min_price=0, max_price=1000000, sklad_max=0, F7=0, F8=0
 ):
-    with open(cards_file, "r", encoding="utf-8") as f:
-        cards_grouped_full = json.load(f)
-
-    with open(sales_file, "r", encoding="utf-8") as f:
-        sales_by_warehouse = json.load(f)
-
-    with open(orders_file, "r", encoding="utf-8") as f:
-        orders = json.load(f)
-    with open(warehouse_weights_file, "r", encoding="utf-8") as f:
-        warehouse_weights = json.load(f)
-    with open(wb_stocks_file, "r", encoding="utf-8") as f:
-        wb_stocks = json.load(f)
-
-    
-   
-    # Считаем выручку и среднюю цену
-    revenue_data = {}
-    update = 0
-    for order in orders:
-        nmId = order.get("nmId")
-        finished_price = order.get("finishedPrice")
-        if not nmId or finished_price is None:
-            continue
-        if nmId not in revenue_data:
-            revenue_data[nmId] = {
-                "totalRevenue_FBS" : 0
-            }
-
-        revenue_data[nmId]["totalRevenue_FBS"] += finished_price
-        update +=1
-        
-    print(f"Добавили {update} записей товаров по FBS")
+    print(f"Добавили выручку по FBS для {len(revenue_by_nm)} товаров")
 
     updated = 0
-    
+
     for group in cards_grouped_full.values():
         for item in group:
             barcode = item.get("barcode")
@@ -668,27 +642,27 @@ def update_cards_with_sales_data(
             if not nmId:
                 continue
 
-            stats = sales_by_warehouse.get(str(nmId))
+            stats = sales_by_warehouse.get(nmId)
             if stats:
                 item["salesByWarehouse"] = stats.get("salesByWarehouse", {})
                 item["totalSales"] = stats.get("totalSales", 0)
                 item["totalRevenue"] = stats.get("totalRevenue", 0)
                 item["avgDailySales"] = stats.get("avgDailySales", 0)
                 updated += 1
-            else:  
+            else:
                 item["salesByWarehouse"] = {}
                 item["totalSales"] = 0
                 item["totalRevenue"] = 0
                 item["avgDailySales"] = 0
-                
-            item["totalRevenue_FBS"] = round(revenue_data.get(nmId, {}).get("totalRevenue_FBS", 0))
 
-  
+            item["totalRevenue_FBS"] = round(revenue_by_nm.get(nmId, 0))
+
+
 # Добавляем stocks_WB по складам WB
             item["stocks_WB"] = []
             total_delivery_analysis = 0
             delivery_analysis = 0
-            wb_stock_entry = wb_stocks.get(str(nmId), {})
+            wb_stock_entry = wb_stocks.get(nmId, {})
 
             for wh_short_name, stock_balance_amount in wb_stock_entry.items():
                 full_name = next(
@@ -700,27 +674,27 @@ def update_cards_with_sales_data(
                 wh_info = warehouse_weights[full_name]
                 if not wh_info:
                     continue
-                
-                
+
+
                 # Считаем сколько товара нужно поставить
                 # Для начала определяем проходит ли товар по ценовому фильтру
                 if not stock_balance_amount:
                     stock_balance_amount = 0
                 if item["prices"][0]["discountedPrice"] >= min_price and item["prices"][0]["discountedPrice"] <= max_price:
-                        if B7 == 1:                    
+                        if B7 == 1:
                             # если b7=1, то = B5*m12*o9/100-n12
                             delivery_analysis = (period_analiz * float(item["avgDailySales"]) * (wh_info["weight"])) / 100 - stock_balance_amount
-                        else:                            
+                        else:
                             #если b7=0 (или не заполнено), то идет равномерное распределение на все склады ((B5*m12)/на количество складов-n12
                             delivery_analysis = (period_analiz* float(item["avgDailySales"])) / len(warehouse_weights) - stock_balance_amount
-                
+
                 else:
                     delivery_analysis = 0
-                
 
-                
+
+
                 if F8 == 0 and round(delivery_analysis) <= 0:
-                    delivery_analysis = None 
+                    delivery_analysis = None
 
                 item["stocks_WB"].append({
                     "col_letter": wh_info["col_letter"],
@@ -749,7 +723,7 @@ def update_cards_with_sales_data(
 
     # Формируем отсортированный словарь обратно
     grouped_sorted = dict(items_list)
-    
+
     product_list = []
     for vendor_code, items in grouped_sorted.items():
         for item in items:
@@ -758,7 +732,7 @@ def update_cards_with_sales_data(
 
     # Считаем warehouse_total_delivery для каждого склада
     warehouse_delivery_totals = {}
-    
+
     for item in product_list:
         stocks_wb = item.get("stocks_WB", [])
         for stock in stocks_wb:
@@ -773,7 +747,7 @@ def update_cards_with_sales_data(
     for wh_name, total in warehouse_delivery_totals.items():
         if wh_name in warehouse_weights:
             warehouse_weights[wh_name]["warehouse_total_delivery"] = total
-    
+
     for wh_name in warehouse_weights:
         if wh_name not in warehouse_delivery_totals:
             warehouse_weights[wh_name]["warehouse_total_delivery"] = 0
@@ -782,22 +756,22 @@ def update_cards_with_sales_data(
     # Проверяем условие F7 > warehouse_total_delivery и пересчитываем если нужно
     if F7 > 0:
         # print(f"\n=== ПЕРЕСЧЕТ ПО F7 = {F7} ===")
-        
+
         # Находим склады, где F7 > warehouse_total_delivery
         warehouses_to_recalculate = []
         for wh_name, total in warehouse_delivery_totals.items():
             if F7 > total:
                 warehouses_to_recalculate.append((wh_name, total))
                 # print(f"Склад для пересчета: {wh_name} (было: {total})")
-        
+
         # Пересчитываем каждый склад, где F7 > warehouse_total_delivery
         for wh_name, total in warehouses_to_recalculate:
             # print(f"\n--- Пересчет склада: {wh_name} ---")
-            
+
             # Получаем коэффициент
             coefficient = F7 / total
             # print(f"Коэффициент: {coefficient:.4f}")
-            
+
             # Пересчитываем delivery_analysis для всех товаров этого склада
             new_deliveries = []
             for item in product_list:
@@ -810,34 +784,34 @@ def update_cards_with_sales_data(
                             new_delivery_float = old_delivery * coefficient
                             new_delivery_int = int(new_delivery_float)  # Округляем вниз
                             fractional_part = new_delivery_float - new_delivery_int  # Дробная часть
-                            
+
                             # print(f"  Товар {item.get('nmID')}: {old_delivery} → {new_delivery_int} (дробная часть: {fractional_part:.4f})")
-                            
+
                             new_deliveries.append({
                                 'item': item,
                                 'stock': stock,
                                 'new_delivery_int': new_delivery_int,
                                 'fractional_part': fractional_part
                             })
-            
+
             # print(f"Найдено товаров для пересчета: {len(new_deliveries)}")
-            
+
             # Сортируем по дробной части (по убыванию)
             new_deliveries.sort(key=lambda x: x['fractional_part'], reverse=True)
-            
+
             # Применяем новые значения
             new_sum = 0
             for delivery_info in new_deliveries:
                 delivery_info['stock']['delivery_analysis'] = delivery_info['new_delivery_int']
                 delivery_info['stock']['fractional_part'] = delivery_info['fractional_part']
                 new_sum += delivery_info['new_delivery_int']
-            
+
             # print(f"Сумма после округления: {new_sum}")
-            
+
             # Распределяем дефицит
             deficit = F7 - new_sum
             # print(f"Дефицит: {deficit}")
-            
+
             # Добавляем по 1 к товарам с наибольшей дробной частью
             added_count = 0
             for i in range(int(deficit)):
@@ -845,20 +819,20 @@ def update_cards_with_sales_data(
                     new_deliveries[i]['stock']['delivery_analysis'] += 1
                     added_count += 1
                     # print(f"  +1 к товару {new_deliveries[i]['item'].get('nmID')} (дробная часть была: {new_deliveries[i]['fractional_part']:.4f})")
-            
+
             # print(f"Добавлено единиц: {added_count}")
-            
+
             # Проверяем итоговую сумму
             final_sum = 0
             for delivery_info in new_deliveries:
                 final_sum += delivery_info['stock']['delivery_analysis']
-            
+
             # print(f"Итоговая сумма: {final_sum} (цель: {F7})")
-            
+
             # Обновляем warehouse_total_delivery для этого склада
             warehouse_weights[wh_name]["warehouse_total_delivery"] = final_sum
             # print(f"Обновлен {wh_name}: {final_sum}")
-        
+
         # print("=== ПЕРЕСЧЕТ ЗАВЕРШЕН ===\n")
 
     # Пересчитываем total_delivery_analysis для всех товаров после всех изменений
@@ -868,7 +842,7 @@ def update_cards_with_sales_data(
             delivery = stock.get("delivery_analysis")
             if delivery is not None:
                 total_delivery_analysis += delivery
-        
+
         item["total_delivery_analysis"] = item["totalStock"] - total_delivery_analysis
 
     result = {
@@ -876,40 +850,40 @@ def update_cards_with_sales_data(
         "warehouses": warehouse_weights
     }
 
-    
-    
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(result, f, ensure_ascii=False, indent=2)
+    ctx.checkpoint("cards_final.json", result)
 
     print(f"Обновлено карточек с данными о продажах: {updated}")
+    return result
 
 
-
-def cleanup_json_files():
-    files = glob.glob("json/*.json")
-    for file in files:
-        try:
-            os.remove(file)
-            print(f"Удалён файл: {file}")
-        except Exception as e:
-            print(f"❌ Ошибка при удалении {file}: {e}")
-            
 def generate_final_data(days=30, period_analiz=10, B7=1, min_price=0, max_price=1000000, sklad_max=0, API_KEY = None, F7=0, F8=0):
-    global HEADERS
-    HEADERS = {"Authorization": API_KEY}
-    cleanup_json_files()
-    get_all_cards()
-    process_cards()
-    update_grouped_with_stocks()
-    update_grouped_with_prices()
-    process_orders_and_save(days)
-    calculate_warehouse_weights(sklad_max=sklad_max)
-    get_grouped_wb_stocks()
-    update_cards_with_sales_data(days=days, period_analiz=period_analiz, B7=B7, min_price=min_price, max_price=max_price, sklad_max=sklad_max, F7=F7, F8=F8)
-    
-    if not os.path.exists("json/cards_final.json"):
-        return None
-
-    with open("json/cards_final.json", "r", encoding="utf-8") as f:
-        return json.load(f)
-
+    # WB_PLANNER_CHECKPOINT_DIR включает сохранение промежуточных стадий на диск
+    ctx = PlannerContext(
+        headers={"Authorization": API_KEY},
+        checkpoint_dir=os.getenv("WB_PLANNER_CHECKPOINT_DIR") or None,
+    )
+    # Все наборы данных независимы друг от друга и грузятся одновременно.
+    # Каталог, категории, цены и склады берутся из кэша по токену,
+    # заказы дозагружаются в локальную историю, остатки запрашиваются каждый раз.
+    fetched = run_parallel(
+        cards=(ctx.cached, "cards", lambda: get_all_cards(ctx)),
+        categories=(ctx.cached, "categories", lambda: get_categorys(ctx)),
+        prices=(ctx.cached, "prices", lambda: get_prices(ctx)),
+        warehouses=(ctx.cached, "warehouses", lambda: get_warehouses(ctx)),
+        orders=(process_orders, ctx, days),
+        wb_stocks=(get_grouped_wb_stocks, ctx),
+    )
+    grouped = process_cards(fetched["cards"], fetched["categories"])
+    ctx.checkpoint("cards_grouped.json", grouped)
+    update_grouped_with_stocks(ctx, grouped, fetched["warehouses"])
+    update_grouped_with_prices(ctx, grouped, fetched["prices"])
+    orders = fetched["orders"]
+    warehouse_weights = calculate_warehouse_weights(
+        ctx, orders["warehouse_stats"], orders["seller_orders_count"], sklad_max=sklad_max,
+    )
+    wb_stocks = add_missing_nm_ids(ctx, fetched["wb_stocks"], get_all_nmId(grouped))
+    return update_cards_with_sales_data(
+        ctx, grouped, orders["sales_by_warehouse"], orders["revenue_by_nm"], warehouse_weights, wb_stocks,
+        days=days, period_analiz=period_analiz, B7=B7, min_price=min_price, max_price=max_price,
+        sklad_max=sklad_max, F7=F7, F8=F8,
+    )
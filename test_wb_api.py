@@ -0,0 +1,48 @@
+"""Кэш наборов данных WB (wb_api.TTLCache) и ключ кэша по токену в PlannerContext."""
+
+from generator import PlannerContext
+from wb_api import TTLCache
+
+
+def test_cache_key_separates_tokens(monkeypatch):
+    monkeypatch.setattr("generator.cache", TTLCache(ttl=60))
+    loads = []
+
+    def loader(token):
+        def load():
+            loads.append(token)
+            return {"token": token}
+        return load
+
+    first = PlannerContext(headers={"Authorization": "token-a"})
+    same_token = PlannerContext(headers={"Authorization": "token-a"})
+    other = PlannerContext(headers={"Authorization": "token-b"})
+
+    assert first.cached("cards", loader("token-a")) == {"token": "token-a"}
+    # Тот же токен в другом запросе берёт данные из кэша
+    assert same_token.cached("cards", loader("token-a")) == {"token": "token-a"}
+    # Другой токен с тем же набором данных не видит чужой кэш
+    assert other.cached("cards", loader("token-b")) == {"token": "token-b"}
+    assert loads == ["token-a", "token-b"]
+    assert first.token_key != other.token_key
+
+
+def test_cache_expires_and_skips_empty_results(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("wb_api.time.monotonic", lambda: now[0])
+    cache = TTLCache(ttl=60)
+    loads = []
+
+    def load():
+        loads.append(now[0])
+        return [now[0]]
+
+    assert cache.get_or_load("key", load) == [1000.0]
+    now[0] += 59
+    assert cache.get_or_load("key", load) == [1000.0]
+    now[0] += 2
+    assert cache.get_or_load("key", load) == [1061.0]
+    # Пустой ответ (ошибка API) не кэшируется
+    assert cache.get_or_load("empty", lambda: []) == []
+    assert cache.get("empty") is None
+    assert loads == [1000.0, 1061.0]
@@ -0,0 +1,85 @@
+"""Проверки локальной истории заказов WB (wb_orders.OrderStore) на временной SQLite."""
+
+import os
+import tempfile
+
+from wb_orders import OrderStore
+
+TOKEN = "token-key"
+DATE_FROM = "2026-01-01T00:00:00"
+
+
+def make_store():
+    directory = tempfile.mkdtemp()
+    return OrderStore(os.path.join(directory, "wb_orders.sqlite3"))
+
+
+def order(srid, last_change_date, **fields):
+    return {
+        "srid": srid,
+        "nmId": 101,
+        "warehouseName": "Коледино",
+        "warehouseType": "Склад WB",
+        "finishedPrice": 500,
+        "date": last_change_date,
+        "lastChangeDate": last_change_date,
+        **fields,
+    }
+
+
+def test_orders_without_finished_price_stay_out_of_aggregates():
+    store = make_store()
+    orders = [
+        order("a", "2026-01-02T10:00:00"),
+        order("b", "2026-01-02T11:00:00", finishedPrice=None),
+        {key: value for key, value in order("c", "2026-01-02T12:00:00").items() if key != "finishedPrice"},
+    ]
+    store.sync(TOKEN, DATE_FROM, lambda since: (orders, True))
+
+    sales = store.sales_by_warehouse(TOKEN, DATE_FROM, days=1)
+    assert sales[101]["salesByWarehouse"] == {"Коледино": 1}
+    assert sales[101]["totalRevenue"] == 500
+
+    stats, _ = store.warehouse_stats(TOKEN, DATE_FROM)
+    assert stats["Коледино"]["ordersCount"] == 1
+    assert store.revenue_by_nm(TOKEN, DATE_FROM) == {101: 500}
+
+
+def test_incremental_sync_fetches_from_watermark(monkeypatch):
+    store = make_store()
+    calls = []
+    batches = [
+        [order("a", "2026-01-02T10:00:00"), order("b", "2026-01-03T10:00:00")],
+        [order("b", "2026-01-04T09:00:00", finishedPrice=700), order("c", "2026-01-04T10:00:00")],
+    ]
+
+    def fetch(since):
+        calls.append(since)
+        return batches[len(calls) - 1], True
+
+    store.sync(TOKEN, DATE_FROM, fetch)
+    assert calls == [DATE_FROM]
+    assert store._get_state(TOKEN)["watermark"] == "2026-01-03T10:00:00"
+
+    # В пределах ORDER_REFRESH_SECONDS окно, уже покрытое историей, отвечаем из базы
+    store.sync(TOKEN, "2026-01-02T00:00:00", fetch)
+    assert calls == [DATE_FROM]
+
+    # После интервала дозапрашиваем только заказы, изменившиеся с watermark
+    monkeypatch.setattr("wb_orders.ORDER_REFRESH_SECONDS", 0)
+    store.sync(TOKEN, DATE_FROM, fetch)
+    assert calls == [DATE_FROM, "2026-01-03T10:00:00"]
+    assert store._get_state(TOKEN)["watermark"] == "2026-01-04T10:00:00"
+    # Изменившийся заказ b обновлён по srid, а не задублирован
+    assert store.revenue_by_nm(TOKEN, DATE_FROM) == {101: 500 + 700 + 500}
+
+
+def test_incomplete_fetch_keeps_watermark(monkeypatch):
+    store = make_store()
+    store.sync(TOKEN, DATE_FROM, lambda since: ([order("a", "2026-01-02T10:00:00")], True))
+
+    monkeypatch.setattr("wb_orders.ORDER_REFRESH_SECONDS", 0)
+    # Выгрузка оборвалась: полученное сохраняем, но watermark не двигаем
+    store.sync(TOKEN, DATE_FROM, lambda since: ([order("b", "2026-01-05T10:00:00")], False))
+    assert store._get_state(TOKEN)["watermark"] == "2026-01-02T10:00:00"
+    assert store.revenue_by_nm(TOKEN, DATE_FROM) == {101: 1000}
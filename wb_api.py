@@ -0,0 +1,116 @@
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Размер пула соединений к API WB, общий для всех запросов планировщика
+HTTP_POOL_SIZE = int(os.getenv("WB_HTTP_POOL_SIZE", "16"))
+# Сколько живут в кэше медленно меняющиеся данные: карточки, категории, цены, склады
+CACHE_TTL_SECONDS = int(os.getenv("WB_CACHE_TTL_SECONDS", "3600"))
+# Сколько страниц с offset-пагинацией запрашиваем одновременно
+PAGE_CONCURRENCY = int(os.getenv("WB_PAGE_CONCURRENCY", "3"))
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Общая сессия requests: соединения к WB переиспользуются между запросами.
+
+    Токен в сессию не кладется, каждый вызов передает свои заголовки.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+    return _session
+
+
+def token_key(token):
+    return hashlib.sha256((token or "").encode("utf-8")).hexdigest()[:16]
+
+
+class TTLCache:
+    """Кэш в памяти процесса с временем жизни записей.
+
+    Пока одна загрузка идет, параллельные запросы с тем же ключом ждут ее,
+    а не запускают вторую. Пустые результаты (ошибка API) не кэшируются.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._data = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+
+    def get_or_load(self, key, loader):
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self._key_lock(key):
+            value = self.get(key)
+            if value is not None:
+                return value
+            value = loader()
+            if value:
+                self.set(key, value)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+cache = TTLCache(CACHE_TTL_SECONDS)
+
+
+def fetch_offset_pages(fetch_page, limit, concurrency=PAGE_CONCURRENCY):
+    """Забирает страницы с offset-пагинацией пачками по `concurrency` запросов.
+
+    `fetch_page(offset)` возвращает список элементов страницы или None при ошибке.
+    Загрузка останавливается на первой пустой или ошибочной странице,
+    страницы возвращаются в порядке offset, как при последовательном обходе.
+    """
+    items = []
+    offset = 0
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="wb-page") as pool:
+        while True:
+            offsets = [offset + i * limit for i in range(concurrency)]
+            for page in pool.map(fetch_page, offsets):
+                if not page:
+                    return items
+                items.extend(page)
+            offset += concurrency * limit
+
+
+def run_parallel(**calls):
+    """Запускает независимые загрузки одновременно: run_parallel(name=(func, *args)).
+
+    Возвращает словарь name → результат. Исключение любой загрузки пробрасывается.
+    """
+    with ThreadPoolExecutor(max_workers=len(calls), thread_name_prefix="wb-stage") as pool:
+        futures = {name: pool.submit(func, *args) for name, (func, *args) in calls.items()}
+        return {name: future.result() for name, future in futures.items()}
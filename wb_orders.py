@@ -0,0 +1,250 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from datetime import datetime, timedelta
+
+# Где лежит локальная история заказов WB (SQLite, один файл на все токены)
+ORDER_STORE_PATH = os.getenv("WB_ORDER_STORE_PATH", "data/wb_orders.sqlite3")
+# Как часто можно дозапрашивать новые заказы у WB; в пределах интервала отвечаем из базы
+ORDER_REFRESH_SECONDS = int(os.getenv("WB_ORDER_REFRESH_SECONDS", "600"))
+# Сколько дней истории храним
+ORDER_RETENTION_DAYS = int(os.getenv("WB_ORDER_RETENTION_DAYS", "400"))
+
+SELLER_WAREHOUSE_TYPE = "Склад продавца"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS wb_orders (
+    token_key TEXT NOT NULL,
+    srid TEXT NOT NULL,
+    nm_id INTEGER,
+    warehouse_name TEXT,
+    warehouse_type TEXT,
+    finished_price NUMERIC,
+    date TEXT,
+    last_change_date TEXT NOT NULL,
+    PRIMARY KEY (token_key, srid)
+);
+CREATE INDEX IF NOT EXISTS wb_orders_token_change_idx ON wb_orders (token_key, last_change_date);
+CREATE INDEX IF NOT EXISTS wb_orders_token_nm_idx ON wb_orders (token_key, nm_id, last_change_date);
+CREATE TABLE IF NOT EXISTS wb_order_sync (
+    token_key TEXT PRIMARY KEY,
+    covered_from TEXT NOT NULL,
+    watermark TEXT NOT NULL,
+    synced_at REAL NOT NULL
+);
+"""
+
+# Общие условия для агрегатов: те же фильтры, что раньше применялись к списку заказов в Python
+WINDOW_FILTER = "token_key = ? AND last_change_date >= ? AND finished_price IS NOT NULL"
+
+
+class OrderStore:
+    """Локальная история заказов WB с инкрементальной дозагрузкой.
+
+    Заказы хранятся по `srid` и обновляются по `lastChangeDate`. Для каждого токена
+    запоминается, с какой даты история полная (`covered_from`) и до какой
+    `lastChangeDate` она загружена (`watermark`). Повторный запуск планировщика
+    с другим `days` не обращается к WB, если окно уже покрыто и данные свежие.
+    """
+
+    def __init__(self, path=ORDER_STORE_PATH):
+        self.path = path
+        self._init_lock = threading.Lock()
+        self._initialized = False
+        self._sync_locks = {}
+        self._sync_locks_lock = threading.Lock()
+
+    def _connect(self):
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    directory = os.path.dirname(self.path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    with closing(sqlite3.connect(self.path)) as conn:
+                        conn.execute("PRAGMA journal_mode=WAL")
+                        conn.executescript(SCHEMA)
+                    self._initialized = True
+        return closing(sqlite3.connect(self.path, timeout=30))
+
+    def _sync_lock(self, token_key):
+        with self._sync_locks_lock:
+            return self._sync_locks.setdefault(token_key, threading.Lock())
+
+    def sync(self, token_key, date_from, fetch_orders):
+        """Догружает заказы, нужные для окна с `date_from`.
+
+        `fetch_orders(since)` возвращает (orders, complete): заказы с lastChangeDate >= since
+        и признак, что выгрузка дошла до конца без ошибок.
+        """
+        with self._sync_lock(token_key):
+            state = self._get_state(token_key)
+            if state and state["covered_from"] <= date_from:
+                if time.time() - state["synced_at"] < ORDER_REFRESH_SECONDS:
+                    print(f"Заказы WB из локальной истории (watermark {state['watermark']})")
+                    return
+                since = state["watermark"]
+            else:
+                since = date_from
+
+            orders, complete = fetch_orders(since)
+            watermark = self._upsert(token_key, orders)
+            if not complete:
+                return
+
+            covered_from = min(state["covered_from"], since) if state else since
+            watermark = max(filter(None, [watermark, state["watermark"] if state else None, since]))
+            self._set_state(token_key, covered_from, watermark)
+            self._purge(token_key)
+
+    def _get_state(self, token_key):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT covered_from, watermark, synced_at FROM wb_order_sync WHERE token_key = ?",
+                (token_key,),
+            ).fetchone()
+        if not row:
+            return None
+        return {"covered_from": row[0], "watermark": row[1], "synced_at": row[2]}
+
+    def _set_state(self, token_key, covered_from, watermark):
+        with self._connect() as conn, conn:
+            conn.execute(
+                """
+                INSERT INTO wb_order_sync (token_key, covered_from, watermark, synced_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (token_key) DO UPDATE SET
+                    covered_from = excluded.covered_from,
+                    watermark = excluded.watermark,
+                    synced_at = excluded.synced_at
+                """,
+                (token_key, covered_from, watermark, time.time()),
+            )
+
+    def _upsert(self, token_key, orders):
+        rows = []
+        watermark = None
+        for order in orders:
+            last_change_date = order.get("lastChangeDate")
+            if not last_change_date:
+                continue
+            srid = order.get("srid") or f"{order.get('gNumber')}:{order.get('nmId')}:{order.get('date')}"
+            # Заказ без finishedPrice храним с NULL: WINDOW_FILTER исключает его из агрегатов, как и раньше
+            finished_price = order.get("finishedPrice")
+            rows.append((
+                token_key,
+                srid,
+                order.get("nmId"),
+                order.get("warehouseName"),
+                order.get("warehouseType", "Склад WB"),
+                finished_price,
+                order.get("date"),
+                last_change_date,
+            ))
+            if watermark is None or last_change_date > watermark:
+                watermark = last_change_date
+        if rows:
+            with self._connect() as conn, conn:
+                conn.executemany(
+                    """
+                    INSERT INTO wb_orders (
+                        token_key, srid, nm_id, warehouse_name, warehouse_type,
+                        finished_price, date, last_change_date
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (token_key, srid) DO UPDATE SET
+                        nm_id = excluded.nm_id,
+                        warehouse_name = excluded.warehouse_name,
+                        warehouse_type = excluded.warehouse_type,
+                        finished_price = excluded.finished_price,
+                        date = excluded.date,
+                        last_change_date = excluded.last_change_date
+                    """,
+                    rows,
+                )
+        print(f"Сохранено заказов WB в локальную историю: {len(rows)}")
+        return watermark
+
+    def _purge(self, token_key):
+        border = (datetime.now() - timedelta(days=ORDER_RETENTION_DAYS)).strftime("%Y-%m-%dT%H:%M:%S")
+        with self._connect() as conn, conn:
+            deleted = conn.execute(
+                "DELETE FROM wb_orders WHERE token_key = ? AND last_change_date < ?",
+                (token_key, border),
+            ).rowcount
+            if deleted:
+                conn.execute(
+                    "UPDATE wb_order_sync SET covered_from = MAX(covered_from, ?) WHERE token_key = ?",
+                    (border, token_key),
+                )
+
+    def sales_by_warehouse(self, token_key, date_from, days):
+        """nmId → продажи по складам, общее число заказов, выручка и среднесуточные продажи."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"""
+                SELECT nm_id, warehouse_name, COUNT(*), SUM(finished_price)
+                FROM wb_orders
+                WHERE {WINDOW_FILTER} AND nm_id != 0 AND warehouse_name != ''
+                GROUP BY nm_id, warehouse_name
+                ORDER BY MIN(rowid)
+                """,
+                (token_key, date_from),
+            ).fetchall()
+
+        grouped = {}
+        for nm_id, warehouse, sales, revenue in rows:
+            info = grouped.setdefault(nm_id, {"salesByWarehouse": {}, "totalSales": 0, "totalRevenue": 0})
+            info["salesByWarehouse"][warehouse] = sales
+            info["totalSales"] += sales
+            info["totalRevenue"] += revenue
+
+        for info in grouped.values():
+            info["totalRevenue"] = int(info["totalRevenue"]) if info["totalSales"] else 0
+            info["avgDailySales"] = round(info["totalSales"] / days, 2)
+        return grouped
+
+    def warehouse_stats(self, token_key, date_from):
+        """Заказы и выручка по складам WB и число заказов со склада продавца."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"""
+                SELECT warehouse_name, MIN(warehouse_type), COUNT(*), SUM(finished_price)
+                FROM wb_orders
+                WHERE {WINDOW_FILTER} AND warehouse_name != '' AND warehouse_type != ?
+                GROUP BY warehouse_name
+                ORDER BY MIN(rowid)
+                """,
+                (token_key, date_from, SELLER_WAREHOUSE_TYPE),
+            ).fetchall()
+            seller_orders = conn.execute(
+                f"""
+                SELECT COUNT(*) FROM wb_orders
+                WHERE {WINDOW_FILTER} AND warehouse_name != '' AND warehouse_type = ?
+                """,
+                (token_key, date_from, SELLER_WAREHOUSE_TYPE),
+            ).fetchone()[0]
+
+        stats = {
+            warehouse: {"ordersCount": orders_count, "revenue": revenue, "warehouseType": warehouse_type}
+            for warehouse, warehouse_type, orders_count, revenue in rows
+        }
+        return stats, seller_orders
+
+    def revenue_by_nm(self, token_key, date_from):
+        """nmId → выручка по всем заказам окна."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"""
+                SELECT nm_id, SUM(finished_price)
+                FROM wb_orders
+                WHERE {WINDOW_FILTER} AND nm_id != 0
+                GROUP BY nm_id
+                """,
+                (token_key, date_from),
+            ).fetchall()
+        return {nm_id: revenue for nm_id, revenue in rows}
+
+
+order_store = OrderStore()